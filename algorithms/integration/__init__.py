@@ -16,11 +16,15 @@
 
 Result = collections.namedtuple(
     "Result",
-    "index, reflections, data, read_time, extract_time, process_time, total_time",
+    "index, reflections, data, read_time, extract_time, process_time, total_time, "
+    "io_wait_time, profile",
 )
+Result.__new__.__defaults__ = (0, None)
 #        :param index: The processing job index
 #        :param reflections: The processed reflections
 #        :param data: Other processed data
+#        :param io_wait_time: The time spent waiting for images to be read
+#        :param profile: The StageProfile of the job
 
 
 class TimingInfo(object):
@@ -30,6 +34,7 @@ class TimingInfo(object):
 
     def __init__(self):
         self.read = 0
+        self.io_wait = 0
         self.extract = 0
         self.initialize = 0
         self.process = 0
@@ -43,6 +48,7 @@ def __str__(self):
             [description, "%.2f seconds" % value]
             for description, value in (
                 ["Read time", self.read],
+                ["I/O wait time", self.io_wait],
                 ["Extract time", self.extract],
                 ["Pre-process time", self.initialize],
                 ["Process time", self.process],
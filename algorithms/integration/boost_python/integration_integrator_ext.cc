@@ -243,6 +243,7 @@ namespace dials { namespace algorithms { namespace boost_python {
     class_<JobList>("JobList")
       .def(init<tiny<int, 2>, const af::const_ref<tiny<int, 2> > &>())
       .def("add", &JobList::add)
+      .def("add_blocks", &JobList::add_blocks)
       .def("__len__", &JobList::size)
       .def("__getitem__", &JobList::operator[], return_internal_reference<>())
       .def("split", &job_list_split)
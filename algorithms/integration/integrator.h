@@ -195,6 +195,32 @@ namespace dials { namespace algorithms {
       groups_.add(int2(j0, j1), expr, range);
     }
 
+    /**
+     * Add a new group of jobs with explicitly given frame ranges
+     * @param expr The range of experiments
+     * @param range The range of frames
+     * @param blocks The frames of each job
+     */
+    void add_blocks(tiny<int, 2> expr,
+                    tiny<int, 2> range,
+                    const af::const_ref<tiny<int, 2> > &blocks) {
+      DIALS_ASSERT(blocks.size() > 0);
+      DIALS_ASSERT(blocks[0][0] == range[0]);
+      DIALS_ASSERT(blocks[blocks.size() - 1][1] == range[1]);
+      for (std::size_t i = 1; i < blocks.size(); ++i) {
+        DIALS_ASSERT(blocks[i][1] > blocks[i][0]);
+        DIALS_ASSERT(blocks[i][0] > blocks[i - 1][0]);
+        DIALS_ASSERT(blocks[i][1] > blocks[i - 1][1]);
+        DIALS_ASSERT(blocks[i][0] <= blocks[i - 1][1]);
+      }
+      std::size_t j0 = size();
+      for (std::size_t i = 0; i < blocks.size(); ++i) {
+        jobs_.push_back(Job(groups_.size(), expr, blocks[i]));
+      }
+      std::size_t j1 = size();
+      groups_.add(int2(j0, j1), expr, range);
+    }
+
     /**
      * @returns The requested job
      */
@@ -10,7 +10,7 @@
 import six.moves.cPickle as pickle
 
 import dials.extensions
-from dials.algorithms.integration import processor
+from dials.algorithms.integration import processor, profiling
 from dials.algorithms.integration.filtering import IceRingFilter
 from dials.algorithms.integration.parallel_integrator import (
     IntegratorProcessor,
@@ -116,6 +116,14 @@ def generate_phil_scope():
           .help = "The maximum percentage of available memory to use for"
                   "allocating shoebox arrays."
 
+        adaptive = True
+          .type = bool
+          .help = "Split blocks which need more shoebox memory than is available"
+                  "to each process and merge very small blocks. Blocks are then"
+                  "processed in order of shoebox memory, largest first, and the"
+                  "number of processes is limited so that the shoeboxes of the"
+                  "largest blocks fit in memory together."
+
       }
 
       use_dynamic_mask = True
@@ -233,6 +241,13 @@ def generate_phil_scope():
         nproc = 1
           .type = int(value_min=1)
           .help = "The number of processes to use per cluster job"
+
+        prefetch = 0
+          .type = int(value_min=0)
+          .help = "The number of images to read ahead on a background thread"
+                  "while the current image is processed. This is reduced if"
+                  "there is not enough memory to hold the extra images."
+          .expert_level = 1
       }
 
       summation {
@@ -380,6 +395,7 @@ def from_phil(params):
         mp.method = params.mp.method
         mp.nproc = params.mp.nproc
         mp.njobs = params.mp.njobs
+        mp.prefetch = params.mp.prefetch
 
         # Set the lookup parameters
         lookup = processor.Lookup()
@@ -392,6 +408,7 @@ def from_phil(params):
         block.threshold = params.block.threshold
         block.force = params.block.force
         block.max_memory_usage = params.block.max_memory_usage
+        block.adaptive = params.block.adaptive
 
         # Set the modelling processor parameters
         result.modelling.mp = mp
@@ -654,18 +671,23 @@ def process(self, frame, reflections):
         :param reflections: The reflections to process
         """
         # Check if pixels are overloaded
-        reflections.is_overloaded(self.experiments)
+        with profiling.stage("mask"):
+            reflections.is_overloaded(self.experiments)
 
-        # Compute the shoebox mask
-        reflections.compute_mask(self.experiments)
+            # Compute the shoebox mask
+            reflections.compute_mask(self.experiments)
 
         # Process the data
-        reflections.compute_background(self.experiments)
-        reflections.compute_centroid(self.experiments)
-        reflections.compute_summed_intensity()
+        with profiling.stage("background"):
+            reflections.compute_background(self.experiments)
+        with profiling.stage("centroid"):
+            reflections.compute_centroid(self.experiments)
+        with profiling.stage("summation"):
+            reflections.compute_summed_intensity()
 
         # Do the profile modelling
-        self.profile_fitter.model(reflections)
+        with profiling.stage("modelling"):
+            self.profile_fitter.model(reflections)
 
         # Print some info
         fmt = " Modelled % 5d / % 5d reflection profiles on image %d"
@@ -758,18 +780,23 @@ def process(self, frame, reflections):
         :param reflections: The reflections to process
         """
         # Check if pixels are overloaded
-        reflections.is_overloaded(self.experiments)
+        with profiling.stage("mask"):
+            reflections.is_overloaded(self.experiments)
 
-        # Compute the shoebox mask
-        reflections.compute_mask(self.experiments)
+            # Compute the shoebox mask
+            reflections.compute_mask(self.experiments)
 
         # Process the data
-        reflections.compute_background(self.experiments)
-        reflections.compute_centroid(self.experiments)
-        reflections.compute_summed_intensity()
+        with profiling.stage("background"):
+            reflections.compute_background(self.experiments)
+        with profiling.stage("centroid"):
+            reflections.compute_centroid(self.experiments)
+        with profiling.stage("summation"):
+            reflections.compute_summed_intensity()
 
         # Do the profile validation
-        self.results = self.profile_fitter.validate(reflections)
+        with profiling.stage("validation"):
+            self.results = self.profile_fitter.validate(reflections)
 
         # Print some info
         fmt = " Validated % 5d / % 5d reflection profiles on image %d"
@@ -866,20 +893,25 @@ def process(self, frame, reflections):
         :param reflections: The reflections to process
         """
         # Check if pixels are overloaded
-        reflections.is_overloaded(self.experiments)
+        with profiling.stage("mask"):
+            reflections.is_overloaded(self.experiments)
 
-        # Compute the shoebox mask
-        reflections.compute_mask(self.experiments)
+            # Compute the shoebox mask
+            reflections.compute_mask(self.experiments)
 
-        # Check for invalid pixels in foreground/background
-        reflections.contains_invalid_pixels()
+            # Check for invalid pixels in foreground/background
+            reflections.contains_invalid_pixels()
 
         # Process the data
-        reflections.compute_background(self.experiments)
-        reflections.compute_centroid(self.experiments)
-        reflections.compute_summed_intensity()
+        with profiling.stage("background"):
+            reflections.compute_background(self.experiments)
+        with profiling.stage("centroid"):
+            reflections.compute_centroid(self.experiments)
+        with profiling.stage("summation"):
+            reflections.compute_summed_intensity()
         if self.profile_fitter:
-            reflections.compute_fitted_intensity(self.profile_fitter)
+            with profiling.stage("fitting"):
+                reflections.compute_fitted_intensity(self.profile_fitter)
 
         # Compute the number of background/foreground pixels
         sbox = reflections["shoebox"]
@@ -938,6 +970,7 @@ def __init__(self, experiments, reflections, params):
         self.params = Parameters.from_phil(params.integration)
         self.profile_model_report = None
         self.integration_report = None
+        self.stage_profiles = []
 
     def integrate(self):
         """
@@ -949,6 +982,7 @@ def integrate(self):
         # Init the report
         self.profile_model_report = None
         self.integration_report = None
+        self.stage_profiles = []
 
         # Heading
         logger.info("=" * 80)
@@ -1065,6 +1099,9 @@ def integrate(self):
 
                 # Process the reference profiles
                 reference, profile_fitter_list, time_info = processor.process()
+                self.stage_profiles.append(
+                    ("modelling", processor.manager.stage_profiles)
+                )
 
                 # Set the reference spots info
                 # self.reflections.set_selected(selection, reference)
@@ -1140,6 +1177,9 @@ def integrate(self):
 
                     # Process the reference profiles
                     reference, validation, time_info = processor.process()
+                    self.stage_profiles.append(
+                        ("validation", processor.manager.stage_profiles)
+                    )
 
                     # Print the modeller report
                     self.profile_validation_report = ProfileValidationReport(
@@ -1174,6 +1214,7 @@ def integrate(self):
 
         # Process the reflections
         self.reflections, _, time_info = processor.process()
+        self.stage_profiles.append(("integration", processor.manager.stage_profiles))
 
         # Finalize the reflections
         self.reflections, self.experiments = self.finalize_reflections(
@@ -1301,6 +1342,7 @@ def __init__(self, experiments, reflections, params):
         self.params = params
         self.profile_model_report = None
         self.integration_report = None
+        self.stage_profiles = []
 
     def initialise(self):
         """
@@ -1340,6 +1382,7 @@ def integrate(self):
         # Init the report
         self.profile_model_report = None
         self.integration_report = None
+        self.stage_profiles = []
 
         # Heading
         logger.info("=" * 80)
@@ -1394,6 +1437,9 @@ def integrate(self):
 
             # Get the reference profiles
             self.reference_profiles = reference_calculator.profiles()
+            self.stage_profiles.append(
+                ("modelling", reference_calculator.stage_profiles)
+            )
         else:
             self.reference_profiles = None
 
@@ -1411,6 +1457,7 @@ def integrate(self):
 
         # Process the reflections
         self.reflections = integrator.reflections()
+        self.stage_profiles.append(("integration", integrator.stage_profiles))
 
         # Do the finalisation
         self.finalise()
@@ -8,6 +8,7 @@
 from libtbx import Auto
 
 import dials.algorithms.integration
+from dials.algorithms.integration import profiling
 from dials.algorithms.integration.processor import NullTask, execute_parallel_task
 from dials.array_family import flex
 from dials.util import tabulate
@@ -388,11 +389,15 @@ def __call__(self):
             self.params.integration.block.max_memory_usage,
         )
 
-        # Integrate
-        self.integrate(imageset)
+        profile = profiling.StageProfile()
+        with profiling.activate(profile):
+            # Integrate
+            with profiling.stage("integrate", all_threads=True):
+                self.integrate(imageset)
 
-        # Write some debug files
-        self.write_debug_files()
+            # Write some debug files
+            with profiling.stage("debug output"):
+                self.write_debug_files()
 
         # Return the result
         return dials.algorithms.integration.Result(
@@ -403,6 +408,7 @@ def __call__(self):
             extract_time=0,
             process_time=0,
             total_time=0,
+            profile=profile,
         )
 
     def compute_required_memory(self, imageset):
@@ -544,6 +550,7 @@ def __init__(self, experiments, reflections, reference, params):
 
         # Initialise the timing information
         # self.time = TimingInfo()
+        self.stage_profiles = profiling.BlockProfiles()
 
         self.initialize()
 
@@ -603,6 +610,7 @@ def tasks(self):
     def accumulate(self, result):
         """Accumulate the results."""
         self.manager.accumulate(result.index, result.reflections)
+        self.stage_profiles.add(result.index, result.profile)
         # self.time.read += result.read_time
         # self.time.extract += result.extract_time
         # self.time.process += result.process_time
@@ -844,11 +852,15 @@ def __call__(self):
             self.params.integration.block.max_memory_usage,
         )
 
-        # Integrate
-        self.compute_reference_profiles(imageset)
+        profile = profiling.StageProfile()
+        with profiling.activate(profile):
+            # Integrate
+            with profiling.stage("reference", all_threads=True):
+                self.compute_reference_profiles(imageset)
 
-        # Write some debug files
-        self.write_debug_files()
+            # Write some debug files
+            with profiling.stage("debug output"):
+                self.write_debug_files()
 
         # Return the result
         return dials.algorithms.integration.Result(
@@ -859,6 +871,7 @@ def __call__(self):
             extract_time=0,
             process_time=0,
             total_time=0,
+            profile=profile,
         )
 
     def compute_required_memory(self, imageset):
@@ -1012,6 +1025,7 @@ def __init__(self, experiments, reflections, params):
 
         # Initialise the timing information
         # self.time = TimingInfo()
+        self.stage_profiles = profiling.BlockProfiles()
 
         self.initialize()
 
@@ -1075,6 +1089,7 @@ def tasks(self):
     def accumulate(self, result):
         """Accumulate the results."""
         self.manager.accumulate(result.index, result.reflections)
+        self.stage_profiles.add(result.index, result.profile)
 
         if self.reference is None:
             self.reference = result.data
@@ -1290,6 +1305,8 @@ def process_output(result):
 
         # Finalize the processing
         reference_manager.finalize()
+        self.stage_profiles = reference_manager.stage_profiles
+        logger.info(self.stage_profiles.summary())
 
         # Set the reflections and profiles
         self._reflections = reference_manager.result()
@@ -1368,6 +1385,8 @@ def process_output(result):
 
         # Finalize the processing
         integration_manager.finalize()
+        self.stage_profiles = integration_manager.stage_profiles
+        logger.info(self.stage_profiles.summary())
 
         # Set the reflections and profiles
         self._reflections = integration_manager.result()
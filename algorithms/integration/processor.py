@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import, division, print_function
 
+import collections
+import concurrent.futures
 import itertools
 import logging
 import math
@@ -12,10 +14,13 @@
 
 import boost_adaptbx.boost.python
 import libtbx
+from scitbx.array_family import shared
 
 import dials.algorithms.integration
 import dials.util
-from dials.array_family import flex
+from dials.algorithms.integration import profiling
+from dials.array_family import flex, shared_table
+from dials.array_family.shared_table import SharedReflectionTable
 from dials.model.data import make_image
 from dials.util import tabulate
 from dials.util.mp import multi_node_parallel_map
@@ -85,6 +90,71 @@ def __getinitargs__():
         return ()
 
 
+def _split_block(block, overlap):
+    """
+    Split a block of frames in two, keeping the overlap between the halves.
+
+    :returns: The two halves, or None if the block is too small to split
+    """
+    f0, f1 = block
+    if f1 - f0 < 2 * overlap + 2:
+        return None
+    mid = (f0 + f1) // 2
+    return [(f0, mid + (overlap + 1) // 2), (mid - overlap // 2, f1)]
+
+
+def adapt_blocks(
+    groups, estimate, limit, overlaps, min_blocks=1, merge_fraction=0.25, cycles=8
+):
+    """
+    Split blocks which need more than a memory limit and merge very small ones.
+
+    :param groups: A list of the (first, last) frames of the blocks in each group
+    :param estimate: A function giving the memory needed for each block of
+                     a list of groups
+    :param limit: The maximum memory for one block
+    :param overlaps: The overlap to keep between split blocks in each group
+    :param min_blocks: Stop merging blocks when there are this many left
+    :param merge_fraction: Merge neighbouring blocks if together they need less
+                           than this fraction of the mean block memory
+    :param cycles: The maximum number of times to split blocks
+    :returns: The new list of groups of blocks and the memory for each block
+    """
+    groups = [list(blocks) for blocks in groups]
+    memory = [list(m) for m in estimate(groups)]
+    for _ in range(cycles):
+        split = False
+        for i, (blocks, nbytes) in enumerate(zip(groups, memory)):
+            new_blocks = []
+            for block, m in zip(blocks, nbytes):
+                halves = _split_block(block, overlaps[i]) if m > limit else None
+                if halves:
+                    new_blocks.extend(halves)
+                    split = True
+                else:
+                    new_blocks.append(block)
+            groups[i] = new_blocks
+        if not split:
+            break
+        memory = [list(m) for m in estimate(groups)]
+
+    # Merge the smallest neighbouring blocks. The memory for the merged block
+    # is at most the sum of the memory for the two blocks.
+    num_blocks = sum(len(blocks) for blocks in groups)
+    mean_memory = sum(sum(m) for m in memory) / num_blocks
+    for blocks, nbytes in zip(groups, memory):
+        while len(blocks) > 1 and num_blocks > min_blocks:
+            total, j = min(
+                (nbytes[j] + nbytes[j + 1], j) for j in range(len(blocks) - 1)
+            )
+            if total > merge_fraction * mean_memory or total > limit:
+                break
+            blocks[j : j + 2] = [(blocks[j][0], blocks[j + 1][1])]
+            nbytes[j : j + 2] = [total]
+            num_blocks -= 1
+    return groups, memory
+
+
 class _Job(object):
     def __init__(self):
         self.index = 0
@@ -104,12 +174,14 @@ def __init__(self):
         self.nproc = 1
         self.njobs = 1
         self.nthreads = 1
+        self.prefetch = 0
 
     def update(self, other):
         self.method = other.method
         self.nproc = other.nproc
         self.njobs = other.njobs
         self.nthreads = other.nthreads
+        self.prefetch = other.prefetch
 
 
 class Lookup(object):
@@ -135,6 +207,7 @@ def __init__(self):
         self.threshold = 0.99
         self.force = False
         self.max_memory_usage = 0.90
+        self.adaptive = True
 
     def update(self, other):
         self.size = other.size
@@ -142,6 +215,7 @@ def update(self, other):
         self.threshold = other.threshold
         self.force = other.force
         self.max_memory_usage = other.max_memory_usage
+        self.adaptive = other.adaptive
 
 
 class Shoebox(object):
@@ -214,6 +288,39 @@ def execute_parallel_task(task):
     return result, handlers[0].messages()
 
 
+class _SharedMemoryTask(object):
+    """
+    Run a task with its reflections passed to and from the worker in shared
+    memory instead of being pickled.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.shared = SharedReflectionTable.from_table(task.reflections)
+        task.reflections = None
+
+    def __call__(self):
+        profile = profiling.StageProfile()
+        with profile.stage("transfer"):
+            self.task.reflections = self.shared.as_table()
+        result = self.task()
+        if result.profile is not None:
+            profile.merge(result.profile)
+        # Write the results over the input columns where possible
+        with profile.stage("transfer"):
+            self.shared.update(result.reflections)
+            self.shared.close()
+        return result._replace(reflections=self.shared, profile=profile)
+
+
+def _result_from_shared_memory(result):
+    shared = result.reflections
+    try:
+        return result._replace(reflections=shared.as_table())
+    finally:
+        shared.unlink()
+
+
 class _Processor(object):
     """Processor interface class."""
 
@@ -281,26 +388,48 @@ def process(self):
         else:
             logger.info(" Using multiprocessing with %d parallel job(s)\n" % (mp_nproc))
         if mp_njobs * mp_nproc > 1:
+            use_shared_memory = (
+                mp_method == "multiprocessing" and shared_table.is_available()
+            )
+            if use_shared_memory:
+                logger.debug("Passing reflections to workers in shared memory")
 
             def process_output(result):
                 for message in result[1]:
                     logger.log(message.levelno, message.msg)
-                self.manager.accumulate(result[0])
-
-            multi_node_parallel_map(
-                func=execute_parallel_task,
-                iterable=list(self.manager.tasks()),
-                njobs=mp_njobs,
-                nproc=mp_nproc,
-                callback=process_output,
-                cluster_method=mp_method,
-                preserve_order=True,
-                preserve_exception_message=True,
-            )
+                if use_shared_memory:
+                    del pending[result[0].index]
+                    self.manager.accumulate(_result_from_shared_memory(result[0]))
+                else:
+                    self.manager.accumulate(result[0])
+
+            tasks = list(self.manager.tasks())
+            if use_shared_memory:
+                tasks = [_SharedMemoryTask(task) for task in tasks]
+                pending = {task.task.index: task for task in tasks}
+            try:
+                multi_node_parallel_map(
+                    func=execute_parallel_task,
+                    iterable=tasks,
+                    njobs=mp_njobs,
+                    nproc=mp_nproc,
+                    callback=process_output,
+                    cluster_method=mp_method,
+                    preserve_order=True,
+                    preserve_exception_message=True,
+                )
+            finally:
+                if use_shared_memory:
+                    # Free the inputs of any tasks which did not complete
+                    for task in pending.values():
+                        task.shared.unlink(missing_ok=True)
         else:
             for task in self.manager.tasks():
                 self.manager.accumulate(task())
         self.manager.finalize()
+        if self.manager.block_memory is not None:
+            logger.info(self.manager.block_summary())
+        logger.info(self.manager.stage_profiles.summary())
         end_time = time()
         self.manager.time.user_time = end_time - start_time
         result1, result2 = self.manager.result()
@@ -366,6 +495,83 @@ def __call__(self):
         )
 
 
+class ImagePrefetcher(object):
+    """
+    Iterate through the images and masks of an imageset in order.
+
+    With a depth greater than zero, up to that many images are read ahead on
+    a background thread while the current image is being processed. Reads are
+    kept on a single thread, since the format instance of an imageset cannot
+    be shared between threads.
+    """
+
+    def __init__(self, imageset, mask=None, depth=0):
+        """
+        Initialise the prefetcher
+
+        :param imageset: The imageset to read
+        :param mask: An optional mask to combine with the mask of each image
+        :param depth: The maximum number of images to read ahead
+        """
+        self.imageset = imageset
+        self.mask = mask
+        self.depth = depth
+        self.read_time = 0.0
+        self.wait_time = 0.0
+
+    def read(self, index):
+        """
+        Read an image and its mask.
+
+        :param index: The index of the image in the imageset
+        :returns: A tuple of (image, mask)
+        """
+        st = time()
+        with profiling.stage("read"):
+            image = self.imageset.get_corrected_data(index)
+            if self.imageset.is_marked_for_rejection(index):
+                mask = tuple(flex.bool(im.accessor(), False) for im in image)
+            else:
+                mask = self.imageset.get_mask(index)
+                if self.mask is not None:
+                    assert len(mask) == len(
+                        self.mask
+                    ), "Mask/Image are incorrect size %d %d" % (
+                        len(mask),
+                        len(self.mask),
+                    )
+                    mask = tuple(m1 & m2 for m1, m2 in zip(self.mask, mask))
+        self.read_time += time() - st
+        return image, mask
+
+    def __len__(self):
+        return len(self.imageset)
+
+    def __iter__(self):
+        if self.depth < 1:
+            for i in range(len(self)):
+                st = time()
+                data = self.read(i)
+                self.wait_time += time() - st
+                yield data
+            return
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            try:
+                for i in range(len(self)):
+                    # Keep the reader busy while the current image is processed
+                    while len(pending) <= self.depth and i + len(pending) < len(self):
+                        pending.append(pool.submit(self.read, i + len(pending)))
+                    st = time()
+                    data = pending.popleft().result()
+                    self.wait_time += time() - st
+                    yield data
+                    del data
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
 class Task(object):
     """
     A class to perform a processing task.
@@ -393,6 +599,17 @@ def __init__(self, index, job, experiments, reflections, params, executor=None):
         self.executor = executor
 
     def __call__(self):
+        """
+        Do the processing, recording the time and memory used by each stage.
+
+        :return: The processed data
+        """
+        profile = profiling.StageProfile()
+        with profiling.activate(profile):
+            result = self.process()
+        return result._replace(profile=profile)
+
+    def process(self):
         """
         Do the processing.
 
@@ -442,15 +659,16 @@ def __call__(self):
         except Exception:
             frame0, frame1 = (0, len(imageset))
 
-        self.executor.initialize(frame0, frame1, self.reflections)
+        with profiling.stage("initialize"):
+            self.executor.initialize(frame0, frame1, self.reflections)
 
-        # Set the shoeboxes (don't allocate)
-        self.reflections["shoebox"] = flex.shoebox(
-            self.reflections["panel"],
-            self.reflections["bbox"],
-            allocate=False,
-            flatten=self.params.shoebox.flatten,
-        )
+            # Set the shoeboxes (don't allocate)
+            self.reflections["shoebox"] = flex.shoebox(
+                self.reflections["panel"],
+                self.reflections["bbox"],
+                allocate=False,
+                flatten=self.params.shoebox.flatten,
+            )
 
         # Create the processor
         processor = ShoeboxProcessor(
@@ -462,60 +680,50 @@ def __call__(self):
         )
 
         # Loop through the imageset, extract pixels and process reflections
-        read_time = 0.0
-        for i in range(len(imageset)):
-            st = time()
-            image = imageset.get_corrected_data(i)
-            if imageset.is_marked_for_rejection(i):
-                mask = tuple(flex.bool(im.accessor(), False) for im in image)
-            else:
-                mask = imageset.get_mask(i)
-                if self.params.lookup.mask is not None:
-                    assert len(mask) == len(
-                        self.params.lookup.mask
-                    ), "Mask/Image are incorrect size %d %d" % (
-                        len(mask),
-                        len(self.params.lookup.mask),
-                    )
-                    mask = tuple(
-                        m1 & m2 for m1, m2 in zip(self.params.lookup.mask, mask)
-                    )
-
-            read_time += time() - st
+        images = ImagePrefetcher(
+            imageset, self.params.lookup.mask, depth=self.params.mp.prefetch
+        )
+        for image, mask in images:
             processor.next(make_image(image, mask), self.executor)
             del image
             del mask
         assert processor.finished(), "Data processor is not finished"
 
+        # The pixels are extracted by the shoebox processor, outside any stage
+        profiling.stage_time("extract", processor.extract_time())
+
         # Optionally save the shoeboxes
         if self.params.debug.output and self.params.debug.separate_files:
-            output = self.reflections
-            if self.params.debug.select is not None:
-                output = output.select(self.params.debug.select(output))
-            if self.params.debug.split_experiments:
-                output = output.split_by_experiment_id()
-                for table in output:
-                    i = table["id"][0]
-                    table.as_file("shoeboxes_%d_%d.refl" % (self.index, i))
-            else:
-                output.as_file("shoeboxes_%d.refl" % self.index)
+            with profiling.stage("debug output"):
+                output = self.reflections
+                if self.params.debug.select is not None:
+                    output = output.select(self.params.debug.select(output))
+                if self.params.debug.split_experiments:
+                    output = output.split_by_experiment_id()
+                    for table in output:
+                        i = table["id"][0]
+                        table.as_file("shoeboxes_%d_%d.refl" % (self.index, i))
+                else:
+                    output.as_file("shoeboxes_%d.refl" % self.index)
 
         # Delete the shoeboxes
         if self.params.debug.separate_files or not self.params.debug.output:
             del self.reflections["shoebox"]
 
         # Finalize the executor
-        self.executor.finalize()
+        with profiling.stage("finalize"):
+            self.executor.finalize()
 
         # Return the result
         return dials.algorithms.integration.Result(
             index=self.index,
             reflections=self.reflections,
             data=self.executor.data(),
-            read_time=read_time,
+            read_time=images.read_time,
             extract_time=processor.extract_time(),
             process_time=processor.process_time(),
             total_time=time() - start_time,
+            io_wait_time=images.wait_time,
         )
 
 
@@ -542,6 +750,10 @@ def __init__(self, experiments, reflections, params):
 
         # Other data
         self.data = {}
+        self.block_memory = None
+        self.block_time = {}
+        self.block_io_wait = {}
+        self.stage_profiles = profiling.BlockProfiles()
 
         # Save some parameters
         self.params = params
@@ -564,8 +776,15 @@ def initialize(self):
 
         # Compute the block size and processors
         self.compute_jobs()
+        if (
+            self.params.block.adaptive
+            and self.params.block.size is not None
+            and len(self.reflections) > 0
+        ):
+            self.adapt_jobs()
         self.split_reflections()
         self.compute_processors()
+        self.compute_prefetch()
 
         # Create the reflection manager
         self.manager = ReflectionManager(self.jobs, self.reflections)
@@ -608,16 +827,24 @@ def task(self, index):
 
     def tasks(self):
         """
-        Iterate through the tasks.
+        Iterate through the tasks. With adaptive blocks, the tasks needing the
+        most shoebox memory are started first.
         """
-        for i in range(len(self)):
+        order = range(len(self))
+        if self.params.block.adaptive and self.block_memory is not None:
+            order = sorted(order, key=lambda i: self.block_memory[i], reverse=True)
+        for i in order:
             yield self.task(i)
 
     def accumulate(self, result):
         """Accumulate the results."""
         self.data[result.index] = result.data
+        self.block_time[result.index] = result.total_time
+        self.block_io_wait[result.index] = result.io_wait_time
+        self.stage_profiles.add(result.index, result.profile)
         self.manager.accumulate(result.index, result.reflections)
         self.time.read += result.read_time
+        self.time.io_wait += result.io_wait_time
         self.time.extract += result.extract_time
         self.time.process += result.process_time
         self.time.total += result.total_time
@@ -689,6 +916,7 @@ def compute_jobs(self):
             lambda x: (id(self.experiments[x].imageset), id(self.experiments[x].scan)),
         )
         self.jobs = JobList()
+        self.job_groups = []
         for key, indices in groups:
             indices = list(indices)
             i0 = indices[0]
@@ -740,8 +968,64 @@ def compute_jobs(self):
                 block_size_frames,
                 block_overlap,
             )
+            self.job_groups.append(((i0, i1), array_range, block_overlap))
         assert len(self.jobs) > 0, "Invalid number of jobs"
 
+    def _job_list(self, groups):
+        """
+        Create a job list from the frames of the blocks in each group
+        """
+        jobs = JobList()
+        for (expr, array_range, _), blocks in zip(self.job_groups, groups):
+            jobs.add_blocks(expr, array_range, shared.tiny_int_2(blocks))
+        return jobs
+
+    def _estimate_block_memory(self, groups):
+        """
+        Estimate the shoebox memory needed for each block in each group
+        """
+        jobs = self._job_list(groups)
+        trial = flex.reflection_table()
+        for key in ("id", "bbox", "flags"):
+            trial[key] = self.reflections[key]
+        jobs.split(trial)
+        memory = list(jobs.shoebox_memory(trial, self.params.shoebox.flatten))
+        result = []
+        for blocks in groups:
+            result.append(memory[: len(blocks)])
+            memory = memory[len(blocks) :]
+        return result
+
+    def adapt_jobs(self):
+        """
+        Split blocks which need more shoebox memory than a single process may use,
+        and merge very small blocks
+        """
+        nproc = self.params.mp.nproc * self.params.mp.njobs
+        limit = (
+            psutil.virtual_memory().available
+            * self.params.block.max_memory_usage
+            / nproc
+        )
+        groups = [[] for _ in self.job_groups]
+        for i in range(len(self.jobs)):
+            job = self.jobs[i]
+            groups[job.index()].append(tuple(job.frames()))
+        num_blocks = len(self.jobs)
+        groups, _ = adapt_blocks(
+            groups,
+            self._estimate_block_memory,
+            limit,
+            [overlap for _, _, overlap in self.job_groups],
+            min_blocks=nproc,
+        )
+        self.jobs = self._job_list(groups)
+        if len(self.jobs) != num_blocks:
+            logger.info(
+                " Adapted %d blocks to %d blocks with at most %.1f GB of shoeboxes\n"
+                % (num_blocks, len(self.jobs), limit / 1e9)
+            )
+
     def split_reflections(self):
         """
         Split the reflections into partials or over job boundaries
@@ -779,9 +1063,10 @@ def compute_processors(self):
         """
 
         # Get the maximum shoebox memory to estimate memory use for one process
-        memory_required_per_process = flex.max(
-            self.jobs.shoebox_memory(self.reflections, self.params.shoebox.flatten)
+        self.block_memory = self.jobs.shoebox_memory(
+            self.reflections, self.params.shoebox.flatten
         )
+        memory_required_per_process = flex.max(self.block_memory)
 
         # Obtain information about system memory
         available_memory = psutil.virtual_memory().available
@@ -856,7 +1141,20 @@ def _report(description, value):
         if self.params.mp.method == "multiprocessing" and self.params.mp.nproc > 1:
 
             # Compute expected memory usage and warn if not enough
-            njobs = available_immediate_limit / memory_required_per_process
+            if self.params.block.adaptive:
+                # Cap the shoebox memory in flight across all processes, even
+                # if the largest blocks are processed at the same time
+                largest = sorted(self.block_memory, reverse=True)
+                njobs = 0
+                in_flight = 0
+                for nbytes in largest[: self.params.mp.nproc]:
+                    if in_flight + nbytes > available_immediate_limit:
+                        break
+                    in_flight += nbytes
+                    njobs += 1
+                _report("Memory required by largest blocks in flight", in_flight / 1e9)
+            else:
+                njobs = available_immediate_limit / memory_required_per_process
             if njobs >= self.params.mp.nproc:
                 # There is enough memory. Take no action
                 pass
@@ -899,6 +1197,35 @@ def _report(description, value):
                 % _average_bbox_size(self.reflections)
             )
 
+    def compute_prefetch(self):
+        """
+        Limit the number of images read ahead by each process to the memory
+        left over once the shoeboxes of the largest blocks are allocated
+        """
+        if self.params.mp.prefetch < 1:
+            return
+        frame_bytes = max(
+            sum(
+                # The corrected image as doubles and the mask as bools
+                panel.get_image_size()[0] * panel.get_image_size()[1] * 9
+                for panel in experiment.detector
+            )
+            for experiment in self.experiments
+        )
+        nproc = self.params.mp.nproc
+        in_flight = sum(sorted(self.block_memory, reverse=True)[:nproc])
+        available = (
+            psutil.virtual_memory().available * self.params.block.max_memory_usage
+            - in_flight
+        )
+        depth = max(0, int(available / nproc // frame_bytes))
+        if depth < self.params.mp.prefetch:
+            logger.warning(
+                "Reducing number of images to prefetch from %d to %d due to memory"
+                " constraints.\n" % (self.params.mp.prefetch, depth)
+            )
+            self.params.mp.prefetch = depth
+
     def summary(self):
         """
         Get a summary of the processing
@@ -939,6 +1266,12 @@ def summary(self):
         else:
             raise RuntimeError("Experiments must be all sequences or all stills")
 
+        # Add the estimated shoebox memory for each block
+        if self.block_memory is not None:
+            rows[0].append("Memory (MB)")
+            for i in range(len(self)):
+                rows[i + 1].append("%.1f" % (self.block_memory[i] / 1e6))
+
         # The job table
         task_table = tabulate(rows, headers="firstrow")
 
@@ -949,13 +1282,51 @@ def summary(self):
             block_size = str(self.params.block.size)
         return (
             "Processing reflections in the following blocks of images:\n\n"
-            " block_size: {} {}\n\n{}\n"
+            " block_size: {} {}\n"
+            " prefetch: {} images\n\n{}\n"
         ).format(
             block_size,
             "" if block_size in ("auto", "Auto") else self.params.block.units,
+            self.params.mp.prefetch,
             task_table,
         )
 
+    def block_summary(self):
+        """
+        Get a summary of the memory and time used by each block
+        """
+        rows = [
+            [
+                "#",
+                "Frame From",
+                "Frame To",
+                "# Reflections",
+                "Memory (MB)",
+                "Time (s)",
+                "I/O wait (s)",
+                "Compute (s)",
+            ]
+        ]
+        for i in range(len(self)):
+            f0, f1 = self.manager.job(i).frames()
+            total = self.block_time.get(i, 0)
+            io_wait = self.block_io_wait.get(i, 0)
+            rows.append(
+                [
+                    str(i),
+                    str(f0),
+                    str(f1),
+                    str(self.manager.num_reflections(i)),
+                    "%.1f" % (self.block_memory[i] / 1e6),
+                    "%.2f" % total,
+                    "%.2f" % io_wait,
+                    "%.2f" % (total - io_wait),
+                ]
+            )
+        return "Memory and time used for each block:\n\n{}\n".format(
+            tabulate(rows, headers="firstrow")
+        )
+
 
 class Processor3D(_ProcessorRot):
     """Top level processor for 3D processing."""
@@ -0,0 +1,269 @@
+"""
+Per-stage timing and memory profiling of the integration pipeline.
+
+Each integration task records the wall time, CPU time and resident memory of
+the stages it runs (reading images, computing masks, background modelling,
+centroids, summation, profile fitting, ...) in a StageProfile. The profile of
+each block is returned to the main process with the result of the task, where
+the profiles of all blocks are aggregated.
+
+Code which runs inside a task does not need a reference to the profile of the
+block: it records stages with the module level stage() function, which adds
+to the profile activated by the task and does nothing otherwise.
+
+The resident memory recorded for a stage is the largest resident set size of
+the process sampled at the end of each call of the stage.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import contextlib
+import json
+import time
+
+import psutil
+
+from dials.util import tabulate
+
+__all__ = [
+    "activate",
+    "BlockProfiles",
+    "stage",
+    "stage_time",
+    "StageProfile",
+    "write_profile",
+]
+
+try:
+    # CPU time of the calling thread, so stages run on background threads do
+    # not include the CPU time of the main thread
+    _cpu_time = time.thread_time
+except AttributeError:
+    # Python < 3.7
+    _cpu_time = time.process_time
+
+_process = None
+
+
+def _rss():
+    global _process
+    if _process is None:
+        _process = psutil.Process()
+    return _process.memory_info().rss
+
+
+class StageProfile(object):
+    """
+    The wall time, CPU time, peak resident memory and number of calls of each
+    stage of processing.
+    """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name, all_threads=False):
+        """
+        Record the time and memory used by a block of code
+
+        :param name: The name of the stage
+        :param all_threads: Count the CPU time of all threads of the process,
+                            for stages which run their own threads
+        """
+        cpu_time = time.process_time if all_threads else _cpu_time
+        wall = time.time()
+        cpu = cpu_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - wall, cpu_time() - cpu, _rss())
+
+    def record(self, name, wall, cpu=None, peak_rss=0, calls=1):
+        """
+        Add a measurement to a stage
+
+        :param name: The name of the stage
+        :param wall: The wall time in seconds
+        :param cpu: The CPU time in seconds, or None if it is not known
+        :param peak_rss: The peak resident memory in bytes
+        :param calls: The number of calls the measurement covers
+        """
+        if name not in self.stages:
+            self.stages[name] = {"wall": 0.0, "cpu": None, "peak_rss": 0, "calls": 0}
+        entry = self.stages[name]
+        entry["wall"] += wall
+        if cpu is not None:
+            entry["cpu"] = (entry["cpu"] or 0.0) + cpu
+        entry["peak_rss"] = max(entry["peak_rss"], peak_rss)
+        entry["calls"] += calls
+
+    def merge(self, other):
+        """
+        Add the stages of another profile, e.g. from another block
+
+        :param other: The other profile
+        """
+        for name, entry in other.stages.items():
+            self.record(name, **entry)
+        return self
+
+    def wall_time(self):
+        """
+        :returns: The total wall time of all stages
+        """
+        return sum(entry["wall"] for entry in self.stages.values())
+
+    def dominant_stage(self):
+        """
+        :returns: The name of the stage with the most wall time, or None
+        """
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda name: self.stages[name]["wall"])
+
+    def as_dict(self):
+        """
+        :returns: The stages as a dictionary which can be written as JSON
+        """
+        return {name: dict(entry) for name, entry in self.stages.items()}
+
+    @classmethod
+    def from_dict(cls, stages):
+        """
+        :param stages: A dictionary created by as_dict
+        :returns: The profile
+        """
+        result = cls()
+        for name, entry in stages.items():
+            result.record(name, **entry)
+        return result
+
+    def __str__(self):
+        """
+        A table of the stages, with the dominant stage marked
+        """
+        total = self.wall_time()
+        dominant = self.dominant_stage()
+        rows = [["Stage", "Calls", "Wall (s)", "CPU (s)", "Peak RSS (MB)", "% Wall"]]
+        for name, entry in self.stages.items():
+            rows.append(
+                [
+                    name + (" *" if name == dominant else ""),
+                    str(entry["calls"]),
+                    "%.2f" % entry["wall"],
+                    "-" if entry["cpu"] is None else "%.2f" % entry["cpu"],
+                    "%.1f" % (entry["peak_rss"] / 1e6),
+                    "%.1f" % (100 * entry["wall"] / total if total else 0),
+                ]
+            )
+        return tabulate(rows, headers="firstrow")
+
+
+class _Null(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null = _Null()
+_active = None
+
+
+@contextlib.contextmanager
+def activate(profile):
+    """
+    Record the stages of the code in the context in a profile
+
+    :param profile: The StageProfile
+    """
+    global _active
+    previous = _active
+    _active = profile
+    try:
+        yield profile
+    finally:
+        _active = previous
+
+
+def stage(name, all_threads=False):
+    """
+    Record a stage in the active profile, if there is one.
+
+    :param name: The name of the stage
+    :param all_threads: Count the CPU time of all threads of the process
+    :returns: A context manager
+    """
+    if _active is None:
+        return _null
+    return _active.stage(name, all_threads=all_threads)
+
+
+def stage_time(name, wall):
+    """
+    Record the wall time of a stage measured elsewhere, e.g. in C++, in the
+    active profile, if there is one.
+
+    :param name: The name of the stage
+    :param wall: The wall time in seconds
+    """
+    if _active is not None:
+        _active.record(name, wall, peak_rss=_rss())
+
+
+class BlockProfiles(object):
+    """
+    The stage profiles of each block processed in one phase of integration,
+    and their total.
+    """
+
+    def __init__(self):
+        self.total = StageProfile()
+        self.blocks = collections.OrderedDict()
+
+    def add(self, index, profile):
+        """
+        Add the profile of a block
+
+        :param index: The index of the block
+        :param profile: The StageProfile of the block, or None
+        """
+        if profile is None:
+            return
+        self.blocks[index] = profile
+        self.total.merge(profile)
+
+    def as_dict(self):
+        """
+        :returns: The profiles as a dictionary which can be written as JSON
+        """
+        return {
+            "dominant_stage": self.total.dominant_stage(),
+            "stages": self.total.as_dict(),
+            "blocks": {str(i): block.as_dict() for i, block in self.blocks.items()},
+        }
+
+    def summary(self):
+        """
+        :returns: A summary table of the total for each stage
+        """
+        return (
+            "Time and memory used by each stage (* marks the dominant stage):\n\n"
+            "{}\n".format(self.total)
+        )
+
+
+def write_profile(filename, phases):
+    """
+    Write the profiles of the phases of integration as JSON
+
+    :param filename: The output filename
+    :param phases: A list of (phase name, BlockProfiles) tuples
+    """
+    output = collections.OrderedDict()
+    for name, profiles in phases:
+        output[name] = profiles.as_dict()
+    with open(filename, "w") as outfile:
+        json.dump(output, outfile, indent=2)
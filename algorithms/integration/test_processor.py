@@ -50,6 +50,7 @@ def test_runtime_error_raised_when_not_enough_memory(
     phil_mock.mp.method = "multiprocessing"
     phil_mock.mp.nproc = 4
     phil_mock.block.max_memory_usage = 0.75
+    phil_mock.block.adaptive = False
 
     reflections = {"bbox": flex.int6(1000, (0, 1, 0, 1, 0, 1))}
     manager = dials.algorithms.integration.processor._Manager(
@@ -66,3 +67,88 @@ def test_runtime_error_raised_when_not_enough_memory(
     mock_flex_max.return_value = 750000
     manager.compute_processors()
     mock_flex_max.assert_called_with(manager.jobs.shoebox_memory.return_value)
+
+
+@mock.patch("dials.algorithms.integration.processor.psutil.virtual_memory")
+@mock.patch("dials.algorithms.integration.processor.psutil.swap_memory")
+def test_adaptive_blocks_limit_memory_in_flight(mock_psutil_swap, mock_psutil_vm):
+    mock_psutil_vm.return_value.available = 1000000
+    mock_psutil_swap.return_value.free = 0
+
+    phil_mock = mock.Mock()
+    phil_mock.mp.method = "multiprocessing"
+    phil_mock.mp.nproc = 4
+    phil_mock.block.max_memory_usage = 0.75
+    phil_mock.block.adaptive = True
+
+    reflections = {"bbox": flex.int6(1000, (0, 1, 0, 1, 0, 1))}
+    manager = dials.algorithms.integration.processor._Manager(
+        None, reflections, phil_mock
+    )
+    manager.jobs = mock.Mock(autospec=JobList)
+
+    # The two largest blocks fit in memory together but not the largest three
+    manager.jobs.shoebox_memory.return_value = flex.size_t(
+        [100000, 400000, 300000, 50000]
+    )
+    manager.compute_processors()
+    assert phil_mock.mp.nproc == 2
+
+    # The largest block on its own needs more than the available memory
+    phil_mock.mp.nproc = 4
+    manager.jobs.shoebox_memory.return_value = flex.size_t([800000, 1000])
+    with pytest.raises(MemoryError):
+        manager.compute_processors()
+
+
+def test_adapt_blocks():
+    from dials.algorithms.integration.processor import adapt_blocks
+
+    # One expensive region of frames and a long tail of cheap frames
+    cost = [100] * 20 + [1] * 80
+
+    def estimate(groups):
+        return [[sum(cost[f0:f1]) for f0, f1 in blocks] for blocks in groups]
+
+    groups = [[(0, 25), (20, 50), (45, 75), (70, 100)]]
+    groups, memory = adapt_blocks(groups, estimate, 600, [2], min_blocks=4)
+    blocks = groups[0]
+    assert blocks[0][0] == 0 and blocks[-1][1] == 100
+    for b0, b1 in zip(blocks, blocks[1:]):
+        assert b0[0] < b1[0] <= b0[1] < b1[1]
+    assert max(memory[0]) <= 600
+    # The expensive region is split and the cheap tail merged
+    assert len([b for b in blocks if b[1] <= 25]) > 1
+    assert len([b for b in blocks if b[0] >= 20]) < 3
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3, 20])
+def test_image_prefetcher_reads_images_in_order(depth):
+    from dials.algorithms.integration.processor import ImagePrefetcher
+
+    class FakeImageSet(object):
+        def __len__(self):
+            return 10
+
+        def get_corrected_data(self, index):
+            return (flex.double(flex.grid(2, 3), index),)
+
+        def is_marked_for_rejection(self, index):
+            return index == 4
+
+        def get_mask(self, index):
+            return (flex.bool(flex.grid(2, 3), True),)
+
+    lookup_mask = (flex.bool([True, False, True, True, True, True]),)
+    lookup_mask[0].reshape(flex.grid(2, 3))
+    images = ImagePrefetcher(FakeImageSet(), lookup_mask, depth=depth)
+    result = list(images)
+    assert len(result) == 10
+    for i, (image, mask) in enumerate(result):
+        assert list(image[0]) == [i] * 6
+        if i == 4:
+            assert mask[0].count(True) == 0
+        else:
+            assert list(mask[0]) == list(lookup_mask[0])
+    assert images.read_time >= 0
+    assert images.wait_time >= 0
@@ -0,0 +1,66 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import time
+
+from dials.algorithms.integration import profiling
+
+
+def test_stage_profile_records_and_merges_stages():
+    profile = profiling.StageProfile()
+    with profile.stage("read"):
+        time.sleep(0.01)
+    with profile.stage("read"):
+        pass
+    profile.record("extract", 0.5)
+    assert list(profile.stages) == ["read", "extract"]
+    assert profile.stages["read"]["calls"] == 2
+    assert profile.stages["read"]["wall"] >= 0.01
+    assert profile.stages["read"]["peak_rss"] > 0
+    assert profile.stages["extract"]["cpu"] is None
+    assert profile.dominant_stage() == "extract"
+    assert "extract *" in str(profile)
+
+    other = profiling.StageProfile.from_dict(profile.as_dict())
+    other.merge(profile)
+    assert other.stages["read"]["calls"] == 4
+    assert other.stages["extract"]["wall"] == 1.0
+
+
+def test_stage_records_only_in_active_profile():
+    with profiling.stage("ignored"):
+        pass
+    profiling.stage_time("ignored", 1.0)
+
+    profile = profiling.StageProfile()
+    with profiling.activate(profile):
+        with profiling.stage("background"):
+            pass
+        profiling.stage_time("extract", 1.0)
+    with profiling.stage("ignored"):
+        pass
+    assert list(profile.stages) == ["background", "extract"]
+
+
+def test_write_profile(tmp_path):
+    blocks = profiling.BlockProfiles()
+    for i in range(3):
+        profile = profiling.StageProfile()
+        profile.record("background", 1.0, cpu=0.5, peak_rss=100 * (i + 1))
+        profile.record("fitting", 2.0, cpu=2.0, peak_rss=10)
+        blocks.add(i, profile)
+    blocks.add(3, None)
+    assert "fitting *" in blocks.summary()
+
+    filename = tmp_path / "profile.json"
+    profiling.write_profile(str(filename), [("integration", blocks)])
+    with filename.open() as fh:
+        result = json.load(fh)
+    assert result["integration"]["dominant_stage"] == "fitting"
+    assert result["integration"]["stages"]["background"] == {
+        "wall": 3.0,
+        "cpu": 1.5,
+        "peak_rss": 300,
+        "calls": 3,
+    }
+    assert sorted(result["integration"]["blocks"]) == ["0", "1", "2"]
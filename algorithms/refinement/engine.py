@@ -4,6 +4,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+import contextlib
 import copy
 import json
 import logging
@@ -15,7 +16,7 @@
 from scitbx.array_family import flex
 from scitbx.lstbx import normal_eqns, normal_eqns_solving
 
-from dials.algorithms.refinement import DialsRefineRuntimeError
+from dials.algorithms.refinement import DialsRefineRuntimeError, refinement_workers
 
 logger = logging.getLogger(__name__)
 
@@ -206,6 +207,7 @@ def __init__(
             tracking = refinery_phil_scope.extract().refinery.journal
         self.history = Journal()
         self.history.add_column("num_reflections")
+        self.history.add_column("sample_size")
         self.history.add_column("objective")  # flex.double()
         if tracking.track_gradient:
             self.history.add_column("gradient")
@@ -226,6 +228,9 @@ def __init__(
         # number of processes to use, for engines that support multiprocessing
         self._nproc = 1
 
+        # persistent worker processes, for engines that support them
+        self._workers = None
+
         self.prepare_for_step()
 
     def get_num_steps(self):
@@ -241,8 +246,12 @@ def prepare_for_step(self):
         # set current parameter values
         self._parameters.set_param_vals(x)
 
-        # do reflection prediction
-        self._target.predict()
+        # do reflection prediction, unless persistent worker processes predict
+        # for the working reflections. Then only the models need updating
+        if self._workers is not None:
+            self._target.compose_without_derivatives()
+        else:
+            self._target.predict()
 
     def update_journal(self):
         """Append latest step information to the journal attributes"""
@@ -250,6 +259,7 @@ def update_journal(self):
         # add step quantities to journal
         self.history.add_row()
         self.history.set_last_cell("num_reflections", self._target.get_num_matches())
+        self.history.set_last_cell("sample_size", self._target.get_sample_size())
         self.history.set_last_cell("rmsd", self._target.rmsds())
         self.history.set_last_cell(
             "parameter_vector", self._parameters.get_param_vals()
@@ -451,6 +461,64 @@ def set_nproc(self, nproc):
         if a policy dictates that this must not be user-controlled"""
         self._nproc = nproc
 
+    @contextlib.contextmanager
+    def persistent_workers(self):
+        """Context within which a refinement run may use persistent worker
+        processes. Does nothing here, but used by derived classes that support
+        them"""
+        yield
+
+    def grow_sample(self):
+        """If refinement is using a growing sample of the working reflections,
+        grow it. Return True if the sample grew, in which case refinement should
+        continue from the current parameters rather than terminate"""
+
+        # Targets from outside refinement, such as those used in scaling, do not
+        # manage a sample of reflections
+        if not hasattr(self._target, "grow_sample"):
+            return False
+        if not self._target.grow_sample():
+            return False
+        logger.debug(
+            "Sample size increased to %d reflections", self._target.get_sample_size()
+        )
+        return True
+
+    def use_whole_working_set(self):
+        """If refinement is using a sample of the working reflections, replace it
+        with the whole working set. Return True if the sample changed, in which
+        case refinement should take at least one more step rather than terminate,
+        so that the final parameters are refined against all the reflections"""
+
+        if not hasattr(self._target, "use_whole_working_set"):
+            return False
+        if not self._target.use_whole_working_set():
+            return False
+        logger.debug(
+            "Sample size increased to %d reflections", self._target.get_sample_size()
+        )
+        return True
+
+    def get_state(self):
+        """Return the state reached at the end of a refinement run, in a form
+        that may be passed between processes and restored by set_state"""
+        return {
+            "x": self.x,
+            "history": self.history,
+            "sample_size": self._target.get_sample_size(),
+        }
+
+    def set_state(self, state):
+        """Restore the state reached at the end of a refinement run, which may
+        have been performed in another process. The parameterisation, sample
+        and predictions are updated to match"""
+        self.x = state["x"]
+        self.history = state["history"]
+        while self._target.get_sample_size() < state["sample_size"]:
+            if not self._target.grow_sample():
+                break
+        self.prepare_for_step()
+
     def run(self):
         """
         To be implemented by derived class. It is expected that each step of
@@ -481,6 +549,10 @@ def __init__(self, *args, **kwargs):
             max_iterations=self._max_iterations
         )
 
+        # set when the minimiser is stopped in order to restart with a larger
+        # sample of the working reflections
+        self._restart = False
+
         from six.moves import cStringIO as StringIO
 
         self._log_string = StringIO
@@ -545,14 +617,18 @@ def callback_after_step(self, minimizer):
         logger.debug("Step %d", self.history.get_nrows() - 1)
 
         if self.test_for_termination():
-            self.history.reason_for_termination = TARGET_ACHIEVED
-            return True
-
-        if self.test_rmsd_convergence():
-            self.history.reason_for_termination = RMSD_CONVERGED
-            return True
+            reason = TARGET_ACHIEVED
+        elif self.test_rmsd_convergence():
+            reason = RMSD_CONVERGED
+        else:
+            return False
 
-        return False
+        # the objective changes with the sample, so restart the minimiser
+        if self.grow_sample():
+            self._restart = True
+        else:
+            self.history.reason_for_termination = reason
+        return True
 
     def run_lbfgs(self, curvatures=False):
         """
@@ -562,11 +638,20 @@ def run_lbfgs(self, curvatures=False):
         ref_log = self._log_string()
         if curvatures:
             self.diag_mode = "always"
-        self.minimizer = lbfgs.run(
-            target_evaluator=self,
-            termination_params=self._termination_params,
-            log=ref_log,
-        )
+        termination_params = self._termination_params
+        self._restart = True
+        while self._restart:
+            self._restart = False
+            self.minimizer = lbfgs.run(
+                target_evaluator=self,
+                termination_params=termination_params,
+                log=ref_log,
+            )
+            if not self._restart and self.use_whole_working_set():
+                # the minimiser stopped for another reason while using a sample
+                # of the working reflections, so finish with the whole set
+                termination_params = lbfgs.termination_parameters(max_iterations=1)
+                self._restart = True
 
         log = ref_log.getvalue()
         if self._log:
@@ -655,6 +740,104 @@ def restart(self):
     def parameter_vector_norm(self):
         return self.x.norm()
 
+    @contextlib.contextmanager
+    def persistent_workers(self):
+        """Fork worker processes that each own a subset of the working
+        reflections, if more than one process is requested. These are then
+        used by build_up for each step of the refinement run, so that this
+        process does not predict for the working reflections until the run
+        is over"""
+
+        if self._nproc == 1 or not refinement_workers.is_available():
+            yield
+            return
+        self._start_workers()
+        try:
+            yield
+        finally:
+            self._workers.close()
+            self._workers = None
+
+        # predict for the working reflections at the final parameters
+        self.prepare_for_step()
+
+    def _start_workers(self):
+        self._workers = refinement_workers.RefinementWorkers(
+            self, self._target.get_obs(), self._nproc
+        )
+        logger.debug("Building normal equations with %d workers", self._workers.nproc)
+
+    def _restart_workers(self):
+        if self._workers is not None:
+            # the workers own parts of the previous sample, so replace them
+            self._workers.close()
+            self._start_workers()
+
+    def grow_sample(self):
+        if not Refinery.grow_sample(self):
+            return False
+        self._restart_workers()
+        return True
+
+    def use_whole_working_set(self):
+        if not Refinery.use_whole_working_set(self):
+            return False
+        self._restart_workers()
+        return True
+
+    def build_up_for_subset(self, x, reflections, objective_only=False):
+        """Predict for a subset of the working reflections at the expanded
+        parameter vector x, and return the residuals and weights of the matches
+        in that subset along with their contributions to the normal equations,
+        their rmsds and their number. If objective_only, the contributions to
+        the normal equations are None. Used by persistent worker processes, so
+        that the Jacobian need not be returned to the main process"""
+
+        self._parameters.set_param_vals(x)
+        matches = self._target.predict_for_subset(
+            reflections, skip_derivatives=objective_only
+        )
+        rmsds = self._target.rmsds_for_reflection_table(matches)
+        if objective_only:
+            residuals, weights = self._target.compute_residuals(matches)
+            return residuals, weights, None, None, rmsds, len(matches)
+
+        equations = normal_eqns.non_linear_ls(n_parameters=len(self.x))
+        residuals = flex.double()
+        weights = flex.double()
+        for block in self._target.split_matches_into_blocks(matches=matches):
+            r, j, w = self._target.compute_residuals_and_gradients(block)
+            if self._constr_manager is not None:
+                j = self._constr_manager.constrain_jacobian(j)
+            equations.add_equations(r, j, w)
+            residuals.extend(r)
+            weights.extend(w)
+
+        # The right hand side of the step equations is -J^T W r
+        step_equations = equations.step_equations()
+        normal_matrix = step_equations.normal_matrix_packed_u().deep_copy()
+        jtwr = -step_equations.right_hand_side()
+        return residuals, weights, normal_matrix, jtwr, rmsds, len(matches)
+
+    def add_normal_equations(self, residuals, weights, normal_matrix, jtwr):
+        """
+        Add the contributions of a set of observations directly to the normal
+        equations, without requiring their jacobian.
+
+        :param residuals: The residuals of the observations
+        :param weights: The weights of the observations
+        :param normal_matrix: The packed upper triangle of J^T W J
+        :param jtwr: The vector J^T W r
+        """
+        self.add_residuals(residuals, weights)
+        step_equations = self.step_equations()
+        # These share memory with the step equations, so update in place. The
+        # right hand side of the step equations is -J^T W r.
+        a = step_equations.normal_matrix_packed_u()
+        a += normal_matrix
+        b = step_equations.right_hand_side()
+        b -= jtwr
+
     def build_up(self, objective_only=False):
 
         # code here to calculate the residuals. Rely on the target class
@@ -671,7 +854,26 @@ def build_up(self, objective_only=False):
         self.reset()
 
         # observation terms
-        if objective_only:
+        if self._workers is not None:
+
+            # ensure the jacobian is not tracked
+            self._jacobian = None
+
+            x = self.x
+            if self._constr_manager is not None:
+                x = self._constr_manager.expand_parameters(x)
+            results = self._workers.build_up(x, objective_only)
+            for residuals, weights, normal_matrix, jtwr, _, _ in results:
+                if objective_only:
+                    self.add_residuals(residuals, weights)
+                else:
+                    self.add_normal_equations(residuals, weights, normal_matrix, jtwr)
+
+            # the rmsds and number of matches are reduced from those of each subset
+            self._target.set_rmsds_from_subsets(
+                [result[4] for result in results], [result[5] for result in results]
+            )
+        elif objective_only:
             residuals, weights = self._target.compute_residuals()
             self.add_residuals(residuals, weights)
         else:
@@ -775,7 +977,13 @@ def calculate_esds(self):
         nm_inv = cf_inv.matrix_multiply_transpose(cf_inv)
 
         # keep the estimated parameter variance-covariance matrix
-        self.parameter_var_cov = self.history["reduced_chi_squared"][-1] * nm_inv
+        self._set_parameter_var_cov(self.history["reduced_chi_squared"][-1] * nm_inv)
+
+    def _set_parameter_var_cov(self, parameter_var_cov):
+        """Keep the parameter variance-covariance matrix and send the resulting
+        uncertainties back to the models and parameterisations"""
+
+        self.parameter_var_cov = parameter_var_cov
         # send this back to the models to calculate their uncertainties
         self._parameters.calculate_model_state_uncertainties(self.parameter_var_cov)
 
@@ -787,6 +995,16 @@ def calculate_esds(self):
         s = flex.sqrt(s2)
         self._parameters.set_param_esds(s)
 
+    def get_state(self):
+        state = Refinery.get_state(self)
+        state["parameter_var_cov"] = getattr(self, "parameter_var_cov", None)
+        return state
+
+    def set_state(self, state):
+        Refinery.set_state(self, state)
+        if state.get("parameter_var_cov") is not None:
+            self._set_parameter_var_cov(state["parameter_var_cov"])
+
     def _print_normal_matrix(self):
         """Print the full normal matrix at the current step. For debugging only"""
         logger.debug("The normal matrix for the current step is:")
@@ -838,11 +1056,14 @@ def __init__(
 
     def run(self):
         self.n_iterations = 0
+        max_iterations = self._max_iterations
 
         # prepare for first step
         self.build_up()
 
         # return early if refinement is not possible
+        if self.dof < 1 and self.use_whole_working_set():
+            self.build_up()
         if self.dof < 1:
             self.history.reason_for_termination = DOF_TOO_LOW
             return
@@ -874,29 +1095,45 @@ def run(self):
             self.history.set_last_cell("solution_norm", self.step().norm())
             self.history.set_last_cell("reduced_chi_squared", self.chi_sq())
 
-            # test termination criteria
+            # test termination criteria. If refining against a sample of the
+            # working reflections, grow the sample and continue instead
             if self.test_for_termination():
-                self.history.reason_for_termination = TARGET_ACHIEVED
-                break
-
-            if self.test_rmsd_convergence():
-                self.history.reason_for_termination = RMSD_CONVERGED
-                break
-
-            if self.had_too_small_a_step():
-                self.history.reason_for_termination = STEP_TOO_SMALL
+                reason = TARGET_ACHIEVED
+            elif self.test_rmsd_convergence():
+                reason = RMSD_CONVERGED
+            elif self.had_too_small_a_step():
+                reason = STEP_TOO_SMALL
+            else:
+                reason = None
+            if reason is not None:
+                if self.grow_sample():
+                    self.build_up()
+                    continue
+                self.history.reason_for_termination = reason
                 break
 
+            # for any other reason to terminate while refining against a sample
+            # of the working reflections, finish with at least one step against
+            # the whole working set
             if self.test_objective_increasing_but_not_nref():
+                stepped_back = self.step_backward()
+                if self.use_whole_working_set():
+                    max_iterations = self.n_iterations + 1
+                    self.build_up()
+                    continue
                 self.history.reason_for_termination = OBJECTIVE_INCREASE
-                if self.step_backward():
+                if stepped_back:
                     self.history.reason_for_termination += (
                         ". Parameters set back one step"
                     )
                 self.prepare_for_step()
                 break
 
-            if self.n_iterations == self._max_iterations:
+            if self.n_iterations == max_iterations:
+                if self.use_whole_working_set():
+                    max_iterations += 1
+                    self.build_up()
+                    continue
                 self.history.reason_for_termination = MAX_ITERATIONS
                 break
 
@@ -948,6 +1185,7 @@ def _run_core(self):
         # set max iterations if not already.
         if self._max_iterations is None:
             self._max_iterations = 100
+        max_iterations = self._max_iterations
 
         self.n_iterations = 0
         nu = 2
@@ -964,6 +1202,8 @@ def _run_core(self):
             )
 
         # return early if refinement is not possible
+        if self.dof < 1 and self.use_whole_working_set():
+            self.build_up()
         if self.dof < 1:
             self.history.reason_for_termination = DOF_TOO_LOW
             return
@@ -1006,17 +1246,31 @@ def _run_core(self):
             self.history.set_last_cell("solution_norm", self.step().norm())
             self.history.set_last_cell("reduced_chi_squared", self.chi_sq())
 
-            # test termination criteria before taking the next forward step
+            # test termination criteria before taking the next forward step. If
+            # refining against a sample of the working reflections, grow the
+            # sample and continue instead
             if self.had_too_small_a_step():
-                self.history.reason_for_termination = STEP_TOO_SMALL
-                break
-            if self.test_for_termination():
-                self.history.reason_for_termination = TARGET_ACHIEVED
-                break
-            if self.test_rmsd_convergence():
-                self.history.reason_for_termination = RMSD_CONVERGED
+                reason = STEP_TOO_SMALL
+            elif self.test_for_termination():
+                reason = TARGET_ACHIEVED
+            elif self.test_rmsd_convergence():
+                reason = RMSD_CONVERGED
+            else:
+                reason = None
+            if reason is not None:
+                if self.grow_sample():
+                    self.build_up()
+                    continue
+                self.history.reason_for_termination = reason
                 break
-            if self.n_iterations == self._max_iterations:
+            # for any other reason to terminate while refining against a sample
+            # of the working reflections, finish with at least one step against
+            # the whole working set
+            if self.n_iterations == max_iterations:
+                if self.use_whole_working_set():
+                    max_iterations += 1
+                    self.build_up()
+                    continue
                 self.history.reason_for_termination = MAX_ITERATIONS
                 break
 
@@ -1036,6 +1290,11 @@ def _run_core(self):
                 self.step_backward()
                 self.history.del_last_row()
                 if nu >= 8192:
+                    if self.use_whole_working_set():
+                        max_iterations = self.n_iterations + 1
+                        nu = 2
+                        self.build_up()
+                        continue
                     self.history.reason_for_termination = MAX_TRIAL_ITERATIONS
                     break
                 self.mu *= nu
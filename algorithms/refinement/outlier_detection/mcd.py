@@ -17,6 +17,7 @@ def __init__(
         separate_experiments=True,
         separate_panels=True,
         block_width=None,
+        nproc=1,
         alpha=0.5,
         max_n_groups=5,
         min_group_size=300,
@@ -36,6 +37,7 @@ def __init__(
             separate_experiments=separate_experiments,
             separate_panels=separate_panels,
             block_width=block_width,
+            nproc=nproc,
         )
 
         # Keep the FastMCD options here
@@ -53,7 +55,14 @@ def __init__(
 
         return
 
-    def _detect_outliers(self, cols):
+    def _run_job(self, args):
+        """Perform outlier detection for a single job, seeding the FastMCD
+        random number generator for the job"""
+
+        cols, seed = args
+        return self._detect_outliers(cols, seed=seed)
+
+    def _detect_outliers(self, cols, seed=None):
 
         fast_mcd = FastMCD(
             cols,
@@ -64,6 +73,7 @@ def _detect_outliers(self, cols):
             k1=self._k1,
             k2=self._k2,
             k3=self._k3,
+            seed=seed,
         )
 
         # get location and MCD scatter estimate
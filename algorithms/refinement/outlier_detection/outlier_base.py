@@ -3,6 +3,7 @@
 import logging
 from math import pi
 
+from libtbx import easy_mp
 from libtbx.phil import parse
 
 from dials.array_family import flex
@@ -23,6 +24,7 @@ def __init__(
         separate_experiments=True,
         separate_panels=True,
         block_width=None,
+        nproc=1,
     ):
 
         # column names of the data in which to look for outliers
@@ -42,6 +44,9 @@ def __init__(
         # block width for splitting scans over phi, or None for no split
         self._block_width = block_width
 
+        # the number of processes over which to run outlier detection jobs
+        self._nproc = nproc
+
         # the number of rejections
         self.nreject = 0
 
@@ -71,6 +76,16 @@ def _detect_outliers(self, cols):
         # to be implemented by derived classes
         raise NotImplementedError()
 
+    def _run_job(self, args):
+        """Perform outlier detection for a single job. args is a tuple of the
+        cols and a seed drawn for the job. Algorithms that use random numbers
+        should override this to seed their own generator with it, so that the
+        result does not depend on the order in which jobs are run, nor on the
+        process that runs them"""
+
+        cols, seed = args
+        return self._detect_outliers(cols)
+
     def __call__(self, reflections):
         """Identify outliers in the input and set the centroid_outlier flag.
         Return True if any outliers were detected, otherwise False"""
@@ -187,6 +202,27 @@ def __call__(self, reflections):
             # keep the splits as they are
             jobs3 = jobs2
 
+        # draw a seed for each job, then run the jobs with enough reflections
+        seeds = flex.random_size_t(len(jobs3), 2 ** 31 - 1)
+        to_run = [
+            i for i, job in enumerate(jobs3) if len(job["indices"]) >= self._min_num_obs
+        ]
+        tasks = [
+            ([jobs3[i]["data"][col] for col in self._cols], seeds[i]) for i in to_run
+        ]
+        nproc = min(self._nproc, len(tasks))
+        if nproc > 1:
+            results = easy_mp.parallel_map(
+                func=self._run_job,
+                iterable=tasks,
+                processes=nproc,
+                method="multiprocessing",
+                preserve_exception_message=True,
+            )
+        else:
+            results = [self._run_job(task) for task in tasks]
+        job_outliers = dict(zip(to_run, results))
+
         # Work out the format of the jobs table
         header = ["Job"]
         if self._separate_experiments:
@@ -201,7 +237,6 @@ def __call__(self, reflections):
         # now loop over the lowest level of splits
         for i, job in enumerate(jobs3):
 
-            data = job["data"]
             indices = job["indices"]
             iexp = job["id"]
             ipanel = job["panel"]
@@ -209,11 +244,8 @@ def __call__(self, reflections):
 
             if nref >= self._min_num_obs:
 
-                # get the subset of data as a list of columns
-                cols = [data[col] for col in self._cols]
-
-                # determine the position of outliers on this sub-dataset
-                outliers = self._detect_outliers(cols)
+                # the position of outliers on this sub-dataset
+                outliers = job_outliers[i]
 
                 # get positions of outliers from the original matches
                 ioutliers = indices.select(outliers)
@@ -302,6 +334,14 @@ def __call__(self, reflections):
     .type = bool
     .expert_level = 1
 
+  nproc = 1
+    .help = "The number of processes over which to run outlier rejection"
+            "jobs, where the data are split by experiment, panel or block."
+            "Each job is seeded separately, so the result does not depend"
+            "on the number of processes."
+    .type = int(value_min=1)
+    .expert_level = 2
+
   separate_blocks = True
     .help = "If true, for scans outlier rejection will be performed separately"
             "in equal-width blocks of phi, controlled by the parameter"
@@ -448,6 +488,7 @@ def from_parameters_and_colnames(params, colnames):
             separate_experiments=params.outlier.separate_experiments,
             separate_panels=params.outlier.separate_panels,
             block_width=params.outlier.block_width,
+            nproc=params.outlier.nproc,
             **kwargs
         )
         return od
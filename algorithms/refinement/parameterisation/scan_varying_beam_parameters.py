@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 from scitbx import matrix
+from scitbx.array_family import flex
 
 from dials.algorithms.refinement.parameterisation.beam_parameters import BeamMixin
 from dials.algorithms.refinement.parameterisation.scan_varying_model_parameters import (
@@ -8,6 +9,10 @@
     ScanVaryingModelParameterisation,
     ScanVaryingParameterSet,
 )
+from dials.algorithms.refinement.refinement_helpers import (
+    dR_from_axis_and_angles,
+    rotation_matrices_from_axis_and_angles,
+)
 
 
 class ScanVaryingBeamParameterisation(ScanVaryingModelParameterisation, BeamMixin):
@@ -98,6 +103,36 @@ def compose(self, t):
 
         return
 
+    def _compose_core_at_frames(self, values):
+        """calculate states and derivatives wrt the values mu1, mu2 and nu for
+        arrays of these values, as _compose_core does for single values"""
+
+        mu1_set, mu2_set, _ = self._param
+        mu1, mu2, nu = values
+        is0 = flex.vec3_double(len(nu), self._initial_state.elems)
+
+        # compose rotation matrices and their first order derivatives, with
+        # angles converted from mrad to radians
+        Mu1 = rotation_matrices_from_axis_and_angles(mu1_set.axis, mu1 * 1.0e-3)
+        dMu1_dmu1 = dR_from_axis_and_angles(mu1_set.axis, mu1 * 1.0e-3)
+        Mu2 = rotation_matrices_from_axis_and_angles(mu2_set.axis, mu2 * 1.0e-3)
+        dMu2_dmu2 = dR_from_axis_and_angles(mu2_set.axis, mu2 * 1.0e-3)
+
+        # compose new states
+        s0_new_dir = (Mu2 * Mu1) * is0
+        s0_new_dir = s0_new_dir / s0_new_dir.norms()
+        s0 = s0_new_dir * nu
+
+        # calculate derivatives of the beam vectors, converting parameters back
+        # to mrad
+        ds0_dval = [
+            (Mu2 * dMu1_dmu1) * is0 * (nu * 1.0e-3),
+            (dMu2_dmu2 * Mu1) * is0 * (nu * 1.0e-3),
+            s0_new_dir,
+        ]
+
+        return s0, ds0_dval
+
     def get_state(self):
         """Return beam vector [s0] at image number t"""
 
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 from scitbx import matrix
+from scitbx.array_family import flex
 
 from dials.algorithms.refinement.parameterisation.crystal_parameters import (
     CrystalOrientationMixin,
@@ -11,7 +12,11 @@
     ScanVaryingModelParameterisation,
     ScanVaryingParameterSet,
 )
-from dials.algorithms.refinement.refinement_helpers import CrystalOrientationCompose
+from dials.algorithms.refinement.refinement_helpers import (
+    CrystalOrientationCompose,
+    dR_from_axis_and_angles,
+    rotation_matrices_from_axis_and_angles,
+)
 
 
 class ScanVaryingCrystalOrientationParameterisation(
@@ -104,6 +109,36 @@ def compose(self, t):
 
         return
 
+    def _compose_core_at_frames(self, values):
+        """calculate states and derivatives wrt the angles for arrays of angles,
+        as CrystalOrientationCompose does for a single set of angles"""
+
+        U0 = self._initial_state.elems
+        phi1_set, phi2_set, phi3_set = self._param
+
+        # compose rotation matrices and their first order derivatives, with
+        # angles converted from mrad to radians
+        phi1, phi2, phi3 = (v * 1.0e-3 for v in values)
+        Phi1 = rotation_matrices_from_axis_and_angles(phi1_set.axis, phi1)
+        dPhi1_dphi1 = dR_from_axis_and_angles(phi1_set.axis, phi1)
+        Phi2 = rotation_matrices_from_axis_and_angles(phi2_set.axis, phi2)
+        dPhi2_dphi2 = dR_from_axis_and_angles(phi2_set.axis, phi2)
+        Phi3 = rotation_matrices_from_axis_and_angles(phi3_set.axis, phi3)
+        dPhi3_dphi3 = dR_from_axis_and_angles(phi3_set.axis, phi3)
+
+        # compose new states
+        Phi21 = Phi2 * Phi1
+        U = Phi3 * Phi21 * U0
+
+        # calculate derivatives of the states wrt the angles in mrad
+        dU_dval = [
+            Phi3 * Phi2 * dPhi1_dphi1 * U0 * 1.0e-3,
+            Phi3 * dPhi2_dphi2 * Phi1 * U0 * 1.0e-3,
+            dPhi3_dphi3 * Phi21 * U0 * 1.0e-3,
+        ]
+
+        return U, dU_dval
+
     def get_state(self):
         """Return crystal orientation matrix [U] at image number t"""
 
@@ -189,6 +224,21 @@ def compose(self, t):
 
         return
 
+    def _compose_core_at_frames(self, values):
+        """calculate states and derivatives wrt the metrical matrix parameters
+        for arrays of their values. The symmetry-constrained reparameterisation
+        composes a single state at a time, so this is done frame by frame"""
+
+        B = flex.mat3_double(len(values[0]))
+        dB_dval = [flex.mat3_double(len(B)) for _ in values]
+        for i, vals in enumerate(zip(*values)):
+            B_i, dB_dval_i = self._compose_core(vals)
+            B[i] = B_i.elems
+            for dB, dB_i in zip(dB_dval, dB_dval_i):
+                dB[i] = dB_i.elems
+
+        return B, dB_dval
+
     def get_state(self):
         """Return crystal orthogonalisation matrix [B] at image number t"""
 
@@ -3,6 +3,7 @@
 from collections import namedtuple
 
 from scitbx import matrix
+from scitbx.array_family import flex
 
 from dials.algorithms.refinement.parameterisation.detector_parameters import (
     DetectorMixin,
@@ -126,6 +127,27 @@ def compose(self, t):
 
         return
 
+    def _compose_core_at_frames(self, values):
+        """calculate states and derivatives wrt the values dist, shift1, shift2,
+        tau1, tau2 and tau3 for arrays of these values. The panel group
+        composition works on a single state at a time, so this is done frame
+        by frame"""
+
+        d = flex.mat3_double(len(values[0]))
+        dd_dval = [flex.mat3_double(len(d)) for _ in values]
+        for i, vals in enumerate(zip(*values)):
+            new_state, dd_dval_i = self._compose_core(
+                *(Param(v, pset.axis) for v, pset in zip(vals, self._param))
+            )
+            f1, f2, f3 = new_state["d1"]
+            s1, s2, s3 = new_state["d2"]
+            o1, o2, o3 = new_state["origin"]
+            d[i] = (f1, s1, o1, f2, s2, o2, f3, s3, o3)
+            for dd, dd_i in zip(dd_dval, dd_dval_i):
+                dd[i] = dd_i.elems
+
+        return d, dd_dval
+
     def get_state(self):
         """Return detector matrix [d] at image number t"""
         # only a single panel exists, so no multi_state_elt argument is allowed
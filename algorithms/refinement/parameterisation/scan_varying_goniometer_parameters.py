@@ -10,6 +10,10 @@
     ScanVaryingModelParameterisation,
     ScanVaryingParameterSet,
 )
+from dials.algorithms.refinement.refinement_helpers import (
+    dR_from_axis_and_angles,
+    rotation_matrices_from_axis_and_angles,
+)
 
 
 class ScanVaryingGoniometerParameterisation(
@@ -103,6 +107,29 @@ def compose(self, t):
 
         return
 
+    def _compose_core_at_frames(self, values):
+        """calculate states and derivatives wrt the angles for arrays of angles,
+        as _compose_core does for single angles"""
+
+        iS = self._initial_state.elems
+        gamma1_set, gamma2_set = self._param
+
+        # compose rotation matrices and their first order derivatives, with
+        # angles converted from mrad to radians
+        g1rad, g2rad = (v * 1.0e-3 for v in values)
+        G1 = rotation_matrices_from_axis_and_angles(gamma1_set.axis, g1rad)
+        dG1_dg1 = dR_from_axis_and_angles(gamma1_set.axis, g1rad)
+        G2 = rotation_matrices_from_axis_and_angles(gamma2_set.axis, g2rad)
+        dG2_dg2 = dR_from_axis_and_angles(gamma2_set.axis, g2rad)
+
+        # compose new states
+        S = (G2 * G1) * iS
+
+        # calculate derivatives of the states wrt the angles in mrad
+        dS_dval = [(G2 * dG1_dg1) * iS * 1.0e-3, (dG2_dg2 * G1) * iS * 1.0e-3]
+
+        return S, dS_dval
+
     def get_state(self):
         """Return setting matrix [S] at image number t"""
 
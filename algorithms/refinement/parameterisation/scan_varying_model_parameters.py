@@ -191,6 +191,51 @@ def compose(self, t):
 
         raise NotImplementedError()
 
+    def compose_at_frames(self, frames, skip_derivatives=False):
+        """compose the model states at each of a sequence of image numbers. The
+        smoothed values of each parameter set are found at all the image numbers
+        in a single call to the smoother, then the states are composed from
+        arrays of these values.
+
+        Returns the states as a flex array and, unless skip_derivatives, a list
+        of the derivatives of the states wrt each free parameter, in the order
+        of get_ds_dp. Each of these is a flex array over the image numbers, or
+        None for a parameter that does not affect any of them.
+
+        Unlike compose, this does not change the state returned by get_state."""
+
+        frames = flex.double(frames)
+        smoothed = [
+            self._smoother.multi_value_weight(frames, pset) for pset in self._param
+        ]
+        states, dstate_dval = self._compose_core_at_frames([s[0] for s in smoothed])
+        if skip_derivatives:
+            return states, None
+
+        # calculate derivatives of state wrt underlying smoother parameters
+        derivatives = []
+        for pset, (_, weights, sumweights), ds_dval in zip(
+            self._param, smoothed, dstate_dval
+        ):
+            if pset.get_fixed():
+                continue
+            inv_sumweights = 1.0 / sumweights
+            for i in range(self._num_samples):
+                dval_dp = weights.col(i).as_dense_vector() * inv_sumweights
+                if dval_dp.all_eq(0.0):
+                    derivatives.append(None)
+                else:
+                    derivatives.append(ds_dval * dval_dp)
+
+        return states, derivatives
+
+    def _compose_core_at_frames(self, values):
+        """calculate the states for flex arrays of the smoothed value of each
+        parameter set, and the derivatives of the states wrt each of those
+        values, as flex arrays"""
+
+        raise NotImplementedError()
+
     def get_param_vals(self, only_free=True):
         """export the values of the internal list of parameters as a
         sequence of floats.
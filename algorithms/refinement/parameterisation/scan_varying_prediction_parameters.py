@@ -1,6 +1,5 @@
 from __future__ import absolute_import, division, print_function
 
-import math
 from collections import namedtuple
 
 from scitbx import matrix
@@ -12,10 +11,26 @@
 from dials.array_family import flex
 
 
+def _group_indices(values):
+    """Group the positions of the elements of a flex array by value. Return the
+    distinct values in ascending order, and for each a flex.size_t array of the
+    positions of the elements with that value"""
+
+    if len(values) == 0:
+        return [], []
+    order = flex.sort_permutation(values)
+    ordered = values.select(order)
+    boundaries = list((ordered[1:] != ordered[:-1]).iselection() + 1)
+    starts = [0] + boundaries
+    ends = boundaries + [len(values)]
+    return [ordered[i] for i in starts], [order[i:j] for i, j in zip(starts, ends)]
+
+
 class StateDerivativeCache(object):
     """Keep derivatives of the model states in a memory-efficient format
     by storing each derivative once alongside the indices of reflections affected
-    by that derivative"""
+    by that derivative. Alternatively, an array of derivatives can be stored
+    alongside the indices of the reflections and the row of the array for each"""
 
     def __init__(self, parameterisations=None):
 
@@ -23,7 +38,7 @@ def __init__(self, parameterisations=None):
             parameterisations = []
         self._cache = dict.fromkeys(parameterisations)
 
-        self._Pair = namedtuple("Pair", ["derivative", "iselection"])
+        self._Pair = namedtuple("Pair", ["derivative", "iselection", "rows"])
 
         # set up lists with the right number of elements
         self.clear()
@@ -44,7 +59,13 @@ def build_gradients(self, parameterisation, isel=None, imatch=None):
         shape = None
         for e in entry:
             if e:
-                shape = e[0].derivative.n
+                derivative = e[0].derivative
+                if isinstance(derivative, flex.vec3_double):
+                    shape = (3, 1)
+                elif isinstance(derivative, flex.mat3_double):
+                    shape = (3, 3)
+                else:
+                    shape = derivative.n
                 break
         if shape is None:
             raise TypeError("No model state derivatives found")
@@ -66,7 +87,12 @@ def build_gradients(self, parameterisation, isel=None, imatch=None):
 
             # Reconstitute full array from the cache
             for pair in p_data:
-                ds_dp.set_selected(pair.iselection, pair.derivative)
+                if pair.rows is None:
+                    ds_dp.set_selected(pair.iselection, pair.derivative)
+                else:
+                    ds_dp.set_selected(
+                        pair.iselection, pair.derivative.select(pair.rows)
+                    )
 
             # First select only elements relevant to the current gradient calculation
             # block (i.e. if nproc > 1 or gradient_calculation_blocksize was set)
@@ -86,14 +112,16 @@ def clear(self):
         for p in self._cache:
             self._cache[p] = [[] for i in range(p.num_free())]
 
-    def append(self, parameterisation, iparam, derivative, iselection):
+    def append(self, parameterisation, iparam, derivative, iselection, rows=None):
         """For a particular parameterisation and parameter number of the free
         parameters of that parameterisation, append a state derivative and the
-        iselection of reflections it affects to the cache"""
+        iselection of reflections it affects to the cache. If rows is set, the
+        derivative is a flex array and rows gives the element of that array for
+        each reflection in the iselection"""
 
         l1 = self._cache[parameterisation]
         l2 = l1[iparam]
-        l2.append(self._Pair(derivative, iselection))
+        l2.append(self._Pair(derivative, iselection, rows))
 
     @property
     def nref(self):
@@ -282,6 +310,41 @@ def _prepare_for_compose(self, reflections, skip_derivatives=False):
         self._derivative_cache.clear()
         self._derivative_cache.nref = nref
 
+    def _block_states(
+        self, parameterisation, state, frames, isel, block_row, cache_derivatives
+    ):
+        """Return the states of a model at each of the block frames of an
+        experiment as a flex array. If the model is not parameterised, the state
+        is that given. If cache_derivatives, also cache the derivatives of the
+        state for the reflections isel, where block_row gives the block of each
+        of those reflections"""
+
+        if parameterisation is not None and hasattr(parameterisation, "num_sets"):
+            states, derivatives = parameterisation.compose_at_frames(
+                frames, skip_derivatives=not cache_derivatives
+            )
+            if cache_derivatives:
+                for j, ds_dp in enumerate(derivatives):
+                    if ds_dp is None:
+                        continue
+                    self._derivative_cache.append(
+                        parameterisation, j, ds_dp, isel, rows=block_row
+                    )
+            return states
+
+        if parameterisation is not None:
+            state = parameterisation.get_state()
+            if cache_derivatives:
+                for j, ds_dp in enumerate(
+                    parameterisation.get_ds_dp(use_none_as_null=True)
+                ):
+                    if ds_dp is None:
+                        continue
+                    self._derivative_cache.append(parameterisation, j, ds_dp, isel)
+        if len(state) == 3:
+            return flex.vec3_double(len(frames), tuple(state))
+        return flex.mat3_double(len(frames), tuple(state))
+
     def compose(self, reflections, skip_derivatives=False):
         """Compose scan-varying crystal parameterisations at the specified image
         number, for the specified experiment, for each image. Put the varying
@@ -289,17 +352,15 @@ def compose(self, reflections, skip_derivatives=False):
 
         self._prepare_for_compose(reflections, skip_derivatives)
 
-        for iexp, exp in enumerate(self._experiments):
-
-            # select the reflections of interest
-            sel = reflections["id"] == iexp
-            isel = sel.iselection()
+        # the states of the scan-varying parameterisations at single frames are
+        # no longer current once the parameters have changed
+        self._current_frame = {}
 
-            # skip empty experiments (https://github.com/dials/dials/issues/1417)
-            if len(isel) == 0:
-                continue
+        # group reflections by experiment. Empty experiments are skipped
+        # (https://github.com/dials/dials/issues/1417)
+        for iexp, isel in zip(*_group_indices(reflections["id"])):
 
-            blocks = reflections["block"].select(isel)
+            exp = self._experiments[iexp]
 
             # identify which parameterisations to use for this experiment
             xl_op = self._get_xl_orientation_parameterisation(iexp)
@@ -308,135 +369,116 @@ def compose(self, reflections, skip_derivatives=False):
             dp = self._get_detector_parameterisation(iexp)
             gp = self._get_goniometer_parameterisation(iexp)
 
-            # reset current frame cache for scan-varying parameterisations
-            self._current_frame = {}
-
-            # get state and derivatives for each block
-            for block in range(flex.min(blocks), flex.max(blocks) + 1):
-
-                # determine the subset of reflections this affects
-                subsel = isel.select(blocks == block)
-                if len(subsel) == 0:
-                    continue
-
-                # get the panels hit by these reflections
-                panels = reflections["panel"].select(subsel)
-
-                # get the integer frame number nearest the centre of that block
-                frames = reflections["block_centre"].select(subsel)
-
-                # can only be false if original block assignment has gone wrong
-                assert frames.all_eq(
-                    frames[0]
-                ), "Failing: a block contains reflections that shouldn't be there"
-                frame = int(math.floor(frames[0]))
-
-                # model states at current frame
-                U = self._get_state_from_parameterisation(xl_op, frame)
-                if U is None:
-                    U = matrix.sqr(exp.crystal.get_U())
-
-                B = self._get_state_from_parameterisation(xl_ucp, frame)
-                if B is None:
-                    B = matrix.sqr(exp.crystal.get_B())
-
-                s0 = self._get_state_from_parameterisation(bp, frame)
-                if s0 is None:
-                    s0 = matrix.col(exp.beam.get_s0())
-
-                S = self._get_state_from_parameterisation(gp, frame)
-                if S is None:
-                    S = matrix.sqr(exp.goniometer.get_setting_rotation())
-
-                # set states for crystal, beam and goniometer
-                reflections["u_matrix"].set_selected(subsel, U.elems)
-                reflections["b_matrix"].set_selected(subsel, B.elems)
-                reflections["s0_vector"].set_selected(subsel, s0.elems)
-                reflections["S_matrix"].set_selected(subsel, S.elems)
-
-                # set states and derivatives for this detector
-                if dp is not None:  # detector is parameterised
-                    if dp.is_multi_state():  # parameterised detector is multi panel
-
-                        # loop through the panels in this detector
-                        for panel_id, _ in enumerate(exp.detector):
-
-                            # get the right subset of array indices to set for this panel
-                            subsel2 = subsel.select(panels == panel_id)
-                            if len(subsel2) == 0:
-                                # if no reflections intersect this panel, skip calculation
-                                continue
+            # group reflections by block. The model states are composed for all
+            # block centres at once, then gathered for all reflections by their
+            # row in the arrays of block states
+            _, block_isels = _group_indices(reflections["block"].select(isel))
+            block_row = flex.size_t(len(isel))
+            for row, block_isel in enumerate(block_isels):
+                block_row.set_selected(block_isel, row)
+
+            # get the integer frame number nearest the centre of each block
+            block_centres = reflections["block_centre"].select(isel)
+            centres = block_centres.select(
+                flex.size_t([block_isel[0] for block_isel in block_isels])
+            )
+            # can only be false if original block assignment has gone wrong
+            assert (block_centres == centres.select(block_row)).all_eq(
+                True
+            ), "Failing: a block contains reflections that shouldn't be there"
+            frames = flex.floor(centres)
+
+            # model states at the block frames for crystal, beam and goniometer
+            U_states = self._block_states(
+                xl_op,
+                exp.crystal.get_U(),
+                frames,
+                isel,
+                block_row,
+                self._varying_xl_orientations and not skip_derivatives,
+            )
+            B_states = self._block_states(
+                xl_ucp,
+                exp.crystal.get_B(),
+                frames,
+                isel,
+                block_row,
+                self._varying_xl_unit_cells and not skip_derivatives,
+            )
+            s0_states = self._block_states(
+                bp,
+                exp.beam.get_s0(),
+                frames,
+                isel,
+                block_row,
+                self._varying_beams and not skip_derivatives,
+            )
+            S_states = self._block_states(
+                gp,
+                exp.goniometer.get_setting_rotation(),
+                frames,
+                isel,
+                block_row,
+                self._varying_goniometers and not skip_derivatives,
+            )
 
-                            dmat = self._get_state_from_parameterisation(
-                                dp, frame, multi_state_elt=panel_id
+            # set states and derivatives for this detector
+            panels = reflections["panel"].select(isel)
+            cache_detector_derivatives = (
+                self._varying_detectors and not skip_derivatives
+            )
+            if dp is None:  # unparameterised detector states vary only by panel
+                d_states = flex.mat3_double([p.get_d_matrix() for p in exp.detector])
+                d_row = panels
+            elif hasattr(dp, "num_sets"):  # scan-varying detector is single panel
+                d_states = self._block_states(
+                    dp,
+                    exp.detector[0].get_d_matrix(),
+                    frames,
+                    isel,
+                    block_row,
+                    cache_detector_derivatives,
+                )
+                d_row = block_row
+            elif dp.is_multi_state():  # static parameterised multi panel detector
+                d_states = flex.mat3_double(len(exp.detector))
+                for panel_id, panel in enumerate(exp.detector):
+                    dmat = dp.get_state(multi_state_elt=panel_id)
+                    if dmat is None:
+                        dmat = panel.get_d_matrix()
+                    d_states[panel_id] = tuple(dmat)
+                d_row = panels
+                if cache_detector_derivatives:
+                    # loop through the panels hit by reflections
+                    for panel_id in sorted(set(panels)):
+                        subsel = isel.select(panels == panel_id)
+                        for j, dd in enumerate(
+                            dp.get_ds_dp(
+                                multi_state_elt=panel_id, use_none_as_null=True
                             )
-                            if dmat is None:
-                                dmat = exp.detector[panel_id].get_d_matrix()
-                            Dmat = exp.detector[panel_id].get_D_matrix()
-                            reflections["d_matrix"].set_selected(subsel2, dmat)
-                            reflections["D_matrix"].set_selected(subsel2, Dmat)
-
-                            if self._varying_detectors and not skip_derivatives:
-                                for j, dd in enumerate(
-                                    dp.get_ds_dp(
-                                        multi_state_elt=panel_id, use_none_as_null=True
-                                    )
-                                ):
-                                    if dd is None:
-                                        continue
-                                    self._derivative_cache.append(dp, j, dd, subsel)
-
-                    else:  # parameterised detector is single panel
-                        dmat = self._get_state_from_parameterisation(dp, frame)
-                        if dmat is None:
-                            dmat = exp.detector[0].get_d_matrix()
-                        Dmat = exp.detector[0].get_D_matrix()
-                        reflections["d_matrix"].set_selected(subsel, dmat)
-                        reflections["D_matrix"].set_selected(subsel, Dmat)
-
-                        if self._varying_detectors and not skip_derivatives:
-                            for j, dd in enumerate(dp.get_ds_dp(use_none_as_null=True)):
-                                if dd is None:
-                                    continue
-                                self._derivative_cache.append(dp, j, dd, subsel)
-
-                else:  # set states for unparameterised detector (dp is None)
-                    # loop through the panels in this detector
-                    for panel_id, _ in enumerate(exp.detector):
-
-                        # get the right subset of array indices to set for this panel
-                        subsel2 = subsel.select(panels == panel_id)
-                        if len(subsel2) == 0:
-                            # if no reflections intersect this panel, skip to the next
-                            continue
-
-                        dmat = exp.detector[panel_id].get_d_matrix()
-                        Dmat = exp.detector[panel_id].get_D_matrix()
-                        reflections["d_matrix"].set_selected(subsel2, dmat)
-                        reflections["D_matrix"].set_selected(subsel2, Dmat)
-
-                # set derivatives of the states for crystal, beam and goniometer
-                if not skip_derivatives:
-                    if xl_op is not None and self._varying_xl_orientations:
-                        for j, dU in enumerate(xl_op.get_ds_dp(use_none_as_null=True)):
-                            if dU is None:
-                                continue
-                            self._derivative_cache.append(xl_op, j, dU, subsel)
-                    if xl_ucp is not None and self._varying_xl_unit_cells:
-                        for j, dB in enumerate(xl_ucp.get_ds_dp(use_none_as_null=True)):
-                            if dB is None:
-                                continue
-                            self._derivative_cache.append(xl_ucp, j, dB, subsel)
-                    if bp is not None and self._varying_beams:
-                        for j, ds0 in enumerate(bp.get_ds_dp(use_none_as_null=True)):
-                            if ds0 is None:
-                                continue
-                            self._derivative_cache.append(bp, j, ds0, subsel)
-                    if gp is not None and self._varying_goniometers:
-                        for j, dS in enumerate(gp.get_ds_dp(use_none_as_null=True)):
-                            if dS is None:
+                        ):
+                            if dd is None:
                                 continue
-                            self._derivative_cache.append(gp, j, dS, subsel)
+                            self._derivative_cache.append(dp, j, dd, subsel)
+            else:  # static parameterised single panel detector
+                d_states = self._block_states(
+                    dp,
+                    exp.detector[0].get_d_matrix(),
+                    frames,
+                    isel,
+                    block_row,
+                    cache_detector_derivatives,
+                )
+                d_row = block_row
+
+            # gather the block states to the reflections of this experiment
+            reflections["u_matrix"].set_selected(isel, U_states.select(block_row))
+            reflections["b_matrix"].set_selected(isel, B_states.select(block_row))
+            reflections["s0_vector"].set_selected(isel, s0_states.select(block_row))
+            reflections["S_matrix"].set_selected(isel, S_states.select(block_row))
+            reflections["d_matrix"].set_selected(isel, d_states.select(d_row))
+            D_states = flex.mat3_double([p.get_D_matrix() for p in exp.detector])
+            reflections["D_matrix"].set_selected(isel, D_states.select(panels))
 
         # set the UB matrices for prediction
         reflections["ub_matrix"] = reflections["u_matrix"] * reflections["b_matrix"]
@@ -76,6 +76,47 @@ def dR_from_axis_and_angle(axis, angle, deg=False):
     return scitbx.matrix.sqr(dR_cpp(axis, angle, deg))
 
 
+def _mat3_from_elements(elements):
+    """Interleave nine flex.double arrays, holding each element of a set of 3x3
+    matrices in row-major order, into a flex.mat3_double"""
+
+    n = len(elements[0])
+    interleaved = flex.double(9 * n)
+    for i, e in enumerate(elements):
+        interleaved.set_selected(flex.size_t_range(i, 9 * n, 9), e)
+    return flex.mat3_double(interleaved)
+
+
+def rotation_matrices_from_axis_and_angles(axis, angles):
+    """Return the rotation matrices about a single axis for each of a flex.double
+    of angles in radians, as a flex.mat3_double. The rotations follow the
+    axis_and_angle_as_r3_rotation_matrix convention"""
+
+    axis = axis.normalize()
+    identity = scitbx.matrix.identity(3).elems
+    outer = axis.outer_product(axis).elems
+    cross = scitbx.matrix.cross_product_matrix(axis.elems).elems
+    ca, sa = flex.cos(angles), flex.sin(angles)
+    return _mat3_from_elements(
+        [ca * identity[i] + (1.0 - ca) * outer[i] + sa * cross[i] for i in range(9)]
+    )
+
+
+def dR_from_axis_and_angles(axis, angles):
+    """Return the first derivatives of the rotation matrices about a single
+    axis for each of a flex.double of angles in radians, as a flex.mat3_double.
+    This is the multi-angle equivalent of dR_from_axis_and_angle"""
+
+    axis = axis.normalize()
+    identity = scitbx.matrix.identity(3).elems
+    outer = axis.outer_product(axis).elems
+    cross = scitbx.matrix.cross_product_matrix(axis.elems).elems
+    ca, sa = flex.cos(angles), flex.sin(angles)
+    return _mat3_from_elements(
+        [sa * (outer[i] - identity[i]) + ca * cross[i] for i in range(9)]
+    )
+
+
 def dR_from_axis_and_angle_py(axis, angle, deg=False):
     """return the first derivative of a rotation matrix specified by its
     axis and angle"""
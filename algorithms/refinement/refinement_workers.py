@@ -0,0 +1,184 @@
+"""
+Worker processes for refinement.
+
+RefinementWorkers are persistent worker processes for building the normal
+equations during a refinement run.
+
+The working reflections are split into contiguous subsets, one per worker. The
+workers are forked once at the start of a refinement run and inherit a copy of
+the refinery, including the target, the prediction parameterisation and the
+reflection manager. At each step only the parameter vector is sent to the
+workers; each worker predicts for its own subset of the reflections, then
+returns the residuals and weights of its matches along with their contributions
+to the normal equations, J^T W J and J^T W r, and their rmsds. The Jacobian
+itself never leaves the worker, and the main process does not predict for the
+working reflections during the run.
+
+run_refineries runs the refineries for independent refinement problems in
+worker processes, then restores the state each one reached in the main process.
+
+Forking is required, so that the workers can inherit the state of the refinery.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import math
+import multiprocessing
+import traceback
+
+from dials.algorithms.refinement import DialsRefineRuntimeError
+
+
+def is_available():
+    """
+    :returns: True if worker processes can be forked on this platform
+    """
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _serve(connection, refinery, reflections, start, end):
+    """Build the normal equations for a fixed subset of the reflections, for
+    each parameter vector received, until None is received."""
+    reflections = reflections[start:end]
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        x, objective_only = job
+        try:
+            result = refinery.build_up_for_subset(x, reflections, objective_only)
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+        else:
+            connection.send((True, result))
+    connection.close()
+
+
+class RefinementWorkers(object):
+    """
+    A set of worker processes which each own a subset of the working reflections.
+
+    The workers must be created after the refinery is fully set up, and closed
+    at the end of the refinement run, as later changes in the main process are
+    not seen by the workers.
+    """
+
+    def __init__(self, refinery, reflections, nproc):
+        """
+        Fork the worker processes
+
+        :param refinery: The refinery being run
+        :param reflections: The working reflections managed by the target
+        :param nproc: The maximum number of worker processes
+        """
+        # ensure at least 100 reflections per worker
+        self.nproc = max(1, min(nproc, len(reflections) // 100))
+        size = int(math.ceil(len(reflections) / self.nproc))
+        context = multiprocessing.get_context("fork")
+        self._connections = []
+        self._processes = []
+        for i in range(self.nproc):
+            start, end = i * size, min((i + 1) * size, len(reflections))
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_serve,
+                args=(child_connection, refinery, reflections, start, end),
+            )
+            process.daemon = True
+            process.start()
+            child_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def build_up(self, x, objective_only=False):
+        """
+        Build the normal equations for each subset of the reflections.
+
+        :param x: The current (expanded) parameter vector
+        :param objective_only: If True, only predict and return the residuals
+        :returns: A list of the residuals, weights, J^T W J, J^T W r, rmsds and
+            number of matches for each subset, in subset order. If
+            objective_only, J^T W J and J^T W r are None
+        """
+        for connection in self._connections:
+            connection.send((x, objective_only))
+        results = [connection.recv() for connection in self._connections]
+        for success, result in results:
+            if not success:
+                raise DialsRefineRuntimeError(
+                    "Refinement worker process failed:\n" + result
+                )
+        return [result for _, result in results]
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _run(connection, refineries):
+    """Run each refinery in turn and send back the final states"""
+    try:
+        states = []
+        for refinery in refineries:
+            refinery.run()
+            states.append(refinery.get_state())
+    except Exception:
+        connection.send((False, traceback.format_exc()))
+    else:
+        connection.send((True, states))
+    connection.close()
+
+
+def run_refineries(refineries, nproc):
+    """
+    Run refineries that share no parameters in up to nproc worker processes,
+    then set the state that each one reached in this process.
+
+    :param refineries: A list of refineries to run
+    :param nproc: The maximum number of worker processes
+    """
+    nproc = max(1, min(nproc, len(refineries)))
+    context = multiprocessing.get_context("fork")
+    connections = []
+    processes = []
+    for i in range(nproc):
+        connection, child_connection = context.Pipe()
+        process = context.Process(
+            target=_run, args=(child_connection, refineries[i::nproc])
+        )
+        process.daemon = True
+        process.start()
+        child_connection.close()
+        connections.append(connection)
+        processes.append(process)
+
+    results = [connection.recv() for connection in connections]
+    for process in processes:
+        process.join()
+    for success, result in results:
+        if not success:
+            raise DialsRefineRuntimeError(
+                "Refinement worker process failed:\n" + result
+            )
+
+    for i, (_, states) in enumerate(results):
+        for refinery, state in zip(refineries[i::nproc], states):
+            refinery.set_state(state)
@@ -14,9 +14,13 @@
 from libtbx.phil import parse
 
 import dials.util
-from dials.algorithms.refinement import DialsRefineConfigError
+from dials.algorithms.refinement import DialsRefineConfigError, refinement_workers
 from dials.algorithms.refinement.constraints import ConstraintManagerFactory
-from dials.algorithms.refinement.engine import AdaptLstbx, refinery_phil_str
+from dials.algorithms.refinement.engine import (
+    AdaptLstbx,
+    Journal,
+    refinery_phil_str,
+)
 from dials.algorithms.refinement.parameterisation import (
     build_prediction_parameterisation,
 )
@@ -72,6 +76,15 @@
               "engine support nproc > 1. Where multiprocessing is possible,"
               "it is helpful only in certain circumstances, so this is not"
               "recommended for typical use."
+
+    decompose = False
+      .type = bool
+      .help = "Refine groups of experiments that share no refined models as"
+              "independent problems, running up to nproc of them at once."
+              "Each group terminates according to its own criteria, so the"
+              "result agrees with joint refinement only to within the"
+              "tolerance of the termination criteria. This has no effect if"
+              "restraints or constraints are set."
   }
 
   parameterisation
@@ -224,6 +237,117 @@ def _trim_scans_to_observations(experiments, reflections):
     return experiments
 
 
+def _split_reflections(reflections, groups):
+    """
+    Split reflections into a table for each group of experiments, with the
+    experiment ids renumbered to index the experiments within that group.
+    Reflections that do not belong to any experiment go with the first group.
+
+    Args:
+      reflections: The reflection table to split
+      groups (list): Lists of experiment ids, one for each group
+
+    Returns:
+      list: A tuple for each group of the selection of its reflections, as a
+      flex.size_t, and a table of those reflections
+    """
+    ids = reflections["id"]
+    unassigned = flex.bool(len(reflections), True)
+    split = []
+    for group in groups:
+        sel = flex.bool(len(reflections), False)
+        local_ids = flex.int(len(reflections), -1)
+        for local_id, iexp in enumerate(group):
+            exp_sel = ids == iexp
+            sel |= exp_sel
+            local_ids.set_selected(exp_sel, local_id)
+        unassigned &= ~sel
+        split.append((sel, local_ids))
+    split[0][0].set_selected(unassigned, True)
+
+    result = []
+    for sel, local_ids in split:
+        isel = sel.iselection()
+        group_reflections = reflections.select(isel)
+        group_reflections["id"] = local_ids.select(isel)
+        result.append((isel, group_reflections))
+    return result
+
+
+def _combine_rmsds(rmsds, nref):
+    """Combine the RMSDs for independent sets of reflections, given the number
+    of reflections in each set"""
+    combined = []
+    for r in zip(*rmsds):
+        combined.append(math.sqrt(sum(n * e * e for n, e in zip(nref, r)) / sum(nref)))
+    return tuple(combined)
+
+
+def _merge_journals(journals):
+    """
+    Merge the journals of refinement runs for independent groups of
+    experiments into one journal, as if they had been refined jointly.
+
+    The RMSDs are combined, weighted by the number of reflections, and the
+    parameter vectors are concatenated. Groups that terminated early are
+    treated as if their final step were repeated. Columns that cannot be
+    combined, such as the parameter correlations, are not included.
+
+    Args:
+      journals (list): The Journal for each group
+
+    Returns:
+      Journal: The merged journal
+    """
+    journals = [j for j in journals if j.get_nrows() > 0]
+    merged = Journal()
+    for key in (
+        "num_reflections",
+        "sample_size",
+        "objective",
+        "gradient_norm",
+        "solution_norm",
+        "parameter_vector",
+        "parameter_vector_norm",
+        "rmsd",
+    ):
+        merged.add_column(key)
+
+    nrows = max([j.get_nrows() for j in journals] + [0])
+    for i in range(nrows):
+        rows = [(j, min(i, j.get_nrows() - 1)) for j in journals]
+        values = {
+            key: [j[key][row] if key in j else None for j, row in rows]
+            for key in merged
+        }
+        merged.add_row()
+
+        nref = values["num_reflections"]
+        merged.set_last_cell("num_reflections", sum(nref))
+        if None not in values["sample_size"]:
+            merged.set_last_cell("sample_size", sum(values["sample_size"]))
+        if None in values["objective"]:
+            continue
+        merged.set_last_cell("objective", sum(values["objective"]))
+        if None not in values["gradient_norm"]:
+            merged.set_last_cell("gradient_norm", max(values["gradient_norm"]))
+        for key in ("solution_norm", "parameter_vector_norm"):
+            if None not in values[key]:
+                merged.set_last_cell(key, math.sqrt(sum(v * v for v in values[key])))
+        parameter_vector = []
+        for v in values["parameter_vector"]:
+            parameter_vector.extend(v)
+        merged.set_last_cell("parameter_vector", parameter_vector)
+        merged.set_last_cell("rmsd", _combine_rmsds(values["rmsd"], nref))
+
+    reasons = []
+    for j in journals:
+        if j.reason_for_termination not in reasons:
+            reasons.append(j.reason_for_termination)
+    merged.reason_for_termination = "; ".join(str(e) for e in reasons)
+    return merged
+
+
 class RefinerFactory(object):
     """Factory class to create refiners"""
 
@@ -271,8 +395,113 @@ def from_parameters_data_experiments(cls, params, reflections, experiments):
         # copy and filter the reflections
         reflections = cls._filter_reflections(reflections)
 
+        if params.refinement.mp.decompose:
+            groups = cls._independent_experiment_groups(params, experiments)
+            if len(groups) > 1:
+                return cls._build_decomposed(params, reflections, experiments, groups)
+
         return cls._build_components(params, reflections, experiments)
 
+    @staticmethod
+    def _independent_experiment_groups(params, experiments):
+        """Split the experiments into groups that can be refined independently.
+        These are the connected components of the graph in which experiments are
+        linked by each model they share that has free parameters. If restraints
+        or constraints are set, all experiments are kept in one group"""
+
+        options = params.refinement.parameterisation
+        all_experiments = [list(range(len(experiments)))]
+        constraints = (
+            options.beam.constraints,
+            options.crystal.orientation.constraints,
+            options.crystal.unit_cell.constraints,
+            options.detector.constraints,
+            options.goniometer.constraints,
+        )
+        restraints = options.crystal.unit_cell.restraints
+        if any(constraints) or restraints.tie_to_target or restraints.tie_to_group:
+            logger.info(
+                "Experiments cannot be refined as independent groups when "
+                "restraints or constraints are set"
+            )
+            return all_experiments
+
+        # models of each type that are fixed completely do not link experiments
+        beam_fix = set(options.beam.fix or [])
+        goniometer_fix = set(options.goniometer.fix or [])
+        linking_models = []
+        if "all" not in beam_fix and not beam_fix.issuperset(
+            ("in_spindle_plane", "out_spindle_plane", "wavelength")
+        ):
+            linking_models.append(experiments.beams())
+        if options.crystal.fix != "all":
+            linking_models.append(experiments.crystals())
+        if options.detector.fix != "all":
+            linking_models.append(experiments.detectors())
+        if "all" not in goniometer_fix and not goniometer_fix.issuperset(
+            ("in_beam_plane", "out_beam_plane")
+        ):
+            linking_models.append(experiments.goniometers())
+
+        # union-find over the experiments
+        parent = list(range(len(experiments)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for models in linking_models:
+            for model in models:
+                if model is None:
+                    continue
+                exp_ids = experiments.indices(model)
+                root = find(exp_ids[0])
+                for iexp in exp_ids[1:]:
+                    parent[find(iexp)] = root
+
+        groups = {}
+        for iexp in range(len(experiments)):
+            groups.setdefault(find(iexp), []).append(iexp)
+        return sorted(groups.values())
+
+    @classmethod
+    def _build_decomposed(cls, params, reflections, experiments, groups):
+        """Build a refiner for each independent group of experiments"""
+
+        logger.info(
+            "The experiments form %d groups that will be refined independently",
+            len(groups),
+        )
+        nproc = params.refinement.mp.nproc
+        params = copy.deepcopy(params)
+        if nproc > 1 and refinement_workers.is_available():
+            # the groups themselves are refined in parallel
+            params.refinement.mp.nproc = 1
+
+        refiners = []
+        selections = []
+        for igroup, (group, (isel, group_reflections)) in enumerate(
+            zip(groups, _split_reflections(reflections, groups))
+        ):
+            logger.info(
+                "\nConfiguring refinement of group %d (experiments %s)",
+                igroup + 1,
+                ", ".join(str(e) for e in group),
+            )
+            group_experiments = ExperimentList()
+            for iexp in group:
+                group_experiments.append(experiments[iexp])
+            refiners.append(
+                cls._build_components(
+                    copy.deepcopy(params), group_reflections, group_experiments
+                )
+            )
+            selections.append(isel)
+
+        return DecomposedRefiner(refiners, groups, selections, len(reflections), nproc)
+
     @classmethod
     def _build_components(cls, params, reflections, experiments):
         """low level build"""
@@ -409,6 +638,10 @@ def _build_components(cls, params, reflections, experiments):
             params.refinement.parameterisation, pred_param
         )
 
+        # If requested, begin with a sample of the working set. Auto-reduction
+        # has considered the whole working set, so this must follow it
+        refman.begin_progressive_sampling()
+
         # Parameter reporting
         logger.debug("Prediction equation parameterisation built")
         logger.debug("Parameter order : name mapping")
@@ -1018,7 +1251,14 @@ def run(self):
         for i, crystal in enumerate(self._experiments.crystals()):
             logger.debug(ordinal_number(i) + " " + str(crystal))
 
-        self._refinery.run()
+        with self._refinery.persistent_workers():
+            self._refinery.run()
+
+        return self._finish_run()
+
+    def _finish_run(self):
+        """Report on a completed refinery run and write the refined states back
+        to the models. Return the refinement history"""
 
         # These involve calculation, so skip them when output is quiet
         if logger.getEffectiveLevel() < logging.ERROR:
@@ -1150,3 +1390,188 @@ def _update_models(self):
                 self._pred_param.set_model_state_uncertainties(
                     u_cov_list, b_cov_list, iexp
                 )
+
+
+class DecomposedRefiner(object):
+    """Public interface for the refinement of groups of experiments that share
+    no refined models, where each group is refined independently by its own
+    Refiner. Results are given in terms of the experiments and reflections that
+    were passed to the RefinerFactory.
+
+    Public methods:
+      run
+      rmsds
+      get_experiments
+      get_matches
+      get_free_reflections
+      get_param_reporter
+      get_parameter_correlation_matrix
+      selection_used_for_refinement
+      predict_for_reflection_table
+      predict_for_indexed
+
+    Notes:
+      * The return value of run is the merged history of refinement of all
+        groups
+      * Parameter correlations are not available across groups
+      * Each group terminates on its own criteria, so the results agree with
+        those of joint refinement only to within the tolerance of the
+        termination criteria. For this reason, decomposition must be requested
+        with refinement.mp.decompose
+    """
+
+    def __init__(self, refiners, groups, selections, nref, nproc=1):
+        """
+        Mandatory arguments:
+          refiners - a Refiner for each group of experiments
+          groups - a list of the experiment ids in each group
+          selections - the input reflections in each group, as flex.size_t
+          nref - the number of input reflections
+        Optional arguments:
+          nproc - the number of groups to refine at once
+        """
+
+        self._refiners = refiners
+        self._groups = groups
+        self._selections = selections
+        self._nref = nref
+        self._nproc = nproc
+
+        # all groups are of the same type
+        self.experiment_type = refiners[0].experiment_type
+
+        self.history = None
+
+    def _restore_ids(self, igroup, reflections):
+        """Return a copy of reflections from one group, with experiment ids and
+        observation indices in terms of the input"""
+
+        reflections = reflections.copy()
+        local_ids = reflections["id"]
+        ids = flex.int(len(reflections), -1)
+        for local_id, iexp in enumerate(self._groups[igroup]):
+            ids.set_selected(local_ids == local_id, iexp)
+        reflections["id"] = ids
+        if "iobs" in reflections:
+            reflections["iobs"] = self._selections[igroup].select(reflections["iobs"])
+        return reflections
+
+    def _combine(self, tables):
+        """Combine reflections from each group into a single table"""
+
+        combined = flex.reflection_table()
+        for igroup, table in enumerate(tables):
+            combined.extend(self._restore_ids(igroup, table))
+        return combined
+
+    def get_experiments(self):
+        """Return a copy of the current refiner experiments"""
+
+        experiments = {}
+        for group, refiner in zip(self._groups, self._refiners):
+            for iexp, experiment in zip(group, refiner._experiments):
+                experiments[iexp] = experiment
+        return _copy_experiments_for_refining(
+            [experiments[iexp] for iexp in sorted(experiments)]
+        )
+
+    def rmsds(self):
+        """Return rmsds of the current models"""
+
+        rmsds = [refiner.rmsds() for refiner in self._refiners]
+        nref = [refiner._target.get_num_matches() for refiner in self._refiners]
+        return _combine_rmsds(rmsds, nref)
+
+    def get_matches(self):
+        """Delegated to the reflection managers"""
+
+        return self._combine([refiner.get_matches() for refiner in self._refiners])
+
+    def get_free_reflections(self):
+        """Delegated to the reflection managers"""
+
+        return self._combine(
+            [refiner.get_free_reflections() for refiner in self._refiners]
+        )
+
+    def get_param_reporter(self):
+        """Get a ParameterReporter for the parameterisations of all groups"""
+
+        pred_params = [refiner._pred_param for refiner in self._refiners]
+        return ParameterReporter(
+            [p for e in pred_params for p in e.get_detector_parameterisations()],
+            [p for e in pred_params for p in e.get_beam_parameterisations()],
+            [
+                p
+                for e in pred_params
+                for p in e.get_crystal_orientation_parameterisations()
+            ],
+            [
+                p
+                for e in pred_params
+                for p in e.get_crystal_unit_cell_parameterisations()
+            ],
+            [p for e in pred_params for p in e.get_goniometer_parameterisations()],
+        )
+
+    def get_parameter_correlation_matrix(self, step, col_select=None):
+        """Parameter correlations are not tracked across independent groups"""
+
+        return None, None
+
+    def run(self):
+        """Run refinement for each group and return the merged history"""
+
+        refineries = [refiner._refinery for refiner in self._refiners]
+        if self._nproc > 1 and refinement_workers.is_available():
+            refinement_workers.run_refineries(refineries, self._nproc)
+        else:
+            for refinery in refineries:
+                with refinery.persistent_workers():
+                    refinery.run()
+
+        histories = []
+        for igroup, refiner in enumerate(self._refiners):
+            logger.info(
+                "\nRefinement of group %d (experiments %s)",
+                igroup + 1,
+                ", ".join(str(e) for e in self._groups[igroup]),
+            )
+            histories.append(refiner._finish_run())
+
+        self.history = _merge_journals(histories)
+        return self.history
+
+    def selection_used_for_refinement(self):
+        """Return a selection as a flex.bool in terms of the input reflection
+        data of those reflections that were used in the final step of
+        refinement."""
+
+        selection = flex.bool(self._nref, False)
+        for isel, refiner in zip(self._selections, self._refiners):
+            used = refiner.selection_used_for_refinement()
+            selection.set_selected(isel.select(used), True)
+        return selection
+
+    def predict_for_indexed(self):
+        """perform prediction for all the indexed reflections passed into
+        refinement and additionally set the used_in_refinement flag"""
+
+        reflections = self._combine(
+            [refiner.predict_for_indexed() for refiner in self._refiners]
+        )
+        reflections.sort("iobs")
+        return reflections
+
+    def predict_for_reflection_table(self, reflections, skip_derivatives=False):
+        """perform prediction for all reflections in the supplied table"""
+
+        for igroup, (isel, group_reflections) in enumerate(
+            _split_reflections(reflections, self._groups)
+        ):
+            preds = self._refiners[igroup].predict_for_reflection_table(
+                group_reflections, skip_derivatives
+            )
+            preds["id"] = reflections["id"].select(isel)
+            reflections.set_selected(isel, preds)
+        return reflections
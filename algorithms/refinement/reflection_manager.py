@@ -63,6 +63,28 @@
       .type = int
       .expert_level = 1
 
+    progressive_sampling
+      .help = "Begin refinement with a small sample of the working set, drawn"
+              "in proportion from each experiment, panel, scan range and"
+              "resolution range. Each time refinement converges for the"
+              "current sample, the sample grows, until the final steps use"
+              "the whole working set. If refinement would stop for any other"
+              "reason first, such as reaching the maximum number of"
+              "iterations, at least one more step is taken using the whole"
+              "working set."
+      .expert_level = 2
+    {
+      initial_sample_size = None
+        .help = "The number of reflections in the first sample. None disables"
+                "progressive sampling."
+        .type = int(value_min=1)
+
+      growth_factor = 4
+        .help = "The factor by which the sample grows each time refinement"
+                "converges for the current sample."
+        .type = float(value_min=1.1)
+    }
+
     close_to_spindle_cutoff = 0.02
       .help = "The inclusion criterion currently uses the volume of the"
               "parallelepiped formed by the spindle axis, the incident"
@@ -115,6 +137,45 @@
 phil_scope = parse(phil_str)
 
 
+def _stratified_ranks(strata):
+    """Give each element a rank in an order in which to draw samples, such that
+    every leading part of the order draws from each stratum in proportion to its
+    size. The order within each stratum is random.
+
+    Args:
+        strata (flex.double): The stratum of each element, as an integer value
+
+    Returns:
+        flex.size_t: The rank of each element
+    """
+
+    n = len(strata)
+    if n == 0:
+        return flex.size_t()
+
+    # group the elements by stratum, in random order within each stratum
+    perm = flex.sort_permutation(strata + flex.random_double(n))
+    sorted_strata = strata.select(perm)
+    starts = [0] + list(
+        ((sorted_strata[1:] - sorted_strata[:-1]) != 0).iselection() + 1
+    )
+    ends = starts[1:] + [n]
+
+    # spread the elements of each stratum evenly across the interval [0, 1),
+    # with a random offset for each stratum
+    position = flex.double(n)
+    offsets = flex.random_double(len(starts))
+    for start, end, offset in zip(starts, ends, offsets):
+        size = end - start
+        position.set_selected(
+            perm[start:end], (flex.size_t_range(size).as_double() + offset) / size
+        )
+
+    ranks = flex.size_t(n)
+    ranks.set_selected(flex.sort_permutation(position), flex.size_t_range(n))
+    return ranks
+
+
 class BlockCalculator(object):
     """Utility class to calculate and set columns in the provided reflection
     table, which will be used during scan-varying refinement. The columns are a
@@ -331,6 +392,8 @@ def from_parameters_reflections_experiments(
             scan_margin=params.scan_margin,
             outlier_detector=outlier_detector,
             weighting_strategy_override=weighting_strategy,
+            progressive_sample_size=params.progressive_sampling.initial_sample_size,
+            progressive_growth_factor=params.progressive_sampling.growth_factor,
         )
 
 
@@ -357,6 +420,8 @@ def __init__(
         scan_margin=0.0,
         outlier_detector=None,
         weighting_strategy_override=None,
+        progressive_sample_size=None,
+        progressive_growth_factor=4,
     ):
 
         if len(reflections) == 0:
@@ -406,6 +471,8 @@ def __init__(
         self._nref_per_degree = nref_per_degree  # random subsets
         self._max_sample_size = max_sample_size  # sample size ceiling
         self._min_sample_size = min_sample_size  # sample size floor
+        self._progressive_sample_size = progressive_sample_size  # growing samples
+        self._progressive_growth_factor = progressive_growth_factor
 
         # exclude reflections that fail some inclusion criteria
         refs_to_keep = self._id_refs_to_keep(reflections)
@@ -440,6 +507,11 @@ def __init__(
         # not known until the manager is finalised
         self._sample_size = None
 
+        # the whole working set and the order in which to sample it, while
+        # refinement uses a growing sample
+        self._working_set = None
+        self._sampling_ranks = None
+
     def get_centroid_analyser(self, debug=False):
         """Create a CentroidAnalysis object for the current reflections"""
 
@@ -645,6 +717,89 @@ def _create_working_set(self):
         self._free_reflections = self._reflections.select(free_sel)
         self._reflections = self._reflections.select(working_isel)
 
+    def _strata(self, reflections):
+        """Assign each reflection to a stratum by experiment, panel, 5 degree
+        range of the scan and one of four equally populated resolution ranges"""
+
+        ids = reflections["id"]
+        panels = reflections["panel"].as_double()
+        phi = reflections["xyzobs.mm.value"].parts()[2]
+        phi_bins = flex.floor((phi - flex.min(phi)) * RAD2DEG / 5.0)
+
+        s0 = flex.vec3_double(len(reflections))
+        for iexp, s0vec in enumerate(self._s0vecs):
+            s0.set_selected(ids == iexp, s0vec)
+        d_star = (reflections["s1"] - s0).norms()
+        quartiles = flex.size_t_range(len(d_star)).as_double() * 4 / len(d_star)
+        resolution_bins = flex.double(len(d_star))
+        resolution_bins.set_selected(
+            flex.sort_permutation(d_star), flex.floor(quartiles)
+        )
+
+        strata = ids.as_double()
+        strata = strata * (flex.max(panels) + 1) + panels
+        strata = strata * (flex.max(phi_bins) + 1) + phi_bins
+        return strata * 4 + resolution_bins
+
+    def begin_progressive_sampling(self):
+        """If progressive sampling was requested, restrict the managed
+        observations to a first sample of the working set. This must only be
+        done once the manager is finalised, just before refinement begins."""
+
+        if not self._progressive_sample_size or self._progressive_sample_size >= len(
+            self._reflections
+        ):
+            return
+
+        self._working_set = self._reflections
+        self._sampling_ranks = _stratified_ranks(self._strata(self._working_set))
+        self._select_sample(self._progressive_sample_size)
+
+    def _select_sample(self, sample_size):
+        """Select the first sample_size observations of the working set in the
+        sampling order, keeping them in their original order"""
+
+        sel = self._sampling_ranks < sample_size
+        self._reflections = self._working_set.select(sel)
+        logger.info(
+            "Refining against a sample of %d of %d reflections in the working set",
+            len(self._reflections),
+            len(self._working_set),
+        )
+
+    def grow_sample(self):
+        """If refinement is using a sample of the working set, grow the sample
+        by the growth factor, up to the whole working set. Return True if the
+        sample grew"""
+
+        if self._working_set is None:
+            return False
+
+        sample_size = int(
+            math.ceil(len(self._reflections) * self._progressive_growth_factor)
+        )
+        if sample_size < len(self._working_set):
+            self._select_sample(sample_size)
+        else:
+            self.use_whole_working_set()
+        return True
+
+    def use_whole_working_set(self):
+        """If refinement is using a sample of the working set, end the sampling
+        and use the whole working set. Return True if the sample changed"""
+
+        if self._working_set is None:
+            return False
+
+        self._reflections = self._working_set
+        self._working_set = None
+        self._sampling_ranks = None
+        logger.info(
+            "Refining against all %d reflections in the working set",
+            len(self._reflections),
+        )
+        return True
+
     def get_accepted_refs_size(self):
         """Return the number of observations that pass inclusion criteria and
         can potentially be used for refinement"""
@@ -151,6 +151,10 @@ def __init__(
         self._rmsds = None
         self._matches = None
 
+        # rmsds and number of matches reduced over subsets of the working
+        # reflections, when these are predicted by worker processes
+        self._subset_reduction = None
+
         # Keep maximum number of reflections used for Jacobian calculation, if
         # a cutoff is required
         self._gradient_calculation_blocksize = gradient_calculation_blocksize
@@ -193,6 +197,7 @@ def predict(self):
 
         # get the matches
         reflections = self._reflection_manager.get_obs()
+        self._subset_reduction = None
 
         # reset the 'use' flag for all observations
         self._reflection_manager.reset_accepted_reflections()
@@ -207,6 +212,45 @@ def predict(self):
         # collect the matches
         self.update_matches(force=True)
 
+    def predict_for_subset(self, reflections, skip_derivatives=False):
+        """perform reflection prediction for a subset of the working reflections,
+        as predict does for all of them, and return the matches in that subset.
+        The 'imatch' column of the matches gives their rows in the subset"""
+
+        self._reflection_manager.reset_accepted_reflections(reflections)
+        reflections = self._predict_core(reflections, skip_derivatives)
+        mask = reflections.get_flags(reflections.flags.predicted)
+        reflections.set_flags(mask, reflections.flags.used_in_refinement)
+
+        isel = mask.iselection()
+        matches = reflections.select(isel)
+        matches["imatch"] = isel
+        return matches
+
+    def compose_without_derivatives(self):
+        """update the models for the working reflections without predicting, for
+        when prediction is done by worker processes. The rmsds and number of
+        matches must then be set by set_rmsds_from_subsets"""
+
+        if hasattr(self._prediction_parameterisation, "compose"):
+            self._prediction_parameterisation.compose(
+                self._reflection_manager.get_obs(), skip_derivatives=True
+            )
+
+    def set_rmsds_from_subsets(self, rmsds, nref):
+        """set the rmsds and number of matches from those of subsets of the
+        working reflections. These are used instead of the matches in this
+        process until the next call to predict"""
+
+        rmsds = [r for r, n in zip(rmsds, nref) if n > 0]
+        nref = [n for n in nref if n > 0]
+        combined = []
+        for r in zip(*rmsds):
+            combined.append(
+                math.sqrt(sum(n * e * e for n, e in zip(nref, r)) / sum(nref))
+            )
+        self._subset_reduction = (tuple(combined), sum(nref))
+
     def predict_for_free_reflections(self):
         """perform prediction for the reflections not used for refinement"""
 
@@ -268,9 +312,31 @@ def calculate_gradients(self, reflections=None, callback=None):
 
         return gradients
 
+    def get_sample_size(self):
+        """Delegated to the reflection manager"""
+
+        return self._reflection_manager.get_sample_size()
+
+    def grow_sample(self):
+        """Delegated to the reflection manager"""
+
+        return self._reflection_manager.grow_sample()
+
+    def use_whole_working_set(self):
+        """Delegated to the reflection manager"""
+
+        return self._reflection_manager.use_whole_working_set()
+
+    def get_obs(self):
+        """return all the working reflections, whether or not they are matched"""
+
+        return self._reflection_manager.get_obs()
+
     def get_num_matches(self):
         """return the number of reflections currently used in the calculation"""
 
+        if self._subset_reduction is not None:
+            return self._subset_reduction[1]
         self.update_matches()
         return len(self._matches)
 
@@ -369,45 +435,50 @@ def compute_restraints_functional_gradients_and_curvatures(self):
 
         return (L, dL_dp, curvs)
 
-    def compute_residuals(self):
-        """return the vector of residuals plus their weights"""
+    def compute_residuals(self, matches=None):
+        """return the vector of residuals plus their weights, for the current
+        matches or those supplied"""
 
-        self.update_matches()
-        return self._extract_residuals_and_weights(self._matches)
+        if matches is None:
+            self.update_matches()
+            matches = self._matches
+        return self._extract_residuals_and_weights(matches)
 
-    def split_matches_into_blocks(self, nproc=1):
+    def split_matches_into_blocks(self, nproc=1, matches=None):
         """Return a list of the matches, split into blocks according to the
         gradient_calculation_blocksize parameter and the number of processes (if relevant).
         The number of blocks will be set such that the total number of reflections
-        being processed by concurrent processes does not exceed gradient_calculation_blocksize"""
+        being processed by concurrent processes does not exceed gradient_calculation_blocksize.
+        If matches are supplied (for example from predict_for_subset) then these are
+        split instead of the current matches"""
 
-        self.update_matches()
+        if matches is None:
+            self.update_matches()
 
-        # Need to be able to track the indices of the original matches table for
-        # scan-varying gradient calculations. A simple and robust (but slightly
-        # expensive) way to do this is to add an index column to the matches table
-        self._matches["imatch"] = flex.size_t_range(len(self._matches))
+            # Need to be able to track the indices of the original matches table for
+            # scan-varying gradient calculations. A simple and robust (but slightly
+            # expensive) way to do this is to add an index column to the matches table
+            self._matches["imatch"] = flex.size_t_range(len(self._matches))
+            matches = self._matches
 
         if self._gradient_calculation_blocksize:
             nblocks = int(
-                math.floor(
-                    len(self._matches) * nproc / self._gradient_calculation_blocksize
-                )
+                math.floor(len(matches) * nproc / self._gradient_calculation_blocksize)
             )
         else:
             nblocks = nproc
         # ensure at least 100 reflections per block
-        nblocks = min(nblocks, int(len(self._matches) / 100))
+        nblocks = min(nblocks, int(len(matches) / 100))
         nblocks = max(nblocks, 1)
-        blocksize = int(math.floor(len(self._matches) / nblocks))
+        blocksize = int(math.floor(len(matches) / nblocks))
         blocks = []
         for block_num in range(nblocks - 1):
             start = block_num * blocksize
             end = (block_num + 1) * blocksize
-            blocks.append(self._matches[start:end])
+            blocks.append(matches[start:end])
         start = (nblocks - 1) * blocksize
-        end = len(self._matches)
-        blocks.append(self._matches[start:end])
+        end = len(matches)
+        blocks.append(matches[start:end])
         return blocks
 
     def compute_residuals_and_gradients(self, block=None):
@@ -499,10 +570,12 @@ def _extract_squared_residuals(matches):
     def rmsds(self):
         """calculate unweighted RMSDs for the matches"""
 
-        self.update_matches()
-
         # cache rmsd calculation for achieved test
-        self._rmsds = self._rmsds_core(self._matches)
+        if self._subset_reduction is not None:
+            self._rmsds = self._subset_reduction[0]
+        else:
+            self.update_matches()
+            self._rmsds = self._rmsds_core(self._matches)
 
         return self._rmsds
 
@@ -144,15 +144,8 @@ def __init__(
 
         return
 
-    def predict(self):
-        """perform reflection prediction for the working reflections and update the
-        reflection manager"""
-
-        # get the matches
-        reflections = self._reflection_manager.get_obs()
-
-        # reset the 'use' flag for all observations
-        self._reflection_manager.reset_accepted_reflections()
+    def _predict_core(self, reflections, skip_derivatives=False):
+        """perform prediction for the specified reflections"""
 
         # set twotheta in place
         self._reflection_predictor(reflections)
@@ -163,14 +156,7 @@ def predict(self):
         )
         reflections["2theta_resid2"] = flex.pow2(reflections["2theta_resid"])
 
-        # set used_in_refinement flag to all those that had predictions
-        mask = reflections.get_flags(reflections.flags.predicted)
-        reflections.set_flags(mask, reflections.flags.used_in_refinement)
-
-        # collect the matches
-        self.update_matches(force=True)
-
-        return
+        return reflections
 
     @staticmethod
     def _extract_residuals_and_weights(matches):
@@ -105,6 +105,8 @@ def __init__(
         self.n_datasets = len(reflection_tables)
         self.Ih_table_blocks = []
         self.blocked_selection_list = []
+        # The indices of the reflections excluded from each dataset
+        self._excluded_indices = [None] * self.n_datasets
         self.properties_dict = {
             "n_unique_in_each_block": [],
             "n_reflections_in_each_block": {},
@@ -137,7 +139,7 @@ def update_data_in_blocks(self, data, dataset_id, column="intensity"):
         assert column in ["intensity", "variance", "inverse_scale_factor"]
         assert dataset_id in range(0, self.n_datasets)
         # split up data for blocks
-        for block in self.blocked_data_list:
+        for block in self.Ih_table_blocks:
             data_for_block = data.select(block.block_selections[dataset_id])
             start = block.dataset_info[dataset_id]["start_index"]
             end = block.dataset_info[dataset_id]["end_index"]
@@ -184,6 +186,61 @@ def reset_error_model(self):
         for block in self.Ih_table_blocks:
             block.reset_error_model()
 
+    def set_excluded_reflections(self, indices_lists):
+        """
+        Exclude reflections from the blocks, given a list of indices per dataset.
+
+        The indices refer to the input reflection table of each dataset (or to
+        the indices_lists if given), as for the block selections. The excluded
+        rows are selected out of the current blocks, so the mapping to the asu
+        and the group structure are not recalculated, and only Ih is
+        recalculated for the new set of reflections. Reflections excluded by a
+        previous call are no longer held, so must also be in the new indices
+        (see readmits).
+        """
+        assert len(indices_lists) == self.n_datasets
+        assert not self.readmits(indices_lists)
+        self._excluded_indices = list(indices_lists)
+        for i, block in enumerate(self.Ih_table_blocks):
+            self.Ih_table_blocks[i] = block.select(self._included_rows(block))
+        self.generate_block_selections()
+        self.calc_Ih()
+
+    def readmits(self, indices_lists):
+        """
+        Return True if any reflection already excluded is not in the given list
+        of indices per dataset, so that set_excluded_reflections cannot be used
+        and the Ih_table must be recreated instead.
+        """
+        for excluded, indices in zip(self._excluded_indices, indices_lists):
+            if not excluded:
+                continue
+            if not indices or flex.max(excluded) > flex.max(indices):
+                return True
+            sel = flex.bool(flex.max(indices) + 1, False)
+            sel.set_selected(indices, True)
+            if not sel.select(excluded).all_eq(True):
+                return True
+        return False
+
+    def _included_rows(self, block):
+        """Return a selection of the rows of a block that are not excluded."""
+        sel = flex.bool(block.size, True)
+        for dataset_id in range(block.n_datasets):
+            indices = self._excluded_indices[dataset_id]
+            block_selection = block.block_selections[dataset_id]
+            if not indices or not block_selection:
+                continue
+            n = max(flex.max(indices), flex.max(block_selection)) + 1
+            excluded = flex.bool(n, False)
+            excluded.set_selected(indices, True)
+            start = block.dataset_info[dataset_id]["start_index"]
+            end = block.dataset_info[dataset_id]["end_index"]
+            sel.set_selected(
+                flex.size_t(range(start, end)), ~excluded.select(block_selection)
+            )
+        return sel
+
     @property
     def blocked_data_list(self):
         """Return the list of IhTableBlock instances."""
@@ -197,6 +254,12 @@ def set_derivatives(self, derivatives, block_id):
         """Set the derivatives matrix for a given block."""
         self.Ih_table_blocks[block_id].derivatives = derivatives
 
+    def set_derivative_blocks(self, derivative_blocks, n_params, block_id):
+        """Set the derivatives of each model component for a given block."""
+        self.Ih_table_blocks[block_id].set_derivative_blocks(
+            derivative_blocks, n_params
+        )
+
     def set_inverse_scale_factors(self, new_scales, block_id):
         """Set the inverse scale factors for a given block."""
         self.Ih_table_blocks[block_id].inverse_scale_factors = new_scales
@@ -439,6 +502,10 @@ class IhTableBlock(object):
             array of values for symmetry groups into an array of size n_refl.
         derivatives: A matrix of derivatives of the reflections wrt the model
             parameters.
+        derivative_blocks: A list of (start row, start column, matrix) of the
+            derivatives of the reflections wrt the parameters of each model
+            component, giving the position of each in the derivatives matrix.
+        n_active_params: The number of columns of the derivatives matrix.
     """
 
     def __init__(self, n_groups, n_refl, n_datasets=1):
@@ -450,7 +517,9 @@ def __init__(self, n_groups, n_refl, n_datasets=1):
         self.dataset_info = {}
         self.n_datasets = n_datasets
         self.h_expand_matrix = None
-        self.derivatives = None
+        self._derivatives = None
+        self.derivative_blocks = None
+        self.n_active_params = 0
         self.binner = None
 
     def add_data(self, dataset_id, group_ids, reflections):
@@ -490,6 +559,44 @@ def add_data(self, dataset_id, group_ids, reflections):
         if self._setup_info["next_dataset"] == len(self.block_selections):
             self._complete_setup()
 
+    @property
+    def derivatives(self):
+        """The derivatives matrix. If only the derivative blocks have been set,
+        the matrix is assembled from these when it is first needed."""
+        if self._derivatives is None and self.derivative_blocks is not None:
+            derivatives = sparse.matrix(self.size, self.n_active_params)
+            for start_row, start_col, block in self.derivative_blocks:
+                derivatives.assign_block(block, start_row, start_col)
+            self._derivatives = derivatives
+        return self._derivatives
+
+    @derivatives.setter
+    def derivatives(self, derivatives):
+        self._derivatives = derivatives
+        if derivatives is None:
+            self.derivative_blocks = None
+        else:
+            self.derivative_blocks = [(0, 0, derivatives)]
+            self.n_active_params = derivatives.n_cols
+
+    @derivatives.deleter
+    def derivatives(self):
+        self.derivatives = None
+
+    def set_derivative_blocks(self, derivative_blocks, n_params):
+        """
+        Set the derivatives of each model component, without assembling the
+        derivatives matrix.
+
+        :param derivative_blocks: A list of (start row, start column, matrix)
+            giving the position of each component's derivatives in the
+            derivatives matrix
+        :param n_params: The total number of parameters
+        """
+        self._derivatives = None
+        self.derivative_blocks = derivative_blocks
+        self.n_active_params = n_params
+
     def _complete_setup(self):
         """Finish the setup of the Ih_table once all data has been added."""
         self.h_index_matrix.compact()
@@ -109,6 +109,9 @@ def compute_residuals_and_gradients(self, block):
     def compute_restraints_residuals_and_gradients(self, block):
         return self.target.compute_restraints_residuals_and_gradients(block)
 
+    def compute_normal_equations(self, block):
+        return self.target.compute_normal_equations(block)
+
     def compute_residuals(self, block):
         return self.target.compute_residuals(block)
 
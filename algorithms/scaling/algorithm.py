@@ -37,6 +37,7 @@
 from dials.command_line.cosym import phil_scope as cosym_phil_scope
 from dials.util.exclude_images import (
     exclude_image_ranges_for_scaling,
+    get_selection_for_valid_image_ranges,
     get_valid_image_ranges,
 )
 from dials.util.multi_dataset_handling import (
@@ -364,9 +365,10 @@ def run(self):
         with ScalingHTMLContextManager(self):
             start_time = time.time()
             results = AnalysisResults()
+            resume = False
 
             for counter in range(1, self.params.filtering.deltacchalf.max_cycles + 1):
-                self.run_scaling_cycle()
+                self.run_scaling_cycle(resume=resume)
 
                 if counter == 1:
                     results.initial_expids_and_image_ranges = [
@@ -461,8 +463,13 @@ def run(self):
                     results.finish(termination_reason="max_cycles")
                     break
 
-                # If not finished then need to create new scaler to try again
-                self._create_model_and_scaler()
+                # If not finished then need to update the scaler or create a new
+                # scaler to try again
+                resume = self._can_resume_scaling()
+                if resume:
+                    self._remove_filtered_data_from_scaler()
+                else:
+                    self._create_model_and_scaler()
             self.filtering_results = results
             # Print summary of results
             logger.info(results)
@@ -472,15 +479,40 @@ def run(self):
             logger.info("\nTotal time taken: {:.4f}s ".format(time.time() - start_time))
             logger.info("%s%s%s", "\n", "=" * 80, "\n")
 
-    def run_scaling_cycle(self):
-        """Do a round of scaling for scaling and filtering."""
+    def run_scaling_cycle(self, resume=False):
+        """Do a round of scaling for scaling and filtering.
+
+        If resume is True, the minimisation of the existing scaler is continued
+        for a limited number of iterations."""
         # Turn off the full matrix round, all else is the same.
 
         initial_full_matrix = self.params.scaling_options.full_matrix
+        initial_max_iterations = self.params.scaling_refinery.max_iterations
         self.scaler.params.scaling_options.full_matrix = False
-        self.scaler = scaling_algorithm(self.scaler)
+        if resume:
+            self.scaler.params.scaling_refinery.max_iterations = (
+                self.params.filtering.deltacchalf.warm_start_max_iterations
+            )
+        keep_scaler = self._can_resume_scaling()
+        self.scaler = scaling_algorithm(self.scaler, prepare_output=not keep_scaler)
         self.scaler.params.scaling_options.full_matrix = initial_full_matrix
+        self.scaler.params.scaling_refinery.max_iterations = initial_max_iterations
+        if keep_scaler:
+            output_tables = self._prepare_output_copies()
+            self.reflections = [
+                output_tables.get(expt.identifier, table)
+                for expt, table in zip(self.experiments, self.reflections)
+            ]
         self.remove_bad_data()
+        if keep_scaler:
+            # keep the exclusions for bad scale factors for the next cycle
+            tables = dict(zip(self.experiments.identifiers(), self.reflections))
+            for scaler in self.scaler.active_scalers:
+                table = tables[scaler.experiment.identifier]
+                excluded = table.get_flags(table.flags.excluded_for_scaling)
+                scaler.reflection_table.set_flags(
+                    excluded, table.flags.excluded_for_scaling
+                )
         for table in self.reflections:
             bad = table.get_flags(table.flags.bad_for_scaling, all=False)
             table.unset_flags(flex.bool(table.size(), True), table.flags.scaled)
@@ -497,6 +529,49 @@ def run_scaling_cycle(self):
             logger.info(e)
         logger.info("Performed cycle of scaling.")
 
+    def _can_resume_scaling(self):
+        """Whether the scaler can be kept between cycles of scaling and filtering."""
+        return self.params.filtering.deltacchalf.warm_start and self.scaler.id_ in (
+            "single",
+            "multi",
+        )
+
+    def _prepare_output_copies(self):
+        """
+        Prepare copies of the reflection tables of the scaler for output.
+
+        The reflection tables of the scaler are left unchanged, so that the
+        scaling can be resumed in a later cycle.
+
+        Returns:
+            A dict of the prepared reflection tables, keyed by experiment identifier.
+        """
+        scalers = self.scaler.active_scalers
+        tables = [scaler.reflection_table for scaler in scalers]
+        for scaler in scalers:
+            scaler.reflection_table = scaler.reflection_table.copy()
+        self.scaler.prepare_reflection_tables_for_output()
+        output = {
+            scaler.experiment.identifier: scaler.reflection_table for scaler in scalers
+        }
+        for scaler, table in zip(scalers, tables):
+            scaler.reflection_table = table
+        return output
+
+    def _remove_filtered_data_from_scaler(self):
+        """Remove the data excluded by filtering from the scaler, keeping the
+        current scaling models, then prepare the scaler for further scaling."""
+        self.experiments = set_image_ranges_in_scaling_models(self.experiments)
+        identifiers = list(self.experiments.identifiers())
+        for scaler in self.scaler.active_scalers:
+            if scaler.experiment.identifier in identifiers:
+                table = scaler.reflection_table
+                sel = get_selection_for_valid_image_ranges(table, scaler.experiment)
+                table.set_flags(~sel, table.flags.user_excluded_in_scaling)
+                table.unset_flags(~sel, table.flags.scaled)
+        self.scaler.remove_excluded_data(identifiers)
+        self.scaler.make_ready_for_scaling()
+
     def _run_final_scale_cycle(self, results):
         self._create_model_and_scaler()
         super(ScaleAndFilterAlgorithm, self).run()
@@ -541,8 +616,11 @@ def do_error_analysis(scaler, reselect=True):
         scaler.make_ready_for_scaling()
 
 
-def scaling_algorithm(scaler):
-    """Main algorithm for scaling."""
+def scaling_algorithm(scaler, prepare_output=True):
+    """Main algorithm for scaling.
+
+    If prepare_output is False, the reflection tables of the scaler are not
+    adjusted and cleaned for output, so that scaling can later be resumed."""
     scaler.perform_scaling()
     need_to_rescale = False
 
@@ -595,7 +673,8 @@ def scaling_algorithm(scaler):
     expand_and_do_outlier_rejection(scaler, calc_cov=True)
     do_error_analysis(scaler, reselect=False)
 
-    scaler.prepare_reflection_tables_for_output()
+    if prepare_output:
+        scaler.prepare_reflection_tables_for_output()
     return scaler
 
 
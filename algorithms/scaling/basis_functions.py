@@ -41,15 +41,15 @@ def _calculate_scale_factors(apm, block_id, scales):
         return multiplied_scale_factors
 
     @staticmethod
-    def _calculate_derivatives(apm, block_id, scales, derivatives_list):
-        """Calculate the derivatives matrix."""
+    def _calculate_derivative_blocks(apm, block_id, scales, derivatives_list):
+        """Calculate the derivatives of the scale factors wrt the parameters of
+        each component, returning a list of (start column, matrix)."""
         if not scales:
-            return sparse.matrix(0, 0)
+            return []
         if len(scales) == 1:
             # only one active parameter, so don't need to chain rule any derivatives
-            # for block_id in range(len(apm.n_obs)):
-            return derivatives_list[0]
-        derivatives = sparse.matrix(apm.n_obs[block_id], apm.n_active_params)
+            return [(0, derivatives_list[0])]
+        derivative_blocks = []
         col_idx = 0
         for i, d in enumerate(derivatives_list):
             scale_multipliers = flex.double(apm.n_obs[block_id], 1.0)
@@ -58,9 +58,23 @@ def _calculate_derivatives(apm, block_id, scales, derivatives_list):
                     scale_multipliers *= s1
             if apm.constant_g_values:
                 scale_multipliers *= apm.constant_g_values[block_id]
-            next_deriv = row_multiply(d, scale_multipliers)
-            derivatives.assign_block(next_deriv, 0, col_idx)
+            derivative_blocks.append((col_idx, row_multiply(d, scale_multipliers)))
             col_idx += d.n_cols
+        return derivative_blocks
+
+    @classmethod
+    def _calculate_derivatives(cls, apm, block_id, scales, derivatives_list):
+        """Calculate the derivatives matrix."""
+        if not scales:
+            return sparse.matrix(0, 0)
+        derivative_blocks = cls._calculate_derivative_blocks(
+            apm, block_id, scales, derivatives_list
+        )
+        if len(derivative_blocks) == 1:
+            return derivative_blocks[0][1]
+        derivatives = sparse.matrix(apm.n_obs[block_id], apm.n_active_params)
+        for col_idx, d in derivative_blocks:
+            derivatives.assign_block(d, 0, col_idx)
         return derivatives
 
     @classmethod
@@ -71,3 +85,14 @@ def calculate_scales_and_derivatives(cls, apm, block_id):
             cls._calculate_scale_factors(apm, block_id, scales),
             cls._calculate_derivatives(apm, block_id, scales, derivatives),
         )
+
+    @classmethod
+    def calculate_scales_and_derivative_blocks(cls, apm, block_id):
+        """Calculate scale factors and the derivatives of each component for
+        minimisation, as for calculate_scales_and_derivatives but without
+        assembling the derivatives matrix."""
+        scales, derivatives = cls._calc_component_scales_derivatives(apm, block_id)
+        return (
+            cls._calculate_scale_factors(apm, block_id, scales),
+            cls._calculate_derivative_blocks(apm, block_id, scales, derivatives),
+        )
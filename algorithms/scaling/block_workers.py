@@ -0,0 +1,125 @@
+"""
+Persistent worker processes for evaluating Ih table blocks during scaling.
+
+The Ih table is split into scaling_options.nproc blocks of symmetry-equivalent
+reflections, which can be evaluated independently at each step of minimisation.
+The Ih table blocks are expensive to send to a worker process, and their sparse
+derivative matrices cannot be pickled, so instead the workers are forked once
+at the start of a round of minimisation and inherit a copy of the scaler,
+including its Ih table blocks and the reflection data of the model components.
+At each step only the parameter vector is sent to the workers; each worker
+updates the scales and Ih values of its blocks and returns the requested target
+quantities for them, with any sparse Jacobian sent back as a list of columns.
+The new scales and Ih values are copied back into the blocks of the scaler in
+the main process, so that these remain current for the calculation of rmsds and
+for any later use.
+
+Forking is required, so that the workers can inherit the state of the scaler.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import math
+import multiprocessing
+
+from scitbx import sparse
+
+# The scaler and parameter manager inherited by the worker processes
+_worker_state = None
+
+
+def is_available():
+    """
+    :returns: True if worker processes can be forked on this platform
+    """
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _pack(value):
+    """Convert sparse matrices, which cannot be pickled, to column dictionaries."""
+    if isinstance(value, sparse.matrix):
+        columns = [dict(value.col(j)) for j in range(value.n_cols)]
+        return ("sparse.matrix", value.n_rows, value.n_cols, columns)
+    return value
+
+
+def _unpack(value):
+    """Rebuild sparse matrices converted by _pack."""
+    if isinstance(value, tuple) and len(value) == 4 and value[0] == "sparse.matrix":
+        return sparse.matrix(value[1], value[2], value[3])
+    return value
+
+
+def _evaluate_block(task):
+    method, x, block_id = task
+    scaler, apm = _worker_state
+    apm.set_param_vals(x)
+    scaler.update_for_minimisation(apm, block_id)
+    block = scaler.get_blocks_for_minimisation()[block_id]
+    result = getattr(apm, method)(block)
+    if isinstance(result, tuple):
+        result = tuple(_pack(value) for value in result)
+    return result, block.inverse_scale_factors, block.Ih_values
+
+
+class BlockWorkers(object):
+    """
+    A pool of worker processes which evaluate the blocks of a scaler's Ih table.
+
+    The pool must be created after the scaler and parameter manager are fully
+    set up for minimisation, and closed at the end of the round of
+    minimisation, as later changes in the main process are not seen by the
+    workers.
+    """
+
+    def __init__(self, scaler, apm, nproc):
+        """
+        Fork the worker processes
+
+        :param scaler: The scaler being minimised
+        :param apm: The active parameter manager of the round of minimisation
+        :param nproc: The maximum number of worker processes
+        """
+        global _worker_state
+        self.scaler = scaler
+        self.n_blocks = len(scaler.get_blocks_for_minimisation())
+        self.nproc = max(1, min(nproc, self.n_blocks))
+        _worker_state = (scaler, apm)
+        try:
+            self._pool = multiprocessing.get_context("fork").Pool(self.nproc)
+        finally:
+            _worker_state = None
+
+    def evaluate(self, method, x):
+        """
+        Evaluate a target method of the parameter manager for each work block.
+
+        :param method: The name of the method, e.g. "compute_functional_gradients"
+        :param x: The current parameter vector
+        :returns: An iterator over the results for each block, in block order
+        """
+        tasks = [(method, x, block_id) for block_id in range(self.n_blocks)]
+        # Give each worker a contiguous range of blocks
+        chunksize = int(math.ceil(self.n_blocks / self.nproc))
+        blocks = self.scaler.Ih_table.blocked_data_list
+        for block_id, (result, scales, Ih_values) in enumerate(
+            self._pool.imap(_evaluate_block, tasks, chunksize=chunksize)
+        ):
+            blocks[block_id].inverse_scale_factors = scales
+            blocks[block_id].Ih_table["Ih_values"] = Ih_values
+            if isinstance(result, tuple):
+                result = tuple(_unpack(value) for value in result)
+            yield result
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
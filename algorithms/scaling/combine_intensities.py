@@ -5,10 +5,11 @@
 
 import logging
 
+import numpy as np
+
 import boost_adaptbx.boost.python
 from cctbx import crystal, miller
 
-from dials.algorithms.scaling.scaling_utilities import DialsMergingStatisticsError
 from dials.array_family import flex
 from dials.util import tabulate
 
@@ -152,48 +153,7 @@ def _determine_Imids(self, raw_intensities):
 
     def _test_Imid_combinations(self):
         """Test the different combinations, returning the rows and results dict."""
-        rows = []
-        results = {}
-
-        for Imid in self.Imids:
-            Int, Var = _get_Is_from_Imidval(self.dataset, Imid)
-            miller_set = miller.set(
-                crystal_symmetry=self.experiment.crystal.get_crystal_symmetry(
-                    assert_is_compatible_unit_cell=False
-                ),
-                indices=self.dataset["miller_index"],
-                anomalous_flag=False,
-            )
-            i_obs = miller.array(
-                miller_set,
-                data=(
-                    Int
-                    * self.dataset["prescaling_correction"]
-                    / self.dataset["inverse_scale_factor"]
-                ),
-            )
-            i_obs.set_observation_type_xray_intensity()
-            i_obs.set_sigmas(
-                flex.sqrt(Var)
-                * self.dataset["prescaling_correction"]
-                / self.dataset["inverse_scale_factor"]
-            )
-            try:
-                rmeas, cchalf = fast_merging_stats(array=i_obs)
-                logger.debug("Imid: %s, Rmeas %s, cchalf %s", Imid, rmeas, cchalf)
-            except RuntimeError:
-                raise DialsMergingStatisticsError(
-                    "Unable to merge for intensity combination"
-                )
-
-            # record the results
-            results[Imid] = rmeas
-            res_str = {0: "prf only", 1: "sum only"}
-            if Imid not in res_str:
-                res_str[Imid] = "Imid = " + str(round(Imid, 2))
-            rows.append([res_str[Imid], str(round(cchalf, 5)), str(round(rmeas, 5))])
-
-        return rows, results
+        return _test_Imid_combinations([self.dataset], self.Imids)
 
 
 def combine_intensities(reflections, Imid):
@@ -343,54 +303,180 @@ def _determine_Imids(self, raw_intensities):
             self.Imids = Imid_list
 
     def _test_Imid_combinations(self):
-        rows = []
-        results = {}
-        for Imid in self.Imids:
-            combined_intensities = flex.double([])
-            combined_sigmas = flex.double([])
-            combined_scales = flex.double([])
-            combined_indices = flex.miller_index([])
-            for dataset in self.datasets:
-                Int, Var = _get_Is_from_Imidval(dataset, Imid)
-                Int *= dataset["prescaling_correction"]
-                sigma = flex.sqrt(Var) * dataset["prescaling_correction"]
-                combined_intensities.extend(Int)
-                combined_sigmas.extend(sigma)
-                combined_scales.extend(dataset["inverse_scale_factor"])
-                combined_indices.extend(dataset["miller_index"])
-            # apply scale factor before determining merging stats
-            miller_set = miller.set(
-                crystal_symmetry=self.active_scalers[
-                    0
-                ].experiment.crystal.get_crystal_symmetry(),
-                indices=combined_indices,
-                anomalous_flag=False,
-            )
-            i_obs = miller.array(
-                miller_set, data=combined_intensities / combined_scales
-            )
-            i_obs.set_observation_type_xray_intensity()
-            i_obs.set_sigmas(combined_sigmas / combined_scales)
-            try:
-                rmeas, cchalf = fast_merging_stats(array=i_obs)
-                logger.debug("Imid: %s, Rmeas %s, cchalf %s", Imid, rmeas, cchalf)
-            except RuntimeError:
-                raise DialsMergingStatisticsError(
-                    "Unable to merge for intensity combination"
-                )
-
-            # record the results
-            results[Imid] = rmeas
-            res_str = {0: "prf only", 1: "sum only"}
-            if Imid not in res_str:
-                res_str[Imid] = "Imid = " + str(round(Imid, 2))
-            rows.append([res_str[Imid], str(round(cchalf, 5)), str(round(rmeas, 5))])
-        return rows, results
+        return _test_Imid_combinations(self.datasets, self.Imids)
 
 
 ### Helper functions for combine_intensities
 
 
+def _test_Imid_combinations(datasets, Imids):
+    """
+    Calculate the merging statistics for each Imid, returning the rows and
+    results dict.
+
+    The reflections of all datasets are grouped by miller index once, and the
+    intensities for every Imid are calculated as one (n_Imids, n_refl) array,
+    so that Rmeas and CC1/2 are evaluated for all Imids in a single pass over
+    the grouped data.
+    """
+    hkl = flex.miller_index()
+    scales = flex.double()
+    Iprf, Vprf, Isum, Vsum = flex.double(), flex.double(), flex.double(), flex.double()
+    for dataset in datasets:
+        hkl.extend(dataset["miller_index"])
+        scales.extend(
+            dataset["prescaling_correction"] / dataset["inverse_scale_factor"]
+        )
+        Iprf.extend(dataset["intensity.prf.value"])
+        Vprf.extend(dataset["intensity.prf.variance"])
+        Int, Var = _get_Is_from_Imidval(dataset, 1)
+        Isum.extend(Int)
+        Vsum.extend(Var)
+
+    intensities, variances = _calculate_intensities_for_Imids(
+        Iprf.as_numpy_array(),
+        Isum.as_numpy_array(),
+        Vprf.as_numpy_array(),
+        Vsum.as_numpy_array(),
+        Imids,
+    )
+    scales = scales.as_numpy_array()
+    _, group_index = np.unique(
+        hkl.as_vec3_double().as_numpy_array().astype(np.int64),
+        axis=0,
+        return_inverse=True,
+    )
+    rmeas_values, cchalf_values = _fast_merging_stats_for_Imids(
+        intensities * scales,
+        np.sqrt(variances) * scales,
+        group_index.ravel(),
+    )
+
+    rows = []
+    results = {}
+    for Imid, rmeas, cchalf in zip(Imids, rmeas_values, cchalf_values):
+        logger.debug("Imid: %s, Rmeas %s, cchalf %s", Imid, rmeas, cchalf)
+
+        # record the results
+        results[Imid] = rmeas
+        res_str = {0: "prf only", 1: "sum only"}
+        if Imid not in res_str:
+            res_str[Imid] = "Imid = " + str(round(Imid, 2))
+        rows.append([res_str[Imid], str(round(cchalf, 5)), str(round(rmeas, 5))])
+
+    return rows, results
+
+
+def _calculate_intensities_for_Imids(Iprf, Isum, Vprf, Vsum, Imids):
+    """Calculate the intensities and variances for each Imid, as arrays of
+    shape (n_Imids, n_refl), in the same way as _get_Is_from_Imidval."""
+    intensities = np.empty((len(Imids), Iprf.size))
+    variances = np.empty((len(Imids), Iprf.size))
+    for i, Imid in enumerate(Imids):
+        if Imid == 0:
+            intensities[i], variances[i] = Iprf, Vprf
+        elif Imid == 1:
+            intensities[i], variances[i] = Isum, Vsum
+    combined = np.array([Imid not in (0, 1) for Imid in Imids], dtype=bool)
+    if combined.any():
+        Imid = np.array(Imids, dtype=np.float64)[combined, np.newaxis]
+        with np.errstate(over="ignore"):
+            w = 1.0 / (1.0 + (Isum / Imid) ** 3)
+        w[:, Isum <= 0] = 1.0
+        intensities[combined] = (w * Iprf) + ((1.0 - w) * Isum)
+        variances[combined] = (w * Vprf) + ((1.0 - w) * Vsum)
+    return intensities, variances
+
+
+def _fast_merging_stats_for_Imids(intensities, sigmas, group_index):
+    """
+    Calculate Rmeas and CC1/2 for each row of intensities and sigmas.
+
+    This is equivalent to calling fast_merging_stats for each row, but all
+    rows are merged together using the precomputed group (unique miller index)
+    of each reflection. Rmeas is identical to that from merge_equivalents_obs.
+    CC1/2 uses one random half-dataset split for all rows, in which the
+    reflections of each group are ordered by a random key and the first half
+    of those passing the I/sigma filter go into the first half-dataset, so its
+    values are equivalent to, but not the same as, those of split_unmerged.
+    """
+    n_rows = intensities.shape[0]
+    n_groups = group_index.max() + 1 if group_index.size else 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        use = (sigmas > 0) & ((intensities / sigmas) > 1.0)
+        weights = np.where(use, 1.0 / np.where(use, sigmas, 1.0) ** 2, 0.0)
+
+    # order reflections by group and by a random key within each group
+    rng = np.random.RandomState(0)
+    order = np.lexsort((rng.random_sample(group_index.size), group_index))
+    group_index = group_index[order]
+    intensities = intensities[:, order]
+    use = use[:, order]
+    weights = weights[:, order]
+
+    # sum the values of each row over the reflections of each group
+    keys = group_index + n_groups * np.arange(n_rows)[:, np.newaxis]
+
+    def group_sums(values):
+        return np.bincount(
+            keys.ravel(), weights=values.ravel(), minlength=n_rows * n_groups
+        ).reshape(n_rows, n_groups)
+
+    n = group_sums(use)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Rmeas, with the merged intensities weighted by 1/sigma^2
+        mean = group_sums(weights * intensities) / group_sums(weights)
+        abs_diff = np.where(use, np.abs(intensities - mean[:, group_index]), 0.0)
+        multiple = n > 1
+        r_meas_num = np.where(
+            multiple, np.sqrt(n / (n - 1)) * group_sums(abs_diff), 0.0
+        ).sum(axis=1)
+        r_meas_den = np.where(
+            multiple, group_sums(np.where(use, intensities, 0.0)), 0.0
+        ).sum(axis=1)
+        rmeas = np.where(r_meas_den == 0, 0.0, r_meas_num / r_meas_den)
+
+        # CC1/2, putting the extra reflection of an odd-sized group in either
+        # half at random
+        n_first = n // 2 + ((n % 2 == 1) & (rng.random_sample(n_groups) < 0.5))
+        group_start = np.searchsorted(group_index, np.arange(n_groups))
+        count = np.cumsum(use, axis=1)
+        count_before = np.where(
+            group_start > 0, count[:, np.maximum(group_start - 1, 0)], 0
+        )
+        rank = count - count_before[:, group_index]
+        first = use & (rank <= n_first[:, group_index])
+        second = use & ~first
+        half_means = [
+            group_sums(np.where(half, weights * intensities, 0.0))
+            / group_sums(np.where(half, weights, 0.0))
+            for half in (first, second)
+        ]
+    cchalf = np.array(
+        [
+            _correlation_coefficient(x[m], y[m])
+            for x, y, m in zip(half_means[0], half_means[1], multiple)
+        ]
+    )
+
+    no_data = ~use.any(axis=1)
+    rmeas[no_data] = -1.0
+    cchalf[no_data] = -1.0
+    return rmeas, cchalf
+
+
+def _correlation_coefficient(x, y):
+    """The linear correlation coefficient of x and y, or zero if undefined."""
+    if x.size < 2:
+        return 0.0
+    dx = x - x.mean()
+    dy = y - y.mean()
+    denominator = np.sqrt((dx * dx).sum() * (dy * dy).sum())
+    if denominator == 0:
+        return 0.0
+    return float((dx * dy).sum() / denominator)
+
+
 def _get_Is_from_Imidval(reflections, Imid):
     """Intepret the Imid value to extract and return the Icomb and Vcomb values."""
     if Imid == 0:  # special value to trigger prf
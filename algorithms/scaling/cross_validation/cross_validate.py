@@ -34,12 +34,21 @@
 cross_validation_mode=multi parameter=physical.absorption_correction
 cross_validation_mode=multi parameter=physical.decay_interval parameter_values="5.0 10.0 15.0"
 cross_validation_mode=multi parameter=model parameter_values="array physical"
+
+The individual scaling runs are independent, so can be run in parallel by
+setting nproc= , in which case each run uses a single process for scaling.
+If the parameter being optimised is a refinement option (in the
+scaling_refinery scope), setting warm_start=True first runs the first
+parameter value for each fold, then starts the runs for the other values
+from the scaling models determined on the same fold, rather than from the
+initial models.
 """
 
 from __future__ import absolute_import, division, print_function
 
 import itertools
 import logging
+import multiprocessing
 import time
 
 import six
@@ -80,6 +89,18 @@
               "allowed is 1/free_set_percentage; if set greater than this then"
               "the repetition will finish afer 1/free_set_percentage folds."
       .expert_level = 2
+    nproc = 1
+      .type = int(value_min=1)
+      .help = "Number of processes over which to run the scaling for the"
+              "different folds and parameter values. If nproc > 1, each"
+              "scaling run uses a single process."
+      .expert_level = 2
+    warm_start = False
+      .type = bool
+      .help = "If the parameter is a scaling_refinery option, start the"
+              "scaling for each parameter value from the models determined"
+              "for the first parameter value on the same fold."
+      .expert_level = 2
   }
 """
 )
@@ -95,10 +116,7 @@ def cross_validate(params, cross_validator):
     if params.cross_validation.cross_validation_mode == "single":
         # just run the setup nfolds times
         cross_validator.create_results_dict(n_options=1)
-        for n in range(params.cross_validation.nfolds):
-            if n < 100.0 / free_set_percentage:
-                params = cross_validator.set_free_set_offset(params, n)
-                cross_validator.run_script(params, config_no=0)
+        configurations = [{}]
 
     elif params.cross_validation.cross_validation_mode == "multi":
         # run each option nfolds times
@@ -152,18 +170,36 @@ def cross_validate(params, cross_validator):
         cross_validator.create_results_dict(len(values[0]))
         cross_validator.set_results_dict_configuration(keys, values)
 
-        for i, v in enumerate(itertools.product(*values)):
-            e = dict(zip(keys, v))
-            for k, val in six.iteritems(e):
-                params = cross_validator.set_parameter(params, k, val)
-            for n in range(params.cross_validation.nfolds):
-                if n < 100.0 / free_set_percentage:
-                    params = cross_validator.set_free_set_offset(params, n)
-                    cross_validator.run_script(params, config_no=i)
+        configurations = [dict(zip(keys, v)) for v in itertools.product(*values)]
 
     else:
         raise ValueError("Error in interpreting mode and options.")
 
+    # Each job is a (configuration number, configuration, fold) tuple
+    jobs = [
+        (i, configuration, n)
+        for i, configuration in enumerate(configurations)
+        for n in range(params.cross_validation.nfolds)
+        if n < 100.0 / free_set_percentage
+    ]
+
+    warm_start = params.cross_validation.warm_start and len(configurations) > 1
+    if warm_start and not all(
+        k.startswith("scaling_refinery.") for k in configurations[0]
+    ):
+        logger.info(
+            "Warm starting is only possible when optimising a scaling_refinery"
+            " parameter, all runs will start from the initial models."
+        )
+        warm_start = False
+
+    if params.cross_validation.nproc == 1 and not warm_start:
+        for i, configuration, n in jobs:
+            params = _configure(params, cross_validator, configuration, n)
+            cross_validator.run_script(params, config_no=i)
+    else:
+        _run_jobs(params, cross_validator, jobs, warm_start)
+
     st = cross_validator.interpret_results()
     logger.info("Summary of the cross validation analysis: \n %s", st.format())
 
@@ -174,3 +210,76 @@ def cross_validate(params, cross_validator):
         )
     )
     logger.info("\n" + "=" * 80 + "\n")
+
+
+# The state inherited by forked worker processes
+_job_state = None
+
+
+def _configure(params, cross_validator, configuration, n):
+    """Set the parameter values of a configuration and the free set offset."""
+    for k, val in six.iteritems(configuration):
+        params = cross_validator.set_parameter(params, k, val)
+    return cross_validator.set_free_set_offset(params, n)
+
+
+def _run_job(job_index):
+    """Run one scaling job, returning the results and the final models."""
+    params, cross_validator, jobs, initial_models = _job_state
+    _, configuration, n = jobs[job_index]
+    params = _configure(params, cross_validator, configuration, n)
+    return cross_validator.calculate_results(params, initial_models.get(n))
+
+
+def _quiet_worker():
+    """Only log warnings from worker processes, to avoid interleaved output."""
+    logging.getLogger("dials").setLevel(logging.WARNING)
+
+
+def _run_job_list(params, cross_validator, jobs, job_indices, initial_models):
+    """Run the jobs, in parallel if requested, with results in job order."""
+    global _job_state
+    nproc = min(params.cross_validation.nproc, len(job_indices))
+    _job_state = (params, cross_validator, jobs, initial_models)
+    try:
+        if nproc > 1 and "fork" in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context("fork").Pool(
+                nproc, initializer=_quiet_worker
+            )
+            try:
+                return pool.map(_run_job, job_indices, chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+        return [_run_job(i) for i in job_indices]
+    finally:
+        _job_state = None
+
+
+def _run_jobs(params, cross_validator, jobs, warm_start):
+    """
+    Run the scaling jobs and add the results to the cross validator.
+
+    The scaling runs inherit the input data of the cross validator from the
+    main process, rather than each being sent a copy. If warm starting, the
+    jobs for the first configuration are run first, and the models from these
+    are used as the starting models for the other configurations.
+    """
+    if params.cross_validation.nproc > 1:
+        # worker processes cannot start further processes for scaling
+        params.scaling_options.nproc = 1
+    job_indices = list(range(len(jobs)))
+    initial_models = {}
+    results = [None] * len(jobs)
+    if warm_start:
+        baseline = [i for i in job_indices if jobs[i][0] == 0]
+        job_indices = [i for i in job_indices if jobs[i][0] != 0]
+        output = _run_job_list(params, cross_validator, jobs, baseline, {})
+        for i, (result, models) in zip(baseline, output):
+            results[i] = result
+            initial_models[jobs[i][2]] = models
+    output = _run_job_list(params, cross_validator, jobs, job_indices, initial_models)
+    for i, (result, _) in zip(job_indices, output):
+        results[i] = result
+    for (config_no, _, _), result in zip(jobs, results):
+        cross_validator.add_results_to_results_dict(config_no, result)
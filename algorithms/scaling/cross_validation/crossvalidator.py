@@ -39,6 +39,12 @@ def run_script(self, params, config_no):
         configuration number being run."""
         raise NotImplementedError()
 
+    def calculate_results(self, params, initial_models=None):
+        """Run the appropriate command line script with the params, starting
+        from the initial models if given, and return the free/work set results
+        and the final models."""
+        raise NotImplementedError()
+
     def get_results_from_script(self, script):
         """Return the work/free results list from the command line script object"""
         raise NotImplementedError()
@@ -183,6 +189,7 @@ def set_parameter(self, params, name, val):
             params.reflection_selection,
             params.reflection_selection.random,
             params.reflection_selection.random.multi_dataset,
+            params.scaling_refinery,
         ]
         if params.model:
             phil_branches.append(params.__getattribute__(str(params.model)))
@@ -214,14 +221,31 @@ def get_free_set_percentage(self, params):
     def run_script(self, params, config_no):
         """Run the scaling script with the params, get the free/work set results
         and add to the results dict"""
+        results, _ = self.calculate_results(params)
+        self.add_results_to_results_dict(config_no, results)
+
+    def calculate_results(self, params, initial_models=None):
+        """Run the scaling script with the params and return the free/work set
+        results and the list of final scaling models, as dictionaries.
+
+        If a list of initial models is given, with one model per experiment, the
+        scaling is started from these models rather than from new models."""
         from dials.algorithms.scaling.algorithm import ScalingAlgorithm
+        from dials.algorithms.scaling.model.model import _dxtbx_scaling_models
 
         params.scaling_options.__setattr__("use_free_set", True)
+        experiments = deepcopy(self.experiments)
+        if initial_models and len(initial_models) == len(experiments):
+            for experiment, model_dict in zip(experiments, initial_models):
+                entry_point = _dxtbx_scaling_models[model_dict["__id__"]]
+                experiment.scaling_model = entry_point.load().from_dict(model_dict)
+                experiment.scaling_model.set_scaling_model_as_unscaled()
         algorithm = ScalingAlgorithm(
             params,
-            experiments=deepcopy(self.experiments),
+            experiments=experiments,
             reflections=deepcopy(self.reflections),
         )
         algorithm.run()
         results = self.get_results_from_script(algorithm)
-        self.add_results_to_results_dict(config_no, results)
+        models = [expt.scaling_model.to_dict() for expt in algorithm.experiments]
+        return results, models
@@ -133,6 +133,8 @@ def mock_script():
     assert params.cut_data.d_min == 1.8
     params = crossvalidator.set_parameter(params, "scaling_options.outlier_zmax", 7.53)
     assert params.scaling_options.outlier_zmax == 7.53
+    params = crossvalidator.set_parameter(params, "scaling_refinery.engine", "LevMar")
+    assert params.scaling_refinery.engine == "LevMar"
     with pytest.raises(ValueError):
         _ = crossvalidator.set_parameter(params, "bad_parameter", 7.53)
 
@@ -215,3 +217,42 @@ def test_cross_validate_script():
             param.cross_validation.cross_validation_mode = "bad"
             with pytest.raises(ValueError):
                 cross_validate(param, crossvalidator)
+
+
+def fake_calculate_results(params, initial_models=None):
+    """Return results and models recording the configuration of the run."""
+    offset = params.scaling_options.free_set_offset
+    rmsd_tolerance = params.scaling_refinery.rmsd_tolerance
+    results = [rmsd_tolerance, float(offset), 0.0, 0.0, 0.0, 0.0]
+    return results, [{"fold": offset, "initial": initial_models}]
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_cross_validate_parallel_warm_start(nproc):
+    """Test that parallel and warm started runs give results in the same order
+    as serial runs, and that warm started runs use the models from the same fold."""
+    param = generated_param()
+    param.cross_validation.cross_validation_mode = "multi"
+    param.cross_validation.parameter = "scaling_refinery.rmsd_tolerance"
+    param.cross_validation.parameter_values = ["0.1", "0.01"]
+    param.cross_validation.nfolds = 3
+    param.cross_validation.nproc = nproc
+    param.cross_validation.warm_start = True
+    crossvalidator = DialsScaleCrossValidator([], [])
+    fpath = "dials.algorithms.scaling.cross_validation."
+    with mock.patch(
+        fpath + "crossvalidator.DialsScaleCrossValidator.calculate_results",
+        side_effect=fake_calculate_results,
+    ) as mock_calculate:
+        with mock.patch(
+            fpath + "crossvalidator.DialsScaleCrossValidator.interpret_results"
+        ):
+            cross_validate(param, crossvalidator)
+    assert crossvalidator.results_dict[0]["work Rmeas"] == [0.1] * 3
+    assert crossvalidator.results_dict[1]["work Rmeas"] == [0.01] * 3
+    assert crossvalidator.results_dict[0]["free Rmeas"] == [0.0, 1.0, 2.0]
+    assert crossvalidator.results_dict[1]["free Rmeas"] == [0.0, 1.0, 2.0]
+    if nproc == 1:
+        initial_models = [c[0][1] for c in mock_calculate.call_args_list]
+        assert initial_models[:3] == [None] * 3
+        assert initial_models[3:] == [[{"fold": n, "initial": None}] for n in range(3)]
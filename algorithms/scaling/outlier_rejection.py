@@ -11,9 +11,11 @@
 
 import copy
 import logging
+import multiprocessing
 
 from scitbx.array_family import flex
 
+from dials.algorithms.scaling import block_workers
 from dials.algorithms.scaling.Ih_table import IhTable
 from dials_scaling_ext import determine_outlier_indices, limit_outlier_weights
 
@@ -72,7 +74,9 @@ def reject_outliers(reflection_table, experiment, method="standard", zmax=6.0):
     return reflection_table
 
 
-def determine_outlier_index_arrays(Ih_table, method="standard", zmax=6.0, target=None):
+def determine_outlier_index_arrays(
+    Ih_table, method="standard", zmax=6.0, target=None, nproc=1
+):
     """
     Run an outlier algorithm and return the outlier indices.
 
@@ -84,6 +88,8 @@ def determine_outlier_index_arrays(Ih_table, method="standard", zmax=6.0, target
         zmax (float): Normalised deviation threshold for classifying an outlier.
         target (Optional[IhTable]): An IhTable to use to obtain target Ih for
             outlier rejectiob, if method=target.
+        nproc (int): The number of processes over which to split the blocks of
+            the Ih_table. The result does not depend on the number of processes.
 
     Returns:
         outlier_index_arrays (list): A list of flex.size_t arrays, with one
@@ -97,12 +103,12 @@ def determine_outlier_index_arrays(Ih_table, method="standard", zmax=6.0, target
     """
     outlier_rej = None
     if method == "standard":
-        outlier_rej = NormDevOutlierRejection(Ih_table, zmax)
+        outlier_rej = NormDevOutlierRejection(Ih_table, zmax, nproc)
     elif method == "simple":
-        outlier_rej = SimpleNormDevOutlierRejection(Ih_table, zmax)
+        outlier_rej = SimpleNormDevOutlierRejection(Ih_table, zmax, nproc)
     elif method == "target":
         assert target is not None
-        outlier_rej = TargetedOutlierRejection(Ih_table, zmax, target)
+        outlier_rej = TargetedOutlierRejection(Ih_table, zmax, target, nproc)
     elif method is not None:
         raise ValueError("Invalid choice of outlier rejection method: %s" % method)
     if not outlier_rej:
@@ -126,9 +132,11 @@ class OutlierRejectionBase(object):
     Base class for outlier rejection algorithms using an IhTable datastructure.
 
     Subclasses must implement the _do_outlier_rejection method, which must
-    add the indices of outliers to the _outlier_indices attribute. The algorithms
-    are run upon initialisation and result in the population of the
-    :obj:`final_outlier_arrays`.
+    return the outliers found in a single Ih_table block. As symmetry
+    equivalent reflections are always in the same block, the blocks can be
+    processed independently, optionally in forked worker processes. The
+    algorithms are run with the run method and result in the population of
+    the :obj:`final_outlier_arrays`.
 
     Attributes:
         final_outlier_arrays (:obj:`list`): A list of flex.size_t arrays of outlier
@@ -136,16 +144,15 @@ class OutlierRejectionBase(object):
             create the Ih_table.
     """
 
-    def __init__(self, Ih_table, zmax):
-        """Set up and run the outlier rejection algorithm."""
-        assert (
-            Ih_table.n_work_blocks == 1
-        ), """
-Outlier rejection algorithms require an Ih_table with nblocks = 1"""
-        # Note: could be possible to code for nblocks > 1
-        self._Ih_table_block = Ih_table.blocked_data_list[0]
+    def __init__(self, Ih_table, zmax, nproc=1):
+        """Set up the outlier rejection algorithm."""
+        self._Ih_table_blocks = Ih_table.blocked_data_list[: Ih_table.n_work_blocks]
+        if nproc > 1 and len(self._Ih_table_blocks) == 1:
+            self._Ih_table_blocks = _split_block_on_groups(
+                self._Ih_table_blocks[0], nproc
+            )
         self._n_datasets = Ih_table.n_datasets
-        self._block_selections = Ih_table.blocked_selection_list[0]
+        self._nproc = nproc
         self._datasets = flex.int([])
         self._zmax = zmax
         self._outlier_indices = flex.size_t([])
@@ -153,9 +160,40 @@ def __init__(self, Ih_table, zmax):
 
     def run(self):
         """Run the outlier rejection algorithm, implemented by a subclass."""
-        self._do_outlier_rejection()
+        block_results = self._map_over_blocks()
+        # Combine the results of each round in block order, which gives the
+        # same result as processing the data in a single block.
+        n_rounds = max(len(rounds) for rounds in block_results)
+        for i in range(n_rounds):
+            for rounds in block_results:
+                if i < len(rounds):
+                    self._outlier_indices.extend(rounds[i][0])
+                    self._datasets.extend(rounds[i][1])
         self.final_outlier_arrays = self._determine_outlier_indices()
 
+    def _map_over_blocks(self):
+        """Run the algorithm on each block, in worker processes if nproc > 1."""
+        global _outlier_rejection
+        nproc = min(self._nproc, len(self._Ih_table_blocks))
+        if nproc > 1 and block_workers.is_available():
+            # The blocks contain sparse matrices, which cannot be pickled, so
+            # the workers inherit the blocks and receive only the block index.
+            _outlier_rejection = self
+            try:
+                pool = multiprocessing.get_context("fork").Pool(nproc)
+            finally:
+                _outlier_rejection = None
+            try:
+                return pool.map(
+                    _do_outlier_rejection_for_block,
+                    range(len(self._Ih_table_blocks)),
+                    chunksize=1,
+                )
+            finally:
+                pool.terminate()
+                pool.join()
+        return [self._do_outlier_rejection(block) for block in self._Ih_table_blocks]
+
     def _determine_outlier_indices(self):
         """
         Determine outlier indices with respect to the input reflection tables.
@@ -178,11 +216,38 @@ def _determine_outlier_indices(self):
             )
         return final_outlier_arrays
 
-    def _do_outlier_rejection(self):
-        """Add indices (w.r.t. the Ih_table data) to self._outlier_indices."""
+    def _do_outlier_rejection(self, Ih_table):
+        """
+        Determine the outliers in an Ih_table block.
+
+        Returns:
+            A list with an entry for each round of the algorithm, of a tuple of
+            the loc_indices and dataset_ids of the outliers found in that round.
+        """
         raise NotImplementedError()
 
 
+# The outlier rejection instance inherited by the worker processes
+_outlier_rejection = None
+
+
+def _do_outlier_rejection_for_block(block_id):
+    outlier_rej = _outlier_rejection
+    return outlier_rej._do_outlier_rejection(outlier_rej._Ih_table_blocks[block_id])
+
+
+def _split_block_on_groups(block, n):
+    """Split an Ih_table block into up to n blocks of contiguous groups."""
+    n = min(n, block.n_groups)
+    if n < 2:
+        return [block]
+    boundaries = [int(i * block.n_groups / n) for i in range(n + 1)]
+    return [
+        block.select_on_groups_isel(flex.size_t(range(start, end)))
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
 class TargetedOutlierRejection(OutlierRejectionBase):
     """Implementation of an outlier rejection algorithm against a target.
 
@@ -191,23 +256,26 @@ class TargetedOutlierRejection(OutlierRejectionBase):
     calculated from the intensity values in the target table.
     """
 
-    def __init__(self, Ih_table, zmax, target):
-        """Set a target Ih_table and run the outlier rejection."""
+    def __init__(self, Ih_table, zmax, target, nproc=1):
+        """Set a target Ih_table for the outlier rejection."""
         assert (
             target.n_work_blocks == 1
         ), """
 Targeted outlier rejection requires a target Ih_table with nblocks = 1"""
-        self._target_Ih_table_block = target.blocked_data_list[0]
-        self._target_Ih_table_block.calc_Ih()
-        super(TargetedOutlierRejection, self).__init__(Ih_table, zmax)
-
-    def _do_outlier_rejection(self):
-        """Add indices (w.r.t. the Ih_table data) to self._outlier_indices."""
-        Ih_table = self._Ih_table_block
-        target = self._target_Ih_table_block
-        target_asu_Ih_dict = dict(
-            zip(target.asu_miller_index, zip(target.Ih_values, target.variances))
+        target_block = target.blocked_data_list[0]
+        target_block.calc_Ih()
+        self._target_asu_Ih_dict = dict(
+            zip(
+                target_block.asu_miller_index,
+                zip(target_block.Ih_values, target_block.variances),
+            )
         )
+        super(TargetedOutlierRejection, self).__init__(Ih_table, zmax, nproc)
+
+    def _do_outlier_rejection(self, Ih_table):
+        """Return the outliers in an Ih_table block, found in a single round."""
+        block = Ih_table
+        target_asu_Ih_dict = self._target_asu_Ih_dict
         Ih_table.Ih_table["target_Ih_value"] = flex.double(Ih_table.size, 0.0)
         Ih_table.Ih_table["target_Ih_sigmasq"] = flex.double(Ih_table.size, 0.0)
         for j, miller_idx in enumerate(Ih_table.asu_miller_index):
@@ -236,15 +304,15 @@ def _do_outlier_rejection(self):
         outliers_sel = flex.abs(norm_dev) > self._zmax
         outliers_isel = nz_sel.iselection().select(outliers_sel)
 
-        outliers = flex.bool(self._Ih_table_block.size, False)
+        outliers = flex.bool(block.size, False)
         outliers.set_selected(outliers_isel, True)
 
-        self._outlier_indices.extend(
-            self._Ih_table_block.Ih_table["loc_indices"].select(outliers)
-        )
-        self._datasets.extend(
-            self._Ih_table_block.Ih_table["dataset_id"].select(outliers)
-        )
+        return [
+            (
+                block.Ih_table["loc_indices"].select(outliers),
+                block.Ih_table["dataset_id"].select(outliers),
+            )
+        ]
 
 
 class SimpleNormDevOutlierRejection(OutlierRejectionBase):
@@ -254,19 +322,13 @@ class SimpleNormDevOutlierRejection(OutlierRejectionBase):
     the symmetry group excluding the test reflection.
     """
 
-    def __init__(self, Ih_table, zmax):
-        super(SimpleNormDevOutlierRejection, self).__init__(Ih_table, zmax)
-        self.weights = limit_outlier_weights(
-            copy.deepcopy(self._Ih_table_block.weights),
-            self._Ih_table_block.h_index_matrix,
-        )
-
-    def _do_outlier_rejection(self):
-        """Add indices (w.r.t. the Ih_table data) to self._outlier_indices."""
-        Ih_table = self._Ih_table_block
+    def _do_outlier_rejection(self, Ih_table):
+        """Return the outliers in an Ih_table block, found in a single round."""
         intensity = Ih_table.intensities
         g = Ih_table.inverse_scale_factors
-        w = self.weights
+        w = limit_outlier_weights(
+            copy.deepcopy(Ih_table.weights), Ih_table.h_index_matrix
+        )
         wgIsum = (
             (w * g * intensity) * Ih_table.h_index_matrix
         ) * Ih_table.h_expand_matrix
@@ -286,10 +348,12 @@ def _do_outlier_rejection(self):
         norm_dev.set_selected(zero_sel, 1000)  # to trigger rejection
         outliers = flex.abs(norm_dev) > self._zmax
 
-        self._outlier_indices.extend(Ih_table.Ih_table["loc_indices"].select(outliers))
-        self._datasets.extend(
-            self._Ih_table_block.Ih_table["dataset_id"].select(outliers)
-        )
+        return [
+            (
+                Ih_table.Ih_table["loc_indices"].select(outliers),
+                Ih_table.Ih_table["dataset_id"].select(outliers),
+            )
+        ]
 
 
 class NormDevOutlierRejection(OutlierRejectionBase):
@@ -299,31 +363,33 @@ class NormDevOutlierRejection(OutlierRejectionBase):
     the symmetry group excluding the test reflection.
     """
 
-    def __init__(self, Ih_table, zmax):
-        super(NormDevOutlierRejection, self).__init__(Ih_table, zmax)
-        self.weights = limit_outlier_weights(
-            copy.deepcopy(self._Ih_table_block.weights),
-            self._Ih_table_block.h_index_matrix,
+    def _do_outlier_rejection(self, Ih_table):
+        """Return the outliers in an Ih_table block, found over several rounds."""
+        weights = limit_outlier_weights(
+            copy.deepcopy(Ih_table.weights), Ih_table.h_index_matrix
         )
+        rounds = []
+        while True:
+            outliers, Ih_table, weights = self._round_of_outlier_rejection(
+                Ih_table, weights
+            )
+            if not outliers[0]:
+                break
+            rounds.append(outliers)
+        return rounds
 
-    def _do_outlier_rejection(self):
-        """Add indices (w.r.t. the Ih_table data) to self._outlier_indices."""
-        self._round_of_outlier_rejection()
-        n_outliers = len(self._outlier_indices)
-        n_new_outliers = n_outliers
-        while n_new_outliers:
-            self._round_of_outlier_rejection()
-            n_new_outliers = len(self._outlier_indices) - n_outliers
-            n_outliers = len(self._outlier_indices)
-
-    def _round_of_outlier_rejection(self):
+    def _round_of_outlier_rejection(self, Ih_table, weights):
         """
         Calculate normal deviations from the data in the Ih_table.
+
+        Returns:
+            A tuple of the outliers found in this round, as a tuple of
+            loc_indices and dataset_ids, and the Ih_table block and weights
+            of the remaining potential outliers.
         """
-        Ih_table = self._Ih_table_block
         intensity = Ih_table.intensities
         g = Ih_table.inverse_scale_factors
-        w = self.weights
+        w = weights
         wgIsum = (
             (w * g * intensity) * Ih_table.h_index_matrix
         ) * Ih_table.h_expand_matrix
@@ -358,13 +424,10 @@ def _round_of_outlier_rejection(self):
         outlier_indices, other_potential_outliers = determine_outlier_indices(
             Ih_table.h_index_matrix, all_z_scores, self._zmax
         )
-        self._outlier_indices.extend(
-            self._Ih_table_block.Ih_table["loc_indices"].select(outlier_indices)
-        )
-        self._datasets.extend(
-            self._Ih_table_block.Ih_table["dataset_id"].select(outlier_indices)
+        outliers = (
+            Ih_table.Ih_table["loc_indices"].select(outlier_indices),
+            Ih_table.Ih_table["dataset_id"].select(outlier_indices),
         )
         sel = flex.bool(Ih_table.size, False)
         sel.set_selected(other_potential_outliers, True)
-        self._Ih_table_block = self._Ih_table_block.select(sel)
-        self.weights = self.weights.select(sel)
+        return outliers, Ih_table.select(sel), weights.select(sel)
@@ -34,6 +34,15 @@
         stdcutoff = 4.0
             .type = float
             .help = "Datasets with a ΔCC½ below (mean - stdcutoff*std) are removed"
+        warm_start = False
+            .type = bool
+            .help = "Keep the scaler between cycles, removing the filtered data"
+                    "from it and resuming the minimisation of the current models,"
+                    "rather than creating a new scaler for each cycle."
+        warm_start_max_iterations = 10
+            .type = int(value_min=1)
+            .help = "The maximum number of iterations of each minimisation when"
+                    "resuming the scaling in a warm-started cycle."
     }
     output {
         scale_and_filter_results = "scale_and_filter_results.json"
@@ -154,6 +154,10 @@ def make_ready_for_scaling(self, outlier=True):
         """Make the scaler in a prepared state for scaling."""
         raise NotImplementedError()
 
+    def remove_excluded_data(self, identifiers):
+        """Update the scaler for data excluded since initialisation."""
+        raise NotImplementedError()
+
     def determine_shared_model_components(self):
         return None
 
@@ -498,10 +502,14 @@ def update_var_cov(self, apm):
     def update_for_minimisation(self, apm, block_id):
         """Update the scale factors and Ih for the next minimisation iteration."""
         apm_i = apm.apm_list[0]
-        scales_i, derivs_i = RefinerCalculator.calculate_scales_and_derivatives(
+        scales_i, derivs_i = RefinerCalculator.calculate_scales_and_derivative_blocks(
             apm_i, block_id
         )
-        self.Ih_table.set_derivatives(derivs_i, block_id)
+        self.Ih_table.set_derivative_blocks(
+            [(0, start_col, d) for start_col, d in derivs_i],
+            apm_i.n_active_params,
+            block_id,
+        )
         self.Ih_table.set_inverse_scale_factors(scales_i, block_id)
         self.Ih_table.update_weights(block_id)
         self.Ih_table.calc_Ih(block_id)
@@ -716,14 +724,21 @@ def _update_model_data(self):
             component.update_reflection_data(block_selections=block_selections)
 
     def _create_Ih_table(self):
-        """Create an Ih_table from the reflection table using the scaling selection."""
+        """Create an Ih_table from the reflection table using the scaling selection.
+
+        The Ih_table is created over the whole scaling subset, then the
+        reflections not in the scaling selection (i.e. the outliers) are
+        excluded, so that further outliers can be excluded by _update_Ih_table."""
         self._Ih_table = IhTable(
-            [self.get_reflections_for_model_minimisation()],
+            [self.get_valid_reflections().select(self.scaling_subset_sel)],
             self.experiment.crystal.get_space_group(),
-            indices_lists=[self.scaling_selection.iselection()],
+            indices_lists=[self.scaling_subset_sel.iselection()],
             nblocks=self.params.scaling_options.nproc,
             anomalous=self.params.anomalous,
         )
+        excluded = self.scaling_subset_sel & ~self.scaling_selection
+        if excluded.count(True):
+            self._Ih_table.set_excluded_reflections([excluded.iselection()])
         if self.error_model:
             variance = self.reflection_table["variance"].select(
                 self.suitable_refl_for_scaling_sel
@@ -734,6 +749,16 @@ def _create_Ih_table(self):
             new_vars = self.error_model.update_variances(variance, intensity)
             self._Ih_table.update_data_in_blocks(new_vars, 0, column="variance")
 
+    def _update_Ih_table(self):
+        """Update the exclusions and data of the Ih_table for the scaling selection,
+        or recreate it if any excluded reflections are to be readmitted."""
+        excluded = [(self.scaling_subset_sel & ~self.scaling_selection).iselection()]
+        if self._Ih_table.readmits(excluded):
+            self._create_Ih_table()
+            return
+        _update_Ih_table_data(self._Ih_table, self, 0, self.error_model)
+        self._Ih_table.set_excluded_reflections(excluded)
+
     def _create_global_Ih_table(
         self, free_set_percentage=0, anomalous=False, remove_outliers=False
     ):
@@ -783,6 +808,9 @@ def _configure_model_and_datastructures(self, for_multi=False):
         self.experiment.scaling_model.configure_components(
             sel_reflections, self.experiment, self.params
         )
+        self._configured_image_range = self.experiment.scaling_model.configdict.get(
+            "valid_image_range"
+        )
         free_set_percentage = 0
         if self.params.scaling_options.use_free_set and not for_multi:
             free_set_percentage = self.params.scaling_options.free_set_percentage
@@ -802,6 +830,7 @@ def round_of_outlier_rejection(self):
                 self.global_Ih_table,
                 self.params.scaling_options.outlier_rejection,
                 self.params.scaling_options.outlier_zmax,
+                nproc=self.params.scaling_options.nproc,
             )[0]
             self.outliers = flex.bool(self.n_suitable_refl, False)
             self.outliers.set_selected(outlier_indices, True)
@@ -810,6 +839,7 @@ def round_of_outlier_rejection(self):
                     self._free_Ih_table,
                     self.params.scaling_options.outlier_rejection,
                     self.params.scaling_options.outlier_zmax,
+                    nproc=self.params.scaling_options.nproc,
                 )[0]
                 self.outliers.set_selected(free_outlier_indices, True)
 
@@ -824,9 +854,43 @@ def make_ready_for_scaling(self, outlier=True):
             self.scaling_selection = self.scaling_subset_sel & ~self.outliers
         else:
             self.scaling_selection = copy.deepcopy(self.scaling_subset_sel)
-        self._create_Ih_table()
+        if self._Ih_table:
+            self._update_Ih_table()
+        else:
+            self._create_Ih_table()
         self._update_model_data()
 
+    def remove_excluded_data(self, identifiers, for_multi=False):
+        """
+        Update the data structures for reflections excluded since initialisation.
+
+        Reflections newly flagged as user excluded in the reflection table are
+        removed from the suitable reflections, and the model data and Ih tables
+        are recreated, keeping the current scaling model and outliers.
+        """
+        assert self.experiment.identifier in identifiers
+        suitable = self._get_suitable_for_scaling_sel(self._reflection_table)
+        keep = suitable.select(self.suitable_refl_for_scaling_sel)
+        image_range = self.experiment.scaling_model.configdict.get("valid_image_range")
+        if keep.count(False) == 0 and image_range == self._configured_image_range:
+            return
+        self.outliers = self.outliers.select(keep)
+        self.suitable_refl_for_scaling_sel = suitable
+        self.n_suitable_refl = suitable.count(True)
+        self.free_set_selection = flex.bool(self.n_suitable_refl, False)
+        # the model may have fewer parameters if its image range has been reduced
+        n_model_params = sum(val.n_params for val in self.components.values())
+        self._var_cov_matrix = sparse.matrix(n_model_params, n_model_params)
+        self._Ih_table = None
+        self._configure_model_and_datastructures(for_multi=for_multi)
+        if not for_multi:
+            self._select_reflections_for_scaling()
+            self._create_Ih_table()
+            self._update_model_data()
+        else:
+            self._global_Ih_table = None
+            self.scaling_selection = ~self.outliers
+
     def clean_reflection_table(self):
         """Remove additional added columns that are not required for output."""
         self._initial_keys.append("inverse_scale_factor")
@@ -934,20 +998,25 @@ def update_for_minimisation(self, apm, block_id):
 
     def _update_for_minimisation(self, apm, block_id, calc_Ih=True):
         scales = flex.double([])
-        derivs = []
-        for apm_i in apm.apm_list:
-            scales_i, derivs_i = RefinerCalculator.calculate_scales_and_derivatives(
+        derivative_blocks = []
+        for j, apm_i in enumerate(apm.apm_list):
+            (
+                scales_i,
+                derivs_i,
+            ) = RefinerCalculator.calculate_scales_and_derivative_blocks(
                 apm_i, block_id
             )
+            # the derivatives of each component, placed by the rows of this
+            # dataset and the columns of the component's parameters
+            for start_col, deriv in derivs_i:
+                derivative_blocks.append(
+                    (scales.size(), apm.apm_data[j]["start_idx"] + start_col, deriv)
+                )
             scales.extend(scales_i)
-            derivs.append(derivs_i)
-        deriv_matrix = sparse.matrix(scales.size(), apm.n_active_params)
-        start_row_no = 0
-        for j, deriv in enumerate(derivs):
-            deriv_matrix.assign_block(deriv, start_row_no, apm.apm_data[j]["start_idx"])
-            start_row_no += deriv.n_rows
         self.Ih_table.set_inverse_scale_factors(scales, block_id)
-        self.Ih_table.set_derivatives(deriv_matrix, block_id)
+        self.Ih_table.set_derivative_blocks(
+            derivative_blocks, apm.n_active_params, block_id
+        )
         self.Ih_table.update_weights(block_id)
         if calc_Ih:
             self.Ih_table.calc_Ih(block_id)
@@ -1026,9 +1095,10 @@ def _create_global_Ih_table(self, anomalous=False, remove_outliers=False):
     def _create_Ih_table(self):
         """Create a new Ih table from the reflection tables."""
         tables = [
-            s.get_reflections_for_model_minimisation() for s in self.active_scalers
+            s.get_valid_reflections().select(s.scaling_subset_sel)
+            for s in self.active_scalers
         ]
-        indices_lists = [s.scaling_selection.iselection() for s in self.active_scalers]
+        indices_lists = [s.scaling_subset_sel.iselection() for s in self.active_scalers]
         self._Ih_table = IhTable(
             tables,
             self.active_scalers[0].experiment.crystal.get_space_group(),
@@ -1036,6 +1106,12 @@ def _create_Ih_table(self):
             nblocks=self.params.scaling_options.nproc,
             anomalous=self.params.anomalous,
         )
+        excluded = [
+            (s.scaling_subset_sel & ~s.scaling_selection).iselection()
+            for s in self.active_scalers
+        ]
+        if any(excluded):
+            self._Ih_table.set_excluded_reflections(excluded)
         if self.error_model:
             for i, scaler in enumerate(self.active_scalers):
                 variance = scaler.reflection_table["variance"].select(
@@ -1047,6 +1123,20 @@ def _create_Ih_table(self):
                 new_vars = self.error_model.update_variances(variance, intensity)
                 self._Ih_table.update_data_in_blocks(new_vars, i, column="variance")
 
+    def _update_Ih_table(self):
+        """Update the exclusions and data of the Ih_table for the scaling selections,
+        or recreate it if any excluded reflections are to be readmitted."""
+        excluded = [
+            (s.scaling_subset_sel & ~s.scaling_selection).iselection()
+            for s in self.active_scalers
+        ]
+        if self._Ih_table.readmits(excluded):
+            self._create_Ih_table()
+            return
+        for i, scaler in enumerate(self.active_scalers):
+            _update_Ih_table_data(self._Ih_table, scaler, i, self.error_model)
+        self._Ih_table.set_excluded_reflections(excluded)
+
     def make_ready_for_scaling(self, outlier=True):
         """
         Prepare the datastructures for a round of scaling.
@@ -1065,7 +1155,10 @@ def make_ready_for_scaling(self, outlier=True):
                 datasets_to_remove.append(i)
         if datasets_to_remove:
             self.remove_datasets(self.active_scalers, datasets_to_remove)
-        self._create_Ih_table()
+        if self._Ih_table and not datasets_to_remove:
+            self._update_Ih_table()
+        else:
+            self._create_Ih_table()
         self._update_model_data()
 
     @Subject.notify_event(event="performed_outlier_rejection")
@@ -1089,6 +1182,7 @@ def _round_of_outlier_rejection(self, target=None):
                 self.params.scaling_options.outlier_rejection,
                 self.params.scaling_options.outlier_zmax,
                 target=target,
+                nproc=self.params.scaling_options.nproc,
             )
             for outlier_indices, scaler in zip(
                 outlier_index_arrays, self.active_scalers
@@ -1101,6 +1195,7 @@ def _round_of_outlier_rejection(self, target=None):
                     self.params.scaling_options.outlier_rejection,
                     self.params.scaling_options.outlier_zmax,
                     target=target,
+                    nproc=self.params.scaling_options.nproc,
                 )
                 for outlier_indices, scaler in zip(
                     free_outlier_index_arrays, self.active_scalers
@@ -1368,6 +1463,12 @@ def __init__(self, single_scalers):
         super(MultiScaler, self).__init__(single_scalers)
         logger.info("Determining symmetry equivalent reflections across datasets.\n")
         self._active_scalers = self.single_scalers
+        self._configure_datastructures()
+        logger.info("Completed configuration of MultiScaler. \n\n" + "=" * 80 + "\n")
+        log_memory_usage()
+
+    def _configure_datastructures(self):
+        """Create the Ih tables and add the data to the model components."""
         self._global_Ih_table, self._free_Ih_table = self._create_global_Ih_table(
             self.params.anomalous
         )
@@ -1376,8 +1477,23 @@ def __init__(self, single_scalers):
         self._create_Ih_table()
         # now add data to scale components from datasets
         self._update_model_data()
-        logger.info("Completed configuration of MultiScaler. \n\n" + "=" * 80 + "\n")
-        log_memory_usage()
+
+    def remove_excluded_data(self, identifiers):
+        """
+        Update the scaler for data excluded since initialisation.
+
+        Datasets not in identifiers are dropped, the single scalers are updated
+        for newly excluded reflections and the Ih tables are recreated, keeping
+        the current scaling models. Any datasets removed during scaling are
+        expected to have already been removed by the caller.
+        """
+        self.single_scalers[:] = [
+            s for s in self.single_scalers if s.experiment.identifier in identifiers
+        ]
+        self._removed_datasets = []
+        for scaler in self.single_scalers:
+            scaler.remove_excluded_data(identifiers, for_multi=True)
+        self._configure_datastructures()
 
     def fix_initial_parameter(self):
         for scaler in self.active_scalers:
@@ -1504,6 +1620,10 @@ def _create_Ih_table(self):
             block.match_Ih_values_to_target(self._target_Ih_table)
         self.Ih_table.generate_block_selections()
 
+    def _update_Ih_table(self):
+        # The Ih values are matched to the target on creation, so always recreate
+        self._create_Ih_table()
+
     def round_of_outlier_rejection(self):
         """Perform a round of targeted outlier rejection."""
         self._round_of_outlier_rejection(target=self._target_Ih_table)
@@ -1574,6 +1694,22 @@ def update_for_minimisation(self, apm, block_id=0):
         """Fill in abstract method, do nothing."""
 
 
+def _update_Ih_table_data(Ih_table, scaler, dataset_id, error_model=None):
+    """Update the data of a dataset in an Ih_table from the scaler's reflections."""
+    sel = scaler.suitable_refl_for_scaling_sel
+    intensity = scaler.reflection_table["intensity"].select(sel)
+    variance = scaler.reflection_table["variance"].select(sel)
+    if error_model:
+        variance = error_model.update_variances(variance, intensity)
+    Ih_table.update_data_in_blocks(intensity, dataset_id, column="intensity")
+    Ih_table.update_data_in_blocks(variance, dataset_id, column="variance")
+    Ih_table.update_data_in_blocks(
+        scaler.reflection_table["inverse_scale_factor"].select(sel),
+        dataset_id,
+        column="inverse_scale_factor",
+    )
+
+
 def calc_sf_variances(components, var_cov):
     """Calculate the variances of the inverse scales."""
     # note - can we do this calculation blockwise as well - takes quite a bit of memory?
@@ -14,6 +14,8 @@
     LevenbergMarquardtIterations,
     SimpleLBFGS,
 )
+from dials.algorithms.scaling import block_workers
+from dials.algorithms.scaling.block_workers import BlockWorkers
 from dials.algorithms.scaling.scaling_utilities import log_memory_usage
 from dials.util import tabulate
 
@@ -157,10 +159,49 @@ def __init__(self, scaler, target, prediction_parameterisation, *args, **kwargs)
         self._scaler = scaler
         self._rmsd_tolerance = scaler.params.scaling_refinery.rmsd_tolerance
         self._parameters = prediction_parameterisation
+        self._workers = None
 
     def print_step_table(self):
         print_step_table(self)
 
+    def run(self):
+        """Run the minimisation, evaluating the Ih table blocks in parallel
+        worker processes if more than one process is requested."""
+        nproc = self._scaler.params.scaling_options.nproc
+        n_blocks = len(self._scaler.get_blocks_for_minimisation())
+        if nproc > 1 and n_blocks > 1 and block_workers.is_available():
+            with BlockWorkers(self._scaler, self._parameters, nproc) as workers:
+                logger.debug(
+                    "Evaluating %d blocks with %d worker processes",
+                    n_blocks,
+                    workers.nproc,
+                )
+                self._workers = workers
+                try:
+                    return super(ScalingRefinery, self).run()
+                finally:
+                    self._workers = None
+        return super(ScalingRefinery, self).run()
+
+    def evaluate_blocks(self, method):
+        """
+        Update the scales and Ih of each work block for the current parameters
+        and evaluate a target method of the parameter manager for the block.
+
+        :param method: The name of the method, e.g. "compute_residuals"
+        :returns: An iterator over the results for each block
+        """
+        if self._workers is not None:
+            for result in self._workers.evaluate(
+                method, self._parameters.get_param_vals()
+            ):
+                yield result
+            return
+        work_blocks = self._scaler.get_blocks_for_minimisation()
+        for block_id, block in enumerate(work_blocks):
+            self._scaler.update_for_minimisation(self._parameters, block_id)
+            yield getattr(self._parameters, method)(block)
+
     @property
     def rmsd_tolerance(self):
         return self._rmsd_tolerance
@@ -227,23 +268,11 @@ def compute_functional_gradients_and_curvatures(self):
         """overwrite method to avoid calls to 'blocks' methods of target"""
         self.prepare_for_step()
 
-        work_blocks = self._scaler.get_blocks_for_minimisation()
-
         f = []
         gi = []
-        for block_id, block in enumerate(work_blocks):
-            self._scaler.update_for_minimisation(self._parameters, block_id)
-            fb, gb = self._parameters.compute_functional_gradients(block)
+        for fb, gb in self.evaluate_blocks("compute_functional_gradients"):
             f.append(fb)
             gi.append(gb)
-        """task_results = easy_mp.parallel_map(
-            func=self._target.compute_functional_gradients,
-            iterable=blocks,
-            processes=self._scaler.params.scaling_options.nproc,
-            method="multiprocessing",
-            preserve_exception_message=True
-        )
-        f, gi = zip(*task_results)"""
 
         f = sum(f)
         g = gi[0]
@@ -275,32 +304,19 @@ def build_up(self, objective_only=False):
         # Reset the state to construction time, i.e. no equations accumulated
         self.reset()
 
-        work_blocks = self._scaler.get_blocks_for_minimisation()
-
         # observation terms
         if objective_only:
-            for block_id, block in enumerate(work_blocks):
-                self._scaler.update_for_minimisation(self._parameters, block_id)
-                residuals, weights = self._parameters.compute_residuals(block)
+            for residuals, weights in self.evaluate_blocks("compute_residuals"):
                 self.add_residuals(residuals, weights)
         else:
             self._jacobian = None
 
-            for block_id, block in enumerate(work_blocks):
-                self._scaler.update_for_minimisation(self._parameters, block_id)
-                (
-                    residuals,
-                    jacobian,
-                    weights,
-                ) = self._parameters.compute_residuals_and_gradients(block)
-                self.add_equations(residuals, jacobian, weights)
-            """task_results = easy_mp.pool_map(
-                fixed_func=self._target.compute_residuals_and_gradients,
-                iterable=blocks,
-                processes=self._scaler.params.scaling_options.nproc
-            )
-            for result in task_results:
-                self.add_equations(result[0], result[1], result[2])"""
+            # Accumulate J^T W J and J^T W r block by block, so that only one
+            # block jacobian is held in memory at any time.
+            for residuals, weights, normal_matrix, jtwr in self.evaluate_blocks(
+                "compute_normal_equations"
+            ):
+                self.add_normal_equations(residuals, weights, normal_matrix, jtwr)
 
         restraints = self._parameters.compute_restraints_residuals_and_gradients(
             self._parameters
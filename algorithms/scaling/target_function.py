@@ -145,6 +145,86 @@ def compute_residuals_and_gradients(cls, Ih_table):
         Ih_table.derivatives = None
         return residuals, jacobian, weights
 
+    @classmethod
+    def compute_normal_equations(cls, Ih_table):
+        """
+        Return the residuals, weights and the contributions of the block to the
+        normal equations, i.e. the packed upper triangle of J^T W J and J^T W r.
+
+        These are accumulated from the derivatives of each model component in
+        turn, so that the jacobian of the block is never formed.
+        """
+        residuals = cls.calculate_residuals(Ih_table)
+        weights = Ih_table.weights
+        n_params = Ih_table.n_active_params
+        normal_matrix = flex.double(n_params * (n_params + 1) // 2, 0.0)
+        jtwr = flex.double(n_params, 0.0)
+
+        rhs_factors, terms = cls._normal_equations_terms(Ih_table, residuals)
+        for start_row, start_col, d in Ih_table.derivative_blocks:
+            factors = rhs_factors[start_row : start_row + d.n_rows]
+            sel = flex.size_t_range(start_col, start_col + d.n_cols)
+            jtwr.set_selected(sel, jtwr.select(sel) + factors * d)
+        for diagonal, blocks in terms:
+            for i, (row_i, col_i, block_i) in enumerate(blocks):
+                for row_j, col_j, block_j in blocks[i:]:
+                    # components of a dataset share rows and those of
+                    # different datasets share none.
+                    if (row_i, block_i.n_rows) != (row_j, block_j.n_rows):
+                        continue
+                    diag = diagonal[row_i : row_i + block_i.n_rows]
+                    if block_i is block_j:
+                        product = block_i.self_transpose_times_diagonal_times_self(diag)
+                    else:
+                        product = block_i.transpose() * row_multiply(block_j, diag)
+                    _add_to_packed_u(normal_matrix, n_params, product, col_i, col_j)
+        Ih_table.derivatives = None
+        return residuals, weights, normal_matrix, jtwr
+
+    @staticmethod
+    def _normal_equations_terms(Ih_table, residuals):
+        """
+        Return the factors that give J^T W r when multiplied by the derivatives
+        of each component, and the terms that sum to J^T W J. Each term is a
+        diagonal and a list of (start row, start column, matrix) X_c for each
+        component, contributing X_a^T diag X_b for each pair of components.
+
+        With Ih_h = sum(wgI)/sum(wg^2) over the reflections of each group,
+        each row of the jacobian is -(Ih d + g dIh/dp), where d is the row of
+        derivatives of the scale factor, so that J^T W J is the sum of
+        d^T (wIh^2) d, F^T (1/sum(wg^2)) F and -E^T (Ih^2/sum(wg^2)) E, with
+        F = sum(wrd) and E = sum(wgd) over the reflections of each group.
+        """
+        weights = Ih_table.weights
+        g = Ih_table.inverse_scale_factors
+        Ih = Ih_table.Ih_values
+        sumgsq = (flex.pow2(g) * weights) * Ih_table.h_index_matrix
+        group_Ih = ((flex.pow2(g) * weights * Ih) * Ih_table.h_index_matrix) / sumgsq
+        dIh = (Ih_table.intensities - (Ih * 2.0 * g)) * weights
+        # sum(wrg) over each group, zero when Ih is the weighted mean intensity
+        sumwrg = (weights * residuals * g) * Ih_table.h_index_matrix
+        rhs_factors = -1.0 * (
+            (weights * residuals * Ih)
+            + (dIh * (Ih_table.h_index_matrix * (sumwrg / sumgsq)))
+        )
+
+        d_blocks = Ih_table.derivative_blocks
+        F_blocks = []
+        E_blocks = []
+        for start_row, start_col, d in d_blocks:
+            rows = flex.size_t_range(start_row, start_row + d.n_rows)
+            h_expand = Ih_table.h_expand_matrix.select_columns(rows)
+            wr = (weights * residuals).select(rows)
+            wg = (weights * g).select(rows)
+            F_blocks.append((0, start_col, h_expand * row_multiply(d, wr)))
+            E_blocks.append((0, start_col, h_expand * row_multiply(d, wg)))
+        terms = [
+            (weights * flex.pow2(Ih), d_blocks),
+            (1.0 / sumgsq, F_blocks),
+            (-1.0 * flex.pow2(group_Ih) / sumgsq, E_blocks),
+        ]
+        return rhs_factors, terms
+
     def compute_restraints_residuals_and_gradients(self, apm):
         """Return the restraints for the residuals and jacobian."""
         if self.param_restraints:
@@ -173,3 +253,32 @@ def calculate_jacobian(Ih_table):
         """Calculate the jacobian matrix, size Ih_table.size by len(self.apm.x)."""
         jacobian = row_multiply(Ih_table.derivatives, -1.0 * Ih_table.Ih_values)
         return jacobian
+
+    @staticmethod
+    def _normal_equations_terms(Ih_table, residuals):
+        """Return the factors that give J^T W r when multiplied by the
+        derivatives of each component, and the terms that sum to J^T W J. As
+        Ih is fixed, each row of the jacobian is -Ih d, so J^T W J is
+        d^T (wIh^2) d."""
+        weights = Ih_table.weights
+        Ih = Ih_table.Ih_values
+        rhs_factors = -1.0 * weights * residuals * Ih
+        return rhs_factors, [(weights * flex.pow2(Ih), Ih_table.derivative_blocks)]
+
+
+def _add_to_packed_u(packed_u, n, block, start_row, start_col):
+    """Add the elements on or above the diagonal of a sparse matrix, placed at
+    (start_row, start_col) in an n x n matrix, to the packed upper triangle of
+    that matrix."""
+    dense = block.as_dense_matrix()
+    n_cols = block.n_cols
+    for i in range(block.n_rows):
+        row = start_row + i
+        # the first column of this row on or above the diagonal
+        j = max(0, row - start_col)
+        if j >= n_cols:
+            continue
+        values = dense[i * n_cols + j : (i + 1) * n_cols]
+        first = row * n - row * (row - 1) // 2 + start_col + j - row
+        sel = flex.size_t_range(first, first + values.size())
+        packed_u.set_selected(sel, packed_u.select(sel) + values)
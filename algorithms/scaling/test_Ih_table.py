@@ -487,6 +487,20 @@ def test_IhTable_freework(large_reflection_table, small_reflection_table, test_s
     derivs = Mock()
     Ih_table.set_derivatives(derivs, 0)
     assert Ih_table.Ih_table_blocks[0].derivatives is derivs
+    # set derivative blocks, which are assembled when the matrix is needed
+    d1 = sparse.matrix(5, 1, [{0: 1.0, 4: 2.0}])
+    d2 = sparse.matrix(2, 2, [{1: 3.0}, {0: 4.0}])
+    Ih_table.set_derivative_blocks([(0, 0, d1), (3, 1, d2)], 3, 2)
+    block = Ih_table.Ih_table_blocks[2]
+    assert block.derivative_blocks == [(0, 0, d1), (3, 1, d2)]
+    assert block.n_active_params == 3
+    derivatives = block.derivatives
+    assert (derivatives.n_rows, derivatives.n_cols) == (5, 3)
+    assert derivatives.non_zeroes == 4
+    assert derivatives[0, 0] == 1.0
+    assert derivatives[4, 0] == 2.0
+    assert derivatives[4, 1] == 3.0
+    assert derivatives[3, 2] == 4.0
     # set variances
     new_var_block_1 = flex.double([1.0, 2.0, 3.0])
     Ih_table.set_variances(new_var_block_1, 1)
@@ -580,6 +594,74 @@ def update_vars_side_effect(*args):
     )
 
 
+def test_IhTable_set_excluded_reflections(
+    large_reflection_table, small_reflection_table, test_sg
+):
+    """Test that excluding reflections from an Ih_table gives the same result
+    as creating an Ih_table without them, and that further reflections can be
+    excluded in place."""
+    Ih_table = IhTable(
+        reflection_tables=[large_reflection_table, small_reflection_table],
+        space_group=test_sg,
+    )
+    sel1 = flex.bool(7, True)
+    sel1[6] = False
+    sel2 = flex.bool(4, True)
+    sel2[1] = False
+    Ih_table.set_excluded_reflections([(~sel1).iselection(), (~sel2).iselection()])
+
+    expected = IhTable(
+        reflection_tables=[
+            large_reflection_table.select(sel1),
+            small_reflection_table.select(sel2),
+        ],
+        indices_lists=[sel1.iselection(), sel2.iselection()],
+        space_group=test_sg,
+    )
+    block = Ih_table.blocked_data_list[0]
+    expected_block = expected.blocked_data_list[0]
+    assert Ih_table.size == 9
+    assert block.n_groups == expected_block.n_groups
+    for sel, expected_sel in zip(
+        Ih_table.blocked_selection_list[0], expected.blocked_selection_list[0]
+    ):
+        assert list(sel) == list(expected_sel)
+    assert list(block.Ih_values) == pytest.approx(list(expected_block.Ih_values))
+    assert block.dataset_info == expected_block.dataset_info
+
+    # Data updates are applied to the remaining reflections
+    Ih_table.update_data_in_blocks(flex.double(7, 1.0), 0, "inverse_scale_factor")
+    assert (
+        list(Ih_table.blocked_data_list[0].inverse_scale_factors)
+        == [1.0] * 6 + [2.0] * 3
+    )
+
+    # Excluded reflections cannot be readmitted in place
+    assert Ih_table.readmits([flex.size_t(), flex.size_t()])
+    assert Ih_table.readmits([flex.size_t([6]), flex.size_t([0])])
+
+    # But further reflections can be excluded
+    further = [flex.size_t([0, 6]), flex.size_t([1])]
+    assert not Ih_table.readmits(further)
+    Ih_table.set_excluded_reflections(further)
+    sel1[0] = False
+    expected = IhTable(
+        reflection_tables=[
+            large_reflection_table.select(sel1),
+            small_reflection_table.select(sel2),
+        ],
+        indices_lists=[sel1.iselection(), sel2.iselection()],
+        space_group=test_sg,
+    )
+    block = Ih_table.blocked_data_list[0]
+    expected_block = expected.blocked_data_list[0]
+    assert Ih_table.size == 8
+    assert [list(sel) for sel in block.block_selections] == [
+        list(sel) for sel in expected_block.block_selections
+    ]
+    assert list(block.inverse_scale_factors) == [1.0] * 5 + [2.0] * 3
+
+
 def test_set_Ih_values_to_target(test_sg):
     """Test the setting of Ih values for targeted scaling."""
     """Generate input for testing joint_Ih_table."""
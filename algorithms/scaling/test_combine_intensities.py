@@ -3,15 +3,21 @@
 """
 from __future__ import absolute_import, division, print_function
 
+import numpy as np
 import pytest
 from mock import Mock
 
+from cctbx import crystal, miller
 from dxtbx.model import Crystal, Experiment
 
 from dials.algorithms.scaling.combine_intensities import (
     MultiDatasetIntensityCombiner,
     SingleDatasetIntensityCombiner,
+    _calculate_intensities_for_Imids,
+    _fast_merging_stats_for_Imids,
+    _get_Is_from_Imidval,
     combine_intensities,
+    fast_merging_stats,
 )
 from dials.algorithms.scaling.scaling_utilities import calculate_prescaling_correction
 from dials.array_family import flex
@@ -273,3 +279,34 @@ def test_combine_intensities_multi_dataset(test_exp_P1):
     Imid = combiner.max_key
 
     assert pytest.approx(Imid) == 1200.0
+
+
+def test_fast_merging_stats_for_Imids():
+    """Test that Rmeas for all Imids at once matches fast_merging_stats"""
+    reflections = generate_simple_table()
+    Imids = [0, 1, 50.0, 1200.0]
+    intensities, variances = _calculate_intensities_for_Imids(
+        reflections["intensity.prf.value"].as_numpy_array(),
+        reflections["intensity.sum.value"].as_numpy_array(),
+        reflections["intensity.prf.variance"].as_numpy_array(),
+        reflections["intensity.sum.variance"].as_numpy_array(),
+        Imids,
+    )
+    group_index = np.repeat(np.arange(5), 5)
+    rmeas, cchalf = _fast_merging_stats_for_Imids(
+        intensities, np.sqrt(variances), group_index
+    )
+
+    miller_set = miller.set(
+        crystal_symmetry=crystal.symmetry(space_group_symbol="P 1"),
+        indices=reflections["miller_index"],
+        anomalous_flag=False,
+    )
+    for i, Imid in enumerate(Imids):
+        Int, Var = _get_Is_from_Imidval(reflections, Imid)
+        assert list(intensities[i]) == pytest.approx(list(Int))
+        assert list(variances[i]) == pytest.approx(list(Var))
+        i_obs = miller.array(miller_set, data=Int, sigmas=flex.sqrt(Var))
+        expected_rmeas, _ = fast_merging_stats(i_obs)
+        assert rmeas[i] == pytest.approx(expected_rmeas)
+        assert -1.0 <= cchalf[i] <= 1.0
@@ -382,3 +382,27 @@ def test_determine_outlier_index_arrays(generated_Ih_table, outlier_target_table
     assert not outliers[0]
     with pytest.raises(ValueError):
         _ = determine_outlier_index_arrays(generated_Ih_table, "badchoice")[0]
+
+
+@pytest.mark.parametrize("method", ["standard", "simple", "target"])
+def test_outlier_rejection_over_blocks(method, test_sg, outlier_target_table):
+    """Test that splitting the Ih_table into blocks, and processing these in
+    parallel, gives the same result as the serial algorithm."""
+    tables = [generate_outlier_table(), generate_outlier_table()]
+    tables[1]["intensity"] = tables[1]["intensity"] * 1.5
+    serial = determine_outlier_index_arrays(
+        IhTable(tables, test_sg, nblocks=1), method, target=outlier_target_table
+    )
+    parallel = determine_outlier_index_arrays(
+        IhTable(tables, test_sg, nblocks=1),
+        method,
+        target=outlier_target_table,
+        nproc=3,
+    )
+    blocked = determine_outlier_index_arrays(
+        IhTable(tables, test_sg, nblocks=2), method, target=outlier_target_table
+    )
+    for result in (parallel, blocked):
+        assert [list(indices) for indices in result] == [
+            list(indices) for indices in serial
+        ]
@@ -623,6 +623,98 @@ def test_scale_and_filter_dataset_mode(dials_data, tmpdir):
     ]
 
 
+def test_scale_and_filter_image_group_mode_warm_start(dials_data, tmpdir):
+    """Test the scale and filter command line program, keeping the scaler
+    between cycles."""
+    location = dials_data("multi_crystal_proteinase_k")
+
+    command = [
+        "dials.scale",
+        "filtering.method=deltacchalf",
+        "filtering.deltacchalf.warm_start=True",
+        "stdcutoff=3.0",
+        "mode=image_group",
+        "max_cycles=3",
+        "d_min=1.4",
+        "group_size=5",
+        "unmerged_mtz=unmerged.mtz",
+        "scale_and_filter_results=analysis_results.json",
+        "error_model=None",
+    ]
+    for i in [1, 2, 3, 4, 5, 7, 10]:
+        command.append(location.join("experiments_" + str(i) + ".json").strpath)
+        command.append(location.join("reflections_" + str(i) + ".pickle").strpath)
+
+    result = procrunner.run(command, working_directory=tmpdir)
+    assert not result.returncode and not result.stderr
+    assert tmpdir.join("scaled.refl").check()
+    assert tmpdir.join("scaled.expt").check()
+    assert tmpdir.join("analysis_results.json").check()
+    result = get_merging_stats(tmpdir.join("unmerged.mtz").strpath)
+    assert result.overall.r_pim < 0.175
+    assert result.overall.cc_one_half > 0.95
+    assert result.overall.n_obs > 50000
+
+    with open(tmpdir.join("analysis_results.json").strpath) as f:
+        analysis_results = json.load(f)
+    # The first cycle is the same as without a warm start, the later cycles
+    # resume the scaling after removing the filtered image groups.
+    assert analysis_results["cycle_results"]["1"]["image_ranges_removed"] == [
+        [[16, 24], 4]
+    ]
+    assert len(analysis_results["cycle_results"]) > 1
+    assert analysis_results["cycle_results"]["2"]["merging_stats"]
+    assert analysis_results["termination_reason"] in (
+        "max_cycles",
+        "max_percent_removed",
+        "no_more_removed",
+    )
+
+
+def test_scale_and_filter_dataset_mode_warm_start(dials_data, tmpdir):
+    """Test the scale and filter command line program, keeping the scaler
+    between cycles when a whole dataset is removed."""
+    location = dials_data("multi_crystal_proteinase_k")
+    command = [
+        "dials.scale",
+        "filtering.method=deltacchalf",
+        "filtering.deltacchalf.warm_start=True",
+        "stdcutoff=1.0",
+        "mode=dataset",
+        "max_cycles=2",
+        "d_min=1.4",
+        "output.reflections=filtered.refl",
+        "scale_and_filter_results=analysis_results.json",
+        "unmerged_mtz=unmerged.mtz",
+        "error_model=None",
+    ]
+    for i in [1, 2, 3, 4, 5, 7, 10]:
+        command.append(location.join("experiments_" + str(i) + ".json").strpath)
+        command.append(location.join("reflections_" + str(i) + ".pickle").strpath)
+
+    result = procrunner.run(command, working_directory=tmpdir)
+    assert not result.returncode and not result.stderr
+    assert tmpdir.join("filtered.refl").check()
+    assert tmpdir.join("scaled.expt").check()
+    assert tmpdir.join("analysis_results.json").check()
+    with open(tmpdir.join("analysis_results.json").strpath) as f:
+        analysis_results = json.load(f)
+
+    removed = analysis_results["initial_expids_and_image_ranges"][4][0]
+    assert analysis_results["cycle_results"]["1"]["removed_datasets"] == [removed]
+    # The second cycle resumes the scaling without the removed dataset.
+    assert len(analysis_results["cycle_results"]) == 2
+    assert removed not in analysis_results["cycle_results"]["2"]["removed_datasets"]
+
+    expts = load.experiment_list(tmpdir.join("scaled.expt").strpath, check_format=False)
+    assert removed not in expts.identifiers()
+    table = flex.reflection_table.from_file(tmpdir.join("filtered.refl").strpath)
+    assert removed not in table.experiment_identifiers().values()
+    assert table.get_flags(table.flags.scaled).count(True) > 0
+    stats = get_merging_stats(tmpdir.join("unmerged.mtz").strpath)
+    assert stats.overall.cc_one_half > 0.95
+
+
 def test_scale_array(dials_data, tmpdir):
     """Test a standard dataset - ideally needs a large dataset or full matrix
     round may fail. Currently turning off absorption term to avoid
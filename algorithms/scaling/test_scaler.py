@@ -7,7 +7,9 @@
 from dxtbx.model.experiment_list import ExperimentList
 from libtbx import phil
 from scitbx import sparse
+from scitbx.lstbx import normal_eqns
 
+from dials.algorithms.scaling import block_workers
 from dials.algorithms.scaling.basis_functions import RefinerCalculator
 from dials.algorithms.scaling.parameter_handler import ScalingParameterManagerGenerator
 from dials.algorithms.scaling.scaler import (
@@ -19,6 +21,7 @@
 )
 from dials.algorithms.scaling.scaler_factory import create_scaler
 from dials.algorithms.scaling.scaling_library import create_scaling_model
+from dials.algorithms.scaling.scaling_refiner import scaling_refinery
 from dials.algorithms.scaling.scaling_utilities import calculate_prescaling_correction
 from dials.algorithms.scaling.target_function import ScalingTarget
 from dials.array_family import flex
@@ -384,6 +387,35 @@ def test_multiscaler_initialisation():
         assert list(decay.d_values[0]) == list(d_suitable.select(block_selections[i]))
 
 
+def test_multiscaler_remove_excluded_data():
+    """Test the update of a multiscaler for data excluded after initialisation."""
+    p, e = (generated_param(), generated_exp(2))
+    r1 = generated_refl(id_=0)
+    r2 = generated_refl(id_=1)
+    exp = create_scaling_model(p, e, [r1, r2])
+    singlescaler1 = create_scaler(p, [exp[0]], [r1])
+    singlescaler2 = create_scaler(p, [exp[1]], [r2])
+    multiscaler = MultiScaler([singlescaler1, singlescaler2])
+    assert multiscaler.global_Ih_table.size == 14
+
+    # exclude one more reflection from the second dataset
+    excluded = flex.bool(8, False)
+    excluded[0] = True
+    r2.set_flags(excluded, r2.flags.user_excluded_in_scaling)
+    multiscaler.remove_excluded_data(["0", "1"])
+    assert singlescaler1.n_suitable_refl == 7
+    assert singlescaler2.n_suitable_refl == 6
+    assert len(singlescaler2.outliers) == 6
+    assert multiscaler.global_Ih_table.size == 13
+    decay = singlescaler2.experiment.scaling_model.components["decay"]
+    assert list(decay.data["d"]) == [2.1, 2.0, 1.4, 1.6, 2.5, 2.5]
+
+    # now remove the first dataset
+    multiscaler.remove_excluded_data(["1"])
+    assert multiscaler.active_scalers == [singlescaler2]
+    assert multiscaler.global_Ih_table.size == 6
+
+
 def test_targetscaler_initialisation():
     """Unit tests for the MultiScalerBase class."""
     p, e = (generated_param(), generated_exp(2))
@@ -771,3 +803,173 @@ def test_multiscaler_update_for_minimisation():
     assert block_list[1].inverse_scale_factors == expected_scales_for_block_2
     assert block_list[1].derivatives == expected_derivatives_for_block_2
     assert block_list[0].derivatives == expected_derivatives_for_block_1
+
+
+@pytest.mark.skipif(
+    not block_workers.is_available(), reason="Requires forked worker processes"
+)
+def test_block_workers_match_serial_evaluation():
+    """Test that blocks evaluated by worker processes match serial evaluation."""
+
+    p, e = (generated_param(), generated_exp(2))
+    p.reflection_selection.method = "use_all"
+    r1 = generated_refl(id_=0)
+    r1["intensity.sum.value"] = r1["intensity"]
+    r1["intensity.sum.variance"] = r1["variance"]
+    r2 = generated_refl(id_=1)
+    r2["intensity.sum.value"] = r2["intensity"]
+    r2["intensity.sum.variance"] = r2["variance"]
+    p.scaling_options.nproc = 2
+    p.model = "physical"
+    exp = create_scaling_model(p, e, [r1, r2])
+    singlescaler1 = create_scaler(p, [exp[0]], [r1])
+    singlescaler2 = create_scaler(p, [exp[1]], [r2])
+
+    multiscaler = MultiScaler([singlescaler1, singlescaler2])
+    pmg = ScalingParameterManagerGenerator(
+        multiscaler.active_scalers,
+        ScalingTarget(),
+        multiscaler.params.scaling_refinery.refinement_order,
+    )
+    apm = pmg.parameter_managers()[0]
+    x = apm.get_param_vals().deep_copy()
+    x[0] *= 1.5
+
+    with block_workers.BlockWorkers(multiscaler, apm, nproc=2) as workers:
+        parallel = list(workers.evaluate("compute_functional_gradients", x))
+    parallel_scales = [
+        block.inverse_scale_factors.deep_copy()
+        for block in multiscaler.get_blocks_for_minimisation()
+    ]
+
+    apm.set_param_vals(x)
+    for block_id, block in enumerate(multiscaler.get_blocks_for_minimisation()):
+        multiscaler.update_for_minimisation(apm, block_id)
+        f, g = apm.compute_functional_gradients(block)
+        assert parallel[block_id][0] == pytest.approx(f)
+        assert list(parallel[block_id][1]) == pytest.approx(list(g))
+        assert list(parallel_scales[block_id]) == pytest.approx(
+            list(block.inverse_scale_factors)
+        )
+
+
+def generated_multiscaler(model="KB", nproc=1):
+    """Create a multiscaler for two datasets and the parameter manager for its
+    first round of minimisation. The Ih table is split into nproc blocks."""
+    p, e = (generated_param(), generated_exp(2))
+    p.reflection_selection.method = "use_all"
+    p.model = model
+    p.scaling_options.nproc = nproc
+    reflections = []
+    for id_ in range(2):
+        r = generated_refl(id_=id_)
+        r["intensity.sum.value"] = r["intensity"]
+        r["intensity.sum.variance"] = r["variance"]
+        reflections.append(r)
+    exp = create_scaling_model(p, e, reflections)
+    multiscaler = MultiScaler(
+        [create_scaler(p, [exp[i]], [r]) for i, r in enumerate(reflections)]
+    )
+    pmg = ScalingParameterManagerGenerator(
+        multiscaler.active_scalers,
+        ScalingTarget(),
+        multiscaler.params.scaling_refinery.refinement_order,
+    )
+    return multiscaler, pmg.parameter_managers()[0]
+
+
+def test_gauss_newton_normal_equations():
+    """Test that the normal equations accumulated from the model components of
+    each block for a Gauss-Newton step match those from the jacobians of the
+    blocks, and that a step can be taken."""
+    multiscaler, apm = generated_multiscaler(model="physical")
+    x0 = apm.get_param_vals().deep_copy()
+    refinery = scaling_refinery(
+        engine="GaussNewton",
+        scaler=multiscaler,
+        target=apm.target,
+        prediction_parameterisation=apm,
+        max_iterations=1,
+    )
+    # the derivatives of each component are set without assembling the matrix
+    multiscaler.update_for_minimisation(apm, 0)
+    block = multiscaler.get_blocks_for_minimisation()[0]
+    assert block._derivatives is None
+    assert len(block.derivative_blocks) > 1
+
+    refinery.build_up()
+    step_equations = refinery.step_equations()
+    normal_matrix = step_equations.normal_matrix_packed_u().deep_copy()
+    right_hand_side = step_equations.right_hand_side().deep_copy()
+
+    expected = normal_eqns.non_linear_ls(n_parameters=len(x0))
+    for block_id, block in enumerate(multiscaler.get_blocks_for_minimisation()):
+        multiscaler.update_for_minimisation(apm, block_id)
+        residuals, jacobian, weights = apm.compute_residuals_and_gradients(block)
+        expected.add_equations(residuals, jacobian, weights)
+    restraints = apm.compute_restraints_residuals_and_gradients(apm)
+    if restraints:
+        expected.add_equations(restraints[0], restraints[1], restraints[2])
+    expected_step_equations = expected.step_equations()
+    assert list(normal_matrix) == pytest.approx(
+        list(expected_step_equations.normal_matrix_packed_u())
+    )
+    assert list(right_hand_side) == pytest.approx(
+        list(expected_step_equations.right_hand_side())
+    )
+
+    # run one step from the starting parameters
+    apm.set_param_vals(x0)
+    refinery = scaling_refinery(
+        engine="GaussNewton",
+        scaler=multiscaler,
+        target=apm.target,
+        prediction_parameterisation=apm,
+        max_iterations=1,
+    )
+    refinery.run()
+    assert refinery.history.get_nrows() >= 1
+    assert list(apm.get_param_vals()) != pytest.approx(list(x0))
+
+
+@pytest.mark.skipif(
+    not block_workers.is_available(), reason="Requires forked worker processes"
+)
+@pytest.mark.parametrize(
+    "method", ["compute_residuals_and_gradients", "compute_normal_equations"]
+)
+def test_block_workers_evaluate_blocks_jacobian(method):
+    """Test that jacobians and normal equations evaluated through the worker
+    pool by the refinery match serial evaluation."""
+    multiscaler, apm = generated_multiscaler(model="physical", nproc=2)
+    x = apm.get_param_vals().deep_copy()
+    x[0] *= 1.5
+    apm.set_param_vals(x)
+    refinery = scaling_refinery(
+        engine="GaussNewton",
+        scaler=multiscaler,
+        target=apm.target,
+        prediction_parameterisation=apm,
+        max_iterations=1,
+    )
+
+    with block_workers.BlockWorkers(multiscaler, apm, nproc=2) as workers:
+        refinery._workers = workers
+        try:
+            parallel = list(refinery.evaluate_blocks(method))
+        finally:
+            refinery._workers = None
+    serial = list(refinery.evaluate_blocks(method))
+
+    assert len(parallel) == len(serial) == 2
+    for parallel_result, serial_result in zip(parallel, serial):
+        for p_value, s_value in zip(parallel_result, serial_result):
+            if isinstance(s_value, sparse.matrix):
+                assert isinstance(p_value, sparse.matrix)
+                assert (p_value.n_rows, p_value.n_cols) == (
+                    s_value.n_rows,
+                    s_value.n_cols,
+                )
+                p_value = p_value.as_dense_matrix()
+                s_value = s_value.as_dense_matrix()
+            assert list(p_value) == pytest.approx(list(s_value))
@@ -129,6 +129,8 @@ def mock_single_Ih_table():
     Ih_table.weights = flex.double([1.0, 1.0, 1.0])
     Ih_table.size = 3
     Ih_table.derivatives = sparse.matrix(3, 1, [{0: 1.0, 1: 2.0, 2: 3.0}])
+    Ih_table.derivative_blocks = [(0, 0, Ih_table.derivatives)]
+    Ih_table.n_active_params = 1
     Ih_table.h_index_matrix = sparse.matrix(3, 2, [{0: 1, 1: 1}, {2: 1}])
     Ih_table.h_expand_matrix = Ih_table.h_index_matrix.transpose()
     return Ih_table
@@ -223,6 +225,15 @@ def test_target_function_methods():
     assert w == w2
     assert j.n_cols == 1 and j.n_rows == 3
 
+    r3, w3, normal_matrix, jtwr = target.compute_normal_equations(
+        mock_single_Ih_table()
+    )
+    assert r3 == r
+    assert w3 == w
+    jcol = j.col(0).as_dense_vector()
+    assert list(normal_matrix) == pytest.approx([flex.sum(jcol * jcol * w)])
+    assert list(jtwr) == pytest.approx([flex.sum(jcol * r * w)])
+
 
 def test_target_function_restraints_methods(mock_apm_restrained, mock_apm_unrestrained):
     """Test for the target restraints methods required for the refinement engine."""
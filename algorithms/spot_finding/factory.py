@@ -58,6 +58,15 @@ def generate_phil_scope():
       .type = bool
       .help = "Compute the mean background for each image"
 
+    streaming_window = None
+      .type = int(value_min=1)
+      .help = "If set, label the strong pixels in 3D in windows of this many"
+              "images. Spots which can no longer grow are closed off at the"
+              "end of each window so that memory usage depends on the window"
+              "size rather than the number of images. The spots found are the"
+              "same as when all images are labelled together."
+      .expert_level = 1
+
     filter
       .help = "Parameters used in the spot finding filter strategy."
 
@@ -474,6 +483,7 @@ def from_parameters(params=None, experiments=None):
             max_spot_size=params.spotfinder.filter.max_spot_size,
             no_shoeboxes_2d=no_shoeboxes_2d,
             min_chunksize=params.spotfinder.mp.min_chunksize,
+            streaming_window=params.spotfinder.streaming_window,
         )
 
     @staticmethod
@@ -6,7 +6,8 @@
 
 import libtbx
 
-from dials.array_family import flex
+from dials.array_family import flex, shared_table
+from dials.array_family.shared_table import SharedReflectionTable
 from dials.util import Sorry
 
 logger = logging.getLogger(__name__)
@@ -66,6 +67,7 @@ def __init__(
             detector = self.imageset.get_detector()
             assert len(self.mask) == len(detector)
         self.first = True
+        self.pid = os.getpid()
 
     def __call__(self, index):
         """
@@ -79,9 +81,13 @@ def __call__(self, index):
 
         # Parallel reading of HDF5 from the same handle is not allowed. Python
         # multiprocessing is a bit messed up and used fork on linux so need to
-        # close and reopen file.
+        # close and reopen file. If we are still in the process that created
+        # the handle then it is safe to keep using it.
         if self.first:
-            if self.imageset.reader().is_single_file_reader():
+            if (
+                os.getpid() != self.pid
+                and self.imageset.reader().is_single_file_reader()
+            ):
                 self.imageset.reader().nullify_format_instance()
             self.first = False
 
@@ -255,11 +261,16 @@ class ExtractSpotsParallelTask(object):
     We need this external class so that we can pickle it for cluster jobs
     """
 
-    def __init__(self, function):
+    def __init__(self, function, shared_memory=False):
         """
         Initialise with the function to call
+
+        :param function: The function to call
+        :param shared_memory: The function returns a list of reflection tables,
+                              which should be passed back in shared memory
         """
         self.function = function
+        self.shared_memory = shared_memory
 
     def __call__(self, task):
         """
@@ -269,6 +280,10 @@ def __call__(self, task):
 
         log.config_simple_cached()
         result = self.function(task)
+        if self.shared_memory:
+            result = [SharedReflectionTable.from_table(table) for table in result]
+            for shared in result:
+                shared.close()
         handlers = logging.getLogger("dials").handlers
         assert len(handlers) == 1, "Invalid number of logging handlers"
         return result, handlers[0].messages()
@@ -319,6 +334,12 @@ def __call__(self, imageset, pixel_labeller):
                 shoeboxes.extend(creator.result())
                 spotsizes.extend(creator.spot_size())
                 hp.extend(creator.hot_pixels())
+        return self.select_by_size(shoeboxes, spotsizes), hotpixels
+
+    def select_by_size(self, shoeboxes, spotsizes):
+        """
+        Remove the spots which were too small or too large to be allocated
+        """
         logger.info("")
         logger.info("Extracted {} spots".format(len(shoeboxes)))
 
@@ -336,7 +357,155 @@ def __call__(self, imageset, pixel_labeller):
         )
 
         # Return the shoeboxes
-        return shoeboxes, hotpixels
+        return shoeboxes
+
+
+class StreamingPixelListLabeller(object):
+    """
+    A class to label the strong pixels on a single panel in 3D as they arrive.
+
+    Pixel lists are buffered until a window of frames is full. The window is
+    then labelled and any connected component which does not touch the last
+    frame of the window can no longer grow, so it is converted into a shoebox
+    straight away. Only the pixels belonging to the components that are still
+    open are carried into the next window, so memory usage depends on the
+    window size rather than on the number of images in the sweep.
+    """
+
+    def __init__(
+        self, panel, window, min_spot_size, max_spot_size, write_hot_pixel_mask
+    ):
+        """
+        Initialise the labeller
+
+        :param panel: The panel number
+        :param window: The number of frames to buffer before labelling
+        :param min_spot_size: The minimum spot size
+        :param max_spot_size: The maximum spot size
+        :param write_hot_pixel_mask: Find the hot pixels
+        """
+        assert window > 0, "Invalid window size"
+        self.panel = panel
+        self.window = window
+        self.min_spot_size = min_spot_size
+        self.max_spot_size = max_spot_size
+        self.write_hot_pixel_mask = write_hot_pixel_mask
+        self.spot_size = flex.size_t()
+        self.hot_pixels = flex.size_t()
+        self._first_frame = None
+        self._size = None
+        self._pending = []
+        self._carried = {}
+
+    def add(self, pixel_list):
+        """
+        Add a pixel list
+
+        :param pixel_list: The pixel list for the next frame
+        :return: The shoeboxes for any spots which have been closed off
+        """
+        if self._first_frame is None:
+            self._first_frame = pixel_list.frame()
+            self._size = pixel_list.size()
+        self._pending.append(pixel_list)
+        if len(self._pending) >= self.window:
+            return self._label(final=False)
+        return flex.shoebox()
+
+    def finish(self):
+        """
+        Label the remaining pixels
+
+        :return: The shoeboxes for all remaining spots
+        """
+        if self._first_frame is None:
+            return flex.shoebox()
+        return self._label(final=True)
+
+    def num_carried_pixels(self):
+        """
+        :return: The number of pixels in spots which are still open
+        """
+        return sum(len(p) for p in self._carried.values())
+
+    def _label(self, final):
+        """
+        Label the current window and split off the closed spots
+        """
+        from dials.model.data import PixelList, PixelListLabeller
+
+        assert len(self._pending) > 0
+        next_frame = self._pending[0].frame()
+
+        # The hot pixel search needs the full frame range so start from the
+        # first frame on the last call, otherwise from the oldest open spot
+        if final and self.write_hot_pixel_mask:
+            start = self._first_frame
+        elif self._carried:
+            start = min(self._carried)
+        else:
+            start = next_frame
+
+        # Add the open spots and the buffered pixel lists to the labeller
+        labeller = PixelListLabeller()
+        for frame in range(start, next_frame):
+            plist = self._carried.get(frame)
+            if plist is None:
+                plist = PixelList(frame, self._size, flex.double(), flex.size_t())
+            labeller.add(plist)
+        for plist in self._pending:
+            labeller.add(plist)
+        self._pending = []
+        self._carried = {}
+        if labeller.num_pixels() == 0:
+            return flex.shoebox()
+
+        # Create the shoeboxes
+        creator = flex.PixelListShoeboxCreator(
+            labeller,
+            self.panel,
+            0,  # zrange
+            False,  # twod
+            self.min_spot_size,
+            self.max_spot_size,
+            final and self.write_hot_pixel_mask,
+        )
+        shoeboxes = creator.result()
+        spot_size = creator.spot_size()
+        if final:
+            self.hot_pixels.extend(creator.hot_pixels())
+        else:
+            # Any spot touching the last frame may still grow
+            z1 = shoeboxes.bounding_boxes().parts()[5]
+            is_open = z1 == labeller.last_frame()
+            if is_open.count(True) > 0:
+                self._carry(labeller, is_open)
+            shoeboxes = shoeboxes.select(~is_open)
+            spot_size = spot_size.select(~is_open)
+        self.spot_size.extend(spot_size)
+        return shoeboxes
+
+    def _carry(self, labeller, is_open):
+        """
+        Keep the pixels belonging to the open spots for the next window
+        """
+        from dials.model.data import PixelList
+
+        labels = flex.size_t(list(labeller.labels_3d()))
+        selection = is_open.select(labels)
+        coords = labeller.coords().select(selection)
+        values = labeller.values().select(selection)
+        z, y, x = coords.parts()
+        index = flex.size_t(list(y * self._size[1] + x))
+
+        # The coordinates are sorted by frame so split into contiguous runs
+        i0 = 0
+        for i1 in range(1, len(z) + 1):
+            if i1 == len(z) or z[i1] != z[i0]:
+                self._carried[z[i0]] = PixelList(
+                    z[i0], self._size, values[i0:i1], index[i0:i1]
+                )
+                i0 = i1
 
 
 class ShoeboxesToReflectionTable(object):
@@ -427,6 +596,7 @@ def __init__(
         no_shoeboxes_2d=False,
         min_chunksize=50,
         write_hot_pixel_mask=False,
+        streaming_window=None,
     ):
         """
         Initialise the class with the strategy
@@ -436,6 +606,7 @@ def __init__(
         :param mp_method: The multi processing method
         :param nproc: The number of processors
         :param max_strong_pixel_fraction: The maximum number of strong pixels
+        :param streaming_window: Label pixels in windows of this many frames
         """
         # Set the required strategies
         self.threshold_function = threshold_function
@@ -453,6 +624,7 @@ def __init__(
         self.no_shoeboxes_2d = no_shoeboxes_2d
         self.min_chunksize = min_chunksize
         self.write_hot_pixel_mask = write_hot_pixel_mask
+        self.streaming_window = streaming_window
 
     def __call__(self, imageset):
         """
@@ -534,9 +706,34 @@ def _find_spots(self, imageset):
         # The indices to iterate over
         indices = list(range(len(imageset)))
 
-        # Initialise the pixel labeller
+        # Initialise the pixel labeller. When streaming, spots are closed off
+        # as soon as they can no longer grow rather than after the last image
         num_panels = len(imageset.get_detector())
-        pixel_labeller = [PixelListLabeller() for p in range(num_panels)]
+        if self.streaming_window and not self._is_twod(imageset):
+            logger.info(
+                "Labelling strong pixels in windows of %d images"
+                % self.streaming_window
+            )
+            pixel_labeller = [
+                StreamingPixelListLabeller(
+                    p,
+                    self.streaming_window,
+                    self.min_spot_size,
+                    self.max_spot_size,
+                    self.write_hot_pixel_mask,
+                )
+                for p in range(num_panels)
+            ]
+        else:
+            pixel_labeller = [PixelListLabeller() for p in range(num_panels)]
+        shoeboxes = flex.shoebox()
+
+        def add_pixel_lists(pixel_list):
+            assert len(pixel_labeller) == len(pixel_list), "Inconsistent size"
+            for plabeller, plist in zip(pixel_labeller, pixel_list):
+                closed = plabeller.add(plist)
+                if closed is not None:
+                    shoeboxes.extend(closed)
 
         # Do the processing
         logger.info("Extracting strong pixels from images")
@@ -552,11 +749,7 @@ def _find_spots(self, imageset):
             def process_output(result):
                 for message in result[1]:
                     logger.log(message.levelno, message.msg)
-                assert len(pixel_labeller) == len(
-                    result[0].pixel_list
-                ), "Inconsistent size"
-                for plabeller, plist in zip(pixel_labeller, result[0].pixel_list):
-                    plabeller.add(plist)
+                add_pixel_lists(result[0].pixel_list)
                 result[0].pixel_list = None
 
             batch_multi_node_parallel_map(
@@ -571,12 +764,8 @@ def process_output(result):
         else:
             for task in indices:
                 result = function(task)
-                assert len(pixel_labeller) == len(
-                    result.pixel_list
-                ), "Inconsistent size"
-                for plabeller, plist in zip(pixel_labeller, result.pixel_list):
-                    plabeller.add(plist)
-                    result.pixel_list = None
+                add_pixel_lists(result.pixel_list)
+                result.pixel_list = None
 
         # Create shoeboxes from pixel list
         converter = PixelListToReflectionTable(
@@ -585,7 +774,32 @@ def process_output(result):
             self.filter_spots,
             self.write_hot_pixel_mask,
         )
-        return converter(imageset, pixel_labeller)
+        if not isinstance(pixel_labeller[0], StreamingPixelListLabeller):
+            return converter(imageset, pixel_labeller)
+
+        # Close off the remaining spots
+        spotsizes = flex.size_t()
+        for plabeller in pixel_labeller:
+            shoeboxes.extend(plabeller.finish())
+            spotsizes.extend(plabeller.spot_size)
+        hot_pixels = tuple(plabeller.hot_pixels for plabeller in pixel_labeller)
+        shoeboxes = converter.pixel_list_to_shoeboxes.select_by_size(
+            shoeboxes, spotsizes
+        )
+        return (
+            converter.shoeboxes_to_reflection_table(imageset, shoeboxes),
+            hot_pixels,
+        )
+
+    def _is_twod(self, imageset):
+        """
+        Check if the spots should be labelled in 2D
+        """
+        from dxtbx.imageset import ImageSequence
+
+        if isinstance(imageset, ImageSequence):
+            return imageset.get_scan().is_still()
+        return True
 
     def _find_spots_2d_no_shoeboxes(self, imageset):
         """
@@ -653,15 +867,25 @@ def _find_spots_2d_no_shoeboxes(self, imageset):
         else:
             logger.info(" Using multiprocessing with %d parallel job(s)\n" % (mp_nproc))
         if mp_nproc > 1 or mp_njobs > 1:
+            use_shared_memory = (
+                mp_method == "multiprocessing" and shared_table.is_available()
+            )
 
             def process_output(result):
                 for message in result[1]:
                     logger.log(message.levelno, message.msg)
-                reflections.extend(result[0][0])
+                if use_shared_memory:
+                    shared = result[0][0]
+                    try:
+                        reflections.extend(shared.as_table())
+                    finally:
+                        shared.unlink()
+                else:
+                    reflections.extend(result[0][0])
                 result[0][0] = None
 
             batch_multi_node_parallel_map(
-                func=ExtractSpotsParallelTask(function),
+                func=ExtractSpotsParallelTask(function, use_shared_memory),
                 iterable=indices,
                 nproc=mp_nproc,
                 njobs=mp_njobs,
@@ -702,6 +926,7 @@ def __init__(
         max_spot_size=20,
         no_shoeboxes_2d=False,
         min_chunksize=50,
+        streaming_window=None,
     ):
         """
         Initialise the class.
@@ -709,6 +934,7 @@ def __init__(
         :param find_spots: The spot finding algorithm
         :param filter_spots: The spot filtering algorithm
         :param scan_range: The scan range to find spots over
+        :param streaming_window: Label pixels in windows of this many frames
         """
 
         # Set the filter and some other stuff
@@ -730,6 +956,7 @@ def __init__(
         self.mp_njobs = mp_njobs
         self.no_shoeboxes_2d = no_shoeboxes_2d
         self.min_chunksize = min_chunksize
+        self.streaming_window = streaming_window
 
     def __call__(self, experiments):
         """
@@ -840,6 +1067,7 @@ def _find_spots_in_imageset(self, imageset):
             no_shoeboxes_2d=self.no_shoeboxes_2d,
             min_chunksize=self.min_chunksize,
             write_hot_pixel_mask=self.write_hot_mask,
+            streaming_window=self.streaming_window,
         )
 
         # Get the max scan range
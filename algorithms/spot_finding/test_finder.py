@@ -0,0 +1,62 @@
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from dials.algorithms.spot_finding.finder import StreamingPixelListLabeller
+from dials.array_family import flex
+from dials.model.data import PixelList, PixelListLabeller
+
+
+def _pixel_lists(size, nframes, first_frame=0):
+    flex.set_random_seed(0)
+    hot = flex.bool(flex.grid(size), False)
+    hot[3, 4] = True
+    for i in range(nframes):
+        image = flex.random_int_gaussian_distribution(size[0] * size[1], 100, 5)
+        mask = flex.random_bool(size[0] * size[1], 0.2)
+        image.reshape(flex.grid(size))
+        mask.reshape(flex.grid(size))
+        yield PixelList(first_frame + i, image, mask | hot)
+
+
+def _sorted_bboxes(shoeboxes):
+    return sorted(tuple(b) for b in shoeboxes.bounding_boxes())
+
+
+@pytest.mark.parametrize("window", [1, 3, 7, 50])
+def test_streaming_labeller_matches_labeller(window):
+    size = (40, 30)
+    nframes = 20
+
+    labeller = PixelListLabeller()
+    for plist in _pixel_lists(size, nframes, first_frame=5):
+        labeller.add(plist)
+    creator = flex.PixelListShoeboxCreator(labeller, 0, 0, False, 1, 50, True)
+    expected = creator.result()
+
+    streaming = StreamingPixelListLabeller(0, window, 1, 50, True)
+    shoeboxes = flex.shoebox()
+    for plist in _pixel_lists(size, nframes, first_frame=5):
+        shoeboxes.extend(streaming.add(plist))
+        assert streaming.num_carried_pixels() < labeller.num_pixels()
+    shoeboxes.extend(streaming.finish())
+
+    assert len(shoeboxes) == len(expected)
+    assert _sorted_bboxes(shoeboxes) == _sorted_bboxes(expected)
+    assert sorted(streaming.spot_size) == sorted(creator.spot_size())
+    assert list(streaming.hot_pixels) == list(creator.hot_pixels())
+    assert list(streaming.hot_pixels) == [3 * size[1] + 4]
+    shoeboxes = shoeboxes.select(shoeboxes.is_allocated())
+    expected = expected.select(expected.is_allocated())
+    assert flex.sum(shoeboxes.summed_intensity().observed_value()) == pytest.approx(
+        flex.sum(expected.summed_intensity().observed_value())
+    )
+
+
+def test_streaming_labeller_no_pixels():
+    streaming = StreamingPixelListLabeller(0, 2, 1, 50, False)
+    assert len(streaming.finish()) == 0
+    for i in range(5):
+        plist = PixelList(i, (10, 10), flex.double(), flex.size_t())
+        assert len(streaming.add(plist)) == 0
+    assert len(streaming.finish()) == 0
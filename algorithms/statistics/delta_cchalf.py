@@ -3,9 +3,9 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
-from collections import defaultdict
 from math import floor, sqrt
 
+import numpy as np
 import six
 
 from cctbx import crystal, miller
@@ -73,6 +73,17 @@ def index(self, h):
             bin_index = 0
         return bin_index
 
+    def indices(self, miller_indices):
+        """
+        Get the bin indices for an array of miller indices
+
+        :param miller_indices: A flex.miller_index array
+        :returns: A numpy array of bin indices
+        """
+        d2 = (1 / flex.pow2(self._unit_cell.d(miller_indices))).as_numpy_array()
+        bin_index = np.floor((d2 - self._xmin) / self._bin_size).astype(np.int64)
+        return np.clip(bin_index, 0, self._nbins - 1)
+
 
 class ReflectionSum(object):
     """
@@ -157,6 +168,50 @@ def compute_cchalf_from_reflection_sums(reflection_sums, binner):
     return compute_mean_cchalf_in_bins(bin_data)
 
 
+def _sum_cchalf_terms(sum_x, sum_x2, n, key, n_keys):
+    """
+    Sum the contributions of unique reflections to the binned CC 1/2
+
+    Only unique reflections with more than one observation contribute.
+
+    :param sum_x: The array of Sum(X) for each unique reflection
+    :param sum_x2: The array of Sum(X^2) for each unique reflection
+    :param n: The array of the number of observations of each unique reflection
+    :param key: The array of the index of the sum to add each reflection to
+    :param n_keys: The number of sums
+    :returns: An array of shape (4, n_keys) of the number of reflections and the
+        sums of the mean, the squared mean and the variance of the mean intensity
+    """
+    use = n > 1
+    n_use = np.where(use, n, 2)  # avoid dividing by zero for unused reflections
+    mean = sum_x / n_use
+    var = (sum_x2 - sum_x ** 2 / n_use) / (n_use - 1) / n_use
+    weights = use.astype(np.float64)
+    return np.array(
+        [
+            np.bincount(key, weights=w, minlength=n_keys)
+            for w in (weights, weights * mean, weights * mean ** 2, weights * var)
+        ]
+    )
+
+
+def _mean_cchalf_from_sums(sums):
+    """
+    Compute the mean CC 1/2 across resolution bins from summed terms
+
+    :param sums: An array of shape (4, ..., n_bins) as from _sum_cchalf_terms
+    :returns: The mean CC 1/2, weighted by the number of reflections in each bin
+    """
+    count, sum_mean, sum_mean2, sum_var = sums
+    use = count > 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma_y = (sum_mean2 - sum_mean ** 2 / count) / (count - 1)
+        sigma_e = sum_var / count
+        cchalf = (sigma_y - sigma_e) / (sigma_y + sigma_e)
+        weights = np.where(use, count, 0.0)
+        return np.where(use, weights * cchalf, 0.0).sum(axis=-1) / weights.sum(axis=-1)
+
+
 class PerGroupCChalfStatistics(object):
     def __init__(
         self,
@@ -196,30 +251,34 @@ def __init__(
             self.d_max = flex.max(self.reflection_table["d"])
         self.binner = ResolutionBinner(mean_unit_cell, self.d_min, self.d_max, n_bins)
 
-        self.reflection_sums = defaultdict(ReflectionSum)
         self.compute_overall_stats()
 
     def compute_overall_stats(self):
-        # Create lookups for elements by miller index
-        index_lookup = defaultdict(list)
-        for i, h in enumerate(self.reflection_table["miller_index"]):
-            index_lookup[h].append(i)
+        # Encode the unique miller indices and the groups as integers
+        miller_index = self.reflection_table["miller_index"]
+        hkl = miller_index.as_vec3_double().as_numpy_array().astype(np.int64)
+        _, first, self._hkl_index = np.unique(
+            hkl, axis=0, return_index=True, return_inverse=True
+        )
+        self._hkl_index = self._hkl_index.ravel()
+        self._groups, self._group_index = np.unique(
+            self.reflection_table["group"].as_numpy_array(), return_inverse=True
+        )
+        self._bin_index = self.binner.indices(
+            miller_index.select(flex.size_t(first.tolist()))
+        )
 
         # Compute the Overall Sum(X) and Sum(X^2) for each unique reflection
-
-        for h in index_lookup:
-            sel = flex.size_t(index_lookup[h])
-            intensities = self.reflection_table["intensity"].select(sel)
-            n = intensities.size()
-            sum_x = flex.sum(intensities)
-            sum_x2 = flex.sum(flex.pow2(intensities))
-            self.reflection_sums[h] = ReflectionSum(sum_x, sum_x2, n)
+        self._intensities = self.reflection_table["intensity"].as_numpy_array()
+        self._sum_x = np.bincount(self._hkl_index, weights=self._intensities)
+        self._sum_x2 = np.bincount(self._hkl_index, weights=self._intensities ** 2)
+        self._n = np.bincount(self._hkl_index)
 
         # Compute some numbers
         self._num_datasets = len(set(self.reflection_table["dataset"]))
-        self._num_groups = len(set(self.reflection_table["group"]))
+        self._num_groups = len(self._groups)
         self._num_reflections = self.reflection_table.size()
-        self._num_unique = len(self.reflection_sums)
+        self._num_unique = len(self._n)
 
         logger.info(
             """
@@ -257,56 +316,56 @@ def d_filter(self):
 
     def run(self):
         """Compute the ΔCC½ for all the data"""
-        self._cchalf_mean = compute_cchalf_from_reflection_sums(
-            self.reflection_sums, self.binner
+        self._overall_sums = _sum_cchalf_terms(
+            self._sum_x, self._sum_x2, self._n, self._bin_index, self.binner.nbins()
         )
+        self._cchalf_mean = float(_mean_cchalf_from_sums(self._overall_sums))
         logger.info("CC 1/2 mean: %.3f", (100 * self._cchalf_mean))
         self._cchalf = self._compute_cchalf_excluding_each_group()
 
     def _compute_cchalf_excluding_each_group(self):
-        #   self, reflection_sums, binner, miller_index, dataset, intensity
-        # ):
         """
         Compute the CC 1/2 with an image excluded.
 
         For each image, update the sums by removing the contribution from the image
-        and then compute the CC 1/2 of the remaining data
+        and then compute the CC 1/2 of the remaining data.
+
+        The partial sums for each (group, unique reflection) pair are determined in
+        one pass, so that the binned sums for each group only need to be updated
+        for the unique reflections observed in that group.
         """
+        n_unique = self._num_unique
+        n_bins = self.binner.nbins()
 
-        # Create a lookup table for each reflection by dataset i.e. group of images
-        dataset_lookup = defaultdict(list)
-        for i, b in enumerate(self.reflection_table["group"]):
-            dataset_lookup[b].append(i)
+        # Compute Sum(X) and Sum(X^2) for each group and unique reflection
+        pairs, pair_index = np.unique(
+            self._group_index.astype(np.int64) * n_unique + self._hkl_index,
+            return_inverse=True,
+        )
+        pair_group = pairs // n_unique
+        pair_hkl = pairs % n_unique
+        old_sums = (self._sum_x[pair_hkl], self._sum_x2[pair_hkl], self._n[pair_hkl])
+        new_sums = (
+            old_sums[0] - np.bincount(pair_index, weights=self._intensities),
+            old_sums[1] - np.bincount(pair_index, weights=self._intensities ** 2),
+            old_sums[2] - np.bincount(pair_index),
+        )
+
+        # Replace the contributions of the affected unique reflections in each bin
+        key = pair_group * n_bins + self._bin_index[pair_hkl]
+        n_keys = self._num_groups * n_bins
+        delta = _sum_cchalf_terms(*(new_sums + (key, n_keys))) - _sum_cchalf_terms(
+            *(old_sums + (key, n_keys))
+        )
+        sums = self._overall_sums[:, np.newaxis, :] + delta.reshape(
+            4, self._num_groups, n_bins
+        )
+        cchalf = _mean_cchalf_from_sums(sums)
 
-        # Compute CC1/2 minus each dataset
         cchalf_i = {}
-        for dataset in dataset_lookup:
-
-            # Find all observations from this dataset and create a lookup based on
-            # miller index
-            index_lookup = defaultdict(list)
-            for i in dataset_lookup[dataset]:
-                index_lookup[self.reflection_table["miller_index"][i]].append(i)
-
-            # Loop through all the reflections and remove the contribution of
-            # reflections from the current dataset
-            dataset_reflection_sums = defaultdict(ReflectionSum)
-            for h in self.reflection_sums:
-                sum_x = self.reflection_sums[h].sum_x
-                sum_x2 = self.reflection_sums[h].sum_x2
-                n = self.reflection_sums[h].n
-                for i in index_lookup[h]:
-                    sum_x -= self.reflection_table["intensity"][i]
-                    sum_x2 -= self.reflection_table["intensity"][i] ** 2
-                    n -= 1
-                dataset_reflection_sums[h] = ReflectionSum(sum_x, sum_x2, n)
-
-            # Compute the CC 1/2 without the reflections from the current dataset
-            cchalf = compute_cchalf_from_reflection_sums(
-                dataset_reflection_sums, self.binner
-            )
-            cchalf_i[dataset] = cchalf
-            logger.info("CC 1/2 excluding group %d: %.3f", dataset, 100 * cchalf)
+        for group, value in zip(self._groups.tolist(), cchalf.tolist()):
+            cchalf_i[group] = value
+            logger.info("CC 1/2 excluding group %d: %.3f", group, 100 * value)
 
         return cchalf_i
 
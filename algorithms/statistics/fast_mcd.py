@@ -2,6 +2,8 @@
 
 import math
 
+import numpy as np
+
 from scitbx.array_family import flex
 
 from dials_refinement_helpers_ext import maha_dist_sq as maha_dist_sq_cpp
@@ -51,6 +53,36 @@ def maha_dist_sq(cols, center, cov):
     return d2
 
 
+def _means_and_covariances(X, subsets):
+    """For each row of the (b, m) array of row indices subsets, calculate the
+    mean and sample covariance matrix of those rows of the (n, p) observation
+    matrix X, and the covariance matrix determinant. Return arrays of shape
+    (b, p), (b, p, p) and (b,)"""
+
+    Y = X[subsets]
+    T = Y.mean(axis=1)
+    Y = Y - T[:, None, :]
+    S = np.matmul(Y.transpose(0, 2, 1), Y) / (subsets.shape[1] - 1)
+    return T, S, np.linalg.det(S)
+
+
+def _maha_dist_sq(X, T, S):
+    """Calculate squared Mahalanobis distances of the rows of the (n, p)
+    observation matrix X from each of the b centers in T with respect to the
+    corresponding covariance matrix in S. Return an array of shape (b, n)"""
+
+    diff = X[None, :, :] - T[:, None, :]
+    return (np.matmul(diff, np.linalg.inv(S)) * diff).sum(axis=2)
+
+
+def _concentration_step(X, h, T, S):
+    """Practical application of Theorem 1 of R&vD for a batch of estimates"""
+
+    d2s = _maha_dist_sq(X, T, S)
+    subsets = np.argpartition(d2s, h - 1, axis=1)[:, :h]
+    return _means_and_covariances(X, subsets)
+
+
 def mcd_finite_sample(p, n, alpha):
     """Finite sample correction factor for the MCD estimate. Described in
     Pison et al. Metrika (2002). doi.org/10.1007/s001840200191. Implementation
@@ -132,6 +164,9 @@ class FastMCD(object):
     """Experimental implementation of the FAST-MCD algorithm of Rousseeuw and
     van Driessen"""
 
+    # the maximum number of trials multiplied by observations to work with at once
+    batch_size = 2 ** 20
+
     def __init__(
         self,
         data,
@@ -142,9 +177,12 @@ def __init__(
         k1=2,
         k2=2,
         k3=100,
+        seed=None,
     ):
         """data expected to be a list of flex.double arrays of the same length,
-        representing the vectors of observations in each dimension"""
+        representing the vectors of observations in each dimension. If seed is
+        None, a seed is drawn from the flex random number generator, so that
+        flex.set_random_seed makes the result reproducible"""
 
         # the full dataset as separate vectors
         self._data = data
@@ -163,6 +201,9 @@ def __init__(
         # some input checks
         assert self._n > self._p
 
+        # the full dataset as an (n, p) observation matrix
+        self._X = np.column_stack([e.as_numpy_array() for e in self._data])
+
         # default initial subset size
         self._alpha = alpha
         n2 = (self._n + self._p + 1) // 2
@@ -182,6 +223,11 @@ def __init__(
         self._k2 = k2
         self._k3 = k3
 
+        # random number generator for sampling
+        if seed is None:
+            seed = int(flex.random_size_t(1, 2 ** 31 - 1)[0])
+        self._rng = np.random.RandomState(seed)
+
         # correction factors
         self._consistency_fac = mcd_consistency(self._p, self._h / self._n)
         self._finite_samp_fac = mcd_finite_sample(self._p, self._n, self._alpha)
@@ -198,11 +244,15 @@ def run(self):
         # algorithm for a small number of observations (up to twice the minimum
         # group size)
         if self._n < 2 * self._min_group_size:
-            self._T_raw, self._S_raw = self.small_dataset_estimate()
+            T, S = self.small_dataset_estimate()
 
         # algorithm for a larger number of observations
         else:
-            self._T_raw, self._S_raw = self.large_dataset_estimate()
+            T, S = self.large_dataset_estimate()
+
+        self._T_raw = flex.double(T.tolist())
+        self._S_raw = flex.double(S.ravel().tolist())
+        self._S_raw.reshape(flex.grid(self._p, self._p))
 
     def get_raw_T_and_S(self):
         """Get the raw MCD location (T) and covariance matrix (S) estimates"""
@@ -216,130 +266,83 @@ def get_corrected_T_and_S(self):
         fac = self._consistency_fac * self._finite_samp_fac
         return self._T_raw, self._S_raw * fac
 
-    @staticmethod
-    def means_and_covariance(vecs):
-        """Prepare a dataset of equal length vectors for Mahalanobis distance
-        squared calculation. The maha_dist_sq function requires the vectors,
-        the vector of their means and their covariance matrix. Given the vectors,
-        return the latter pair as a tuple"""
-
-        center = flex.double([flex.mean(e) for e in vecs])
-        covmat = cov(*vecs)
-        return (center, covmat)
-
-    @staticmethod
-    def sample_data(data, sample_size):
-        """sample (without replacement) the data vectors to select the same
-        sample_size rows from each."""
-
-        n = len(data[0])
-        rows = flex.random_selection(n, sample_size)
-        cols = [e.select(rows) for e in data]
-        return cols
-
-    def split_into_groups(self, sample, ngroups):
-        """Split each vector in the data sample into groups of approximately equal
-        size."""
-
-        # number of obs in the sample
-        sample_size = len(sample[0])
-
-        # random permutation
-        p = flex.random_permutation(sample_size)
-        permuted = [col.select(p) for col in sample]
-
-        # determine groups
-        blocksize = int(sample_size / ngroups)
-        rem = sample_size % ngroups
-        blocksizes = [blocksize] * (ngroups - rem) + [blocksize + 1] * rem
-
-        starts = [0]
-        ends = [blocksizes[0]]
-        for b in blocksizes[1:]:
-            starts.append(ends[-1])
-            ends.append(ends[-1] + b)
-        blocks = zip(starts, ends)
-
-        # split into groups
-        groups = [[col[start:end] for col in permuted] for start, end in blocks]
-
-        return groups
-
-    def form_initial_subset(self, h, data):
-        """Method 2 of subsection 3.1 of R&vD"""
-
-        # permutation of input data for sampling
-        p = flex.random_permutation(len(data[0]))
-        permuted = [col.select(p) for col in data]
-
-        # draw random p+1 subset J (or larger if required)
-        detS0 = 0.0
-        i = 0
-        while not detS0 > 0.0:
-            subset_size = self._p + 1 + i
-            J = [e[0:subset_size] for e in permuted]
-            i += 1
-            T0, S0 = self.means_and_covariance(J)
-            detS0 = S0.matrix_determinant_via_lu()
-
-        H1 = self.concentration_step(h, data, T0, S0)
-        return H1
-
-    @staticmethod
-    def concentration_step(h, data, T, S):
-        """Practical application of Theorem 1 of R&vD"""
-
-        d2s = maha_dist_sq(data, T, S)
-        p = flex.sort_permutation(d2s)
-        H1 = [col.select(p)[0:h] for col in data]
-        return H1
+    def initial_estimates(self, X, h, n_trials):
+        """Method 2 of subsection 3.1 of R&vD, for n_trials random subsets of the
+        observations X at once. Return the location and covariance estimates
+        after the first concentration step, with their determinants"""
+
+        # a random permutation of the observations for each trial
+        m = len(X)
+        permutations = np.argsort(self._rng.random_sample((n_trials, m)), axis=1)
+
+        # draw random p+1 subsets J (or larger where required)
+        subset_size = self._p + 1
+        T0, S0, detS0 = _means_and_covariances(X, permutations[:, :subset_size])
+        singular = np.flatnonzero(~(detS0 > 0.0))
+        while len(singular) and subset_size < m:
+            subset_size += 1
+            T0[singular], S0[singular], detS0[singular] = _means_and_covariances(
+                X, permutations[singular, :subset_size]
+            )
+            singular = singular[~(detS0[singular] > 0.0)]
 
-    def small_dataset_estimate(self):
-        """When a dataset is small, perform the initial trials directly on the
-        whole dataset"""
+        return self.concentration_steps(X, h, T0, S0, detS0, 1)
 
-        trials = []
-        for i in range(self._n_trials):
+    def concentration_steps(
+        self, X, h, T, S, detS, n_steps, stop_if_converged=False, check=False
+    ):
+        """Take up to n_steps concentration steps from each of the estimates T and
+        S (with determinants detS) over the observations X. The estimates are
+        worked on in batches. If stop_if_converged, an estimate takes no further
+        steps once its determinant is unchanged. If check, ensure that each step
+        does not increase the determinant"""
+
+        T, S, detS = T.copy(), S.copy(), detS.copy()
+        batch_size = max(1, self.batch_size // len(X))
+        for start in range(0, len(detS), batch_size):
+            active = np.arange(start, min(start + batch_size, len(detS)))
+            for j in range(n_steps):
+                Tnew, Snew, detSnew = _concentration_step(X, h, T[active], S[active])
 
-            H1 = self.form_initial_subset(h=self._h, data=self._data)
-            T1, S1 = self.means_and_covariance(H1)
-            detS1 = S1.matrix_determinant_via_lu()
+                # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
+                # this is not always the case here. Ensure that detScurr is no smaller
+                # than one billionth the value of detSnew less than detSnew
+                if check:
+                    assert np.all(detS[active] > (detSnew - detSnew / 1.0e9))
 
-            # perform concentration steps
-            detScurr, Tcurr, Scurr = detS1, T1, S1
-            for j in range(self._k1):  # take maximum of k1 steps
+                converged = detSnew == detS[active]
+                T[active], S[active], detS[active] = Tnew, Snew, detSnew
+                if stop_if_converged:
+                    active = active[~converged]
+                    if not len(active):
+                        break
 
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detSnew = Snew.matrix_determinant_via_lu()
+        return T, S, detS
 
-                # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
-                # this is not always the case here. Ensure that detScurr is no smaller than
-                # one billionth the value of detSnew less than detSnew
-                assert detScurr > (detSnew - detSnew / 1.0e9)
-                detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-            trials.append((detSnew, Tnew, Snew))
-
-        # choose 10 trials with the lowest detS3
-        trials.sort(key=lambda x: x[0])
-        best_trials = []
-        for i in range(10):
-            detCurr, Tcurr, Scurr = trials[i]
-            for j in range(self._k3):  # take maximum of k3 steps
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detNew = Snew.matrix_determinant_via_lu()
-                if detNew == detCurr:
-                    # print "trial {0}; iteration {1}; convergence".format(i,j)
-                    break
-                detCurr, Tcurr, Scurr = detNew, Tnew, Snew
-            best_trials.append((detNew, Tnew, Snew))
+    def small_dataset_estimate(self):
+        """When a dataset is small, perform the initial trials directly on the
+        whole dataset"""
+
+        T, S, detS = self.initial_estimates(self._X, self._h, self._n_trials)
+        T, S, detS = self.concentration_steps(
+            self._X, self._h, T, S, detS, self._k1, check=True
+        )
+
+        # choose 10 trials with the lowest detS3 and take maximum of k3 steps
+        best = np.argsort(detS, kind="stable")[:10]
+        T, S, detS = self.concentration_steps(
+            self._X,
+            self._h,
+            T[best],
+            S[best],
+            detS[best],
+            self._k3,
+            stop_if_converged=True,
+        )
 
         # Find the minimum covariance determinant from that set of 10
-        best_trials.sort(key=lambda x: x[0])
-        _, Tbest, Sbest = best_trials[0]
-        return Tbest, Sbest
+        best = np.argmin(detS)
+        return T[best], S[best]
 
     def large_dataset_estimate(self):
         """When a dataset is large, construct disjoint subsets of the full data
@@ -354,62 +357,34 @@ def large_dataset_estimate(self):
             ngroups = self._max_n_groups
             sample_size = self._min_group_size * self._max_n_groups
 
-        # sample the data and split into groups
-        sampled = self.sample_data(self._data, sample_size=sample_size)
-        groups = self.split_into_groups(sample=sampled, ngroups=ngroups)
+        # sample the data (in random order) and split into groups
+        sampled = self._rng.choice(self._n, sample_size, replace=False)
+        groups = np.array_split(sampled, ngroups)
 
         # work within the groups now
         n_trials = self._n_trials // ngroups
-        trials = []
         h_frac = self._h / self._n
+        trials = []
         for group in groups:
 
-            h_sub = int(len(group[0]) * h_frac)
-            gp_trials = []
-            for i in range(n_trials):
-
-                H1 = self.form_initial_subset(h=h_sub, data=group)
-                T1, S1 = self.means_and_covariance(H1)
-                detS1 = S1.matrix_determinant_via_lu()
-
-                # perform concentration steps
-                detScurr, Tcurr, Scurr = detS1, T1, S1
-                for j in range(self._k1):  # take k1 steps
-
-                    Hnew = self.concentration_step(h_sub, group, Tcurr, Scurr)
-                    Tnew, Snew = self.means_and_covariance(Hnew)
-                    detSnew = Snew.matrix_determinant_via_lu()
-
-                    # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
-                    # this is not always the case here. Ensure that detScurr is no smaller than
-                    # one billionth the value of detSnew less than detSnew
-                    assert detScurr > (detSnew - detSnew / 1.0e9)
-                    detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-                gp_trials.append((detSnew, Tnew, Snew))
+            X = self._X[group]
+            h_sub = int(len(group) * h_frac)
+            T, S, detS = self.initial_estimates(X, h_sub, n_trials)
+            T, S, detS = self.concentration_steps(
+                X, h_sub, T, S, detS, self._k1, check=True
+            )
 
             # choose 10 trials with the lowest determinant and put in the outer list
-            gp_trials.sort(key=lambda x: x[0])
-            trials.extend(gp_trials[0:10])
+            best = np.argsort(detS, kind="stable")[:10]
+            trials.append((T[best], S[best], detS[best]))
 
         # now have 10 best trials from each group. Work with the merged (==sampled)
-        # set
-        mrgd_trials = []
+        # set, taking k2 steps
+        T, S, detS = (np.concatenate(e) for e in zip(*trials))
         h_mrgd = int(sample_size * h_frac)
-        for trial in trials:
-
-            detScurr, Tcurr, Scurr = trial
-            for j in range(self._k2):  # take k2 steps
-
-                Hnew = self.concentration_step(h_mrgd, sampled, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detSnew = Snew.matrix_determinant_via_lu()
-                detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-            mrgd_trials.append((detSnew, Tnew, Snew))
-
-        # sort trials by the lowest detS3 and work with the whole dataset now
-        mrgd_trials.sort(key=lambda x: x[0])
+        T, S, detS = self.concentration_steps(
+            self._X[sampled], h_mrgd, T, S, detS, self._k2
+        )
 
         # choose number of steps to iterate based on dataset size (ugly)
         size = self._n * self._p
@@ -439,24 +414,19 @@ def large_dataset_estimate(self):
         # choose number of trials to look at based on number of obs (ugly)
         n_reps = 1 if self._n > 5000 else 10
 
-        best_trials = []
-        for i in range(n_reps):
-            detCurr, Tcurr, Scurr = mrgd_trials[i]
-            for j in range(k4):  # take maximum of k4 steps
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detNew = Snew.matrix_determinant_via_lu()
-                if detNew == detCurr:
-                    # print "trial {0}; iteration {1}; convergence".format(i,j)
-                    break
-                detCurr, Tcurr, Scurr = detNew, Tnew, Snew
-            # print "determinant", detNew
-            # print "location:", list(Tnew)
-            # print "covariance:"
-            # print Snew.as_scitbx_matrix()
-            best_trials.append((detNew, Tnew, Snew))
-
-        # Find the minimum covariance determinant from that set of 10
-        best_trials.sort(key=lambda x: x[0])
-        _, Tbest, Sbest = best_trials[0]
-        return Tbest, Sbest
+        # sort trials by the lowest detS3 and work with the whole dataset now,
+        # taking a maximum of k4 steps
+        best = np.argsort(detS, kind="stable")[:n_reps]
+        T, S, detS = self.concentration_steps(
+            self._X,
+            self._h,
+            T[best],
+            S[best],
+            detS[best],
+            k4,
+            stop_if_converged=True,
+        )
+
+        # Find the minimum covariance determinant from that set
+        best = np.argmin(detS)
+        return T[best], S[best]
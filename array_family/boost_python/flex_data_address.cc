@@ -0,0 +1,45 @@
+/*
+ * flex_data_address.cc
+ *
+ *  This code is distributed under the BSD license, a copy of which is
+ *  included in the root directory of this package.
+ */
+#include <boost/python.hpp>
+#include <boost/python/def.hpp>
+#include <scitbx/array_family/flex_types.h>
+#include <scitbx/array_family/tiny_types.h>
+#include <scitbx/vec2.h>
+#include <scitbx/vec3.h>
+#include <scitbx/mat3.h>
+#include <cctbx/miller.h>
+
+namespace dials { namespace af { namespace boost_python {
+
+  using namespace boost::python;
+
+  /**
+   * Get the address and element size of the storage of a flex array. This
+   * allows other array libraries to create views on the data without copying.
+   * The array must be kept alive, and not resized, while a view is in use.
+   * @param a The flex array
+   * @returns A tuple of (address, element size)
+   */
+  template <typename T>
+  tuple data_address(scitbx::af::versa<T, scitbx::af::flex_grid<> > &a) {
+    return make_tuple(reinterpret_cast<std::size_t>(a.begin()), sizeof(T));
+  }
+
+  void export_flex_data_address() {
+    def("data_address", &data_address<bool>);
+    def("data_address", &data_address<int>);
+    def("data_address", &data_address<std::size_t>);
+    def("data_address", &data_address<float>);
+    def("data_address", &data_address<double>);
+    def("data_address", &data_address<scitbx::vec2<double> >);
+    def("data_address", &data_address<scitbx::vec3<double> >);
+    def("data_address", &data_address<scitbx::mat3<double> >);
+    def("data_address", &data_address<scitbx::af::int6>);
+    def("data_address", &data_address<cctbx::miller::index<> >);
+  }
+
+}}}  // namespace dials::af::boost_python
@@ -31,6 +31,7 @@ namespace dials { namespace af { namespace boost_python {
   void export_flex_unit_cell();
   void export_flex_shoebox_extractor();
   void export_flex_binner();
+  void export_flex_data_address();
 
   template <typename FloatType>
   std::string get_real_type();
@@ -55,6 +56,7 @@ namespace dials { namespace af { namespace boost_python {
     export_flex_unit_cell();
     export_flex_shoebox_extractor();
     export_flex_binner();
+    export_flex_data_address();
 
     def("get_real_type", &get_real_type<ProfileFloatType>);
 
@@ -201,10 +201,20 @@ def as_msgpack_file(self, filename):
             self.as_msgpack_to_file(dials.util.ext.streambuf(python_file_obj=outfile))
 
     @staticmethod
-    def from_msgpack_file(filename):
+    def from_msgpack_file(filename, columns=None):
         """
         Read the reflection table from file in msgpack format
+
+        :param filename: The msgpack filename
+        :param columns: If set, only decode these columns straight away. The
+                        file is memory mapped and the other columns are decoded
+                        the first time that they are accessed.
+        :return: The reflection table
         """
+        if columns is not None:
+            from dials.array_family.msgpack_reader import LazyReflectionTable
+
+            return LazyReflectionTable.from_msgpack_file(filename, columns)
         if filename and hasattr(filename, "__fspath__"):
             filename = filename.__fspath__()
         with libtbx.smart_open.for_reading(filename, "rb") as infile:
@@ -212,6 +222,38 @@ def from_msgpack_file(filename):
                 infile.read()
             )
 
+    def as_row_group_file(self, filename, row_group_size=None, compression=None):
+        """
+        Write the reflection table to file in the chunked row group format
+
+        :param filename: The filename
+        :param row_group_size: The maximum number of rows in each row group
+        :param compression: The columns to compress with zlib, or True for all
+        """
+        from dials.array_family import row_group_file
+
+        if row_group_size is None:
+            row_group_size = row_group_file.default_row_group_size
+        row_group_file.RowGroupReflectionFile.write(
+            self, filename, row_group_size=row_group_size, compression=compression
+        )
+
+    @staticmethod
+    def from_row_group_file(filename, columns=None, **selection):
+        """
+        Read the reflection table from file in the chunked row group format
+
+        :param filename: The filename
+        :param columns: If set, only read these columns
+        :param selection: Only read the matching reflections, selected by any
+                          of ids, identifiers, z_range, d_range and flags. Row
+                          groups without matching reflections are skipped.
+        :return: The reflection table
+        """
+        from dials.array_family.row_group_file import RowGroupReflectionFile
+
+        return RowGroupReflectionFile(filename).read(columns=columns, **selection)
+
     def as_file(self, filename):
         """
         Write the reflection table to file in either msgpack or pickle format
@@ -222,13 +264,24 @@ def as_file(self, filename):
             self.as_msgpack_file(filename)
 
     @staticmethod
-    def from_file(filename):
+    def from_file(filename, columns=None):
         """
-        Read the reflection table from either pickle or msgpack
+        Read the reflection table from either pickle, msgpack or row group files
+
+        :param filename: The reflection filename
+        :param columns: If set, only decode these columns from a msgpack file
+                        straight away and decode the others on first access
+        :return: The reflection table
         """
+        from dials.array_family.row_group_file import is_row_group_file
+
+        if is_row_group_file(filename):
+            return dials_array_family_flex_ext.reflection_table.from_row_group_file(
+                filename, columns=columns
+            )
         try:
             return dials_array_family_flex_ext.reflection_table.from_msgpack_file(
-                filename
+                filename, columns=columns
             )
         except RuntimeError:
             return dials_array_family_flex_ext.reflection_table.from_pickle(filename)
@@ -1247,6 +1300,52 @@ def calculate_entering_flags(self, experiments):
 
         self["entering"] = enterings
 
+    def as_numpy_view(self, key, readonly=False):
+        """
+        Get a NumPy array which shares memory with a column, without copying.
+
+        The view must not be used after the table is resized.
+
+        :param key: The column name
+        :param readonly: Make the NumPy array read only
+        :return: The NumPy array
+        """
+        from dials.array_family.numpy_view import as_numpy_view
+
+        return as_numpy_view(self[key], readonly=readonly)
+
+    def new_numpy_column(self, key, column_type):
+        """
+        Add a zeroed column and return a NumPy view of it, so that results can
+        be written straight into the table.
+
+        :param key: The column name
+        :param column_type: The flex type of the column, e.g. flex.double
+        :return: The NumPy array
+        """
+        self[key] = column_type(self.size())
+        return self.as_numpy_view(key)
+
+    def set_numpy_column(self, key, array, column_type=None):
+        """
+        Set a column from a NumPy array.
+
+        If the array is already a view of the column nothing is done, otherwise
+        the data are copied once into the table.
+
+        :param key: The column name
+        :param array: The NumPy array
+        :param column_type: The flex type of the column. If not set, this is
+                            chosen from the element type and shape of the array
+        """
+        from dials.array_family.numpy_view import flex_type_for, is_view_of
+
+        if key in self and is_view_of(array, self[key]):
+            return
+        if column_type is None:
+            column_type = flex_type_for(array)
+        self.new_numpy_column(key, column_type)[...] = array
+
     def get(self, key, default=None):
         """
         Get item from object for given key (ex: reflection_table column).
@@ -0,0 +1,479 @@
+"""
+Column selective reading of reflection tables stored in msgpack format.
+
+A reflection file written by reflection_table.as_msgpack_file is laid out as
+
+  [ "dials::af::reflection_table", 1, {
+      "identifiers": { id: identifier, ... },
+      "nrows": N,
+      "data": { name: [ type, column ], ... } } ]
+
+where the bulk of every column is a single msgpack binary blob. This makes it
+cheap to walk the headers of the file and record where each column lives
+without touching the column data. Individual columns can then be decoded by
+passing a small msgpack document holding only those columns to the existing
+reflection_table.from_msgpack decoder.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import io
+import mmap
+import struct
+
+import libtbx.smart_open
+
+from dials.array_family import flex
+
+__all__ = [
+    "LazyReflectionTable",
+    "MsgpackReflectionIndex",
+    "pack_identifiers",
+    "table_from_msgpack_columns",
+]
+
+_filetype = "dials::af::reflection_table"
+
+# The sizes of the fixed length msgpack types by their leading byte
+_fixed_size = {
+    0xC0: 0,  # nil
+    0xC2: 0,  # false
+    0xC3: 0,  # true
+    0xCA: 4,  # float 32
+    0xCB: 8,  # float 64
+    0xD4: 2,  # fixext 1
+    0xD5: 3,  # fixext 2
+    0xD6: 5,  # fixext 4
+    0xD7: 9,  # fixext 8
+    0xD8: 17,  # fixext 16
+}
+
+# The leading bytes of the msgpack types with a length or value field
+_sized = {
+    0xC4: ("bin", ">B"),
+    0xC5: ("bin", ">H"),
+    0xC6: ("bin", ">I"),
+    0xC7: ("ext", ">B"),
+    0xC8: ("ext", ">H"),
+    0xC9: ("ext", ">I"),
+    0xCC: ("int", ">B"),
+    0xCD: ("int", ">H"),
+    0xCE: ("int", ">I"),
+    0xCF: ("int", ">Q"),
+    0xD0: ("int", ">b"),
+    0xD1: ("int", ">h"),
+    0xD2: ("int", ">i"),
+    0xD3: ("int", ">q"),
+    0xD9: ("str", ">B"),
+    0xDA: ("str", ">H"),
+    0xDB: ("str", ">I"),
+    0xDC: ("array", ">H"),
+    0xDD: ("array", ">I"),
+    0xDE: ("map", ">H"),
+    0xDF: ("map", ">I"),
+}
+
+
+def _read_header(buf, pos):
+    """
+    Read the header of the msgpack object at pos.
+
+    :returns: A tuple (kind, value, pos) where value is the integer value or
+              the length of the object and pos is the offset of its contents
+    """
+    try:
+        (b,) = struct.unpack_from(">B", buf, pos)
+        pos += 1
+        if b <= 0x7F:
+            return "int", b, pos
+        elif b >= 0xE0:
+            return "int", b - 0x100, pos
+        elif b <= 0x8F:
+            return "map", b & 0x0F, pos
+        elif b <= 0x9F:
+            return "array", b & 0x0F, pos
+        elif b <= 0xBF:
+            return "str", b & 0x1F, pos
+        elif b in _fixed_size:
+            return "fixed", _fixed_size[b], pos
+        kind, fmt = _sized[b]
+        (value,) = struct.unpack_from(fmt, buf, pos)
+        pos += struct.calcsize(fmt)
+        if kind == "ext":
+            # Skip the type byte
+            pos += 1
+        return kind, value, pos
+    except (KeyError, struct.error):
+        raise RuntimeError("Invalid msgpack data at offset %d" % (pos - 1))
+
+
+def _skip(buf, pos):
+    """
+    Return the offset just past the msgpack object at pos.
+    """
+    kind, value, pos = _read_header(buf, pos)
+    if kind in ("str", "bin", "ext", "fixed"):
+        return pos + value
+    elif kind == "array":
+        for i in range(value):
+            pos = _skip(buf, pos)
+    elif kind == "map":
+        for i in range(2 * value):
+            pos = _skip(buf, pos)
+    return pos
+
+
+def _read_expected(buf, pos, expected):
+    kind, value, pos = _read_header(buf, pos)
+    if kind != expected:
+        raise RuntimeError("Expected msgpack %s, got %s" % (expected, kind))
+    return value, pos
+
+
+def _read_str(buf, pos):
+    length, pos = _read_expected(buf, pos, "str")
+    return bytes(buf[pos : pos + length]).decode("utf-8"), pos + length
+
+
+def _pack_header(fix, fix_max, formats, n):
+    if n <= fix_max:
+        return struct.pack(">B", fix | n)
+    for code, fmt in formats:
+        if n < 2 ** (8 * struct.calcsize(fmt)):
+            return struct.pack(">B", code) + struct.pack(fmt, n)
+    raise ValueError("msgpack object too large")
+
+
+def _pack_str(s):
+    s = s.encode("utf-8")
+    header = _pack_header(
+        0xA0, 0x1F, ((0xD9, ">B"), (0xDA, ">H"), (0xDB, ">I")), len(s)
+    )
+    return header + s
+
+
+def _pack_uint(n):
+    return _pack_header(0x00, 0x7F, ((0xCC, ">B"), (0xCE, ">I"), (0xCF, ">Q")), n)
+
+
+def _pack_array_header(n):
+    return _pack_header(0x90, 0x0F, ((0xDC, ">H"), (0xDD, ">I")), n)
+
+
+def _pack_map_header(n):
+    return _pack_header(0x80, 0x0F, ((0xDE, ">H"), (0xDF, ">I")), n)
+
+
+def table_from_msgpack_columns(nrows, identifiers, columns):
+    """
+    Create a reflection table from individually packed columns.
+
+    :param nrows: The number of rows
+    :param identifiers: The packed msgpack map of experiment identifiers
+    :param columns: A list of (name, packed column) pairs
+    :returns: The reflection table
+    """
+    parts = [
+        _pack_array_header(3),
+        _pack_str(_filetype),
+        _pack_uint(1),
+        _pack_map_header(3),
+        _pack_str("identifiers"),
+        identifiers,
+        _pack_str("nrows"),
+        _pack_uint(nrows),
+        _pack_str("data"),
+        _pack_map_header(len(columns)),
+    ]
+    for key, column in columns:
+        parts.append(_pack_str(key))
+        parts.append(column)
+    return flex.reflection_table.from_msgpack(b"".join(parts))
+
+
+def pack_identifiers(identifiers):
+    """
+    Pack a dictionary of experiment identifiers as a msgpack map.
+    """
+    parts = [_pack_map_header(len(identifiers))]
+    for key in sorted(identifiers):
+        if key < 0:
+            parts.append(struct.pack(">Bq", 0xD3, key))
+        else:
+            parts.append(_pack_uint(key))
+        parts.append(_pack_str(identifiers[key]))
+    return b"".join(parts)
+
+
+class MsgpackReflectionIndex(object):
+    """
+    An index of the columns in a msgpack reflection file.
+
+    The file is memory mapped so that only the columns which are read are
+    paged in from disk. Compressed files are read into memory instead.
+    """
+
+    def __init__(self, filename=None, buffer=None):
+        """
+        Build the column index
+
+        :param filename: The msgpack reflection file
+        :param buffer: Alternatively, a reflection table packed as msgpack
+        """
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        self.filename = filename
+        self._buffer = buffer
+        if buffer is None:
+            self._open(filename)
+        try:
+            self._build_index()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self, filename):
+        with libtbx.smart_open.for_reading(filename, "rb") as infile:
+            if isinstance(infile, io.BufferedReader):
+                try:
+                    self._buffer = mmap.mmap(
+                        infile.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+                except ValueError:
+                    # Cannot map an empty file
+                    pass
+            if self._buffer is None:
+                # Compressed files are decompressed into memory
+                self._buffer = infile.read()
+
+    def _build_index(self):
+        buf = self._buffer
+        n, pos = _read_expected(buf, 0, "array")
+        filetype, pos = _read_str(buf, pos)
+        if n != 3 or filetype != _filetype:
+            raise RuntimeError("%s is not a msgpack reflection file" % self.filename)
+        version, pos = _read_expected(buf, pos, "int")
+        if version != 1:
+            raise RuntimeError("Expected version 1, got %d" % version)
+        self.nrows = None
+        self.columns = {}
+        self._identifiers = None
+        nitems, pos = _read_expected(buf, pos, "map")
+        for i in range(nitems):
+            name, pos = _read_str(buf, pos)
+            if name == "nrows":
+                self.nrows, pos = _read_expected(buf, pos, "int")
+            elif name == "identifiers":
+                end = _skip(buf, pos)
+                self._identifiers = (pos, end)
+                pos = end
+            elif name == "data":
+                ncols, pos = _read_expected(buf, pos, "map")
+                for j in range(ncols):
+                    key, pos = _read_str(buf, pos)
+                    end = _skip(buf, pos)
+                    _, pos_type = _read_expected(buf, pos, "array")
+                    column_type, _ = _read_str(buf, pos_type)
+                    self.columns[key] = (column_type, pos, end)
+                    pos = end
+            else:
+                raise RuntimeError("Unknown key %s in reflection file" % name)
+        if self.nrows is None:
+            raise RuntimeError("Number of rows not found in reflection file")
+
+    def keys(self):
+        """
+        :returns: The column names in the order they appear in the file
+        """
+        return sorted(self.columns, key=lambda k: self.columns[k][1])
+
+    def column_type(self, key):
+        """
+        :returns: The type name of the column as written in the file
+        """
+        return self.columns[key][0]
+
+    def column_nbytes(self, key):
+        """
+        :returns: The size of the column in the file
+        """
+        return self.columns[key][2] - self.columns[key][1]
+
+    def read(self, columns=None):
+        """
+        Decode a set of columns into a reflection table.
+
+        :param columns: The column names to read, or None to read all columns
+        :returns: A reflection table with the columns and experiment identifiers
+        """
+        if columns is None:
+            columns = self.keys()
+        return table_from_msgpack_columns(
+            self.nrows,
+            self.identifiers_bytes(),
+            [(key, self.column_bytes(key)) for key in columns],
+        )
+
+    def column_bytes(self, key):
+        """
+        :returns: The packed msgpack object holding the column
+        """
+        if self._buffer is None:
+            raise RuntimeError("Reflection file index has been closed")
+        if key not in self.columns:
+            raise KeyError("Unknown column '%s'" % key)
+        _, start, end = self.columns[key]
+        return self._buffer[start:end]
+
+    def identifiers_bytes(self):
+        """
+        :returns: The packed msgpack map of experiment identifiers
+        """
+        if self._identifiers is None:
+            return _pack_map_header(0)
+        return self._buffer[slice(*self._identifiers)]
+
+    def close(self):
+        """
+        Release the memory map
+        """
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = None
+
+
+# The attributes of a lazy table which do not need every column to be loaded
+_lazy_attributes = frozenset(
+    [
+        "__class__",
+        "__dict__",
+        "__getitem__",
+        "__setitem__",
+        "__delitem__",
+        "__contains__",
+        "has_key",
+        "keys",
+        "ncols",
+        "nrows",
+        "size",
+        "experiment_identifiers",
+        "pending_columns",
+        "load_columns",
+        "load_all",
+    ]
+)
+
+
+class LazyReflectionTable(flex.reflection_table):
+    """
+    A reflection table which reads its columns from a msgpack file on demand.
+
+    The table has the full set of rows and experiment identifiers. Columns
+    which have not been read yet are decoded from the file the first time they
+    are accessed by name. Calling any other method of the table, e.g. select
+    or extend, first reads all of the remaining columns so that the result is
+    the same as for a fully loaded table. Passing the table directly to a C++
+    function that operates on the whole table bypasses this, so in that case
+    call load_all first.
+    """
+
+    @classmethod
+    def from_msgpack_file(cls, filename, columns=None):
+        """
+        Read a reflection table from a msgpack file
+
+        :param filename: The msgpack reflection file
+        :param columns: The columns to read straight away. All other columns are
+                        read on first access.
+        :returns: The lazy reflection table
+        """
+        index = MsgpackReflectionIndex(filename)
+        if columns is None:
+            columns = []
+        table = cls(index.nrows)
+        loaded = index.read(columns)
+        identifiers = loaded.experiment_identifiers()
+        for key in identifiers.keys():
+            table.experiment_identifiers()[key] = identifiers[key]
+        for key in columns:
+            table[key] = loaded[key]
+        pending = set(index.columns) - set(columns)
+        table.__dict__["_index"] = index
+        table.__dict__["_pending"] = pending
+        if not pending:
+            index.close()
+        return table
+
+    def __getattribute__(self, name):
+        if name not in _lazy_attributes:
+            if object.__getattribute__(self, "__dict__").get("_pending"):
+                object.__getattribute__(self, "load_all")()
+        return super(LazyReflectionTable, self).__getattribute__(name)
+
+    def pending_columns(self):
+        """
+        :returns: The names of the columns which have not been read yet
+        """
+        return sorted(self.__dict__.get("_pending", ()))
+
+    def load_columns(self, columns):
+        """
+        Read columns from the file if they have not been read yet
+        """
+        pending = self.__dict__.get("_pending", set())
+        columns = [c for c in columns if c in pending]
+        if not columns:
+            return
+        loaded = self.__dict__["_index"].read(columns)
+        for key in columns:
+            flex.reflection_table.__setitem__(self, key, loaded[key])
+            pending.discard(key)
+        if not pending:
+            self.__dict__["_index"].close()
+
+    def load_all(self):
+        """
+        Read all the remaining columns from the file
+        """
+        self.load_columns(self.pending_columns())
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            self.load_columns([key])
+        else:
+            self.load_all()
+        return super(LazyReflectionTable, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            self.__dict__.get("_pending", set()).discard(key)
+        else:
+            self.load_all()
+        super(LazyReflectionTable, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        pending = self.__dict__.get("_pending", set())
+        if isinstance(key, str) and key in pending:
+            pending.discard(key)
+            if not pending:
+                self.__dict__["_index"].close()
+            return
+        if not isinstance(key, str):
+            self.load_all()
+        super(LazyReflectionTable, self).__delitem__(key)
+
+    def __contains__(self, key):
+        return key in self.__dict__.get("_pending", ()) or super(
+            LazyReflectionTable, self
+        ).__contains__(key)
+
+    def has_key(self, key):
+        return key in self
+
+    def keys(self):
+        return list(super(LazyReflectionTable, self).keys()) + self.pending_columns()
+
+    def ncols(self):
+        return super(LazyReflectionTable, self).ncols() + len(
+            self.__dict__.get("_pending", ())
+        )
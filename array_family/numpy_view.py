@@ -0,0 +1,100 @@
+"""
+NumPy views of flex arrays which share memory with the flex array.
+
+flex.<type>.as_numpy_array() and flex.<type>(numpy_array) both copy the data.
+The functions here instead create a NumPy array over the storage of a flex
+array, so that large columns can be passed to NumPy, and results written back,
+without doubling the memory used.
+
+A view holds a reference to its flex array, so the storage is not released
+while the view exists. However, resizing the flex array (for example by
+extending the reflection table it belongs to) may move the storage, after
+which the view must not be used.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import cctbx.array_family.flex
+
+import dials_array_family_flex_ext
+
+__all__ = ["as_numpy_view", "flex_type_for", "is_view_of", "numpy_view_types"]
+
+# The NumPy element type and the trailing shape for each flex type
+numpy_view_types = {
+    cctbx.array_family.flex.bool: (np.bool_, ()),
+    cctbx.array_family.flex.int: (np.intc, ()),
+    cctbx.array_family.flex.size_t: (np.uintp, ()),
+    cctbx.array_family.flex.float: (np.float32, ()),
+    cctbx.array_family.flex.double: (np.float64, ()),
+    cctbx.array_family.flex.vec2_double: (np.float64, (2,)),
+    cctbx.array_family.flex.vec3_double: (np.float64, (3,)),
+    cctbx.array_family.flex.mat3_double: (np.float64, (3, 3)),
+    dials_array_family_flex_ext.int6: (np.intc, (6,)),
+    cctbx.array_family.flex.miller_index: (np.intc, (3,)),
+}
+
+
+class _FlexBuffer(object):
+    """
+    Expose the storage of a flex array through the NumPy array interface.
+    """
+
+    def __init__(self, array, readonly=False):
+        try:
+            dtype, shape = numpy_view_types[type(array)]
+        except KeyError:
+            raise TypeError("Cannot create a NumPy view of %s" % type(array).__name__)
+        dtype = np.dtype(dtype)
+        address, itemsize = dials_array_family_flex_ext.data_address(array)
+        assert itemsize == dtype.itemsize * int(np.prod(shape, dtype=int))
+        self.array = array
+        self.__array_interface__ = {
+            "version": 3,
+            "shape": (len(array),) + shape,
+            "typestr": dtype.str,
+            "data": (address, readonly),
+        }
+
+
+def as_numpy_view(array, readonly=False):
+    """
+    Create a NumPy array sharing memory with a flex array.
+
+    :param array: The flex array
+    :param readonly: Make the NumPy array read only
+    :returns: The NumPy array. Vector and matrix types have one trailing
+              dimension per component, e.g. (n, 3) for flex.vec3_double
+    """
+    if len(array) == 0 and type(array) in numpy_view_types:
+        dtype, shape = numpy_view_types[type(array)]
+        return np.empty((0,) + shape, dtype=dtype)
+    return np.asarray(_FlexBuffer(array, readonly))
+
+
+def is_view_of(view, array):
+    """
+    :returns: True if the NumPy array is a complete view of the flex array
+    """
+    if len(array) == 0 or not isinstance(view, np.ndarray):
+        return False
+    address, itemsize = dials_array_family_flex_ext.data_address(array)
+    return (
+        view.flags.c_contiguous
+        and view.__array_interface__["data"][0] == address
+        and view.nbytes == len(array) * itemsize
+    )
+
+
+def flex_type_for(array):
+    """
+    :returns: The flex type which can hold the elements of a NumPy array
+    """
+    for flex_type, (dtype, shape) in numpy_view_types.items():
+        if array.dtype == np.dtype(dtype) and array.shape[1:] == shape:
+            return flex_type
+    raise TypeError(
+        "No flex type for NumPy array of %s with shape %s" % (array.dtype, array.shape)
+    )
@@ -0,0 +1,408 @@
+"""
+A chunked, columnar file format for reflection tables.
+
+The file starts with a short magic string followed by any number of row
+groups, each laid out as
+
+  <uint64 header length> <JSON header> <column> <column> ...
+
+The JSON header records the number of rows in the group, the experiment
+identifiers, the name, type, size and compression of each column, and the
+minimum and maximum of a few columns which are commonly used to select
+reflections: "id", the z component of the observed (or else calculated) pixel
+centroid, "d" and "flags". Each column is stored as the msgpack object written
+by reflection_table.as_msgpack, optionally compressed with zlib.
+
+Row groups can be appended to an existing file without rewriting it, and a
+reader can use the statistics to skip every row group which cannot contain
+reflections matching a selection, before decoding any column data.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import struct
+import zlib
+
+from dials.array_family import flex
+from dials.array_family.msgpack_reader import (
+    MsgpackReflectionIndex,
+    pack_identifiers,
+    table_from_msgpack_columns,
+)
+
+__all__ = ["RowGroupReflectionFile", "is_row_group_file"]
+
+_magic = b"DIALSRG1"
+_header_size = struct.Struct("<Q")
+
+# The default number of rows in each row group
+default_row_group_size = 1000000
+
+
+def is_row_group_file(filename):
+    """
+    :returns: True if the file is a row group reflection file
+    """
+    if filename and hasattr(filename, "__fspath__"):
+        filename = filename.__fspath__()
+    try:
+        with open(filename, "rb") as infile:
+            return infile.read(len(_magic)) == _magic
+    except (IOError, OSError):
+        return False
+
+
+def _z_column(table):
+    for key in ("xyzobs.px.value", "xyzcal.px"):
+        if key in table:
+            return table[key].parts()[2]
+    return None
+
+
+def _statistics(table):
+    """
+    Compute the statistics used to skip row groups when reading.
+    """
+    stats = {}
+    if len(table) == 0:
+        return stats
+    if "id" in table:
+        stats["id"] = [flex.min(table["id"]), flex.max(table["id"])]
+    z = _z_column(table)
+    if z is not None:
+        stats["z"] = [flex.min(z), flex.max(z)]
+    if "d" in table:
+        stats["d"] = [flex.min(table["d"]), flex.max(table["d"])]
+    if "flags" in table:
+        flags = table["flags"]
+        # The bitwise or of all the flags set in the row group
+        any_flags = 0
+        for value in flex.reflection_table.flags.values.values():
+            if table.get_flags(value).count(True):
+                any_flags |= int(value)
+        stats["flags"] = [int(flex.min(flags)), int(flex.max(flags)), any_flags]
+    return stats
+
+
+class _Selection(object):
+    """
+    A selection of reflections by experiment, z, resolution and flags.
+    """
+
+    def __init__(self, ids=None, z_range=None, d_range=None, flags=None):
+        self.ids = None if ids is None else set(ids)
+        self.z_range = z_range
+        self.d_range = d_range
+        self.flags = None if flags is None else int(flags)
+
+    def columns(self, z_key):
+        """
+        :returns: The columns needed to apply the selection to rows
+        """
+        columns = []
+        if self.ids is not None:
+            columns.append("id")
+        if self.z_range is not None:
+            columns.append(z_key)
+        if self.d_range is not None:
+            columns.append("d")
+        if self.flags is not None:
+            columns.append("flags")
+        return columns
+
+    def skip(self, stats):
+        """
+        :returns: True if no row in a group with these statistics can match
+        """
+        if self.ids is not None and "id" in stats:
+            low, high = stats["id"]
+            if not any(low <= i <= high for i in self.ids):
+                return True
+        if self.z_range is not None and "z" in stats:
+            low, high = stats["z"]
+            if high < self.z_range[0] or low >= self.z_range[1]:
+                return True
+        if self.d_range is not None and "d" in stats:
+            low, high = stats["d"]
+            d_min, d_max = self.d_range
+            if d_min is not None and high < d_min:
+                return True
+            if d_max is not None and low > d_max:
+                return True
+        if self.flags is not None and "flags" in stats:
+            if stats["flags"][2] & self.flags != self.flags:
+                return True
+        return False
+
+    def select(self, table):
+        """
+        :returns: The selection of rows of the table which match
+        """
+        selection = flex.bool(len(table), True)
+        if self.ids is not None:
+            id_selection = flex.bool(len(table), False)
+            for i in self.ids:
+                id_selection |= table["id"] == i
+            selection &= id_selection
+        if self.z_range is not None:
+            z = _z_column(table)
+            selection &= (z >= self.z_range[0]) & (z < self.z_range[1])
+        if self.d_range is not None:
+            d_min, d_max = self.d_range
+            if d_min is not None:
+                selection &= table["d"] >= d_min
+            if d_max is not None:
+                selection &= table["d"] <= d_max
+        if self.flags is not None:
+            selection &= table.get_flags(self.flags)
+        return selection
+
+
+class RowGroupReflectionFile(object):
+    """
+    Read and append to a row group reflection file.
+    """
+
+    def __init__(self, filename):
+        """
+        Read the row group headers from the file
+
+        :param filename: The row group reflection file
+        """
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        self.filename = filename
+        with open(filename, "rb") as infile:
+            if infile.read(len(_magic)) != _magic:
+                raise RuntimeError("%s is not a row group reflection file" % filename)
+            self.row_groups = _read_headers(infile)
+
+    @classmethod
+    def write(
+        cls,
+        table,
+        filename,
+        row_group_size=default_row_group_size,
+        compression=None,
+    ):
+        """
+        Write a reflection table to a new row group file.
+
+        :param table: The reflection table
+        :param filename: The file to write
+        :param row_group_size: The maximum number of rows in each row group
+        :param compression: The columns to compress with zlib, or True for all
+        :returns: The row group reflection file
+        """
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        with open(filename, "wb") as outfile:
+            outfile.write(_magic)
+            _write_row_groups(outfile, table, row_group_size, compression)
+        return cls(filename)
+
+    def append(self, table, row_group_size=default_row_group_size, compression=None):
+        """
+        Append the rows of a reflection table as new row groups.
+
+        The table must have the same columns as the rows already in the file,
+        and must not map an experiment id to a different identifier.
+
+        :param table: The reflection table
+        :param row_group_size: The maximum number of rows in each row group
+        :param compression: The columns to compress with zlib, or True for all
+        """
+        if self.row_groups:
+            if sorted(table.keys()) != sorted(self.keys()):
+                raise ValueError(
+                    "Cannot append columns %s to a file with columns %s"
+                    % (sorted(table.keys()), sorted(self.keys()))
+                )
+            identifiers = self.experiment_identifiers()
+            for key in table.experiment_identifiers().keys():
+                value = table.experiment_identifiers()[key]
+                if identifiers.get(key, value) != value:
+                    raise ValueError(
+                        "Experiment id %d is already mapped to %s"
+                        % (key, identifiers[key])
+                    )
+        with open(self.filename, "ab") as outfile:
+            offset = outfile.tell()
+            _write_row_groups(outfile, table, row_group_size, compression)
+        with open(self.filename, "rb") as infile:
+            infile.seek(offset)
+            self.row_groups.extend(_read_headers(infile))
+
+    @property
+    def nrows(self):
+        return sum(group["nrows"] for group in self.row_groups)
+
+    def keys(self):
+        """
+        :returns: The column names
+        """
+        if not self.row_groups:
+            return []
+        return [column["name"] for column in self.row_groups[0]["columns"]]
+
+    def experiment_identifiers(self):
+        """
+        :returns: A dictionary of experiment identifiers from all row groups
+        """
+        identifiers = {}
+        for group in self.row_groups:
+            for key, value in group["identifiers"].items():
+                identifiers[int(key)] = value
+        return identifiers
+
+    def read(
+        self,
+        columns=None,
+        ids=None,
+        identifiers=None,
+        z_range=None,
+        d_range=None,
+        flags=None,
+    ):
+        """
+        Read a selection of rows and columns into a reflection table.
+
+        Row groups whose statistics show that none of their rows can match
+        the selection are skipped without being read.
+
+        :param columns: The column names to read, or None to read all columns
+        :param ids: Only read reflections with these experiment ids
+        :param identifiers: Only read reflections with these experiment
+                            identifiers
+        :param z_range: Only read reflections with z0 <= z < z1
+        :param d_range: Only read reflections with d_min <= d <= d_max, where
+                        either of (d_min, d_max) may be None
+        :param flags: Only read reflections with all of these flags set
+        :returns: The reflection table
+        """
+        if identifiers is not None:
+            lookup = {v: k for k, v in self.experiment_identifiers().items()}
+            missing = [i for i in identifiers if i not in lookup]
+            if missing:
+                raise KeyError("Unknown experiment identifiers %s" % missing)
+            ids = [lookup[i] for i in identifiers] + list(ids or [])
+        if columns is None:
+            columns = self.keys()
+        missing = [c for c in columns if c not in self.keys()]
+        if missing:
+            raise KeyError("Unknown column '%s'" % missing[0])
+
+        selection = _Selection(ids, z_range, d_range, flags)
+        z_key = "xyzobs.px.value" if "xyzobs.px.value" in self.keys() else "xyzcal.px"
+        extra = [c for c in selection.columns(z_key) if c not in columns]
+        for key in extra:
+            if key not in self.keys():
+                raise KeyError("Cannot select on missing column '%s'" % key)
+
+        groups = [g for g in self.row_groups if not selection.skip(g["stats"])]
+        if not groups:
+            # Keep the columns even though there are no rows
+            groups = self.row_groups[:1]
+            selection = None
+        result = None
+        with open(self.filename, "rb") as infile:
+            for group in groups:
+                table = self._read_group(infile, group, list(columns) + extra)
+                if selection is not None:
+                    table = table.select(selection.select(table))
+                else:
+                    table = table.select(flex.bool(len(table), False))
+                for key in extra:
+                    del table[key]
+                if result is None:
+                    result = table
+                else:
+                    result.extend(table)
+        if result is None:
+            return flex.reflection_table()
+        return result
+
+    def _read_group(self, infile, group, columns):
+        packed = []
+        by_name = {column["name"]: column for column in group["columns"]}
+        for key in columns:
+            column = by_name[key]
+            infile.seek(column["offset"])
+            data = infile.read(column["nbytes"])
+            if column["compression"] == "zlib":
+                data = zlib.decompress(data)
+            packed.append((key, data))
+        identifiers = {int(k): v for k, v in group["identifiers"].items()}
+        return table_from_msgpack_columns(
+            group["nrows"], pack_identifiers(identifiers), packed
+        )
+
+
+def _read_headers(infile):
+    """
+    Read the row group headers from the current position to the end of a file.
+    """
+    headers = []
+    while True:
+        size = infile.read(_header_size.size)
+        if not size:
+            return headers
+        if len(size) != _header_size.size:
+            raise RuntimeError("Truncated row group header")
+        (size,) = _header_size.unpack(size)
+        header = json.loads(infile.read(size).decode("utf-8"))
+        offset = infile.tell()
+        for column in header["columns"]:
+            column["offset"] = offset
+            offset += column["nbytes"]
+        infile.seek(offset)
+        headers.append(header)
+
+
+def _write_row_groups(outfile, table, row_group_size, compression):
+    """
+    Write the rows of a table to a file as a sequence of row groups.
+    """
+    if row_group_size < 1:
+        raise ValueError("Row group size must be at least 1")
+    nrows = len(table)
+    for start in range(0, max(nrows, 1), row_group_size):
+        subset = table[start : min(start + row_group_size, nrows)]
+        _write_row_group(outfile, subset, compression)
+
+
+def _write_row_group(outfile, table, compression):
+    index = MsgpackReflectionIndex(buffer=table.as_msgpack())
+    columns = []
+    payload = []
+    for key in index.keys():
+        data = index.column_bytes(key)
+        if compression is True or (compression and key in compression):
+            data = zlib.compress(data)
+            method = "zlib"
+        else:
+            method = "none"
+        columns.append(
+            {
+                "name": key,
+                "type": index.column_type(key),
+                "nbytes": len(data),
+                "compression": method,
+            }
+        )
+        payload.append(data)
+    header = {
+        "nrows": len(table),
+        "identifiers": {
+            str(k): table.experiment_identifiers()[k]
+            for k in table.experiment_identifiers().keys()
+        },
+        "columns": columns,
+        "stats": _statistics(table),
+    }
+    header = json.dumps(header).encode("utf-8")
+    outfile.write(_header_size.pack(len(header)))
+    outfile.write(header)
+    for data in payload:
+        outfile.write(data)
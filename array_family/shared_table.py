@@ -0,0 +1,213 @@
+"""
+Pass reflection tables to and from multiprocessing workers in shared memory.
+
+Sending a reflection table to a worker normally means pickling every column,
+writing the bytes down a pipe, and unpickling a second copy on the other side.
+A SharedReflectionTable instead copies each numeric column once into its own
+multiprocessing.shared_memory segment. Only a small descriptor naming the
+segments is pickled, and the worker reads the columns straight out of shared
+memory. Columns which cannot be shared this way (e.g. strings or shoeboxes) are
+packed with msgpack and travel with the descriptor.
+
+A worker can write its results back into the same segments. Columns which
+already exist with the same type and number of rows are overwritten in place,
+and only new columns need new segments. Segments are only ever unlinked by the
+process which finally reads the results, normally the parent process, which
+frees any segments that a worker replaced along with those still in use.
+
+Shared memory needs Python 3.8 and workers started with fork, so that they
+share the resource tracker of the parent process. Use is_available() to check.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+
+import numpy as np
+
+from dials.array_family import flex
+from dials.array_family.numpy_view import as_numpy_view, numpy_view_types
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+__all__ = ["SharedReflectionTable", "is_available"]
+
+_column_types = {t.__name__: t for t in numpy_view_types}
+
+
+def is_available():
+    """
+    :returns: True if reflection tables can be passed in shared memory
+    """
+    return (
+        shared_memory is not None
+        and multiprocessing.get_start_method(allow_none=False) == "fork"
+    )
+
+
+def _column_array(segment, column_type, nrows):
+    dtype, shape = numpy_view_types[column_type]
+    return np.ndarray((nrows,) + shape, dtype=dtype, buffer=segment.buf)
+
+
+class SharedReflectionTable(object):
+    """
+    A picklable descriptor of a reflection table held in shared memory.
+    """
+
+    def __init__(self, nrows, identifiers):
+        """
+        Create an empty descriptor
+
+        :param nrows: The number of rows
+        :param identifiers: A dictionary of experiment identifiers
+        """
+        self.nrows = nrows
+        self.identifiers = identifiers
+        self.columns = {}
+        self.packed = None
+        # names of segments no longer in use, to be freed by unlink
+        self.stale = []
+        self._segments = {}
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Copy a reflection table into shared memory.
+
+        :param table: The reflection table
+        :returns: The descriptor
+        """
+        identifiers = table.experiment_identifiers()
+        result = cls(table.size(), {k: identifiers[k] for k in identifiers.keys()})
+        try:
+            result._write(table)
+        except Exception:
+            result.unlink()
+            raise
+        return result
+
+    def update(self, table):
+        """
+        Replace the contents with a reflection table.
+
+        Columns with an existing segment of the same type and size are written
+        in place. Segments of columns which are not in the table, or which no
+        longer have the right size, are not unlinked here, as this may be called
+        by a worker, but are left for unlink to free.
+
+        :param table: The reflection table
+        :returns: The descriptor
+        """
+        if table.size() != self.nrows:
+            for key in list(self.columns):
+                self._retire_column(key)
+            self.nrows = table.size()
+        identifiers = table.experiment_identifiers()
+        self.identifiers = {k: identifiers[k] for k in identifiers.keys()}
+        for key in list(self.columns):
+            if key not in table or type(table[key]).__name__ != self.columns[key][0]:
+                self._retire_column(key)
+        self._write(table)
+        return self
+
+    def _write(self, table):
+        other = []
+        for key in table.keys():
+            column = table[key]
+            if type(column) not in numpy_view_types:
+                other.append(key)
+                continue
+            type_name = type(column).__name__
+            if key in self.columns:
+                segment = self._segment(key)
+            else:
+                nbytes = as_numpy_view(column).nbytes
+                segment = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+                self.columns[key] = (type_name, segment.name)
+                self._segments[key] = segment
+            array = _column_array(segment, type(column), self.nrows)
+            array[...] = as_numpy_view(column, readonly=True)
+            del array
+        self.packed = None
+        if other:
+            subset = flex.reflection_table()
+            for key in other:
+                subset[key] = table[key]
+            self.packed = subset.as_msgpack()
+
+    def _segment(self, key):
+        if key not in self._segments:
+            self._segments[key] = shared_memory.SharedMemory(name=self.columns[key][1])
+        return self._segments[key]
+
+    def as_table(self):
+        """
+        Copy the columns out of shared memory into a reflection table.
+
+        :returns: The reflection table
+        """
+        if self.packed is not None:
+            table = flex.reflection_table.from_msgpack(self.packed)
+        else:
+            table = flex.reflection_table(self.nrows)
+        for key, (type_name, _) in self.columns.items():
+            column_type = _column_types[type_name]
+            array = _column_array(self._segment(key), column_type, self.nrows)
+            table.new_numpy_column(key, column_type)[...] = array
+            del array
+        for key, value in self.identifiers.items():
+            table.experiment_identifiers()[key] = value
+        return table
+
+    def nbytes(self):
+        """
+        :returns: The total size of the shared memory segments
+        """
+        return sum(self._segment(key).size for key in self.columns)
+
+    def close(self):
+        """
+        Close the segments in this process, without freeing them
+        """
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+
+    def _retire_column(self, key):
+        segment = self._segments.pop(key, None)
+        if segment is not None:
+            segment.close()
+        self.stale.append(self.columns.pop(key)[1])
+
+    def unlink(self, missing_ok=False):
+        """
+        Free the shared memory segments, including any no longer in use. This
+        should only be called by the process which reads the final results.
+
+        :param missing_ok: Ignore segments which have already been freed
+        """
+        for key in list(self.columns):
+            self._retire_column(key)
+        for name in self.stale:
+            try:
+                segment = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                if not missing_ok:
+                    raise
+            else:
+                segment.close()
+                segment.unlink()
+        self.stale = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_segments"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
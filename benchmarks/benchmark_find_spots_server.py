@@ -0,0 +1,214 @@
+"""
+Benchmark the per-request latency of dials.find_spots_server.
+
+A server is started for each mode, and the same images are sent to it in four
+ways:
+
+  single      one request at a time, each on a new connection
+  keep_alive  one request at a time, reusing one kept-alive connection
+  concurrent  nproc client threads, each reusing its own kept-alive connection
+  batch       all images in one POST /batch request, streamed back
+
+The latency of each image is measured from when its request was sent (for
+batch, from when the batch was sent) until its result arrived. The p50, p99,
+mean and maximum latencies and the total time for each pass are printed as
+JSON, and optionally written to a file so they can be compared across commits.
+An untimed pass over the images is made first, so that the worker processes
+have started and the imported images are cached.
+
+Usage: dials.python benchmark_find_spots_server.py [--modes=queue,fork]
+           [--nproc=4] [--repeats=3] [--param=min_spot_size=3]
+           [--output=benchmark_find_spots_server.json] image_1.cbf ...
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+from dials.command_line.find_spots_client import percentile, work, work_batch
+
+
+def _free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def _wait_for_server(port, max_wait=60):
+    end = time.time() + max_wait
+    while time.time() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError("Server failed to start after %d seconds" % max_wait)
+
+
+def _path(filename, params):
+    return ";".join([filename] + list(params))
+
+
+def _check(response):
+    d = json.loads(response)
+    if "error" in d:
+        raise RuntimeError("%s: %s" % (d.get("image"), d["error"]))
+
+
+def _single(host, port, filenames, params):
+    """Send each image on a new connection, closed after the response."""
+    latencies = []
+    for filename in filenames:
+        start = time.time()
+        conn = http.client.HTTPConnection(host, port)
+        try:
+            conn.request(
+                "GET", _path(filename, params), headers={"Connection": "close"}
+            )
+            response = conn.getresponse().read()
+        finally:
+            conn.close()
+        latencies.append(time.time() - start)
+        _check(response)
+    return latencies
+
+
+def _keep_alive(host, port, filenames, params):
+    """Send each image in turn on the kept-alive connection of this thread."""
+    latencies = []
+    for filename in filenames:
+        start = time.time()
+        response = work(host, port, filename, params)
+        latencies.append(time.time() - start)
+        _check(response)
+    return latencies
+
+
+def _concurrent(host, port, filenames, params, nproc):
+    """Send the images from nproc threads, each with a kept-alive connection."""
+    latencies = []
+    errors = []
+
+    def worker(chunk):
+        try:
+            latencies.extend(_keep_alive(host, port, chunk, params))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=worker, args=(filenames[i::nproc],))
+        for i in range(nproc)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return latencies
+
+
+def _batch(host, port, filenames, params):
+    """Send all the images in one batch request."""
+    latencies = []
+    start = time.time()
+    for d in work_batch(host, port, filenames, params):
+        latencies.append(time.time() - start)
+        if "error" in d:
+            raise RuntimeError("%s: %s" % (d.get("image"), d["error"]))
+    return latencies
+
+
+def _summary(latencies, total):
+    return {
+        "requests": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies),
+        "max": max(latencies),
+        "total": total,
+    }
+
+
+def run_mode(mode, filenames, params, nproc, repeats):
+    """Start a server in the given mode and time each way of sending images."""
+    host, port = "127.0.0.1", _free_port()
+    server = subprocess.Popen(
+        [
+            "dials.find_spots_server",
+            "port=%d" % port,
+            "nproc=%d" % nproc,
+            "mode=%s" % mode,
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    methods = [
+        ("single", lambda: _single(host, port, filenames, params)),
+        ("keep_alive", lambda: _keep_alive(host, port, filenames, params)),
+        ("concurrent", lambda: _concurrent(host, port, filenames, params, nproc)),
+        ("batch", lambda: _batch(host, port, filenames, params)),
+    ]
+    result = {"mode": mode, "nproc": nproc, "images": len(filenames)}
+    try:
+        _wait_for_server(port)
+        _concurrent(host, port, filenames, params, nproc)
+        for name, method in methods:
+            latencies = []
+            start = time.time()
+            for _ in range(repeats):
+                latencies.extend(method())
+            result[name] = _summary(latencies, (time.time() - start) / repeats)
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def _comma_separated(cast):
+    return lambda value: [cast(v) for v in value.split(",")]
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument(
+        "--modes", type=_comma_separated(str), default=["queue", "fork"]
+    )
+    parser.add_argument("--nproc", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="A find_spots parameter to send with each request, e.g. d_min=2",
+    )
+    parser.add_argument("--output", default=None)
+    options = parser.parse_args(args)
+
+    # The server is sent absolute paths as the request path
+    filenames = [os.path.abspath(f) for f in options.images]
+    results = [
+        run_mode(mode, filenames, options.param, options.nproc, options.repeats)
+        for mode in options.modes
+    ]
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output)
+    return results
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,121 @@
+"""
+Compare reading and writing reflection tables as msgpack and row group files.
+
+A synthetic table is written in both formats, then read back in full and with
+selections on experiment id, z and resolution. For msgpack files the
+selections are applied after reading the whole table; for row group files they
+are pushed down to the reader. Timings and file sizes are printed as JSON.
+
+Usage: dials.python benchmark_reflection_files.py [--nrows=20000000] [--tmpdir=.]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from dials.array_family import flex
+
+
+def synthetic_table(nrows, nexperiments=4, nimages=3600):
+    flex.set_random_seed(0)
+    table = flex.reflection_table()
+    table["id"] = flex.floor(flex.random_double(nrows) * nexperiments).iround()
+    # Reflections are written in the order that they are found
+    z = flex.random_double(nrows) * nimages
+    order = flex.sort_permutation(z)
+    table["xyzobs.px.value"] = flex.vec3_double(
+        flex.random_double(nrows) * 2000,
+        flex.random_double(nrows) * 2000,
+        z.select(order),
+    )
+    table["d"] = 1.0 + flex.random_double(nrows) * 50
+    table["miller_index"] = flex.miller_index(
+        flex.random_int_gaussian_distribution(nrows, 0, 20),
+        flex.random_int_gaussian_distribution(nrows, 0, 20),
+        flex.random_int_gaussian_distribution(nrows, 0, 20),
+    )
+    table["intensity.sum.value"] = flex.random_double(nrows) * 1000
+    table["intensity.sum.variance"] = flex.random_double(nrows) * 1000
+    table["flags"] = flex.size_t(nrows, 0)
+    table.set_flags(flex.random_bool(nrows, 0.9), table.flags.indexed)
+    for i in range(nexperiments):
+        table.experiment_identifiers()[i] = "experiment-%d" % i
+    return table
+
+
+def _time(function):
+    start = time.time()
+    result = function()
+    return time.time() - start, result
+
+
+def _msgpack_selections(filename, nimages):
+    table = flex.reflection_table.from_msgpack_file(filename)
+    z = table["xyzobs.px.value"].parts()[2]
+    return {
+        "experiment": table.select_on_experiment_identifiers(["experiment-1"]),
+        "z_range": table.select((z >= 0) & (z < nimages / 10)),
+        "d_range": table.select(table["d"] <= 2.0),
+    }
+
+
+def _row_group_selections(filename, nimages):
+    return {
+        "experiment": flex.reflection_table.from_row_group_file(
+            filename, identifiers=["experiment-1"]
+        ),
+        "z_range": flex.reflection_table.from_row_group_file(
+            filename, z_range=(0, nimages / 10)
+        ),
+        "d_range": flex.reflection_table.from_row_group_file(
+            filename, d_range=(None, 2.0)
+        ),
+    }
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nrows", type=int, default=20000000)
+    parser.add_argument("--row-group-size", type=int, default=1000000)
+    parser.add_argument("--compression", action="store_true")
+    parser.add_argument("--tmpdir", default=None)
+    options = parser.parse_args(args)
+
+    nimages = 3600
+    table = synthetic_table(options.nrows, nimages=nimages)
+    directory = tempfile.mkdtemp(dir=options.tmpdir)
+    msgpack_file = os.path.join(directory, "reflections.refl")
+    row_group_file = os.path.join(directory, "reflections.rg.refl")
+    results = {"nrows": options.nrows, "row_group_size": options.row_group_size}
+    try:
+        results["msgpack"] = {
+            "write": _time(lambda: table.as_msgpack_file(msgpack_file))[0],
+            "read": _time(lambda: flex.reflection_table.from_file(msgpack_file))[0],
+            "select": _time(lambda: _msgpack_selections(msgpack_file, nimages))[0],
+            "size": os.path.getsize(msgpack_file),
+        }
+        results["row_group"] = {
+            "write": _time(
+                lambda: table.as_row_group_file(
+                    row_group_file,
+                    row_group_size=options.row_group_size,
+                    compression=options.compression or None,
+                )
+            )[0],
+            "read": _time(lambda: flex.reflection_table.from_file(row_group_file))[0],
+            "select": _time(lambda: _row_group_selections(row_group_file, nimages))[0],
+            "size": os.path.getsize(row_group_file),
+        }
+    finally:
+        shutil.rmtree(directory)
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    run()
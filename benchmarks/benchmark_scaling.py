@@ -0,0 +1,295 @@
+"""
+Benchmark dials.scale on synthetic multi-sweep datasets.
+
+Synthetic rotation sweeps are generated for a tetragonal crystal, with the
+observed intensities modulated by a smooth scale and decay across each sweep.
+ScalingAlgorithm (and optionally ScaleAndFilterAlgorithm) is then run end to
+end for every combination of dataset count, reflections per dataset, scaling
+model and nproc. Each configuration is run in a fresh process, so that the
+peak RSS reported is for that configuration alone. The peak RSS of the largest
+worker process is reported separately, as worker memory is not included in
+the peak RSS of the main process.
+
+The cumulative time spent in each phase of the algorithm is recorded alongside
+the total time. Phases are timed inclusively, so Ih table creation is also
+counted within the phases that create Ih tables. The results are printed as
+JSON, and optionally written to a file so they can be compared across commits.
+
+Usage: dials.python benchmark_scaling.py [--datasets=1,4] [--reflections=20000]
+           [--models=physical,KB,array,dose_decay] [--nproc=1,4] [--filter]
+           [--output=benchmark_scaling.json]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+from cctbx import crystal, miller, sgtbx
+from dxtbx.model import Beam, Crystal, Detector, Experiment, Goniometer, Scan
+from dxtbx.model.experiment_list import ExperimentList
+from libtbx import phil
+
+from dials.algorithms.scaling import Ih_table, algorithm, scaler
+from dials.algorithms.scaling.algorithm import ScaleAndFilterAlgorithm, ScalingAlgorithm
+from dials.algorithms.statistics.cc_half_algorithm import CCHalfFromDials
+from dials.array_family import flex
+from dials.command_line.scale import phil_scope
+
+
+def synthetic_experiments(n_datasets, n_images, unit_cell, space_group):
+    """Create rotation sweeps sharing one crystal model."""
+    symmetry = crystal.symmetry(unit_cell=unit_cell, space_group_symbol=space_group)
+    direct = symmetry.unit_cell().orthogonalization_matrix()
+    crystal_model = Crystal(
+        direct[0:9:3],
+        direct[1:9:3],
+        direct[2:9:3],
+        space_group=sgtbx.space_group_info(space_group).group(),
+    )
+    experiments = ExperimentList()
+    for i in range(n_datasets):
+        experiment = Experiment(
+            beam=Beam(s0=(0.0, 0.0, -1.0)),
+            scan=Scan(image_range=[1, n_images], oscillation=[0.0, 0.5]),
+            goniometer=Goniometer((1.0, 0.0, 0.0)),
+            detector=Detector(),
+            crystal=crystal_model,
+        )
+        experiment.identifier = str(i)
+        experiments.append(experiment)
+    return experiments
+
+
+def synthetic_intensities(crystal_symmetry, d_min, b_factor=20.0):
+    """Generate Wilson-distributed intensities for all indices in P1."""
+    asu = miller.build_set(crystal_symmetry, anomalous_flag=False, d_min=d_min)
+    s_sq = asu.d_star_sq().data() / 4.0
+    # exponential distribution from uniform deviates in (0, 1]
+    wilson = -flex.log(1.0 - flex.random_double(asu.size()))
+    data = 1000.0 * wilson * flex.exp(-2.0 * b_factor * s_sq)
+    return miller.array(asu, data=data).expand_to_p1().generate_bijvoet_mates()
+
+
+def synthetic_reflections(experiments, intensities, n_reflections):
+    """Sample observations of the intensities for each experiment."""
+    reflections = []
+    unit_cell = intensities.unit_cell()
+    for i, experiment in enumerate(experiments):
+        n_images = experiment.scan.get_num_images()
+        sel = flex.random_size_t(n_reflections, intensities.size())
+        observed = intensities.select(sel)
+        table = flex.reflection_table()
+        table["id"] = flex.int(n_reflections, i)
+        table.experiment_identifiers()[i] = experiment.identifier
+        table["miller_index"] = observed.indices()
+        table["d"] = unit_cell.d(observed.indices())
+        z = flex.random_double(n_reflections) * n_images
+        table["xyzobs.px.value"] = flex.vec3_double(
+            flex.random_double(n_reflections) * 2000,
+            flex.random_double(n_reflections) * 2000,
+            z,
+        )
+        theta = flex.random_double(n_reflections) * 0.6
+        phi = flex.random_double(n_reflections) * 2.0 * math.pi
+        table["s1"] = flex.vec3_double(
+            flex.sin(theta) * flex.cos(phi),
+            flex.sin(theta) * flex.sin(phi),
+            -flex.cos(theta),
+        )
+        # a smooth scale variation across the sweep, plus radiation damage
+        scale = (1.0 + 0.2 * flex.sin(z * 2.0 * math.pi / n_images)) * flex.exp(
+            -z / n_images / (table["d"] * table["d"])
+        )
+        true_intensity = observed.data() * scale
+        variance = true_intensity + 10.0
+        noise = (flex.random_double(n_reflections) - 0.5) * 2.0 * flex.sqrt(variance)
+        for intensity in ("sum", "prf"):
+            table["intensity.%s.value" % intensity] = true_intensity + noise
+            table["intensity.%s.variance" % intensity] = variance
+        table["partiality"] = flex.double(n_reflections, 1.0)
+        table["flags"] = flex.size_t(n_reflections, 0)
+        table.set_flags(flex.bool(n_reflections, True), table.flags.integrated_sum)
+        table.set_flags(flex.bool(n_reflections, True), table.flags.integrated_prf)
+        reflections.append(table)
+    return reflections
+
+
+def scaling_params(model, nproc, filtering, n_datasets, directory):
+    params = phil_scope.fetch(phil.parse("")).extract()
+    params.model = model
+    params.scaling_options.nproc = nproc
+    params.output.html = None
+    params.output.json = None
+    if filtering:
+        params.filtering.method = "deltacchalf"
+        if n_datasets == 1:
+            # dataset mode is only possible when scaling multiple datasets
+            params.filtering.deltacchalf.mode = "image_group"
+        params.filtering.output.scale_and_filter_results = os.path.join(
+            directory, "scale_and_filter_results.json"
+        )
+    return params
+
+
+def _timed_phases():
+    """The functions to time, as (phase, owner, attribute name)."""
+    return [
+        ("Ih_table", Ih_table.IhTable, "__init__"),
+        ("minimisation", scaler.ScalerBase, "_perform_scaling"),
+        ("outlier_rejection", scaler, "determine_outlier_index_arrays"),
+        ("error_model", scaler, "run_error_model_refinement"),
+        ("merging_stats", algorithm, "merging_stats_from_scaled_array"),
+        ("filtering", CCHalfFromDials, "run"),
+    ]
+
+
+@contextlib.contextmanager
+def phase_timer():
+    """Accumulate the time spent in each phase while the context is active."""
+    timings = collections.OrderedDict()
+    originals = []
+
+    def timed(phase, function):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings[phase] += time.time() - start
+
+        return wrapper
+
+    for phase, owner, name in _timed_phases():
+        timings[phase] = 0.0
+        original = vars(owner)[name]
+        originals.append((owner, name, original))
+        setattr(owner, name, timed(phase, original))
+    try:
+        yield timings
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # getrusage returns kb on linux, bytes on mac
+    units_per_mb = 1024
+    if platform.system() == "Darwin":
+        units_per_mb = 1024 * 1024
+    return resource.getrusage(who).ru_maxrss / units_per_mb
+
+
+def run_configuration(configuration):
+    """Generate the data and run the scaling algorithm for one configuration."""
+    flex.set_random_seed(0)
+    experiments = synthetic_experiments(
+        configuration["datasets"],
+        configuration["images"],
+        (50, 50, 80, 90, 90, 90),
+        "P 41 21 2",
+    )
+    intensities = synthetic_intensities(
+        experiments[0].crystal.get_crystal_symmetry(), d_min=configuration["d_min"]
+    )
+    reflections = synthetic_reflections(
+        experiments, intensities, configuration["reflections"]
+    )
+    directory = tempfile.mkdtemp()
+    params = scaling_params(
+        configuration["model"],
+        configuration["nproc"],
+        configuration["filter"],
+        configuration["datasets"],
+        directory,
+    )
+    algorithm_class = (
+        ScaleAndFilterAlgorithm if configuration["filter"] else ScalingAlgorithm
+    )
+    result = dict(configuration)
+    try:
+        with phase_timer() as timings:
+            start = time.time()
+            script = algorithm_class(params, experiments, reflections)
+            script.run()
+            result["total"] = time.time() - start
+        result["phases"] = timings
+        if script.merging_statistics_result:
+            overall = script.merging_statistics_result.overall
+            result["cc_one_half"] = overall.cc_one_half
+            result["r_meas"] = overall.r_meas
+    finally:
+        shutil.rmtree(directory)
+    result["peak_rss_mb"] = peak_rss_mb()
+    # The largest of the worker processes that have finished, for nproc > 1
+    result["peak_rss_children_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def _comma_separated(cast):
+    return lambda value: [cast(v) for v in value.split(",")]
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--datasets", type=_comma_separated(int), default=[1, 4])
+    parser.add_argument("--reflections", type=_comma_separated(int), default=[20000])
+    parser.add_argument(
+        "--models",
+        type=_comma_separated(str),
+        default=["physical", "KB", "array", "dose_decay"],
+    )
+    parser.add_argument("--nproc", type=_comma_separated(int), default=[1, 4])
+    parser.add_argument("--images", type=int, default=360)
+    parser.add_argument("--d-min", type=float, default=1.5)
+    parser.add_argument(
+        "--filter", action="store_true", help="Also run scale and filter"
+    )
+    parser.add_argument("--output", default=None)
+    options = parser.parse_args(args)
+
+    filtering = [False, True] if options.filter else [False]
+    results = []
+    # Use a fresh process for each configuration, so the peak RSS is not
+    # inherited from an earlier configuration.
+    context = multiprocessing.get_context("spawn")
+    for datasets, reflections, model, nproc, filter_ in itertools.product(
+        options.datasets, options.reflections, options.models, options.nproc, filtering
+    ):
+        configuration = {
+            "datasets": datasets,
+            "reflections": reflections,
+            "model": model,
+            "nproc": nproc,
+            "filter": filter_,
+            "images": options.images,
+            "d_min": options.d_min,
+        }
+        pool = context.Pool(1)
+        try:
+            results.append(pool.apply(run_configuration, (configuration,)))
+        finally:
+            pool.close()
+            pool.join()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output)
+    return results
+
+
+if __name__ == "__main__":
+    run()
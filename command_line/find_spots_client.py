@@ -5,9 +5,12 @@
 standard_library.install_aliases()
 import http.client
 import json
+import math
 import os
 import socket as pysocket
 import sys
+import threading
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -17,13 +20,86 @@
 import dials.util
 
 
+_connections = threading.local()
+
+
+def _connection(host, port):
+    """
+    Return the HTTP connection for the current thread, so that connections
+    are kept alive and reused between requests.
+    """
+    conn = getattr(_connections, "conn", None)
+    if conn is None or (conn.host, conn.port) != (host, int(port)):
+        conn = http.client.HTTPConnection(host, port)
+        _connections.conn = conn
+    return conn
+
+
 def work(host, port, filename, params):
-    conn = http.client.HTTPConnection(host, port)
     path = filename
     for param in params:
         path += ";%s" % param
-    conn.request("GET", path)
-    return conn.getresponse().read()
+    for attempt in range(2):
+        conn = _connection(host, port)
+        try:
+            conn.request("GET", path)
+            return conn.getresponse().read()
+        except (http.client.HTTPException, ConnectionError):
+            # The server may have closed an idle connection, so try once more
+            conn.close()
+            _connections.conn = None
+            if attempt:
+                raise
+
+
+def work_batch(host, port, images, params):
+    """
+    Send a batch of images to the server in a single request.
+
+    Each image is either a filename or a dictionary with a filename and an
+    inclusive range of frames. The results are yielded as soon as the server
+    has finished each image, which is not necessarily in the order given.
+    """
+    conn = http.client.HTTPConnection(host, port)
+    try:
+        body = json.dumps({"images": images, "params": list(params)})
+        conn.request(
+            "POST", "/batch", body, headers={"Content-type": "application/json"}
+        )
+        response = conn.getresponse()
+        if response.status != 200:
+            yield json.loads(response.read().decode())
+            return
+        for line in response:
+            if line.strip():
+                yield json.loads(line.decode())
+    finally:
+        conn.close()
+
+
+def percentile(values, q):
+    """
+    Return the q'th percentile of values, using the nearest rank.
+    """
+    values = sorted(values)
+    rank = int(math.ceil(q / 100 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def latency_summary(times, label="Latency per image"):
+    return "%s: p50 %.3fs p99 %.3fs max %.3fs (%d images)" % (
+        label,
+        percentile(times, 50),
+        percentile(times, 99),
+        max(times),
+        len(times),
+    )
+
+
+def _timed_work(host, port, filename, params):
+    t0 = time.time()
+    response = work(host, port, filename, params)
+    return response, time.time() - t0
 
 
 def _nproc():
@@ -82,17 +158,7 @@ def response_to_xml(d):
     return "<response>\n%s\n</response>" % response
 
 
-def work_all(
-    host,
-    port,
-    filenames,
-    params,
-    plot=False,
-    table=False,
-    json_file=None,
-    grid=None,
-    nproc=None,
-):
+def _work_all_threads(host, port, filenames, params, nproc):
     from multiprocessing.pool import ThreadPool as thread_pool
 
     if nproc is None:
@@ -100,13 +166,78 @@ def work_all(
     pool = thread_pool(processes=nproc)
     threads = {}
     for filename in filenames:
-        threads[filename] = pool.apply_async(work, (host, port, filename, params))
+        threads[filename] = pool.apply_async(
+            _timed_work, (host, port, filename, params)
+        )
     results = []
+    times = []
     for filename in filenames:
-        response = threads[filename].get()
+        response, t = threads[filename].get()
         d = json.loads(response)
         results.append(d)
+        times.append(t)
         print(response_to_xml(d))
+    return results, times
+
+
+def _work_all_batch(host, port, filenames, params, frames):
+    images = []
+    for filename in filenames:
+        # Undo the quoting used to pass URLs as a path
+        if "%3A//" in filename:
+            filename = urllib.parse.unquote(filename[1:])
+        if frames is not None:
+            images.append({"filename": filename, "frames": list(frames)})
+        else:
+            images.append(filename)
+
+    # The time for each image is measured from when the previous one arrived
+    results = []
+    times = []
+    t0 = time.time()
+    for d in work_batch(host, port, images, params):
+        t1 = time.time()
+        results.append(d)
+        times.append(t1 - t0)
+        t0 = t1
+        print(response_to_xml(d))
+
+    # Return the results in the order in which they were requested
+    order = {}
+    for image in images:
+        if isinstance(image, dict):
+            first, last = image["frames"]
+            for frame in range(first, last + 1):
+                order[(image["filename"], frame)] = len(order)
+        else:
+            order[(image, None)] = len(order)
+    results.sort(key=lambda d: order.get((d.get("image"), d.get("frame")), -1))
+    return results, times
+
+
+def work_all(
+    host,
+    port,
+    filenames,
+    params,
+    plot=False,
+    table=False,
+    json_file=None,
+    grid=None,
+    nproc=None,
+    latency=False,
+    batch=False,
+    frames=None,
+):
+    if batch:
+        results, times = _work_all_batch(host, port, filenames, params, frames)
+        label = "Time between images"
+    else:
+        results, times = _work_all_threads(host, port, filenames, params, nproc)
+        label = "Latency per image"
+
+    if latency and times:
+        print(latency_summary(times, label=label))
 
     if json_file is not None:
         "Writing results to %s" % json_file
@@ -204,6 +335,19 @@ def stop(host, port, nproc):
   .type = path
 grid = None
   .type = ints(size=2, value_min=1)
+batch = False
+  .type = bool
+  .help = "Send all of the images to the server in a single request and"
+          "print the results as each image is finished"
+frames = None
+  .type = ints(size=2, value_min=1)
+  .help = "In batch mode, find spots on this inclusive range of frames of"
+          "each file, e.g. for the images in an HDF5 master file"
+latency = False
+  .type = bool
+  .help = "Report the 50th and 99th percentile of the time taken for the"
+          "server to respond to each image. In batch mode, the time between"
+          "the results for consecutive images is reported instead."
 """
 )
 
@@ -255,10 +399,12 @@ def run(args=None):
             print("Failure")
             sys.exit(1)
     else:
-        if len(filenames) == 1:
-            response = work(params.host, params.port, filenames[0], unhandled)
+        if len(filenames) == 1 and not params.batch:
+            response, t = _timed_work(params.host, params.port, filenames[0], unhandled)
 
             print(response_to_xml(json.loads(response)))
+            if params.latency:
+                print(latency_summary([t]))
         else:
             work_all(
                 params.host,
@@ -270,6 +416,9 @@ def run(args=None):
                 json_file=params.json,
                 grid=params.grid,
                 nproc=nproc,
+                latency=params.latency,
+                batch=params.batch,
+                frames=params.frames,
             )
 
 
@@ -4,11 +4,18 @@
 
 standard_library.install_aliases()
 
+import collections
+import concurrent.futures
+import copy
+import functools
 import http.server as server_base
 import json
 import logging
 import multiprocessing
+import os
+import socketserver
 import sys
+import threading
 import time
 import urllib.parse
 
@@ -60,6 +67,15 @@
 
   dials.find_spots_client /path/to/image.cbf min_spot_size=2 d_min=2
 
+By default the server accepts requests in the main process and passes them to
+``nproc`` persistent worker processes through a bounded queue. Each worker keeps
+the parsed parameters and the imported images for recently used files, so that
+repeated requests for frames of the same file only pay for reading and
+thresholding the requested frame. If more than ``max_queued`` requests are
+waiting the server responds with ``503 Service Unavailable``. The previous
+behaviour where every process accepts connections itself is available with
+``mode=fork``.
+
 To stop the server::
 
   dials.find_spots_client stop [host=hostname] [port=1234]
@@ -67,13 +83,8 @@
 
 stop = False
 
-
-def work(filename, cl=None):
-    if cl is None:
-        cl = []
-
-    phil_scope = libtbx.phil.parse(
-        """\
+work_phil_scope = libtbx.phil.parse(
+    """\
 ice_rings {
   filter = True
     .type = bool
@@ -87,32 +98,125 @@ def work(filename, cl=None):
 indexing_min_spots = 10
   .type = int(value_min=1)
 """
-    )
+)
+
+# The number of imported experiment lists to keep open in each process
+experiments_cache_size = 8
+_experiments_cache = collections.OrderedDict()
+
+
+def _get_phil_scope(name):
+    if name == "server":
+        return work_phil_scope
+    elif name == "find_spots":
+        from dials.command_line.find_spots import phil_scope
+    elif name == "index":
+        from dials.command_line.index import phil_scope
+    elif name == "integrate":
+        from dials.command_line.integrate import phil_scope
+    return phil_scope
+
+
+@functools.lru_cache(maxsize=32)
+def _process_arguments(name, args):
+    """
+    Interpret the arguments for the named phil scope.
+
+    The result is cached for each distinct set of arguments, so that repeated
+    requests with the same parameters do not pay for parsing them again. The
+    extracted parameters are shared so callers must copy them before
+    modifying them.
+    """
+    phil_scope = _get_phil_scope(name)
     interp = phil_scope.command_line_argument_interpreter()
-    params, unhandled = interp.process_and_fetch(
-        cl, custom_processor="collect_remaining"
+    working_phil, unhandled = interp.process_and_fetch(
+        list(args), custom_processor="collect_remaining"
     )
-    filter_ice = params.extract().ice_rings.filter
-    ice_rings_width = params.extract().ice_rings.width
-    index = params.extract().index
-    integrate = params.extract().integrate
-    indexing_min_spots = params.extract().indexing_min_spots
+    if name != "server":
+        logger.info("The following %s parameters have been modified:" % name)
+        logger.info(phil_scope.fetch_diff(source=working_phil).as_str())
+    return working_phil.extract(), tuple(unhandled)
+
+
+def _extract_params(name, args):
+    params, unhandled = _process_arguments(name, tuple(args))
+    return copy.deepcopy(params), unhandled
+
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _load_experiments(filename, scan_range=None):
+    """
+    Import the experiments for a file, reusing a previous import if possible.
+
+    Keeping the experiment list means that the format instance, and hence any
+    open HDF5 file handle, is reused for subsequent frames of the same file.
+    The cached import is discarded if the file has changed on disk or does
+    not cover the requested scan range.
+    """
+    from dxtbx.imageset import ImageSequence
+    from dxtbx.model.experiment_list import ExperimentListFactory
+
+    stamp = _file_stamp(filename)
+    cached = _experiments_cache.pop(filename, None)
+    if cached is not None and cached[0] == stamp:
+        experiments = cached[1]
+        imageset = experiments.imagesets()[0]
+        if scan_range and isinstance(imageset, ImageSequence):
+            i0, i1 = imageset.get_array_range()
+            if any(j0 - 1 < i0 or j1 > i1 for j0, j1 in scan_range):
+                experiments = None
+    else:
+        experiments = None
+    if experiments is None:
+        experiments = ExperimentListFactory.from_filenames([filename])
+    _experiments_cache[filename] = (stamp, experiments)
+    while len(_experiments_cache) > experiments_cache_size:
+        _experiments_cache.popitem(last=False)
+    return experiments
+
+
+def warm_up():
+    """
+    Import the modules needed to process a request ahead of the first request.
+    """
+    from dxtbx.model.experiment_list import ExperimentListFactory  # noqa: F401
+
+    from dials.algorithms.spot_finding import per_image_analysis  # noqa: F401
+
+    _get_phil_scope("find_spots")
+    return os.getpid()
+
+
+def work(filename, cl=None):
+    if cl is None:
+        cl = []
+
+    params, unhandled = _extract_params("server", cl)
+    filter_ice = params.ice_rings.filter
+    ice_rings_width = params.ice_rings.width
+    index = params.index
+    integrate = params.integrate
+    indexing_min_spots = params.indexing_min_spots
 
     from dxtbx.model.experiment_list import ExperimentListFactory
 
     from dials.array_family import flex
-    from dials.command_line.find_spots import phil_scope as find_spots_phil_scope
 
-    interp = find_spots_phil_scope.command_line_argument_interpreter()
-    phil_scope, unhandled = interp.process_and_fetch(
-        unhandled, custom_processor="collect_remaining"
-    )
-    logger.info("The following spotfinding parameters have been modified:")
-    logger.info(find_spots_phil_scope.fetch_diff(source=phil_scope).as_str())
-    params = phil_scope.extract()
+    params, _ = _extract_params("find_spots", unhandled)
     # no need to write the hot mask in the server/client
     params.spotfinder.write_hot_mask = False
-    experiments = ExperimentListFactory.from_filenames([filename])
+    if index:
+        # indexing modifies the experiment models so don't share them
+        experiments = ExperimentListFactory.from_filenames([filename])
+    else:
+        experiments = _load_experiments(filename, params.spotfinder.scan_range)
     t0 = time.time()
     reflections = flex.reflection_table.from_observations(experiments, params)
     t1 = time.time()
@@ -131,15 +235,8 @@ def work(filename, cl=None):
     if index and stats["n_spots_no_ice"] > indexing_min_spots:
         logging.basicConfig(stream=sys.stdout, level=logging.INFO)
         from dials.algorithms.indexing import indexer
-        from dials.command_line.index import phil_scope as index_phil_scope
 
-        interp = index_phil_scope.command_line_argument_interpreter()
-        phil_scope, unhandled = interp.process_and_fetch(
-            unhandled, custom_processor="collect_remaining"
-        )
-        logger.info("The following indexing parameters have been modified:")
-        index_phil_scope.fetch_diff(source=phil_scope).show()
-        params = phil_scope.extract()
+        params, unhandled = _extract_params("index", unhandled)
 
         if (
             imageset.get_goniometer() is not None
@@ -187,15 +284,8 @@ def work(filename, cl=None):
 
             from dials.algorithms.integration.integrator import create_integrator
             from dials.algorithms.profile_model.factory import ProfileModelFactory
-            from dials.command_line.integrate import phil_scope as integrate_phil_scope
 
-            interp = integrate_phil_scope.command_line_argument_interpreter()
-            phil_scope, unhandled = interp.process_and_fetch(
-                unhandled, custom_processor="collect_remaining"
-            )
-            logger.error("The following integration parameters have been modified:")
-            integrate_phil_scope.fetch_diff(source=phil_scope).show()
-            params = phil_scope.extract()
+            params, unhandled = _extract_params("integrate", unhandled)
 
             try:
                 params.profile.gaussian_rs.min_spots = 0
@@ -260,12 +350,144 @@ def work(filename, cl=None):
     return stats
 
 
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue(object):
+    """
+    Dispatch requests to a pool of persistent worker processes.
+
+    The workers are started up front and live for the lifetime of the server,
+    so the parameter and experiment caches in each worker are reused between
+    requests. The number of requests waiting for a worker is bounded: once
+    the queue is full a request waits up to timeout seconds for a free slot
+    before QueueFull is raised.
+    """
+
+    def __init__(self, nproc, max_queued, timeout):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(nproc + max_queued)
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=nproc)
+        jobs = [self._executor.submit(warm_up) for j in range(nproc)]
+        concurrent.futures.wait(jobs)
+
+    def submit(self, filename, params, block=True):
+        """
+        Queue a request, returning a future for the result.
+        """
+        if block:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        else:
+            acquired = self._slots.acquire(False)
+        if not acquired:
+            raise QueueFull("Too many requests are waiting to be processed")
+        try:
+            future = self._executor.submit(work, filename, params)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def __call__(self, filename, params):
+        return self.submit(filename, params).result()
+
+    def imap_unordered(self, jobs):
+        """
+        Run a sequence of (key, filename, params) jobs, yielding (key, future)
+        pairs in the order in which they finish.
+
+        Jobs are only queued while there is space in the queue, so a large
+        batch does not starve other requests.
+        """
+        pending = {}
+        for key, filename, params in jobs:
+            while True:
+                try:
+                    future = self.submit(filename, params, block=not pending)
+                    break
+                except QueueFull:
+                    if not pending:
+                        raise
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield pending.pop(future), future
+            pending[future] = key
+        for future in concurrent.futures.as_completed(pending):
+            yield pending[future], future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, server_base.HTTPServer):
+    daemon_threads = True
+    job_queue = None
+
+
+def batch_jobs(request):
+    """
+    Expand a batch request into a list of (key, filename, params) jobs.
+
+    A batch request is a JSON object with a list of "images" and an optional
+    list of "params" which apply to every image. Each image is either a
+    filename, or an object with a "filename" and an inclusive range of
+    "frames" in which case a job is created for every frame in the range.
+    """
+    params = [str(p) for p in request.get("params", [])]
+    jobs = []
+    for image in request["images"]:
+        if isinstance(image, dict):
+            filename = str(image["filename"])
+            first, last = image["frames"]
+            for frame in range(int(first), int(last) + 1):
+                jobs.append(
+                    (
+                        {"image": filename, "frame": frame},
+                        filename,
+                        params + ["scan_range=%d,%d" % (frame, frame)],
+                    )
+                )
+        else:
+            jobs.append(({"image": str(image)}, str(image), params))
+    return jobs
+
+
 class handler(server_base.BaseHTTPRequestHandler):
+
+    # Keep connections open so that clients can reuse them
+    protocol_version = "HTTP/1.1"
+    timeout = 30
+
+    def end_headers(self):
+        if getattr(self.server, "job_queue", None) is None:
+            # In fork mode each process serves one connection at a time, so
+            # don't let an idle client hold on to it
+            self.send_header("Connection", "close")
+        server_base.BaseHTTPRequestHandler.end_headers(self)
+
+    def send_json(self, response, d):
+        data = json.dumps(d).encode()
+        self.send_response(response)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, data):
+        self.wfile.write(("%x\r\n" % len(data)).encode() + data + b"\r\n")
+        self.wfile.flush()
+
     def do_GET(self):
         """Respond to a GET request."""
         if self.path == "/Ctrl-C":
             self.send_response(200)
+            self.send_header("Content-Length", "0")
             self.end_headers()
+            self.close_connection = True
 
             global stop
             stop = True
@@ -280,19 +502,72 @@ def do_GET(self):
 
         d = {"image": filename}
 
+        job_queue = getattr(self.server, "job_queue", None)
         try:
-            stats = work(filename, params)
+            if job_queue is not None:
+                stats = job_queue(filename, params)
+            else:
+                stats = work(filename, params)
             d.update(stats)
             response = 200
+        except QueueFull as e:
+            d["error"] = str(e)
+            response = 503
         except Exception as e:
             d["error"] = str(e)
             response = 500
 
-        self.send_response(response)
-        self.send_header("Content-type", "application/json")
+        self.send_json(response, d)
+
+    def do_POST(self):
+        """
+        Respond to a POST request for a batch of images.
+
+        The results are streamed back as newline-delimited JSON, one line per
+        image in the order in which they are finished.
+        """
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            jobs = batch_jobs(json.loads(self.rfile.read(length).decode()))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": "Invalid batch request: %s" % e})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
         self.end_headers()
-        response = json.dumps(d).encode()
-        self.wfile.write(response)
+
+        job_queue = getattr(self.server, "job_queue", None)
+        if job_queue is not None:
+            results = job_queue.imap_unordered(jobs)
+        else:
+            results = (
+                (key, _run_now(filename, params)) for key, filename, params in jobs
+            )
+        try:
+            for key, future in results:
+                d = dict(key)
+                try:
+                    d.update(future.result())
+                except Exception as e:
+                    d["error"] = str(e)
+                self.write_chunk((json.dumps(d) + "\n").encode())
+        except QueueFull as e:
+            self.write_chunk((json.dumps({"error": str(e)}) + "\n").encode())
+        self.write_chunk(b"")
+
+
+def _run_now(filename, params):
+    """
+    Run a job in this process, returning a completed future.
+    """
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(work(filename, params))
+    except Exception as e:
+        future.set_exception(e)
+    return future
 
 
 def serve(httpd):
@@ -309,11 +584,47 @@ def serve(httpd):
   .type = int(value_min=1)
 port = 1701
   .type = int(value_min=1)
+mode = *queue fork
+  .type = choice
+  .help = "queue: accept requests in the main process and dispatch them to"
+          "persistent worker processes through a bounded job queue."
+          "fork: all processes accept requests on the shared socket."
+max_queued = Auto
+  .type = int(value_min=0)
+  .help = "The maximum number of requests waiting for a worker in queue"
+          "mode. Defaults to nproc."
+queue_timeout = 60
+  .type = float(value_min=0)
+  .help = "How long a request may wait for a place in the queue before the"
+          "server responds with 503 Service Unavailable."
+cache_size = 8
+  .type = int(value_min=1)
+  .help = "The number of imported files to keep open in each process"
 """
 )
 
 
-def main(nproc, port):
+def main(nproc, port, mode="queue", max_queued=None, queue_timeout=60):
+    if mode == "queue":
+        if max_queued is None:
+            max_queued = nproc
+        httpd = ThreadingHTTPServer(("", port), handler)
+        # Don't block forever so that we notice when asked to stop
+        httpd.timeout = 1
+        httpd.job_queue = JobQueue(nproc, max_queued, queue_timeout)
+        print(
+            time.asctime(),
+            "Serving %d worker processes on port %d with up to %d queued requests"
+            % (nproc, port, max_queued),
+        )
+        try:
+            serve(httpd)
+        finally:
+            httpd.job_queue.shutdown()
+            httpd.server_close()
+        print(time.asctime(), "done")
+        return
+
     server_class = server_base.HTTPServer
     httpd = server_class(("", port), handler)
     print(time.asctime(), "Serving %d processes on port %d" % (nproc, port))
@@ -343,7 +654,17 @@ def run(args=None):
         from libtbx.introspection import number_of_processors
 
         params.nproc = number_of_processors(return_value_if_unknown=-1)
-    main(params.nproc, params.port)
+    if params.max_queued is libtbx.Auto:
+        params.max_queued = None
+    global experiments_cache_size
+    experiments_cache_size = params.cache_size
+    main(
+        params.nproc,
+        params.port,
+        mode=params.mode,
+        max_queued=params.max_queued,
+        queue_timeout=params.queue_timeout,
+    )
 
 
 if __name__ == "__main__":
@@ -31,6 +31,7 @@
 
 import dials.util.log
 from dials.algorithms.integration.integrator import create_integrator
+from dials.algorithms.integration.profiling import write_profile
 from dials.algorithms.profile_model.factory import ProfileModelFactory
 from dials.array_family import flex
 from dials.util import show_mail_handle_errors
@@ -72,6 +73,11 @@
       .type = str
       .help = "The integration report filename (*.xml or *.json)"
 
+    profile = 'integrated.profile.json'
+      .type = str
+      .help = "The filename for the time and memory used by each stage of"
+              "integration, in total and for each block, as JSON"
+
     include_bad_reference = False
       .type = bool
       .help = "Include bad reference data including unindexed spots,"
@@ -619,6 +625,11 @@ def refl_extend(src, dest, eid):
         experiments = accepted_expts
         reflections = accepted_refls
 
+    # Write the time and memory used by each stage
+    if params.output.profile is not None:
+        logger.info("Saving the integration profile to %s", params.output.profile)
+        write_profile(params.output.profile, integrator.stage_profiles)
+
     # Write a report if requested
     report = None
     if params.output.report is not None:
@@ -384,7 +384,7 @@ def _create_flag_count_table(table):
     """
 
     # Calculate the counts of entries that match each flag
-    numpy_flags = table["flags"].as_numpy_array()
+    numpy_flags = table.as_numpy_view("flags", readonly=True)
     flag_count = {
         flag: np.sum(numpy_flags & value != 0)
         for value, flag in table.flags.values.items()
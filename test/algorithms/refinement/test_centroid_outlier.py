@@ -39,3 +39,44 @@ def test_centroid_outlier(dials_regression, method, colnames, expected_nout):
     outliers = residuals.get_flags(residuals.flags.centroid_outlier)
 
     assert outliers.count(True) == expected_nout
+
+
+def test_centroid_outlier_nproc():
+    # synthetic residuals on three panels, with some gross outliers on each
+    flex.set_random_seed(0)
+    n = 900
+    residuals = flex.reflection_table()
+    residuals["id"] = flex.int(n, 0)
+    residuals["panel"] = flex.size_t([i % 3 for i in range(n)])
+    for col in ("x_resid", "y_resid", "phi_resid"):
+        values = flex.random_double(n) - 0.5
+        values.set_selected(flex.size_t(range(0, n, 50)), 10.0)
+        residuals[col] = values
+    residuals.set_flags(flex.bool(n, True), residuals.flags.predicted)
+
+    params = phil_scope.extract()
+    params.outlier.algorithm = "mcd"
+    params.outlier.separate_panels = True
+    params.outlier.separate_blocks = False
+    colnames = ["x_resid", "y_resid", "phi_resid"]
+
+    # the outliers found do not depend on the number of processes
+    flagged = []
+    for nproc in (1, 3):
+        params.outlier.nproc = nproc
+        flex.set_random_seed(42)
+        reflections = residuals.copy()
+        outlier_detector = CentroidOutlierFactory.from_parameters_and_colnames(
+            params, colnames
+        )
+        outlier_detector(reflections)
+        flagged.append(reflections.get_flags(reflections.flags.centroid_outlier))
+        # a seed is drawn for each of the three jobs from the global random
+        # number generator, but the jobs do not reseed it
+        next_values = flex.random_double(5)
+        flex.set_random_seed(42)
+        flex.random_size_t(3, 2 ** 31 - 1)
+        assert next_values.all_eq(flex.random_double(5))
+
+    assert flagged[0].all_eq(flagged[1])
+    assert flagged[0].select(flex.size_t(range(0, n, 50))).all_eq(True)
@@ -11,7 +11,11 @@
 from libtbx import phil
 
 from dials.algorithms.refinement import DialsRefineConfigError, RefinerFactory
-from dials.algorithms.refinement.refiner import _trim_scans_to_observations, phil_scope
+from dials.algorithms.refinement.refiner import (
+    DecomposedRefiner,
+    _trim_scans_to_observations,
+    phil_scope,
+)
 from dials.array_family import flex
 from dials.util.slice import slice_reflections
 
@@ -120,3 +124,114 @@ def test_trim_scans_to_observations(dials_data):
     for exp, r1, r2 in zip(experiments, new_array_ranges, new_osc_ranges):
         assert exp.scan.get_angle_from_array_index(r1[0]) == pytest.approx(r2[0])
         assert exp.scan.get_angle_from_array_index(r1[1]) == pytest.approx(r2[1])
+
+
+def test_decomposed_refinement(dials_data):
+
+    data_dir = dials_data("l_cysteine_dials_output")
+    experiments = ExperimentListFactory.from_json_file(
+        (data_dir / "indexed.expt").strpath, check_format=False
+    )
+    reflections = flex.reflection_table.from_file((data_dir / "indexed.refl").strpath)
+
+    # Give each experiment its own crystal and fix the shared beam and detector,
+    # so that each of the four experiments can be refined independently
+    for experiment in experiments:
+        experiment.crystal = deepcopy(experiment.crystal)
+    params = phil_scope.fetch(source=phil.parse("")).extract()
+    params.refinement.parameterisation.beam.fix = ["all"]
+    params.refinement.parameterisation.detector.fix = "all"
+    params.refinement.mp.decompose = True
+    # Use a deterministic outlier algorithm, so that joint and decomposed
+    # refinement use the same reflections
+    params.refinement.reflections.outlier.algorithm = "tukey"
+
+    groups = RefinerFactory._independent_experiment_groups(params, experiments)
+    assert groups == [[0], [1], [2], [3]]
+
+    # Shared models with free parameters link experiments
+    linked = deepcopy(experiments)
+    linked[2].crystal = linked[0].crystal
+    assert RefinerFactory._independent_experiment_groups(params, linked) == [
+        [0, 2],
+        [1],
+        [3],
+    ]
+
+    # Restraints prevent decomposition
+    restrained = phil_scope.fetch(
+        source=phil.parse(
+            "refinement.parameterisation.crystal.unit_cell.restraints."
+            "tie_to_group.sigmas=1,1,1,1,1,1"
+        )
+    ).extract()
+    assert RefinerFactory._independent_experiment_groups(restrained, experiments) == [
+        [0, 1, 2, 3]
+    ]
+
+    refiner = RefinerFactory.from_parameters_data_experiments(
+        params, reflections, experiments
+    )
+    assert isinstance(refiner, DecomposedRefiner)
+    history = refiner.run()
+    assert history.get_nrows() > 0
+
+    # Results are in terms of the input experiments and reflections
+    assert len(refiner.get_experiments()) == len(experiments)
+    preds = refiner.predict_for_indexed()
+    assert len(preds) == len(reflections)
+    assert (preds["id"] == reflections["id"]).all_eq(True)
+    used = refiner.selection_used_for_refinement()
+    assert used.count(True) == len(refiner.get_matches())
+
+    # Joint refinement of the same data reaches the same models, to within the
+    # tolerance of the termination criteria
+    params.refinement.mp.decompose = False
+    joint = RefinerFactory.from_parameters_data_experiments(
+        params, reflections, experiments
+    )
+    assert not isinstance(joint, DecomposedRefiner)
+    joint.run()
+    assert refiner.rmsds() == pytest.approx(joint.rmsds(), rel=1e-3)
+    for decomposed_expt, joint_expt in zip(
+        refiner.get_experiments(), joint.get_experiments()
+    ):
+        assert decomposed_expt.crystal.get_unit_cell().parameters() == pytest.approx(
+            joint_expt.crystal.get_unit_cell().parameters(), rel=1e-4
+        )
+        assert decomposed_expt.crystal.get_U() == pytest.approx(
+            joint_expt.crystal.get_U(), abs=1e-5
+        )
+
+
+@pytest.mark.parametrize("engine", ["GaussNewton", "LevMar", "SimpleLBFGS"])
+def test_progressive_sampling_reaching_max_iterations(dials_data, engine):
+
+    data_dir = dials_data("l_cysteine_dials_output")
+    experiments = ExperimentListFactory.from_json_file(
+        (data_dir / "indexed.expt").strpath, check_format=False
+    )
+    reflections = flex.reflection_table.from_file((data_dir / "indexed.refl").strpath)
+
+    # Move the crystals away from the solution, then stop after one iteration,
+    # which is before refinement against the sample could converge
+    for crystal in experiments.crystals():
+        crystal.rotate_around_origin((1, 0, 0), 0.1)
+    params = phil_scope.fetch(source=phil.parse("")).extract()
+    params.refinement.refinery.engine = engine
+    params.refinement.refinery.max_iterations = 1
+    params.refinement.reflections.progressive_sampling.initial_sample_size = 500
+
+    refiner = RefinerFactory.from_parameters_data_experiments(
+        params, reflections, experiments
+    )
+    history = refiner.run()
+
+    # The final steps are still taken against the whole working set
+    n_working = len(refiner.get_matches())
+    assert n_working > 500
+    assert history["sample_size"][0] == 500
+    assert history["sample_size"][-1] == n_working
+    if engine != "SimpleLBFGS":
+        assert history.reason_for_termination == "Reached maximum number of iterations"
+        assert history["sample_size"].count(n_working) >= 2
@@ -6,9 +6,18 @@
 
 from __future__ import absolute_import, division, print_function
 
+import math
+
+import pytest
 from mock import Mock, patch
 
-from dials.algorithms.refinement.refiner import _copy_experiments_for_refining
+from dials.algorithms.refinement.engine import Journal
+from dials.algorithms.refinement.refiner import (
+    _copy_experiments_for_refining,
+    _merge_journals,
+    _split_reflections,
+)
+from dials.array_family import flex
 
 
 def test_that_the_experiment_reduced_copier_works_as_intended():
@@ -22,3 +31,43 @@ def test_that_the_experiment_reduced_copier_works_as_intended():
     # Anything read-only should be untouched
     for att in ["scan", "profile", "imageset", "scaling_model"]:
         assert getattr(sample, att) is getattr(dupe, att)
+
+
+def test_split_reflections():
+    reflections = flex.reflection_table()
+    reflections["id"] = flex.int([0, 1, 2, -1, 2, 0, 3])
+    split = _split_reflections(reflections, [[0, 2], [1, 3]])
+
+    # reflections that belong to no experiment go with the first group
+    isel, group_reflections = split[0]
+    assert list(isel) == [0, 2, 3, 4, 5]
+    assert list(group_reflections["id"]) == [0, 1, -1, 1, 0]
+    isel, group_reflections = split[1]
+    assert list(isel) == [1, 6]
+    assert list(group_reflections["id"]) == [0, 1]
+
+
+def test_merge_journals():
+    journals = []
+    for nrows, nref, rmsd in ((3, 100, 1.0), (2, 300, 2.0)):
+        journal = Journal()
+        for key in ("num_reflections", "objective", "parameter_vector", "rmsd"):
+            journal.add_column(key)
+        for i in range(nrows):
+            journal.add_row()
+            journal.set_last_cell("num_reflections", nref)
+            journal.set_last_cell("objective", float(i))
+            journal.set_last_cell("parameter_vector", [float(i)] * 2)
+            journal.set_last_cell("rmsd", (rmsd, rmsd / (i + 1)))
+        journal.reason_for_termination = "Group of %d" % nrows
+        journals.append(journal)
+
+    merged = _merge_journals(journals)
+    assert merged.get_nrows() == 3
+    assert merged["num_reflections"] == [400, 400, 400]
+    # the second journal is treated as if its last row were repeated
+    assert merged["objective"] == [0.0, 2.0, 3.0]
+    assert merged["parameter_vector"][2] == [2.0, 2.0, 1.0, 1.0]
+    assert merged["rmsd"][0] == pytest.approx((math.sqrt(3.25), math.sqrt(3.25)))
+    assert merged["gradient_norm"] == [None] * 3
+    assert merged.reason_for_termination == "Group of 3; Group of 2"
@@ -6,7 +6,10 @@
 
 from dxtbx.model.experiment_list import ExperimentListFactory
 
-from dials.algorithms.refinement.reflection_manager import ReflectionManager
+from dials.algorithms.refinement.reflection_manager import (
+    ReflectionManager,
+    _stratified_ranks,
+)
 from dials.array_family import flex
 
 
@@ -46,3 +49,59 @@ def test_scan_margin(dials_data):
     # Check 1 degree scan margin trims approximately 1 degree
     assert min(phi2) == pytest.approx(min(phi1) + math.radians(margin), abs=1e-3)
     assert max(phi2) == pytest.approx(max(phi1) - math.radians(margin), abs=1e-3)
+
+
+def test_stratified_ranks():
+    strata = flex.double([0] * 100 + [1] * 300 + [2] * 600)
+    ranks = _stratified_ranks(strata)
+    assert sorted(ranks) == list(range(len(strata)))
+
+    # every leading part of the order draws from each stratum in proportion
+    for sample_size in (10, 100, 500):
+        sample = strata.select(ranks < sample_size)
+        for stratum, fraction in ((0, 0.1), (1, 0.3), (2, 0.6)):
+            assert (sample == stratum).count(True) == pytest.approx(
+                fraction * sample_size, abs=1
+            )
+
+
+def test_progressive_sampling(dials_data):
+
+    data_dir = dials_data("l_cysteine_dials_output")
+    experiments = ExperimentListFactory.from_json_file(
+        (data_dir / "indexed.expt").strpath, check_format=False
+    )
+    reflections = flex.reflection_table.from_file((data_dir / "indexed.refl").strpath)
+    reflections.set_flags(
+        flex.bool(len(reflections), True), reflections.flags.predicted
+    )
+
+    refman = ReflectionManager(
+        reflections,
+        experiments,
+        progressive_sample_size=500,
+        progressive_growth_factor=4,
+    )
+    refman.finalise()
+    working_set = refman.get_obs()
+    n_working = len(working_set)
+    assert n_working > 2000
+
+    refman.begin_progressive_sampling()
+    sample = refman.get_obs()
+    assert len(sample) == 500
+    assert set(sample["iobs"]).issubset(set(working_set["iobs"]))
+    # every experiment is sampled in proportion to its size in the working set
+    for iexp in range(len(experiments)):
+        n_exp = (working_set["id"] == iexp).count(True)
+        assert (sample["id"] == iexp).count(True) == pytest.approx(
+            500 * n_exp / n_working, rel=0.2
+        )
+
+    # the sample grows until it is the whole working set
+    sizes = []
+    while refman.grow_sample():
+        sizes.append(refman.get_sample_size())
+    assert sizes[0] == 2000
+    assert sizes[-1] == n_working
+    assert refman.get_obs() is working_set
@@ -21,6 +21,9 @@
 from dials.algorithms.refinement.parameterisation.scan_varying_detector_parameters import (
     ScanVaryingDetectorParameterisationSinglePanel,
 )
+from dials.algorithms.refinement.parameterisation.scan_varying_goniometer_parameters import (
+    ScanVaryingGoniometerParameterisation,
+)
 from dials.algorithms.refinement.parameterisation.scan_varying_model_parameters import (
     GaussianSmoother,
     ScanVaryingParameterSet,
@@ -496,3 +499,42 @@ def test_ScanVaryingDetectorParameterisation(nintervals, plots=False):
 
     for e, f in zip(an_ds_dp, fd_ds_dp):
         assert approx_equal((e - f), null_mat, eps=1.0e-6)
+
+
+def test_compose_at_frames():
+    """Check that composing the states at many image numbers in one call agrees
+    with composing them one image at a time"""
+
+    vmp = _TestScanVaryingModelParameterisation()
+    frames = [1, 20.5, 50, 73.25, 100]
+
+    parameterisations = [
+        ScanVaryingCrystalOrientationParameterisation(vmp.xl, vmp.image_range, 5),
+        ScanVaryingCrystalUnitCellParameterisation(vmp.xl, vmp.image_range, 5),
+        ScanVaryingBeamParameterisation(vmp.beam, vmp.image_range, 5, vmp.goniometer),
+        ScanVaryingGoniometerParameterisation(
+            vmp.goniometer, vmp.image_range, 5, vmp.beam
+        ),
+        ScanVaryingDetectorParameterisationSinglePanel(
+            vmp.detector, vmp.image_range, 5
+        ),
+    ]
+
+    for p in parameterisations:
+        # apply a random parameter shift so that the states vary over the scan
+        p_vals = p.get_param_vals()
+        sigmas = [0.02 * abs(v) + 0.1 for v in p_vals]
+        p.set_param_vals(random_param_shift(p_vals, sigmas))
+
+        states, derivatives = p.compose_at_frames(frames)
+        assert len(states) == len(frames)
+        assert len(derivatives) == p.num_free()
+
+        for i, t in enumerate(frames):
+            p.compose(t)
+            assert approx_equal(states[i], p.get_state().elems, eps=1.0e-10)
+            for ds_dp, expected in zip(derivatives, p.get_ds_dp()):
+                if ds_dp is None:
+                    assert approx_equal(expected.elems, [0.0] * len(expected))
+                else:
+                    assert approx_equal(ds_dp[i], expected.elems, eps=1.0e-10)
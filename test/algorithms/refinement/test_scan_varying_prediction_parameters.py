@@ -23,6 +23,7 @@
 )
 from dials.algorithms.refinement.parameterisation.scan_varying_prediction_parameters import (
     ScanVaryingPredictionParameterisation,
+    _group_indices,
 )
 from dials.algorithms.refinement.prediction.managed_predictors import (
     ScansExperimentsPredictor,
@@ -223,6 +224,14 @@ def test(cmdline_overrides=[]):
     pred_param.compose(reflections)
 
 
+def test_group_indices():
+    values, groups = _group_indices(flex.size_t([3, 0, 3, 1, 0, 3]))
+    assert values == [0, 1, 3]
+    assert [sorted(g) for g in groups] == [[1, 4], [3], [0, 2, 5]]
+
+    assert _group_indices(flex.int()) == ([], [])
+
+
 if __name__ == "__main__":
     cmdline_overrides = sys.argv[1:]
     test(cmdline_overrides)
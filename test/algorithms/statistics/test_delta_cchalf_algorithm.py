@@ -3,11 +3,22 @@
 """Tests for ΔCC½ algorithms."""
 from __future__ import absolute_import, division, print_function
 
+import random
+from collections import defaultdict
+
 import mock
+import pytest
 
+from cctbx import sgtbx, uctbx
 from dxtbx.model import Crystal, Experiment, ExperimentList, Scan
 
 from dials.algorithms.statistics.cc_half_algorithm import CCHalfFromDials
+from dials.algorithms.statistics.delta_cchalf import (
+    PerGroupCChalfStatistics,
+    ReflectionSum,
+    ResolutionBinner,
+    compute_cchalf_from_reflection_sums,
+)
 from dials.array_family import flex
 from dials.command_line.compute_delta_cchalf import phil_scope
 
@@ -119,3 +130,48 @@ def mock_algorithm(*_):
         assert script.results_summary["dataset_removal"][
             "experiments_fully_removed"
         ] == ["0"]
+
+
+def test_PerGroupCChalfStatistics_matches_reference():
+    """Compare the CC½ excluding each group to a direct calculation."""
+    random.seed(0)
+    n = 2000
+    table = flex.reflection_table()
+    table["miller_index"] = flex.miller_index(
+        [tuple(random.randint(1, 6) for _ in range(3)) for _ in range(n)]
+    )
+    table["intensity"] = flex.double(
+        [100.0 * sum(h) + random.gauss(0, 50) for h in table["miller_index"]]
+    )
+    table["variance"] = flex.double(n, 1.0)
+    table["dataset"] = flex.int(n, 0)
+    table["group"] = flex.int([random.randint(0, 9) for _ in range(n)])
+    unit_cell = uctbx.unit_cell((10, 11, 12, 90, 90, 90))
+    space_group = sgtbx.space_group_info("P 2 2 2").group()
+
+    statistics = PerGroupCChalfStatistics(table, unit_cell, space_group, n_bins=3)
+    statistics.run()
+
+    binner = ResolutionBinner(
+        unit_cell, statistics.d_min, statistics.d_max, 3, output=False
+    )
+
+    def reference_cchalf(sel):
+        sums = defaultdict(ReflectionSum)
+        for h, x in zip(
+            statistics.reflection_table["miller_index"].select(sel),
+            statistics.reflection_table["intensity"].select(sel),
+        ):
+            sums[h].sum_x += x
+            sums[h].sum_x2 += x ** 2
+            sums[h].n += 1
+        return compute_cchalf_from_reflection_sums(sums, binner)
+
+    groups = statistics.reflection_table["group"]
+    assert statistics.mean_cchalf() == pytest.approx(
+        reference_cchalf(flex.bool(n, True))
+    )
+    cchalf_i = statistics.cchalf_i()
+    assert sorted(cchalf_i) == list(range(10))
+    for group, cchalf in cchalf_i.items():
+        assert cchalf == pytest.approx(reference_cchalf(groups != group))
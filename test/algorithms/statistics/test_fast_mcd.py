@@ -261,3 +261,19 @@ def test_fast_mcd_large(dials_regression):
     # Correction factors
     assert approx_equal(fast_mcd._consistency_fac, 2.45659976388)
     assert approx_equal(fast_mcd._finite_samp_fac, 1.00193273884)
+
+
+def test_fast_mcd_seed():
+    from scitbx.array_family import flex
+
+    from dials.algorithms.statistics.fast_mcd import FastMCD
+
+    # both the small and large dataset algorithms give the same estimates for
+    # the same seed
+    flex.set_random_seed(0)
+    for n in (200, 1000):
+        data = [flex.random_double(n) for _ in range(3)]
+        first = FastMCD(data, seed=1).get_raw_T_and_S()
+        second = FastMCD(data, seed=1).get_raw_T_and_S()
+        assert first[0].all_eq(second[0])
+        assert first[1].all_eq(second[1])
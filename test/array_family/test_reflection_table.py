@@ -2,6 +2,7 @@
 
 import copy
 import os
+import pickle
 import random
 
 import pytest
@@ -1450,3 +1451,215 @@ def test_calculate_entering_flags(dials_regression):
     flags = refl["entering"]
     assert flags.count(True) == 58283
     assert flags.count(False) == 57799
+
+
+def test_from_msgpack_file_selected_columns(tmpdir):
+    from dials.array_family.msgpack_reader import (
+        LazyReflectionTable,
+        MsgpackReflectionIndex,
+    )
+
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 1, 1, 0])
+    table["miller_index"] = flex.miller_index(
+        [(1, 2, 3), (4, 5, 6), (0, 0, 1), (2, 0, 0)]
+    )
+    table["intensity.sum.value"] = flex.double([1.0, 2.0, 3.0, 4.0])
+    table["xyzobs.px.value"] = flex.vec3_double(4, (1.0, 2.0, 3.0))
+    table["label"] = flex.std_string(["a", "b", "c", "d"])
+    table.experiment_identifiers()[0] = "abc"
+    table.experiment_identifiers()[1] = "def"
+    filename = tmpdir.join("reflections.refl").strpath
+    table.as_msgpack_file(filename)
+
+    index = MsgpackReflectionIndex(filename)
+    assert index.nrows == 4
+    assert sorted(index.keys()) == sorted(table.keys())
+    assert index.column_type("miller_index") == "cctbx::miller::index<>"
+    subset = index.read(["id", "label"])
+    assert sorted(subset.keys()) == ["id", "label"]
+    assert list(subset["label"]) == ["a", "b", "c", "d"]
+    assert dict(subset.experiment_identifiers()) == {0: "abc", 1: "def"}
+    with pytest.raises(KeyError):
+        index.read(["missing"])
+    index.close()
+
+    lazy = flex.reflection_table.from_file(
+        filename, columns=["miller_index", "intensity.sum.value"]
+    )
+    assert isinstance(lazy, LazyReflectionTable)
+    assert len(lazy) == 4
+    assert lazy.ncols() == 5
+    assert "id" in lazy
+    assert lazy.pending_columns() == ["id", "label", "xyzobs.px.value"]
+    assert list(lazy["intensity.sum.value"]) == [1.0, 2.0, 3.0, 4.0]
+    assert list(lazy["id"]) == [0, 1, 1, 0]
+    assert lazy.pending_columns() == ["label", "xyzobs.px.value"]
+    del lazy["label"]
+    assert lazy.pending_columns() == ["xyzobs.px.value"]
+    assert "label" not in lazy
+
+    # Any other operation on the table reads all of the remaining columns
+    selected = lazy.select(lazy["id"] == 1)
+    assert lazy.pending_columns() == []
+    assert sorted(selected.keys()) == sorted(
+        ["id", "miller_index", "intensity.sum.value", "xyzobs.px.value"]
+    )
+    assert list(selected["miller_index"]) == [(4, 5, 6), (0, 0, 1)]
+    assert dict(lazy.experiment_identifiers()) == {0: "abc", 1: "def"}
+
+    # Reading with no columns still gives the full table on access
+    lazy = flex.reflection_table.from_msgpack_file(filename, columns=[])
+    assert lazy.pending_columns() == sorted(table.keys())
+    assert list(lazy["xyzobs.px.value"]) == list(table["xyzobs.px.value"])
+
+
+def test_row_group_file(tmpdir):
+    from dials.array_family.row_group_file import RowGroupReflectionFile
+
+    table = flex.reflection_table()
+    table["id"] = flex.int([0] * 10 + [1] * 10)
+    table["d"] = flex.double(range(20, 0, -1))
+    table["xyzobs.px.value"] = flex.vec3_double(
+        [(1.0, 2.0, z + 0.5) for z in range(20)]
+    )
+    table["miller_index"] = flex.miller_index([(i, 0, 1) for i in range(20)])
+    table["flags"] = flex.size_t(20, 0)
+    table.set_flags(flex.size_t([3, 15]), table.flags.indexed)
+    table.experiment_identifiers()[0] = "abc"
+    table.experiment_identifiers()[1] = "def"
+    filename = tmpdir.join("reflections.refl").strpath
+    table.as_row_group_file(filename, row_group_size=5, compression=["d"])
+
+    rgfile = RowGroupReflectionFile(filename)
+    assert len(rgfile.row_groups) == 4
+    assert rgfile.nrows == 20
+    assert rgfile.row_groups[1]["stats"]["z"] == [5.5, 9.5]
+    compression = {c["name"]: c["compression"] for c in rgfile.row_groups[0]["columns"]}
+    assert compression["d"] == "zlib"
+    assert compression["id"] == "none"
+
+    # Round trip through from_file
+    result = flex.reflection_table.from_file(filename)
+    assert sorted(result.keys()) == sorted(table.keys())
+    assert list(result["d"]) == list(table["d"])
+    assert list(result["miller_index"]) == list(table["miller_index"])
+    assert dict(result.experiment_identifiers()) == {0: "abc", 1: "def"}
+
+    # Selections skip row groups and filter rows
+    subset = rgfile.read(columns=["miller_index"], identifiers=["def"])
+    assert list(subset.keys()) == ["miller_index"]
+    assert list(subset["miller_index"]) == [(i, 0, 1) for i in range(10, 20)]
+    subset = rgfile.read(z_range=(7, 12))
+    assert list(subset["xyzobs.px.value"].parts()[2]) == [7.5, 8.5, 9.5, 10.5, 11.5]
+    subset = rgfile.read(d_range=(None, 3))
+    assert list(subset["d"]) == [3, 2, 1]
+    subset = rgfile.read(flags=table.flags.indexed)
+    assert list(subset["miller_index"]) == [(3, 0, 1), (15, 0, 1)]
+    subset = rgfile.read(d_range=(100, None))
+    assert len(subset) == 0
+    assert sorted(subset.keys()) == sorted(table.keys())
+
+    # Append new row groups without rewriting the file
+    extra = table.select(table["id"] == 1)
+    rgfile.append(extra, row_group_size=20)
+    assert len(rgfile.row_groups) == 5
+    assert len(RowGroupReflectionFile(filename).read(ids=[1])) == 20
+    with pytest.raises(ValueError):
+        del extra["d"]
+        rgfile.append(extra)
+
+
+def test_numpy_views():
+    np = pytest.importorskip("numpy")
+    from dials.array_family.numpy_view import as_numpy_view, is_view_of
+
+    table = flex.reflection_table()
+    table["intensity"] = flex.double([1.0, 2.0, 3.0])
+    table["xyz"] = flex.vec3_double([(1, 2, 3), (4, 5, 6), (7, 8, 9)])
+    table["miller_index"] = flex.miller_index([(1, 0, 0), (0, 1, 0), (0, 0, 1)])
+    table["flags"] = flex.size_t([1, 2, 4])
+
+    # Writes through the view are seen by the table
+    intensity = table.as_numpy_view("intensity")
+    intensity *= 2
+    assert list(table["intensity"]) == [2.0, 4.0, 6.0]
+    xyz = table.as_numpy_view("xyz")
+    assert xyz.shape == (3, 3)
+    assert xyz[1].tolist() == [4, 5, 6]
+    assert table.as_numpy_view("miller_index")[2].tolist() == [0, 0, 1]
+    flags = table.as_numpy_view("flags", readonly=True)
+    assert flags.tolist() == [1, 2, 4]
+    with pytest.raises(ValueError):
+        flags[0] = 0
+
+    # The view keeps the storage alive
+    column = flex.double(range(10))
+    view = as_numpy_view(column)
+    assert is_view_of(view, column)
+    del column
+    assert view.sum() == 45
+    assert as_numpy_view(flex.double()).shape == (0,)
+    with pytest.raises(TypeError):
+        as_numpy_view(flex.std_string(["a"]))
+
+    # Results are written into the table without a copy
+    result = table.new_numpy_column("result", flex.double)
+    np.multiply(intensity, 3, out=result)
+    assert list(table["result"]) == [6.0, 12.0, 18.0]
+    table.set_numpy_column("result", result)
+    assert list(table["result"]) == [6.0, 12.0, 18.0]
+    table.set_numpy_column("copied", np.array([[1, 2, 3]] * 3, dtype=np.intc))
+    assert isinstance(table["copied"], flex.miller_index)
+    assert list(table["copied"]) == [(1, 2, 3)] * 3
+
+
+def test_shared_reflection_table():
+    pytest.importorskip("numpy")
+    shared_table = pytest.importorskip("dials.array_family.shared_table")
+    if not shared_table.is_available():
+        pytest.skip("Shared memory is not available")
+
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 1, 1])
+    table["xyzobs.px.value"] = flex.vec3_double([(1, 2, 3), (4, 5, 6), (7, 8, 9)])
+    table["miller_index"] = flex.miller_index([(1, 0, 0), (0, 1, 0), (0, 0, 1)])
+    table["label"] = flex.std_string(["a", "b", "c"])
+    table.experiment_identifiers()[0] = "abc"
+    table.experiment_identifiers()[1] = "def"
+
+    shared = shared_table.SharedReflectionTable.from_table(table)
+    try:
+        # Only the descriptor is pickled
+        shared = pickle.loads(pickle.dumps(shared))
+        result = shared.as_table()
+        assert sorted(result.keys()) == sorted(table.keys())
+        assert list(result["xyzobs.px.value"]) == list(table["xyzobs.px.value"])
+        assert list(result["miller_index"]) == list(table["miller_index"])
+        assert list(result["label"]) == ["a", "b", "c"]
+        assert dict(result.experiment_identifiers()) == {0: "abc", 1: "def"}
+
+        # Existing columns are written in place, new ones get new segments
+        segments = dict(shared.columns)
+        result["id"] = flex.int([2, 2, 2])
+        result["intensity"] = flex.double([1, 2, 3])
+        del result["label"]
+        shared.update(result)
+        assert shared.columns["id"] == segments["id"]
+        assert "intensity" in shared.columns
+        result = shared.as_table()
+        assert list(result["id"]) == [2, 2, 2]
+        assert list(result["intensity"]) == [1, 2, 3]
+        assert "label" not in result
+
+        # A different number of rows needs new segments, but the old segments
+        # are only freed by unlink
+        old_segment = shared.columns["id"][1]
+        shared.update(result.select(flex.size_t([0])))
+        assert old_segment in shared.stale
+        assert shared.nrows == 1
+        assert list(shared.as_table()["id"]) == [2]
+    finally:
+        shared.unlink()
+    assert shared.columns == {}
+    assert shared.stale == []
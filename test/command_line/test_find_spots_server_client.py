@@ -10,8 +10,8 @@
 import pytest
 
 
-@pytest.fixture
-def server(tmp_path) -> int:
+@pytest.fixture(params=["queue", "fork"])
+def server(request, tmp_path) -> int:
     """Fixture to load a find_spots_server server"""
     if sys.hexversion >= 0x3080000 and sys.platform == "darwin":
         pytest.skip("find_spots server known to be broken on MacOS with Python 3.8+")
@@ -21,7 +21,12 @@ def server(tmp_path) -> int:
         sock.bind(("", 0))
         host, port = sock.getsockname()
     # Start the server
-    server_command = ["dials.find_spots_server", f"port={port}", "nproc=3"]
+    server_command = [
+        "dials.find_spots_server",
+        f"port={port}",
+        "nproc=3",
+        f"mode={request.param}",
+    ]
     p = subprocess.Popen(server_command, cwd=tmp_path)
     wait_for_server(port)
     yield port
@@ -37,6 +42,17 @@ def test_server_return_codes(dials_data, server):
         urllib.request.urlopen(f"http://127.0.0.1:{server}/some/junk/filename")
 
 
+def test_server_keep_alive(dials_data, request, server):
+    first_file = dials_data("centroid_test_data").listdir("*.cbf", sort=True)[0].strpath
+    response = urllib.request.urlopen(f"http://127.0.0.1:{server}/{first_file}")
+    assert response.code == 200
+    # Only the queue mode server keeps connections open between requests
+    if request.node.callspec.params["server"] == "fork":
+        assert response.headers["Connection"] == "close"
+    else:
+        assert response.headers["Connection"] is None
+
+
 def test_find_spots_server_client(dials_data, tmp_path, server):
     filenames = [
         f.strpath for f in dials_data("centroid_test_data").listdir("*.cbf", sort=True)
@@ -50,6 +66,101 @@ def test_find_spots_server_client(dials_data, tmp_path, server):
         assert not result.returncode and not result.stderr
 
 
+def test_find_spots_server_client_batch(dials_data, server):
+    filenames = [
+        f.strpath for f in dials_data("centroid_test_data").listdir("*.cbf", sort=True)
+    ]
+    client_command = [
+        "dials.find_spots_client",
+        f"port={server}",
+        "min_spot_size=3",
+        "algorithm=dispersion",
+        "batch=True",
+    ]
+    result = procrunner.run(client_command + filenames[1:])
+    assert not result.returncode and not result.stderr
+    out = "<document>%s</document>" % result.stdout.decode("latin-1")
+    xmldoc = minidom.parseString(out)
+    assert len(xmldoc.getElementsByTagName("image")) == 8
+    spot_counts = sorted(
+        int(node.childNodes[0].data)
+        for node in xmldoc.getElementsByTagName("spot_count")
+    )
+    assert spot_counts == sorted([196, 205, 209, 195, 205, 203, 207, 189])
+
+
+def test_batch_jobs():
+    from dials.command_line.find_spots_server import batch_jobs
+
+    jobs = batch_jobs(
+        {
+            "images": ["/a/b.cbf", {"filename": "/c/master.h5", "frames": [3, 4]}],
+            "params": ["d_min=2"],
+        }
+    )
+    assert jobs == [
+        ({"image": "/a/b.cbf"}, "/a/b.cbf", ["d_min=2"]),
+        (
+            {"image": "/c/master.h5", "frame": 3},
+            "/c/master.h5",
+            ["d_min=2", "scan_range=3,3"],
+        ),
+        (
+            {"image": "/c/master.h5", "frame": 4},
+            "/c/master.h5",
+            ["d_min=2", "scan_range=4,4"],
+        ),
+    ]
+    with pytest.raises(KeyError):
+        batch_jobs({"params": []})
+
+
+def test_find_spots_server_latency(dials_data, tmp_path, server):
+    """Benchmark the server with synthetic images written from a real image"""
+    from dxtbx.format.FormatCBFMini import FormatCBFMini
+    from dxtbx.model.experiment_list import ExperimentListFactory
+
+    from dials.array_family import flex
+
+    first_file = dials_data("centroid_test_data").listdir("*.cbf", sort=True)[0]
+    experiments = ExperimentListFactory.from_filenames([first_file.strpath])
+    imageset = experiments.imagesets()[0]
+    data = imageset.get_raw_data(0)[0].as_double()
+    flex.set_random_seed(0)
+    filenames = []
+    for i in range(20):
+        noise = flex.random_double(data.size()) * 10
+        noise.reshape(data.accessor())
+        filename = tmp_path / f"synthetic_{i:04d}.cbf"
+        FormatCBFMini.as_file(
+            imageset.get_detector(),
+            imageset.get_beam(),
+            imageset.get_goniometer(),
+            imageset.get_scan(),
+            data + noise,
+            str(filename),
+        )
+        filenames.append(str(filename))
+
+    result = procrunner.run(
+        ["dials.find_spots_client", f"port={server}", "nproc=4", "latency=True"]
+        + filenames
+    )
+    assert not result.returncode and not result.stderr
+    summary = [
+        line
+        for line in result.stdout.decode("latin-1").splitlines()
+        if line.startswith("Latency per image")
+    ]
+    assert len(summary) == 1
+    out = "<document>%s</document>" % result.stdout.decode("latin-1").replace(
+        summary[0], ""
+    )
+    xmldoc = minidom.parseString(out)
+    assert len(xmldoc.getElementsByTagName("image")) == 20
+    assert len(xmldoc.getElementsByTagName("spot_count")) == 20
+
+
 def wait_for_server(port, max_wait=20):
     print("Waiting up to %d seconds for server to start" % max_wait)
     server_ok = False
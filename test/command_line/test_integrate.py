@@ -48,6 +48,13 @@ def test_basic_integrate(dials_data, tmpdir):
 
     assert dict(table.experiment_identifiers()) == {0: "foo"}
 
+    with tmpdir.join("integrated.profile.json").open() as fh:
+        profile = json.load(fh)
+    assert profile["integration"]["dominant_stage"] in profile["integration"]["stages"]
+    for stage in ("read", "extract", "background", "centroid", "summation"):
+        assert profile["integration"]["stages"][stage]["calls"] > 0
+    assert profile["integration"]["blocks"]
+
     originaltable = table
 
     tmpdir.join("integrated.refl").remove()
@@ -714,6 +714,30 @@ def test_sum_partial_reflections():
     assert r2 is r
     assert list(r["identifier"]) == [1, 2, 3]
 
+    # Interleaved partials, with the combined values matching the values from
+    # combining each set of partials separately
+    r = flex.reflection_table()
+    r["intensity.prf.value"] = flex.double([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 0.0])
+    r["intensity.prf.variance"] = flex.double([1.0, 2.0, 1.0, 3.0, 1.0, 2.0, 1.0])
+    r["intensity.scale.value"] = flex.double([2.0, 1.0, 5.0, 3.0, 4.0, 6.0, 1.0])
+    r["intensity.scale.variance"] = flex.double([1.0, 2.0, 1.0, 4.0, 1.0, 2.0, 1.0])
+    r["partial_id"] = flex.int([3, 1, 3, 1, 2, 3, 4])
+    r["partiality"] = flex.double([0.3, 0.4, 0.3, 0.5, 1.0, 0.3, 0.5])
+    r["identifier"] = flex.int([1, 2, 3, 4, 5, 6, 7])
+    expected = r.copy()
+    for partials in ([0, 2, 5], [1, 3]):
+        expected = _sum_prf_partials(expected, partials)
+        expected = _sum_scale_partials(expected, partials)
+
+    r = sum_partial_reflections(r)
+    assert list(r["identifier"]) == [1, 2, 5, 7]
+    assert list(r["partiality"]) == pytest.approx([0.9, 0.9, 1.0, 0.5])
+    for col in ["intensity.prf", "intensity.scale"]:
+        for part in [".value", ".variance"]:
+            assert list(r[col + part]) == pytest.approx(
+                list(expected[col + part].select(flex.size_t([0, 1, 4, 6])))
+            )
+
     # Add test to check calculation in case where both prf and sum - but this
     # requires knowing how the values will be weighted, so leave until that is
     # decided.
@@ -43,9 +43,10 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
-from collections import defaultdict
 from typing import Any, List, Type
 
+import numpy as np
+
 from cctbx import crystal, miller
 
 from dials.algorithms.scaling.outlier_rejection import reject_outliers
@@ -815,62 +816,72 @@ def sum_partial_reflections(reflection_table):
         sel = sel & (reflection_table["intensity." + intensity + ".variance"] > 0)
     isel = sel.iselection()
 
-    # create map of partial_id to reflections
-    delete = flex.size_t()
-    partial_map = defaultdict(list)
-    for j in isel:
-        partial_map[reflection_table["partial_id"][j]].append(j)
-
-    # now work through this map - get total partiality for every reflection;
-    # here only consider reflections with > 1 component;
-    partial_ids = []
-    for p_id in partial_map:
-        if len(partial_map[p_id]) > 1:
-            partial_ids.append(p_id)
-
-    header = ["Partial id", "Partiality"]
-    for i in intensities:
-        header.extend([str(i) + " intensity", str(i) + " variance"])
-    rows = []
-
-    # Now loop through 'matched' partials, summing and then deleting before return
-    for p_id in partial_ids:
-        j = partial_map[p_id]
-        for i in j:
-            data = [str(p_id), str(reflection_table["partiality"][i])]
-            for intensity in intensities:
-                data.extend(
-                    [
-                        str(reflection_table["intensity." + intensity + ".value"][i]),
-                        str(
-                            reflection_table["intensity." + intensity + ".variance"][i]
-                        ),
-                    ]
-                )
-            rows.append(data)
-
-        # do the summing of the partiality values separately to allow looping
-        # over multiple times
-        total_partiality = sum(reflection_table["partiality"][i] for i in j)
-        if "prf" in intensities:
-            reflection_table = _sum_prf_partials(reflection_table, j)
-        if "sum" in intensities:
-            reflection_table = _sum_sum_partials(reflection_table, j)
-        if "scale" in intensities:
-            reflection_table = _sum_scale_partials(reflection_table, j)
-        # FIXME now that the partials have been summed, should fractioncalc be set
-        # to one (except for summation case?)
-        reflection_table["partiality"][j[0]] = total_partiality
-        delete.extend(flex.size_t(j[1:]))
-        data = ["combined " + str(p_id), str(total_partiality)]
-        for intensity in intensities:
-            data.extend(
-                [
-                    str(reflection_table["intensity." + intensity + ".value"][j[0]]),
-                    str(reflection_table["intensity." + intensity + ".variance"][j[0]]),
-                ]
-            )
-        rows.append(data)
+    # Group the selected reflections by partial_id, only considering partials
+    # with > 1 component. The rows are in ascending order, so the first row of
+    # each group is the one which will hold the combined values.
+    _, group, counts = np.unique(
+        reflection_table["partial_id"].select(isel).as_numpy_array(),
+        return_inverse=True,
+        return_counts=True,
+    )
+    multiple = counts[group] > 1
+    rows = isel.as_numpy_array()[multiple]
+    _, first, group = np.unique(group[multiple], return_index=True, return_inverse=True)
+    n_groups = first.size
+    keep = flex.size_t(rows[first].tolist())
+    is_first = np.zeros(rows.size, dtype=bool)
+    is_first[first] = True
+    delete = flex.size_t(rows[~is_first].tolist())
+
+    def group_sum(values):
+        return np.bincount(group, weights=values, minlength=n_groups)
+
+    def column(name):
+        return reflection_table[name].as_numpy_array()[rows]
+
+    # Formatting this table can be sloooow for large numbers of reflections, so skip
+    # this unless debug output has been requested
+    debug = logger.getEffectiveLevel() <= logging.DEBUG
+    if debug:
+        header = ["Partial id", "Partiality"]
+        for i in intensities:
+            header.extend([str(i) + " intensity", str(i) + " variance"])
+        components = _partials_table_data(reflection_table, rows, intensities)
+
+    # FIXME now that the partials have been summed, should fractioncalc be set
+    # to one (except for summation case?)
+    total_partiality = group_sum(column("partiality"))
+    reflection_table["partiality"].set_selected(
+        keep, flex.double(total_partiality.tolist())
+    )
+    for intensity in intensities:
+        value = column("intensity." + intensity + ".value")
+        variance = column("intensity." + intensity + ".variance")
+        if intensity == "prf":
+            value, variance = _sum_prf_partial_groups(value, variance, group_sum)
+        elif intensity == "sum":
+            value, variance = group_sum(value), group_sum(variance)
+        else:
+            value, variance = _sum_scale_partial_groups(value, variance, group_sum)
+        reflection_table["intensity." + intensity + ".value"].set_selected(
+            keep, flex.double(value.tolist())
+        )
+        reflection_table["intensity." + intensity + ".variance"].set_selected(
+            keep, flex.double(variance.tolist())
+        )
+
+    if debug:
+        combined = _partials_table_data(reflection_table, rows[first], intensities)
+        partial_ids = reflection_table["partial_id"].select(keep).as_numpy_array()
+        order = np.argsort(group, kind="stable")
+        splits = np.cumsum(np.bincount(group, minlength=n_groups))[:-1]
+        components = np.split(components[order], splits)
+        table_rows = []
+        for i in np.argsort(first):
+            for data in components[i]:
+                table_rows.append([str(partial_ids[i])] + list(data))
+            table_rows.append(["combined " + str(partial_ids[i])] + list(combined[i]))
+
     reflection_table.del_selected(delete)
     if nrefl > reflection_table.size():
         logger.info(
@@ -878,14 +889,46 @@ def sum_partial_reflections(reflection_table):
             % (nrefl - reflection_table.size())
         )
 
-    # Formatting this table can be sloooow for large numbers of reflections, so skip
-    # this unless debug output has been requested
-    if logger.getEffectiveLevel() <= logging.DEBUG:
+    if debug:
         logger.debug("\nSummary of combination of partial reflections")
-        logger.debug(tabulate(rows, header))
+        logger.debug(tabulate(table_rows, header))
     return reflection_table
 
 
+def _partials_table_data(reflection_table, rows, intensities):
+    """Format the partiality and intensities of the rows for the debug table."""
+    columns = ["partiality"]
+    for intensity in intensities:
+        columns.append("intensity." + intensity + ".value")
+        columns.append("intensity." + intensity + ".variance")
+    data = [reflection_table[c].as_numpy_array()[rows] for c in columns]
+    return np.array([[str(v) for v in values] for values in zip(*data)]).reshape(
+        len(rows), len(columns)
+    )
+
+
+def _sum_prf_partial_groups(value, variance, group_sum):
+    """Combine groups of prf partials, as _sum_prf_partials."""
+    weight = value * value / variance
+    total_weight = group_sum(weight)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        combined_value = np.where(
+            total_weight != 0, group_sum(weight * value) / total_weight, 0.0
+        )
+        combined_variance = np.where(
+            total_weight != 0,
+            group_sum(weight * variance) / total_weight,
+            group_sum(variance),
+        )
+    return combined_value, combined_variance
+
+
+def _sum_scale_partial_groups(value, variance, group_sum):
+    """Combine groups of scale partials, as _sum_scale_partials."""
+    total_weight = group_sum(1.0 / variance)
+    return group_sum(value / variance) / total_weight, 1.0 / total_weight
+
+
 # FIXME what are the correct weights to use for the different cases? - why
 # weighting by (I/sig(I))^2 not just 1/variance for prf. See tests?
 